@@ -0,0 +1,155 @@
+"""
+Pianificatore dell'assegnazione delle bobine per un intero ordine.
+
+Riceve tutta la domanda di filamento dell'ordine (una riga per ogni consumo da creare) e la
+risolve in memoria contro un'unica fotografia della disponibilità delle bobine attive:
+  - per ogni filamento le richieste più grandi vengono servite per prime;
+  - tra le bobine sufficienti si preferiscono quelle già iniziate, poi la più vuota;
+  - se nessuna bobina basta la richiesta viene divisa su più bobine, partendo dalla più piena e
+    chiudendo il resto sulla bobina più adatta;
+  - finché c'è disponibilità nessuna bobina viene impegnata oltre il disponibile. Quando le bobine
+    attive non bastano, il resto viene comunque assegnato (il consumo deve restare uguale alla
+    distinta base, per costi, registro e previsioni) all'ultima bobina usata, o alla più grande del
+    filamento; la mancanza è riportata in AllocationPlan.shortfalls e la bobina in overcommitted;
+  - un filamento senza bobine attive usa la sua bobina esaurita più recente; solo se il filamento
+    non ha alcuna bobina la richiesta resta senza assegnazione (e tutta in shortfalls).
+"""
+from collections import namedtuple
+from decimal import Decimal
+
+from .models import Spool
+
+ZERO = Decimal('0.00')
+
+Demand = namedtuple('Demand', ['key', 'filament_id', 'grams'])
+
+
+class _Stock:
+    __slots__ = ('spool', 'available', 'started')
+
+    def __init__(self, spool, available, started):
+        self.spool = spool
+        self.available = available
+        self.started = started
+
+
+class AllocationPlan:
+    """
+    Esito dell'assegnazione: {chiave richiesta: [(bobina, grammi), ...]}, mancanze per filamento e
+    grammi impegnati oltre il disponibile per bobina.
+    """
+
+    def __init__(self):
+        self.allocations = {}
+        self.shortfalls = {}
+        self.overcommitted = {}
+
+    def unassigned(self):
+        """Filamenti con grammi rimasti senza bobina (il filamento non ha bobine)."""
+        committed = {}
+        for spool, grams in self.overcommitted.items():
+            committed[spool.filament_id] = committed.get(spool.filament_id, ZERO) + grams
+        return {
+            filament_id: grams - committed.get(filament_id, ZERO)
+            for filament_id, grams in self.shortfalls.items()
+            if grams > committed.get(filament_id, ZERO)
+        }
+
+    def parts(self, key):
+        return self.allocations.get(key, [])
+
+    def spool_ids(self):
+        return {spool.id for parts in self.allocations.values() for spool, _ in parts}
+
+
+class SpoolAllocator:
+    """Fotografia della disponibilità delle bobine attive, consumata man mano che si assegna."""
+
+    def __init__(self, spools):
+        self.stock = {}
+        # Bobina esaurita più recente di ogni filamento, per la domanda dei filamenti senza bobine attive
+        self.fallback = {}
+        for spool in spools:
+            if not spool.is_active:
+                current = self.fallback.get(spool.filament_id)
+                if current is None or spool.id > current.spool.id:
+                    self.fallback[spool.filament_id] = _Stock(spool, ZERO, True)
+                continue
+            available = max(ZERO, Decimal(spool.available_grams))
+            started = available < Decimal(spool.gross_grams)
+            self.stock.setdefault(spool.filament_id, []).append(_Stock(spool, available, started))
+
+    @classmethod
+    def for_filaments(cls, filament_ids):
+        """Carica in una query le bobine dei filamenti indicati, con i pesi annotati."""
+        filament_ids = set(filament_ids)
+        if not filament_ids:
+            return cls([])
+        return cls(Spool.objects.with_weights().filter(filament_id__in=filament_ids))
+
+    def available(self, filament_id):
+        return sum((stock.available for stock in self.stock.get(filament_id, [])), ZERO)
+
+    def allocate(self, demands):
+        """Risolve tutte le richieste [Demand, ...] e restituisce un AllocationPlan."""
+        plan = AllocationPlan()
+        # Le richieste più grandi per prime: i pezzi piccoli riempiono poi i ritagli delle bobine
+        ordered = sorted(enumerate(demands), key=lambda item: (item[1].filament_id, -item[1].grams, item[0]))
+        for _, demand in ordered:
+            if demand.grams <= 0:
+                continue
+            parts, missing = self._take(demand.filament_id, Decimal(demand.grams))
+            if missing > 0:
+                plan.shortfalls[demand.filament_id] = plan.shortfalls.get(demand.filament_id, ZERO) + missing
+                parts = self._overcommit(demand.filament_id, parts, missing, plan)
+            if parts:
+                plan.allocations[demand.key] = parts
+        return plan
+
+    def _overcommit(self, filament_id, parts, missing, plan):
+        """Assegna la mancanza all'ultima bobina usata, o alla più grande (o esaurita più recente) del filamento."""
+        if parts:
+            spool, grams = parts[-1]
+            parts = parts[:-1] + [(spool, grams + missing)]
+        else:
+            candidates = self.stock.get(filament_id)
+            if candidates:
+                spool = max(candidates, key=lambda s: (s.spool.gross_grams, -s.spool.id)).spool
+            elif filament_id in self.fallback:
+                spool = self.fallback[filament_id].spool
+            else:
+                return parts
+            parts = [(spool, missing)]
+        plan.overcommitted[spool] = plan.overcommitted.get(spool, ZERO) + missing
+        return parts
+
+    def _best_fit(self, candidates, grams):
+        """Bobina sufficiente da preferire: già iniziata, poi la più vuota."""
+        fits = [stock for stock in candidates if stock.available >= grams]
+        if not fits:
+            return None
+        return min(fits, key=lambda stock: (not stock.started, stock.available, stock.spool.id))
+
+    def _take(self, filament_id, grams):
+        candidates = self.stock.get(filament_id)
+        if not candidates:
+            # Nessuna bobina attiva: manca tutta la richiesta
+            return [], grams
+
+        parts = []
+        remaining = grams
+        while remaining > 0:
+            stock = self._best_fit(candidates, remaining)
+            if stock is not None:
+                take = remaining
+            else:
+                # Nessuna bobina basta: si svuota la più piena e si prosegue con il resto
+                stock = max(candidates, key=lambda s: (s.available, -s.spool.id))
+                if stock.available <= 0:
+                    break
+                take = stock.available
+            stock.available -= take
+            stock.started = True
+            parts.append((stock.spool, take))
+            remaining -= take
+        return parts, remaining
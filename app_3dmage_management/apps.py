@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class App3DmageManagementConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'app_3dmage_management'
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,230 @@
+"""
+Feed delle modifiche per domini (ordini di lavoro, coda di stampa, magazzino, filamenti, contabilità,
+impostazioni, notifiche).
+
+Ogni dominio ha un contatore intero (DomainVersion) incrementato atomicamente quando i suoi dati cambiano.
+I client restano in ascolto tramite long-poll (WSGI) o Server-Sent Events (ASGI) e ricaricano
+solo le sezioni dei domini effettivamente modificati, invece di interrogare il server ogni pochi secondi.
+
+Le connessioni in attesa non leggono il database: ogni processo tiene una fotografia condivisa delle
+versioni, aggiornata dopo il commit di ogni modifica fatta dal processo stesso (che sveglia subito i
+client) e al massimo una volta ogni SHARED_CHECK_INTERVAL per vedere le modifiche degli altri processi.
+Le stesse versioni fanno da ETag per le API JSON di sola lettura (conditional_on).
+"""
+import asyncio
+import threading
+import time
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.db import transaction
+from django.db.models import F
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import condition
+
+WORK_ORDERS = 'work_orders'
+PRINT_QUEUE = 'print_queue'
+STOCK = 'stock'
+FILAMENTS = 'filaments'
+ACCOUNTING = 'accounting'
+SETTINGS = 'settings'
+NOTIFICATIONS = 'notifications'
+DOMAINS = (WORK_ORDERS, PRINT_QUEUE, STOCK, FILAMENTS, ACCOUNTING, SETTINGS, NOTIFICATIONS)
+
+# Intervallo tra due letture condivise delle versioni (per processo, non per client): serve solo a
+# vedere le modifiche fatte da altri processi, quelle dello stesso processo arrivano subito.
+SHARED_CHECK_INTERVAL = 10
+# Attesa prima che EventSource si ricolleghi dopo una disconnessione
+STREAM_RETRY = 2
+LONG_POLL_TIMEOUT = 25
+STREAM_KEEPALIVE = 15
+STREAM_MAX_DURATION = 300
+
+_changed = threading.Condition()
+# Fotografia condivisa: {dominio: versione}, istante della lettura e numero di aggiornamenti
+_snapshot = {}
+_snapshot_at = None
+_generation = 0
+# Una sola lettura condivisa alla volta
+_refresh_lock = threading.Lock()
+# Stream SSE in attesa: (event loop, asyncio.Event) da svegliare a ogni aggiornamento
+_async_waiters = set()
+
+
+def _publish(versions):
+    """Aggiorna la fotografia e sveglia long-poll e stream in attesa."""
+    global _snapshot, _snapshot_at, _generation
+    with _changed:
+        _snapshot_at = time.monotonic()
+        if versions == _snapshot:
+            return
+        _snapshot = dict(versions)
+        _generation += 1
+        _changed.notify_all()
+        for loop, event in list(_async_waiters):
+            loop.call_soon_threadsafe(event.set)
+
+
+def _refresh_snapshot():
+    """Legge tutte le versioni (una query) e le pubblica."""
+    versions = get_domain_versions(DOMAINS)
+    _publish(versions)
+    return versions
+
+
+def _notify_waiters():
+    _refresh_snapshot()
+
+
+def shared_versions(domains=DOMAINS):
+    """
+    Versioni dalla fotografia del processo, senza query. Il database viene letto solo se la
+    fotografia è più vecchia di SHARED_CHECK_INTERVAL, da un solo thread per volta.
+    """
+    with _refresh_lock:
+        if _snapshot_at is None or time.monotonic() - _snapshot_at >= SHARED_CHECK_INTERVAL:
+            _refresh_snapshot()
+    with _changed:
+        return {domain: _snapshot.get(domain, '0') for domain in domains}
+
+
+def bump_domain_versions(*domains):
+    """
+    Incrementa con F()+1 il contatore dei domini indicati (una sola UPDATE) e sveglia
+    i client in attesa dopo il commit. L'incremento segue la transazione: se viene annullata,
+    anche le versioni tornano indietro.
+    """
+    from .models import DomainVersion
+    domains = set(domains)
+    updated = DomainVersion.objects.filter(domain__in=domains).update(version=F('version') + 1)
+    if updated < len(domains):
+        # Domini non ancora registrati (normalmente creati dalla migrazione)
+        existing = set(DomainVersion.objects.filter(domain__in=domains).values_list('domain', flat=True))
+        for domain in domains - existing:
+            DomainVersion.objects.get_or_create(domain=domain, defaults={'version': 1})
+    transaction.on_commit(_notify_waiters)
+
+
+def get_domain_versions(domains=DOMAINS):
+    """Restituisce {dominio: versione} con una sola query; i domini mai modificati valgono '0'."""
+    from .models import DomainVersion
+    versions = {domain: '0' for domain in domains}
+    for domain, version in DomainVersion.objects.filter(domain__in=domains).values_list('domain', 'version'):
+        versions[domain] = str(version)
+    return versions
+
+
+def htmx_version(request, domain):
+    """
+    Scorciatoia HTMX: restituisce (versione corrente del dominio, invariato).
+    `invariato` è True se la richiesta HTMX porta già (?v=) la versione corrente:
+    la vista può allora rispondere 204 senza ricalcolare il parziale.
+    """
+    current = get_domain_versions((domain,))[domain]
+    return current, bool(request.headers.get('HX-Request')) and request.GET.get('v') == current
+
+
+def domains_etag(domains):
+    """ETag dalle versioni dei domini (una query): cambia solo quando cambia uno dei domini."""
+    versions = get_domain_versions(domains)
+    return '"' + '-'.join(f'{domain}.{versions[domain]}' for domain in domains) + '"'
+
+
+def conditional_on(*domains):
+    """
+    Decoratore per le API JSON di sola lettura che dipendono solo dai domini indicati.
+    L'ETag è calcolato dalle versioni prima di chiamare la vista, non dal contenuto: se il client
+    invia If-None-Match con l'ETag corrente la risposta è 304 senza eseguire le query della vista.
+    Cache-Control private/no-cache: il browser conserva la risposta ma la riconvalida ogni volta.
+    Va applicato sotto @login_required.
+    """
+    def etag_func(request, *args, **kwargs):
+        return domains_etag(domains)
+
+    def decorator(view):
+        conditional_view = condition(etag_func=etag_func)(view)
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            response = conditional_view(request, *args, **kwargs)
+            patch_cache_control(response, private=True, no_cache=True)
+            return response
+        return wrapper
+    return decorator
+
+
+def changed_domains(known, current):
+    """Domini la cui versione corrente differisce da quella nota al client."""
+    return {domain: version for domain, version in current.items() if known.get(domain) != version}
+
+
+def wait_for_changes(known, domains=DOMAINS, timeout=LONG_POLL_TIMEOUT):
+    """
+    Long-poll: blocca finché almeno un dominio cambia rispetto a `known` o scade il timeout.
+    Restituisce i domini cambiati (dizionario vuoto allo scadere del timeout).
+    """
+    deadline = time.monotonic() + timeout
+    with _changed:
+        seen_generation = _generation
+    # Una lettura all'arrivo della richiesta, poi solo la fotografia condivisa
+    versions = _refresh_snapshot()
+    changes = changed_domains(known, {domain: versions[domain] for domain in domains})
+    while not changes:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return changes
+        with _changed:
+            # Un aggiornamento arrivato mentre si confrontavano le versioni non va perso
+            if _generation == seen_generation:
+                _changed.wait(min(SHARED_CHECK_INTERVAL, remaining))
+            seen_generation = _generation
+        changes = changed_domains(known, shared_versions(domains))
+    return changes
+
+
+async def _wait_for_publish(seen_generation, timeout):
+    """Attende (senza occupare thread) il prossimo aggiornamento della fotografia o il timeout."""
+    loop = asyncio.get_running_loop()
+    event = asyncio.Event()
+    waiter = (loop, event)
+    with _changed:
+        if _generation != seen_generation:
+            return
+        _async_waiters.add(waiter)
+    try:
+        await asyncio.wait_for(event.wait(), timeout)
+    except asyncio.TimeoutError:
+        pass
+    finally:
+        with _changed:
+            _async_waiters.discard(waiter)
+
+
+async def stream_changes(domains=DOMAINS):
+    """
+    Generatore asincrono per Server-Sent Events.
+    Alla connessione invia le versioni correnti di tutti i domini, poi solo quelle cambiate.
+    La connessione viene chiusa dopo STREAM_MAX_DURATION: EventSource si ricollega da solo.
+    """
+    read_shared = sync_to_async(shared_versions)
+    known = {}
+    started = last_sent = time.monotonic()
+
+    yield f'retry: {STREAM_RETRY * 1000}\n\n'
+    # Una lettura alla connessione, poi solo la fotografia condivisa
+    versions = await sync_to_async(_refresh_snapshot)()
+    current = {domain: versions[domain] for domain in domains}
+    while time.monotonic() - started < STREAM_MAX_DURATION:
+        changes = changed_domains(known, current)
+        if changes:
+            known.update(changes)
+            for domain, version in changes.items():
+                yield f'event: {domain}\ndata: {version}\n\n'
+            last_sent = time.monotonic()
+        elif time.monotonic() - last_sent >= STREAM_KEEPALIVE:
+            yield ': keepalive\n\n'
+            last_sent = time.monotonic()
+        with _changed:
+            seen_generation = _generation
+        await _wait_for_publish(seen_generation, min(STREAM_KEEPALIVE, SHARED_CHECK_INTERVAL))
+        current = await read_shared(domains)
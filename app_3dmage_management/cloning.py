@@ -0,0 +1,234 @@
+"""
+Motore di clonazione dei Progetti Master negli Ordini di Lavoro.
+
+Invece di creare un PrintFile (e i relativi FilamentUsage) alla volta, l'intero ordine
+viene pianificato in memoria: la domanda di filamento di tutti i file viene risolta in una
+volta sola dal pianificatore delle bobine (allocation.SpoolAllocator) e tutte le righe
+vengono scritte con bulk_create. Il numero di query resta quindi costante al crescere
+del numero di set.
+
+I consumi scritti corrispondono sempre alla distinta base, anche quando le bobine attive non
+bastano (la parte mancante resta impegnata in eccesso su una bobina del filamento): costi, registro
+pesi e previsioni vedono tutta la domanda. La mancanza è descritta da shortfall_summary(), che le
+viste mostrano come avviso, e resta in una Notification finché non viene letta.
+"""
+import math
+import re
+
+from . import changefeed
+from .allocation import Demand, SpoolAllocator
+from django.urls import reverse
+
+from .models import (
+    Filament, MasterPrintFile, Notification, PrintFile, FilamentUsage, SpoolLedger, PrintStatsRollup, WorkOrderRawMaterial
+)
+
+COPY_NUMBER_RE = re.compile(r'\((\d+)\)$')
+
+
+class MasterCloner:
+    """
+    Pianifica e scrive la copia della distinta base di un Progetto Master in un WorkOrder.
+
+    Uso tipico:
+        cloner = MasterCloner(master_project, work_order, replacements)
+        cloner.plan_batches(batches)
+        cloner.plan_raw_materials(total_quantity)
+        cloner.save()
+    """
+
+    def __init__(self, master_project, work_order, replacements=None):
+        self.master_project = master_project
+        self.work_order = work_order
+
+        self.master_files = list(
+            MasterPrintFile.objects.filter(project=master_project)
+            .prefetch_related('project_parts', 'filament_usages')
+            .order_by('id')
+        )
+
+        self.replacements = self._resolve_replacements(replacements or {})
+        self.allocator = SpoolAllocator.for_filaments(
+            self._target_filament_id(usage.filament_id)
+            for mpf in self.master_files
+            for usage in mpf.filament_usages.all()
+        )
+        self.allocation = None
+
+        # Righe pianificate: (PrintFile non salvato, [(filament_id, grammi), ...])
+        self.planned_files = []
+        self.planned_raw_materials = []
+        self._existing_names = None
+
+    # --- Preparazione ---
+
+    def _resolve_replacements(self, replacements):
+        """Converte la mappa {id_originale: id_sostituto} validando i filamenti sostitutivi con una sola query."""
+        requested = {}
+        for original_id, replacement_id in replacements.items():
+            try:
+                requested[int(original_id)] = int(replacement_id)
+            except (TypeError, ValueError):
+                continue
+        if not requested:
+            return {}
+        valid_ids = set(Filament.objects.filter(id__in=requested.values()).values_list('id', flat=True))
+        return {original: replacement for original, replacement in requested.items() if replacement in valid_ids}
+
+    def _target_filament_id(self, filament_id):
+        return self.replacements.get(filament_id, filament_id)
+
+    # --- Pianificazione ---
+
+    def _next_copy_number(self, base_name):
+        """Primo numero di copia libero tra i file dell'ordine il cui nome inizia con base_name."""
+        if self._existing_names is None:
+            self._existing_names = list(PrintFile.objects.filter(work_order=self.work_order).values_list('name', flat=True))
+        names = self._existing_names + [pf.name for pf, _ in self.planned_files]
+        max_num = 0
+        for name in names:
+            if not name.startswith(base_name):
+                continue
+            match = COPY_NUMBER_RE.search(name)
+            if match:
+                max_num = max(max_num, int(match.group(1)))
+        return max_num + 1
+
+    def _plan_file(self, mpf, part, name, printer_id):
+        print_file = PrintFile(
+            work_order=self.work_order,
+            master_print_file=mpf,
+            project_part=part,
+            name=name,
+            print_time_seconds=mpf.estimated_time_seconds,
+            printer_id=printer_id,
+            plate_id=mpf.plate_id,
+            produced_quantity=mpf.produced_quantity,
+            status=PrintFile.Status.TODO
+        )
+        demand = [
+            (self._target_filament_id(master_usage.filament_id), master_usage.grams_used)
+            for master_usage in mpf.filament_usages.all()
+        ]
+        self.planned_files.append((print_file, demand))
+        return print_file
+
+    def plan_single_set(self):
+        """Un file per ogni coppia file master/parte, con la stampante suggerita dal master."""
+        for mpf in self.master_files:
+            for part in list(mpf.project_parts.all()) or [None]:
+                self._plan_file(mpf, part, mpf.name, mpf.printer_id)
+
+    def plan_batches(self, batches, append=False):
+        """
+        Pianifica i file per ogni set richiesto.
+        Ogni set indica la quantità e la stampante scelta per ogni parte ('skip' per saltarla).
+        Con append=True i nomi proseguono la numerazione dei file già presenti nell'ordine.
+        """
+        for batch_idx, batch in enumerate(batches):
+            batch_qty = batch.get('quantity', 0)
+            if batch_qty <= 0:
+                continue
+
+            part_printer_map = batch.get('printers', {})
+            batch_suffix = f" (Set {batch_idx + 1})" if len(batches) > 1 else ""
+
+            for mpf in self.master_files:
+                for part in list(mpf.project_parts.all()) or [None]:
+                    part_id_str = str(part.id) if part else 'None'
+                    selected_printer_id = part_printer_map.get(part_id_str)
+
+                    if selected_printer_id == 'skip':
+                        continue
+                    if selected_printer_id:
+                        # Il file deve corrispondere alla stampante scelta per la parte in questo set
+                        if mpf.printer_id and str(mpf.printer_id) != str(selected_printer_id):
+                            continue
+                    elif mpf.printer_id:
+                        # Il file richiede una stampante non configurata nel set
+                        continue
+
+                    file_multiplier = math.ceil(batch_qty / mpf.produced_quantity) if mpf.produced_quantity > 0 else 1
+                    actual_printer_id = selected_printer_id or mpf.printer_id
+                    start_num = self._next_copy_number(mpf.name) if append else 1
+
+                    for i in range(file_multiplier):
+                        if append:
+                            pf_name = f"{mpf.name}{batch_suffix}  ({start_num + i})"
+                        else:
+                            multiplier_suffix = f" ({i + 1})" if file_multiplier > 1 else ""
+                            pf_name = f"{mpf.name}{batch_suffix}{multiplier_suffix}"
+                        self._plan_file(mpf, part, pf_name, actual_printer_id)
+
+    def plan_raw_materials(self, sets):
+        """Copia le materie prime del master moltiplicate per il numero di set."""
+        for pm_rm in self.master_project.raw_materials.all():
+            self.planned_raw_materials.append(WorkOrderRawMaterial(
+                work_order=self.work_order,
+                raw_material_id=pm_rm.raw_material_id,
+                quantity=pm_rm.quantity * sets
+            ))
+
+    def allocate_spools(self):
+        """
+        Assegna le bobine a tutta la domanda di filamento pianificata, in una sola passata.
+        Restituisce l'AllocationPlan (con le eventuali mancanze per filamento).
+        """
+        demands = [
+            Demand((file_index, usage_index), filament_id, grams)
+            for file_index, (_, demand) in enumerate(self.planned_files)
+            for usage_index, (filament_id, grams) in enumerate(demand)
+        ]
+        self.allocation = self.allocator.allocate(demands)
+        return self.allocation
+
+    def shortfall_summary(self):
+        """Descrizione dei filamenti che non bastano per l'ordine (stringa vuota se non mancano)."""
+        if not self.allocation or not self.allocation.shortfalls:
+            return ''
+        filaments = Filament.objects.in_bulk(self.allocation.shortfalls.keys())
+        unassigned = self.allocation.unassigned()
+        return ', '.join(
+            f"{filaments[filament_id]} ({grams:.1f}g"
+            + (", nessuna bobina: consumo non registrato)" if filament_id in unassigned else ", impegnati oltre il disponibile)")
+            for filament_id, grams in self.allocation.shortfalls.items()
+            if filament_id in filaments
+        )
+
+    # --- Scrittura ---
+
+    def save(self):
+        """Scrive il piano con bulk_create e aggiorna il registro delle bobine e gli aggregati statistici."""
+        if self.allocation is None:
+            self.allocate_spools()
+
+        print_files = PrintFile.objects.bulk_create([pf for pf, _ in self.planned_files])
+        if print_files:
+            changefeed.bump_domain_versions(changefeed.PRINT_QUEUE, changefeed.WORK_ORDERS)
+
+        usages = [
+            FilamentUsage(print_file=pf, spool=spool, grams_used=grams)
+            for file_index, (pf, demand) in enumerate(self.planned_files)
+            for usage_index in range(len(demand))
+            for spool, grams in self.allocation.parts((file_index, usage_index))
+        ]
+        if usages:
+            FilamentUsage.objects.bulk_create(usages)
+            # bulk_create non invia segnali: il registro va aggiornato esplicitamente
+            SpoolLedger.refresh({usage.spool_id for usage in usages})
+
+        if self.planned_raw_materials:
+            WorkOrderRawMaterial.objects.bulk_create(self.planned_raw_materials)
+
+        if print_files:
+            PrintStatsRollup.refresh_days({PrintStatsRollup.day_of(pf.created_at) for pf in print_files})
+
+        if self.allocation.shortfalls:
+            # L'avviso della vista si vede una volta sola: la mancanza resta tra le notifiche
+            Notification.objects.create(
+                message=f"Ordine {self.work_order.name}, filamento insufficiente: {self.shortfall_summary()}"[:255],
+                level=Notification.NotificationLevel.WARNING,
+                related_url=reverse('project_detail', args=[self.work_order.id]),
+            )
+
+        return print_files
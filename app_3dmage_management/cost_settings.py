@@ -0,0 +1,66 @@
+"""
+Impostazioni di costo (costo kWh, usura oraria) con cache in memoria condivisa dal processo.
+
+I valori vengono letti da GlobalSetting una sola volta e riutilizzati finché il contatore del
+dominio 'settings' non cambia. Il contatore viene controllato al massimo ogni VERSION_CHECK_INTERVAL
+secondi, così anche gli altri processi vedono le modifiche; nel processo che salva l'impostazione
+la cache viene svuotata subito dal segnale su GlobalSetting.
+"""
+import threading
+import time
+from collections import namedtuple
+from decimal import Decimal
+
+from . import changefeed
+
+ELECTRICITY_COST_KWH = 'electricity_cost_kwh'
+WEAR_TEAR_COEFFICIENT = 'wear_tear_coefficient'
+
+DEFAULTS = {
+    ELECTRICITY_COST_KWH: Decimal('0.25'),
+    WEAR_TEAR_COEFFICIENT: Decimal('0.10'),
+}
+
+VERSION_CHECK_INTERVAL = 5
+
+CostSettings = namedtuple('CostSettings', ['electricity_cost_kwh', 'wear_tear_coefficient'])
+
+_lock = threading.Lock()
+_cache = {'settings': None, 'version': None, 'checked_at': 0.0}
+
+
+def _read_settings():
+    """Legge le impostazioni dal database, creando quelle mancanti con i valori predefiniti."""
+    from .models import GlobalSetting
+    stored = dict(GlobalSetting.objects.filter(key__in=DEFAULTS).values_list('key', 'value'))
+    missing = [GlobalSetting(key=key, value=value) for key, value in DEFAULTS.items() if key not in stored]
+    if missing:
+        GlobalSetting.objects.bulk_create(missing, ignore_conflicts=True)
+        stored.update({setting.key: setting.value for setting in missing})
+    return CostSettings(
+        electricity_cost_kwh=stored[ELECTRICITY_COST_KWH],
+        wear_tear_coefficient=stored[WEAR_TEAR_COEFFICIENT],
+    )
+
+
+def get_cost_settings():
+    """Restituisce le impostazioni di costo correnti (di norma senza alcuna query)."""
+    now = time.monotonic()
+    with _lock:
+        settings = _cache['settings']
+        if settings is not None and now - _cache['checked_at'] < VERSION_CHECK_INTERVAL:
+            return settings
+
+    version = changefeed.get_domain_versions((changefeed.SETTINGS,))[changefeed.SETTINGS]
+    if settings is None or version != _cache['version']:
+        settings = _read_settings()
+
+    with _lock:
+        _cache.update(settings=settings, version=version, checked_at=now)
+    return settings
+
+
+def invalidate_cost_settings():
+    """Svuota la cache: la prossima lettura tornerà al database."""
+    with _lock:
+        _cache.update(settings=None, version=None, checked_at=0.0)
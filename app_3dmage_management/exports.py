@@ -0,0 +1,243 @@
+"""
+Esportazioni CSV in streaming.
+
+Ogni esportazione dichiara intestazione, queryset (con gli stessi filtri GET della dashboard da cui
+si parte) e conversione di una riga. Le righe vengono lette dal database a blocchi con
+iterator(chunk_size=EXPORT_CHUNK_SIZE) e inviate al client man mano tramite StreamingHttpResponse:
+la memoria usata non dipende dal numero di righe e i primi byte partono subito.
+
+Il formato resta quello già usato per il magazzino (BOM UTF-8, separatore ';', virgola decimale),
+così i file si aprono direttamente in Excel.
+"""
+import csv
+import datetime
+
+from django.db.models import Sum
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+
+from . import search
+from .models import StockItem, Expense, PrintFile, FilamentUsage
+
+EXPORT_CHUNK_SIZE = 2000
+# Righe CSV accumulate prima di ogni invio al client
+ROWS_PER_WRITE = 200
+
+
+class _Echo:
+    """Pseudo-buffer per csv.writer: restituisce la riga invece di scriverla."""
+
+    def write(self, value):
+        return value
+
+
+def _money(value):
+    return f'{value:.2f}'.replace('.', ',') if value is not None else ''
+
+
+def _date(value):
+    if not value:
+        return ''
+    if isinstance(value, datetime.datetime):
+        value = timezone.localtime(value)
+    return value.strftime('%d/%m/%Y')
+
+
+def _year(params, key='year'):
+    value = params.get(key, '')
+    return int(value) if value.isdigit() else None
+
+
+class CsvExport:
+    name = ''
+    filename = ''
+    header = []
+
+    def queryset(self, params):
+        raise NotImplementedError
+
+    def row(self, obj):
+        raise NotImplementedError
+
+    def lines(self, params):
+        """Righe CSV già formattate, a gruppi di ROWS_PER_WRITE."""
+        writer = csv.writer(_Echo(), delimiter=';')
+        yield '\ufeff' + writer.writerow(self.header)
+        buffer = []
+        for obj in self.queryset(params).iterator(chunk_size=EXPORT_CHUNK_SIZE):
+            buffer.append(writer.writerow(self.row(obj)))
+            if len(buffer) >= ROWS_PER_WRITE:
+                yield ''.join(buffer)
+                buffer = []
+        if buffer:
+            yield ''.join(buffer)
+
+    def response(self, params):
+        response = StreamingHttpResponse(self.lines(params), content_type='text/csv; charset=utf-8')
+        response['Content-Disposition'] = f'attachment; filename="{self.filename}_{timezone.now().strftime("%Y-%m-%d")}.csv"'
+        return response
+
+
+class StockSalesExport(CsvExport):
+    """Magazzino e vendite: filtri del magazzino (q, status) e delle vendite (sold_to, payment_method, notes, date)."""
+    name = 'magazzino-vendite'
+    filename = 'export_magazzino_vendite'
+    header = [
+        'ID Oggetto', 'ID Progetto Origine', 'Categoria Progetto', 'Nome Oggetto', 'Stato', 'Quantita',
+        'Costo Materiali (€)', 'Costo Manodopera (€)', 'Costo Totale Produzione (€)',
+        'Prezzo Vendita Suggerito (Unità) (€)', 'Data Creazione', 'Data Vendita',
+        'Prezzo Vendita Effettivo (Unità) (€)', 'Ricavo Totale (€)', 'Profitto (€)',
+        'Venduto a', 'Metodo Pagamento', 'Note'
+    ]
+
+    def queryset(self, params):
+        items = StockItem.objects.select_related('work_order__category', 'payment_method')
+        if params.get('q'):
+            # Stessa ricerca delle dashboard di magazzino (oggetti) e vendite (venduti)
+            items = items.filter(pk__in=search.matching_ids(params['q'], search.Kind.STOCK_ITEM, search.Kind.SALE))
+        if params.get('status'):
+            items = items.filter(status=params['status'])
+        if params.get('sold_to'):
+            items = items.filter(sold_to__icontains=params['sold_to'])
+        if params.get('payment_method') == 'UNPAID':
+            items = items.filter(status='SOLD', payment_method__isnull=True)
+        elif params.get('payment_method'):
+            items = items.filter(payment_method_id=params['payment_method'])
+        if params.get('notes'):
+            items = items.filter(notes__icontains=params['notes'])
+        if params.get('start_date'):
+            items = items.filter(sold_at__gte=params['start_date'])
+        if params.get('end_date'):
+            items = items.filter(sold_at__lte=params['end_date'])
+        return items.order_by('status', '-created_at')
+
+    def row(self, item):
+        total_revenue = (item.sale_price or 0) * item.quantity
+        profit = total_revenue - (item.material_cost + item.labor_cost) if item.status == 'SOLD' else None
+        return [
+            item.custom_id or item.id,
+            item.work_order.custom_id if item.work_order else 'N/A',
+            item.work_order.category.name if item.work_order and item.work_order.category else 'N/A',
+            item.name,
+            item.get_status_display(),
+            item.quantity,
+            _money(item.material_cost),
+            _money(item.labor_cost),
+            _money(item.total_cost),
+            _money(item.suggested_price),
+            item.created_at.strftime('%d/%m/%Y'),
+            item.sold_at.strftime('%d/%m/%Y') if item.sold_at else '',
+            _money(item.sale_price),
+            _money(total_revenue) if item.status == 'SOLD' else '',
+            _money(profit),
+            item.sold_to,
+            item.payment_method.name if item.payment_method else ('DA PAGARE' if item.status == 'SOLD' else ''),
+            item.notes
+        ]
+
+
+class ExpensesExport(CsvExport):
+    """Spese: filtri della contabilità (q, year, payment_method, category)."""
+    name = 'spese'
+    filename = 'export_spese'
+    header = ['ID', 'Data', 'Descrizione', 'Categoria', 'Pagato con', 'Importo (€)', 'Note']
+
+    def queryset(self, params):
+        expenses = Expense.objects.select_related('category', 'payment_method')
+        if params.get('q'):
+            # Stessa ricerca della dashboard contabile
+            expenses = expenses.filter(pk__in=search.matching_ids(params['q'], search.Kind.EXPENSE))
+        if _year(params):
+            expenses = expenses.filter(expense_date__year=_year(params))
+        if params.get('payment_method'):
+            expenses = expenses.filter(payment_method_id=params['payment_method'])
+        if params.get('category'):
+            expenses = expenses.filter(category_id=params['category'])
+        return expenses.order_by('-expense_date', '-id')
+
+    def row(self, expense):
+        return [
+            expense.id,
+            _date(expense.expense_date),
+            expense.description,
+            expense.category.name if expense.category else '',
+            expense.payment_method.name if expense.payment_method else '',
+            _money(expense.amount),
+            expense.notes,
+        ]
+
+
+class PrintHistoryExport(CsvExport):
+    """Storico stampe concluse: filtri delle statistiche (year, printer)."""
+    name = 'storico-stampe'
+    filename = 'export_storico_stampe'
+    header = [
+        'ID File', 'ID Ordine', 'Ordine', 'Nome File', 'Stampante', 'Piatto', 'Stato', 'Data Creazione',
+        'Inizio Stampa', 'Tempo di Stampa (ore)', 'Oggetti Stampati', 'Grammi Usati'
+    ]
+
+    def queryset(self, params):
+        files = PrintFile.objects.filter(status__in=['DONE', 'FAILED']).select_related('work_order', 'printer', 'plate')
+        if _year(params):
+            files = files.filter(created_at__year=_year(params))
+        if params.get('printer', '').isdigit():
+            files = files.filter(printer_id=int(params['printer']))
+        return files.annotate(total_grams=Sum('filament_usages__grams_used')).order_by('-created_at', '-id')
+
+    def row(self, print_file):
+        return [
+            print_file.id,
+            print_file.work_order.custom_id or print_file.work_order_id,
+            print_file.work_order.name,
+            print_file.name,
+            print_file.printer.name if print_file.printer else '',
+            print_file.plate.name if print_file.plate else '',
+            print_file.get_status_display(),
+            _date(print_file.created_at),
+            _date(print_file.started_at),
+            _money(print_file.print_time_seconds / 3600),
+            print_file.actual_quantity if print_file.status == 'DONE' else 0,
+            _money(print_file.total_grams or 0),
+        ]
+
+
+class FilamentUsageExport(CsvExport):
+    """Consumi di filamento delle stampe concluse: filtri delle statistiche (year, printer) più filament."""
+    name = 'consumi-filamento'
+    filename = 'export_consumi_filamento'
+    header = [
+        'Data', 'ID Ordine', 'Nome File', 'Stato', 'Stampante', 'Filamento', 'Bobina', 'Grammi Usati', 'Costo Materiale (€)'
+    ]
+
+    def queryset(self, params):
+        usages = FilamentUsage.objects.filter(
+            print_file__status__in=['DONE', 'FAILED']
+        ).select_related('print_file__work_order', 'print_file__printer', 'spool__filament')
+        if _year(params):
+            usages = usages.filter(print_file__created_at__year=_year(params))
+        if params.get('printer', '').isdigit():
+            usages = usages.filter(print_file__printer_id=int(params['printer']))
+        if params.get('filament', '').isdigit():
+            usages = usages.filter(spool__filament_id=int(params['filament']))
+        return usages.order_by('-print_file__created_at', '-id')
+
+    def row(self, usage):
+        print_file = usage.print_file
+        spool = usage.spool
+        cost = usage.grams_used * spool.cost / spool.initial_weight_g if spool.initial_weight_g else None
+        return [
+            _date(print_file.created_at),
+            print_file.work_order.custom_id or print_file.work_order_id,
+            print_file.name,
+            print_file.get_status_display(),
+            print_file.printer.name if print_file.printer else '',
+            str(spool.filament),
+            spool.identifier,
+            _money(usage.grams_used),
+            _money(cost),
+        ]
+
+
+EXPORTS = {export.name: export for export in (
+    StockSalesExport(), ExpensesExport(), PrintHistoryExport(), FilamentUsageExport()
+)}
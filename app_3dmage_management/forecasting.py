@@ -0,0 +1,231 @@
+"""
+Previsione delle scorte di filamento e suggerimenti di riordino.
+
+Per ogni filamento con bobine attive si ricavano:
+  - il consumo medio giornaliero dalle stampe DONE/FAILED degli ultimi FORECAST_WINDOW_DAYS giorni;
+  - i grammi già impegnati dai file TODO/PRINTING e l'istante in cui la coda li avrà stampati;
+  - i giorni di autonomia del peso disponibile (residuo meno impegnato) al consumo medio.
+Un filamento va riordinato se non basta a completare la coda oppure se l'autonomia scende sotto
+REORDER_LEAD_DAYS; la quantità suggerita copre la mancanza più REORDER_COVER_DAYS giorni di consumo.
+
+Il calcolo (tre query più le stime della coda) viene riutilizzato finché filamenti, coda e ordini
+non cambiano, e comunque al massimo per FORECAST_TTL secondi. La lettura delle previsioni non scrive
+nulla: le Notification per i filamenti che si esauriranno prima della fine della coda (una sola
+finché non viene letta) le crea il comando pianificato refresh_filament_forecast.
+"""
+import datetime
+import math
+import threading
+import time
+from collections import namedtuple
+from decimal import Decimal
+
+from django.db.models import Sum, Min
+from django.urls import reverse
+from django.utils import timezone
+
+from . import changefeed
+
+FORECAST_DOMAINS = (changefeed.FILAMENTS, changefeed.PRINT_QUEUE, changefeed.WORK_ORDERS)
+FORECAST_TTL = 15 * 60
+FORECAST_WINDOW_DAYS = 90
+# Storico minimo su cui distribuire il consumo, per non gonfiare la media dei filamenti appena introdotti
+MIN_HISTORY_DAYS = 7
+REORDER_LEAD_DAYS = 14
+REORDER_COVER_DAYS = 30
+DEFAULT_SPOOL_GRAMS = 1000
+
+ZERO = Decimal('0.00')
+
+_lock = threading.Lock()
+_cache = {'forecast': None, 'version': None, 'built_at': 0.0}
+
+
+class FilamentForecast(namedtuple('FilamentForecast', [
+    'filament_id', 'remaining_grams', 'committed_grams', 'daily_grams', 'queue_finish',
+    'days_to_empty', 'empty_date', 'shortage_grams', 'reorder_grams', 'reorder_spools',
+])):
+    __slots__ = ()
+
+    @property
+    def available_grams(self):
+        return max(ZERO, self.remaining_grams - self.committed_grams)
+
+    @property
+    def runs_out_before_queue(self):
+        return self.shortage_grams > 0
+
+    @property
+    def needs_reorder(self):
+        return self.reorder_spools > 0
+
+
+class InventoryForecast:
+    """Previsioni calcolate in un certo istante, per id filamento."""
+
+    def __init__(self, now):
+        self.now = now
+        self.filaments = {}
+
+    def get(self, filament_id):
+        return self.filaments.get(filament_id)
+
+    @property
+    def reorders(self):
+        return [forecast for forecast in self.filaments.values() if forecast.needs_reorder]
+
+    @property
+    def shortages(self):
+        return [forecast for forecast in self.filaments.values() if forecast.runs_out_before_queue]
+
+
+def _history_rates(now):
+    """{filament_id: grammi al giorno} dalle stampe concluse nella finestra di osservazione."""
+    from .models import FilamentUsage
+    since = now - datetime.timedelta(days=FORECAST_WINDOW_DAYS)
+    rows = FilamentUsage.objects.filter(
+        print_file__status__in=['DONE', 'FAILED'],
+        print_file__created_at__gte=since,
+    ).values('spool__filament_id').annotate(grams=Sum('grams_used'), first_use=Min('print_file__created_at'))
+
+    rates = {}
+    for row in rows:
+        observed_days = (now - row['first_use']).total_seconds() / 86400
+        days = min(FORECAST_WINDOW_DAYS, max(MIN_HISTORY_DAYS, observed_days))
+        rates[row['spool__filament_id']] = Decimal(row['grams'] or 0) / Decimal(str(round(days, 4)))
+    return rates
+
+
+def forecast_filament(filament_id, remaining, committed, daily_grams, queue_finish, spool_grams, now):
+    """Previsione di un filamento, senza query."""
+    available = remaining - committed
+    shortage = max(ZERO, -available)
+    available = max(ZERO, available)
+
+    if daily_grams > 0:
+        days_to_empty = float(available / daily_grams)
+        empty_date = timezone.localdate(max(queue_finish or now, now)) + datetime.timedelta(days=int(days_to_empty))
+    else:
+        days_to_empty = None
+        empty_date = None
+
+    reorder_grams = ZERO
+    if shortage > 0 or (days_to_empty is not None and days_to_empty < REORDER_LEAD_DAYS):
+        reorder_grams = shortage + max(ZERO, daily_grams * REORDER_COVER_DAYS - available)
+    reorder_spools = math.ceil(reorder_grams / Decimal(spool_grams)) if reorder_grams > 0 else 0
+
+    return FilamentForecast(
+        filament_id=filament_id,
+        remaining_grams=remaining,
+        committed_grams=committed,
+        daily_grams=daily_grams.quantize(Decimal('0.01')),
+        queue_finish=queue_finish,
+        days_to_empty=days_to_empty,
+        empty_date=empty_date,
+        shortage_grams=shortage,
+        reorder_grams=reorder_grams.quantize(Decimal('0.01')),
+        reorder_spools=reorder_spools,
+    )
+
+
+def build_forecast(now=None):
+    """Calcola le previsioni di tutti i filamenti con bobine attive."""
+    from .models import Spool, FilamentUsage
+    from .scheduling import get_schedule
+    now = now or timezone.now()
+    forecast = InventoryForecast(now)
+
+    stock = {}
+    spool_sizes = {}
+    for filament_id, remaining, initial_weight in Spool.objects.with_weights().filter(
+        is_active=True
+    ).values_list('filament_id', 'remaining_grams', 'initial_weight_g'):
+        stock[filament_id] = stock.get(filament_id, ZERO) + Decimal(remaining)
+        # Il riordino si esprime in bobine del formato più grande in uso
+        spool_sizes[filament_id] = max(spool_sizes.get(filament_id, 0), initial_weight or 0)
+
+    committed = {}
+    queued_files = {}
+    for filament_id, print_file_id, grams in FilamentUsage.objects.filter(
+        spool__is_active=True, print_file__status__in=['TODO', 'PRINTING']
+    ).values_list('spool__filament_id', 'print_file_id', 'grams_used'):
+        committed[filament_id] = committed.get(filament_id, ZERO) + grams
+        queued_files.setdefault(filament_id, set()).add(print_file_id)
+
+    rates = _history_rates(now)
+    schedule = get_schedule() if queued_files else None
+
+    for filament_id, remaining in stock.items():
+        queue_finish = None
+        if schedule is not None:
+            finishes = [eta.finish for eta in map(schedule.file, queued_files.get(filament_id, ())) if eta]
+            queue_finish = max(finishes, default=None)
+        forecast.filaments[filament_id] = forecast_filament(
+            filament_id,
+            remaining=remaining,
+            committed=committed.get(filament_id, ZERO),
+            daily_grams=rates.get(filament_id, ZERO),
+            queue_finish=queue_finish,
+            spool_grams=spool_sizes.get(filament_id) or DEFAULT_SPOOL_GRAMS,
+            now=now,
+        )
+    return forecast
+
+
+def notify_shortages(forecast):
+    """
+    Crea una Notification per ogni filamento che si esaurirà prima della fine della coda,
+    a meno che ce ne sia già una non letta per lo stesso filamento. Restituisce quelle create.
+    """
+    from .models import Filament, Notification
+    shortages = {item.filament_id: item for item in forecast.shortages}
+    if not shortages:
+        return []
+
+    dashboard_url = reverse('filament_dashboard')
+    urls = {filament_id: f'{dashboard_url}?filament={filament_id}' for filament_id in shortages}
+    already_notified = set(
+        Notification.objects.filter(is_read=False, related_url__in=urls.values()).values_list('related_url', flat=True)
+    )
+
+    created = []
+    for filament in Filament.objects.filter(id__in=shortages):
+        if urls[filament.id] in already_notified:
+            continue
+        item = shortages[filament.id]
+        message = f"Filamento {filament} in esaurimento: mancano {item.shortage_grams:.0f}g per completare la coda di stampa"
+        if item.reorder_spools:
+            message += f" (riordinare {item.reorder_spools} bobine)"
+        created.append(Notification(
+            message=message[:255],
+            level=Notification.NotificationLevel.WARNING,
+            related_url=urls[filament.id],
+        ))
+    if not created:
+        return []
+    created = Notification.objects.bulk_create(created)
+    # bulk_create non invia post_save
+    changefeed.bump_domain_versions(changefeed.NOTIFICATIONS)
+    return created
+
+
+def get_forecast():
+    """Restituisce le previsioni correnti, ricalcolandole solo se filamenti, coda o ordini sono cambiati."""
+    versions = changefeed.get_domain_versions(FORECAST_DOMAINS)
+    version = tuple(versions[domain] for domain in FORECAST_DOMAINS)
+    now = time.monotonic()
+    with _lock:
+        forecast = _cache['forecast']
+        if forecast is not None and _cache['version'] == version and now - _cache['built_at'] < FORECAST_TTL:
+            return forecast
+
+    forecast = build_forecast()
+    with _lock:
+        _cache.update(forecast=forecast, version=version, built_at=now)
+    return forecast
+
+
+def invalidate_forecast():
+    """Svuota la cache: la prossima lettura ricalcola le previsioni."""
+    with _lock:
+        _cache.update(forecast=None, version=None, built_at=0.0)
@@ -33,6 +33,9 @@ class PrintFileForm(forms.ModelForm):
     def __init__(self, *args, **kwargs):
         work_order = kwargs.pop('work_order', None)
         super().__init__(*args, **kwargs)
+        # Le etichette di piatti e parti leggono stampante e progetto: caricati insieme alle opzioni
+        self.fields['plate'].queryset = Plate.objects.select_related('printer')
+        self.fields['project_part'].queryset = ProjectPart.objects.select_related('project')
         # Attempt to find work_order if not explicitly passed
         if not work_order:
             if self.instance and hasattr(self.instance, 'work_order'):
@@ -41,7 +44,7 @@ class PrintFileForm(forms.ModelForm):
                 work_order = kwargs['initial']['work_order']
         
         if work_order and hasattr(work_order, 'project') and work_order.project:
-            self.fields['project_part'].queryset = ProjectPart.objects.filter(project=work_order.project)
+            self.fields['project_part'].queryset = ProjectPart.objects.filter(project=work_order.project).select_related('project')
         elif work_order:
             self.fields['project_part'].queryset = ProjectPart.objects.none()
             
@@ -172,12 +175,14 @@ class PrintFileEditForm(forms.ModelForm):
     def __init__(self, *args, **kwargs):
         work_order = kwargs.pop('work_order', None)
         super().__init__(*args, **kwargs)
+        self.fields['plate'].queryset = Plate.objects.select_related('printer')
+        self.fields['project_part'].queryset = ProjectPart.objects.select_related('project')
         if not work_order:
             if self.instance and hasattr(self.instance, 'work_order'):
                 work_order = self.instance.work_order
         
         if work_order and hasattr(work_order, 'project') and work_order.project:
-            self.fields['project_part'].queryset = ProjectPart.objects.filter(project=work_order.project)
+            self.fields['project_part'].queryset = ProjectPart.objects.filter(project=work_order.project).select_related('project')
         elif work_order:
             self.fields['project_part'].queryset = ProjectPart.objects.none()
             
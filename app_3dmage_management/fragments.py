@@ -0,0 +1,74 @@
+"""
+Cache dei parziali HTMX più richiesti: tabella degli ordini attivi, tabella del magazzino e coda di stampa.
+
+Quando un dominio cambia, ogni client aperto chiede di nuovo il proprio parziale; i client con gli
+stessi filtri riceverebbero lo stesso HTML calcolato N volte. Il rendering viene quindi salvato nella
+cache di Django con chiave (parziale, parametri di filtro/ordinamento, versioni dei domini, giorno):
+il primo client dopo una modifica lo calcola, gli altri lo ricevono senza query. Le chiavi delle
+versioni superate non vengono più lette e scadono da sole.
+
+Si usa la cache 'fragments' se configurata (in memoria per processo, o su file con FRAGMENT_CACHE_DIR
+quando più processi servono l'applicazione), altrimenti 'default'. I parziali mostrano stime che
+dipendono dall'ora corrente: la durata di una voce è quella delle stime dello scheduler.
+"""
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+from . import changefeed
+from .scheduling import SCHEDULE_TTL
+
+FRAGMENT_CACHE = 'fragments'
+FRAGMENT_TTL = SCHEDULE_TTL
+# Parametri che non cambiano il contenuto: la versione nota al client
+IGNORED_PARAMS = {'v'}
+
+
+def get_cache():
+    return caches[FRAGMENT_CACHE if FRAGMENT_CACHE in settings.CACHES else 'default']
+
+
+def fragment_key(template_name, request, versions):
+    params = sorted((key, value) for key, values in request.GET.lists() if key not in IGNORED_PARAMS for value in values)
+    raw = json.dumps([params, sorted(versions.items()), timezone.localdate().isoformat()])
+    return f"fragment:{template_name}:{hashlib.sha1(raw.encode()).hexdigest()}"
+
+
+class Fragment:
+    """
+    Parziale HTMX di una vista. lookup() restituisce la risposta già in cache (o None), render()
+    calcola il parziale dal contesto e lo salva. Richieste non HTMX non passano dalla cache.
+    """
+
+    def __init__(self, request, template_name, domains, known_versions=None):
+        self.request = request
+        self.template_name = template_name
+        self.key = None
+        if request.headers.get('HX-Request'):
+            # Versioni già lette dalla vista (htmx_version) riusate, le altre in una query
+            versions = dict(known_versions or {})
+            missing = [domain for domain in domains if domain not in versions]
+            if missing:
+                versions.update(changefeed.get_domain_versions(missing))
+            self.key = fragment_key(template_name, request, versions)
+
+    def lookup(self):
+        if self.key is None:
+            return None
+        html = get_cache().get(self.key)
+        return HttpResponse(html) if html is not None else None
+
+    def render(self, context):
+        html = render_to_string(self.template_name, context, request=self.request)
+        if self.key is not None:
+            get_cache().set(self.key, html, FRAGMENT_TTL)
+        return HttpResponse(html)
+
+
+def clear():
+    get_cache().clear()
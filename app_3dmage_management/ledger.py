@@ -0,0 +1,220 @@
+"""
+Registro dei saldi dei metodi di pagamento.
+
+Ogni variazione di saldo (vendita, spesa, storno, trasferimento, correzione) è una riga append-only
+di BalanceMovement con la sua data contabile; PaymentMethod.balance resta come valore in cache,
+aggiornato con F() nella stessa transazione del movimento, così due richieste concorrenti non si
+sovrascrivono il saldo a vicenda. Modifiche ed eliminazioni non cancellano movimenti: registrano
+uno storno datato come l'operazione originale.
+
+Il saldo a una data è l'ultima istantanea di fine mese (BalanceSnapshot) più la somma dei movimenti
+successivi fino a quella data: una query per tutti i metodi, su un intervallo dell'indice
+(payment_method, occurred_on). Le istantanee dei mesi chiusi si creano con ensure_snapshots() (o il
+comando snapshot_balances); un movimento retrodatato cancella quelle che lo comprendono.
+"""
+import calendar
+import datetime
+import uuid
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import DecimalField, F, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, TruncMonth
+from django.utils import timezone
+
+from .models import BalanceMovement, BalanceSnapshot, PaymentMethod
+
+ZERO = Decimal('0.00')
+Kind = BalanceMovement.Kind
+
+
+def month_end(day):
+    return day.replace(day=calendar.monthrange(day.year, day.month)[1])
+
+
+def last_closed_month_end(today=None):
+    """Ultimo giorno del mese precedente: i mesi chiusi non ricevono più movimenti ordinari."""
+    today = today or timezone.localdate()
+    return today.replace(day=1) - datetime.timedelta(days=1)
+
+
+def record(payment_method, amount, kind, occurred_on=None, **fields):
+    """Registra un movimento e aggiorna il saldo in cache del metodo di pagamento."""
+    amount = Decimal(amount)
+    with transaction.atomic():
+        movement = BalanceMovement.append(payment_method, amount, kind, occurred_on, **fields)
+        PaymentMethod.objects.filter(pk=payment_method.pk).update(balance=F('balance') + amount)
+    payment_method.refresh_from_db(fields=['balance'])
+    return movement
+
+
+def record_expense(expense):
+    if not (expense.payment_method and expense.amount):
+        return None
+    return record(
+        expense.payment_method, -expense.amount, Kind.EXPENSE, expense.expense_date,
+        description=expense.description[:255], expense=expense
+    )
+
+
+def reverse_expense(payment_method, amount, occurred_on, expense=None, description=''):
+    """Storno di una spesa (modificata o eliminata), alla data della spesa originale."""
+    if not (payment_method and amount):
+        return None
+    return record(
+        payment_method, amount, Kind.REVERSAL, occurred_on,
+        description=description or f"Storno spesa {expense.description if expense else ''}".strip()[:255],
+        expense=expense
+    )
+
+
+def record_sale(stock_item, amount=None):
+    """Incasso netto (commissioni escluse) di una vendita, alla data di vendita."""
+    if not stock_item.payment_method:
+        return None
+    amount = stock_item.get_net_revenue() if amount is None else amount
+    if not amount:
+        return None
+    return record(
+        stock_item.payment_method, amount, Kind.SALE, stock_item.sold_at,
+        description=f"Vendita {stock_item.name}"[:255], stock_item=stock_item
+    )
+
+
+def reverse_sale(payment_method, amount, occurred_on, stock_item=None):
+    if not (payment_method and amount):
+        return None
+    return record(
+        payment_method, -amount, Kind.REVERSAL, occurred_on,
+        description=f"Storno vendita {stock_item.name if stock_item else ''}".strip()[:255],
+        stock_item=stock_item
+    )
+
+
+def transfer(source, destination, amount, occurred_on=None):
+    """Trasferimento in partita doppia: le due righe si registrano insieme o per niente."""
+    transfer_id = uuid.uuid4()
+    description = f"{source} → {destination}"[:255]
+    with transaction.atomic():
+        # Ordine fisso dei lock: due trasferimenti opposti non si bloccano a vicenda
+        list(PaymentMethod.objects.select_for_update().filter(pk__in=[source.pk, destination.pk]).order_by('pk'))
+        outgoing = record(source, -amount, Kind.TRANSFER, occurred_on, description=description, transfer_id=transfer_id)
+        incoming = record(destination, amount, Kind.TRANSFER, occurred_on, description=description, transfer_id=transfer_id)
+    return outgoing, incoming
+
+
+def correct_balance(payment_method, new_balance, occurred_on=None):
+    """Porta il saldo al valore indicato con un movimento di correzione pari alla differenza."""
+    with transaction.atomic():
+        current = PaymentMethod.objects.select_for_update().values_list('balance', flat=True).get(pk=payment_method.pk)
+        delta = Decimal(new_balance) - current
+        if not delta:
+            return None
+        return record(payment_method, delta, Kind.CORRECTION, occurred_on, description=Kind.CORRECTION.label)
+
+
+def balances_as_of(day=None, methods=None):
+    """
+    Metodi di pagamento annotati con ledger_balance, il saldo a fine giornata del giorno indicato
+    (oggi se omesso): ultima istantanea non successiva più i movimenti tra l'istantanea e il giorno.
+    """
+    day = day or timezone.localdate()
+    methods = PaymentMethod.objects.all() if methods is None else methods
+    snapshots = BalanceSnapshot.objects.filter(payment_method=OuterRef('pk'), period_end__lte=day).order_by('-period_end')
+    methods = methods.annotate(
+        snapshot_end=Subquery(snapshots.values('period_end')[:1]),
+        snapshot_balance=Coalesce(Subquery(snapshots.values('balance')[:1]), Value(ZERO), output_field=DecimalField()),
+    )
+    tail = BalanceMovement.objects.filter(
+        payment_method=OuterRef('pk'), occurred_on__lte=day,
+        occurred_on__gt=Coalesce(OuterRef('snapshot_end'), Value(datetime.date.min)),
+    ).order_by().values('payment_method').annotate(total=Sum('amount')).values('total')
+    return methods.annotate(
+        ledger_balance=F('snapshot_balance') + Coalesce(Subquery(tail), Value(ZERO), output_field=DecimalField())
+    )
+
+
+def ensure_snapshots(until=None):
+    """
+    Crea le istantanee di fine mese mancanti fino a until (default: ultimo mese chiuso), partendo per
+    ogni metodo dall'ultima istantanea esistente. Restituisce il numero di istantanee create.
+    """
+    until = month_end(until) if until else last_closed_month_end()
+    last = BalanceSnapshot.objects.filter(payment_method=OuterRef('pk')).order_by('-period_end')
+    methods = [
+        method for method in PaymentMethod.objects.annotate(
+            last_end=Subquery(last.values('period_end')[:1]), last_balance=Subquery(last.values('balance')[:1]),
+        )
+        if method.last_end is None or method.last_end < until
+    ]
+    if not methods:
+        return 0
+
+    # Somme mensili dei soli movimenti successivi all'ultima istantanea di ogni metodo
+    pending = Q()
+    for method in methods:
+        pending |= Q(payment_method=method, occurred_on__gt=method.last_end) if method.last_end else Q(payment_method=method)
+    monthly = {}
+    for method_id, month, total in (
+        BalanceMovement.objects.filter(pending, occurred_on__lte=until).annotate(month=TruncMonth('occurred_on'))
+        .order_by().values('payment_method', 'month').annotate(total=Sum('amount'))
+        .values_list('payment_method', 'month', 'total')
+    ):
+        monthly.setdefault(method_id, {})[month] = total
+
+    created = []
+    for method in methods:
+        totals = monthly.get(method.pk, {})
+        if method.last_end:
+            month, balance = method.last_end + datetime.timedelta(days=1), method.last_balance
+        elif totals:
+            month, balance = min(totals), ZERO
+        else:
+            continue
+        while month <= until:
+            balance += totals.get(month, ZERO)
+            created.append(BalanceSnapshot(payment_method=method, period_end=month_end(month), balance=balance))
+            month = month_end(month) + datetime.timedelta(days=1)
+    BalanceSnapshot.objects.bulk_create(created, ignore_conflicts=True)
+    return len(created)
+
+
+def period_balances(year, methods=None):
+    """
+    Saldi di fine mese dell'anno indicato: (metodi, righe), una riga per mese già iniziato con il
+    saldo di ogni metodo. I mesi chiusi vengono letti dalle istantanee, il mese in corso dal registro.
+    """
+    today = timezone.localdate()
+    methods = list(PaymentMethod.objects.all() if methods is None else methods)
+    ensure_snapshots(min(datetime.date(year, 12, 31), last_closed_month_end(today)))
+    snapshots = {
+        (snapshot.payment_method_id, snapshot.period_end): snapshot.balance
+        for snapshot in BalanceSnapshot.objects.filter(period_end__year=year)
+    }
+    rows = []
+    for month in range(1, 13):
+        first_day = datetime.date(year, month, 1)
+        if first_day > today:
+            break
+        period_end = month_end(first_day)
+        if period_end >= today:
+            # Mese in corso: saldo a oggi, già annotato se i metodi vengono da balances_as_of()
+            if not all(hasattr(method, 'ledger_balance') for method in methods):
+                current = {method.pk: method.ledger_balance for method in balances_as_of(today)}
+                for method in methods:
+                    method.ledger_balance = current.get(method.pk, ZERO)
+            balances = [method.ledger_balance for method in methods]
+        else:
+            # Metodo senza movimenti fino a quel mese: nessuna istantanea, saldo zero
+            balances = [snapshots.get((method.pk, period_end), ZERO) for method in methods]
+        rows.append({'period_end': min(period_end, today), 'balances': balances, 'total': sum(balances, ZERO)})
+    return methods, rows
+
+
+def cache_mismatches():
+    """Metodi il cui saldo in cache non coincide con il registro: [(metodo, cache, registro)]."""
+    return [
+        (method, method.balance, method.ledger_balance)
+        for method in balances_as_of(datetime.date.max)
+        if method.balance != method.ledger_balance
+    ]
@@ -0,0 +1,264 @@
+"""
+Assegnazione automatica dei file da stampare alle stampanti.
+
+I file TODO degli ordini attivi vengono distribuiti sulle stampanti compatibili partendo dall'istante
+in cui ognuna termina la stampa in corso:
+  - 'makespan': euristica LPT, i file più lunghi per primi sulla stampante che si libera prima;
+  - 'lateness': ordine per priorità e data di consegna, ogni file sulla stampante che lo finisce prima.
+In entrambi i casi, dentro la coda di ogni stampante i file seguono priorità e data di consegna.
+
+Con match_plates un file che richiede un piatto può andare solo sulle stampanti che possiedono un
+piatto con lo stesso nome. Il piano si calcola in memoria (anteprima) e si applica con una UPDATE
+per stampante tramite queue_order. Con un sottoinsieme di stampanti si bilanciano solo i loro file
+(e quelli senza stampante): le code delle altre restano com'erano.
+
+L'anteprima porta la versione della coda di stampa e l'istante di calcolo: apply_confirmed_plan
+ricalcola lo stesso piano solo se la coda non è cambiata nel frattempo, altrimenti solleva StalePlan.
+"""
+import datetime
+from collections import namedtuple
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from . import changefeed
+from .models import DomainVersion, PrintFile, Plate, PrintStatsRollup
+from .queue_order import POSITION_GAP, apply_positions
+
+ACTIVE_STATUSES = ['TODO', 'PRINTING']
+OBJECTIVES = ('makespan', 'lateness')
+
+PRIORITY_RANK = {'URGENT': 0, 'HIGH': 1, 'MEDIUM': 2, 'LOW': 3}
+PRIORITY_WEIGHT = {'URGENT': 8, 'HIGH': 4, 'MEDIUM': 2, 'LOW': 1}
+
+Assignment = namedtuple('Assignment', ['file_id', 'printer_id', 'position', 'start', 'finish'])
+_Job = namedtuple('_Job', ['file_id', 'work_order_id', 'printer_id', 'seconds', 'plate_name', 'priority', 'delivery_date'])
+
+
+class StalePlan(Exception):
+    """La coda di stampa è cambiata dopo l'anteprima del piano."""
+
+
+class BalancePlan:
+    """Piano di assegnazione: file assegnati, file senza stampante compatibile e indicatori."""
+
+    def __init__(self, now, objective):
+        self.now = now
+        self.objective = objective
+        self.assignments = []
+        self.unassigned = []
+        self.printer_finish = {}
+        self.order_finish = {}
+        self.weighted_lateness_hours = 0.0
+        self.current_printers = {}
+        self.plate_names = {}
+        self.version = None
+
+    @property
+    def makespan(self):
+        """Istante in cui l'ultima stampante termina la coda."""
+        return max(self.printer_finish.values(), default=self.now)
+
+    @property
+    def moved(self):
+        """Assegnazioni che cambiano la stampante attuale del file."""
+        return [a for a in self.assignments if self.current_printers.get(a.file_id) != a.printer_id]
+
+    def as_dict(self):
+        return {
+            'objective': self.objective,
+            'version': self.version,
+            'now': self.now.isoformat(),
+            'makespan': self.makespan.isoformat(),
+            'weighted_lateness_hours': round(self.weighted_lateness_hours, 2),
+            'assignments': [
+                {
+                    'file_id': a.file_id,
+                    'printer_id': a.printer_id,
+                    'position': a.position,
+                    'start': a.start.isoformat(),
+                    'finish': a.finish.isoformat(),
+                }
+                for a in self.assignments
+            ],
+            'unassigned': self.unassigned,
+            'moved': len(self.moved),
+        }
+
+
+def _sequence_key(job):
+    """Ordine dei file nella coda: priorità, poi data di consegna (senza data in fondo), poi durata."""
+    return (
+        PRIORITY_RANK.get(job.priority, len(PRIORITY_RANK)),
+        job.delivery_date or datetime.date.max,
+        -job.seconds,
+        job.file_id,
+    )
+
+
+def load_jobs(file_ids=None, printer_ids=None):
+    """
+    File da stampare degli ordini attivi (una query). Con printer_ids solo quelli in coda sulle
+    stampanti indicate o ancora senza stampante.
+    """
+    files = PrintFile.objects.filter(status='TODO', work_order__status__in=ACTIVE_STATUSES)
+    if file_ids is not None:
+        files = files.filter(id__in=file_ids)
+    if printer_ids is not None:
+        files = files.filter(Q(printer_id__in=printer_ids) | Q(printer__isnull=True))
+    return [
+        _Job(*row) for row in files.values_list(
+            'id', 'work_order_id', 'printer_id', 'print_time_seconds', 'plate__name',
+            'work_order__priority', 'work_order__delivery_date'
+        )
+    ]
+
+
+def printer_availability(printer_ids, now):
+    """Istante in cui ogni stampante termina la stampa in corso (adesso, se è libera)."""
+    available = {printer_id: now for printer_id in printer_ids}
+    printing = PrintFile.objects.filter(
+        status='PRINTING', printer_id__in=printer_ids, work_order__status__in=ACTIVE_STATUSES
+    ).values_list('printer_id', 'started_at', 'print_time_seconds')
+    for printer_id, started_at, seconds in printing:
+        finish = (started_at or now) + datetime.timedelta(seconds=seconds)
+        available[printer_id] = max(available[printer_id], finish)
+    return available
+
+
+def plate_owners(printer_ids):
+    """{nome piatto normalizzato: {printer_id, ...}} per le stampanti indicate."""
+    owners = {}
+    for name, printer_id in Plate.objects.filter(printer_id__in=printer_ids).values_list('name', 'printer_id'):
+        owners.setdefault(name.strip().lower(), set()).add(printer_id)
+    return owners
+
+
+def plan_balance(jobs, printer_ids, available, objective='makespan', plate_map=None, now=None):
+    """
+    Calcola il piano in memoria, senza query.
+    plate_map, se indicato, limita i file con piatto alle stampanti che ne possiedono uno omonimo.
+    """
+    if objective not in OBJECTIVES:
+        raise ValueError(f"Obiettivo non valido: {objective}")
+    now = now or timezone.now()
+    plan = BalancePlan(now, objective)
+    plan.current_printers = {job.file_id: job.printer_id for job in jobs}
+    plan.plate_names = {job.file_id: job.plate_name for job in jobs if job.plate_name}
+    printer_ids = list(printer_ids)
+    load = {printer_id: available.get(printer_id, now) for printer_id in printer_ids}
+
+    def compatible(job):
+        if plate_map is None or not job.plate_name:
+            return printer_ids
+        owners = plate_map.get(job.plate_name.strip().lower(), ())
+        return [printer_id for printer_id in printer_ids if printer_id in owners]
+
+    if objective == 'makespan':
+        ordered = sorted(jobs, key=lambda job: (-job.seconds, job.file_id))
+    else:
+        ordered = sorted(jobs, key=_sequence_key)
+
+    queues = {printer_id: [] for printer_id in printer_ids}
+    for job in ordered:
+        candidates = compatible(job)
+        if not candidates:
+            plan.unassigned.append(job.file_id)
+            continue
+        # La stampante che si libera prima finisce anche prima il file; a parità resta quella attuale
+        printer_id = min(candidates, key=lambda p: (load[p], p != job.printer_id, p))
+        load[printer_id] += datetime.timedelta(seconds=job.seconds)
+        queues[printer_id].append(job)
+
+    for printer_id, queue in queues.items():
+        cursor = available.get(printer_id, now)
+        for index, job in enumerate(sorted(queue, key=_sequence_key)):
+            start = cursor
+            cursor = start + datetime.timedelta(seconds=job.seconds)
+            plan.assignments.append(Assignment(job.file_id, printer_id, (index + 1) * POSITION_GAP, start, cursor))
+            finish = plan.order_finish.get(job.work_order_id)
+            plan.order_finish[job.work_order_id] = cursor if finish is None else max(finish, cursor)
+        plan.printer_finish[printer_id] = cursor
+
+    orders = {job.work_order_id: job for job in jobs}
+    for work_order_id, finish in plan.order_finish.items():
+        job = orders[work_order_id]
+        if job.delivery_date is None:
+            continue
+        deadline = timezone.make_aware(datetime.datetime.combine(job.delivery_date + datetime.timedelta(days=1), datetime.time.min))
+        late_seconds = (finish - deadline).total_seconds()
+        if late_seconds > 0:
+            plan.weighted_lateness_hours += PRIORITY_WEIGHT.get(job.priority, 1) * late_seconds / 3600
+    return plan
+
+
+def build_balance_plan(printer_ids, objective='makespan', match_plates=True, file_ids=None, now=None):
+    """Carica versione della coda, file, disponibilità e piatti (quattro query) e calcola il piano."""
+    now = now or timezone.now()
+    printer_ids = list(printer_ids)
+    # Letta prima dei dati: una modifica durante il calcolo rende comunque superata l'anteprima
+    version = changefeed.get_domain_versions((changefeed.PRINT_QUEUE,))[changefeed.PRINT_QUEUE]
+    jobs = load_jobs(file_ids, printer_ids)
+    available = printer_availability(printer_ids, now)
+    plate_map = plate_owners(printer_ids) if match_plates else None
+    plan = plan_balance(jobs, printer_ids, available, objective, plate_map, now)
+    plan.version = version
+    return plan
+
+
+@transaction.atomic
+def apply_confirmed_plan(printer_ids, version, now, objective='makespan', match_plates=True):
+    """
+    Applica il piano dell'anteprima confermata (versione e istante restituiti da as_dict).
+    Con la stessa versione della coda e lo stesso istante il ricalcolo dà esattamente le assegnazioni
+    mostrate; se nel frattempo la coda è cambiata solleva StalePlan senza toccare nulla.
+    Restituisce (piano, file aggiornati).
+    """
+    # La riga della versione resta bloccata fino al commit (sui database che lo supportano)
+    current = DomainVersion.objects.select_for_update().filter(
+        domain=changefeed.PRINT_QUEUE
+    ).values_list('version', flat=True).first()
+    if str(version) != str(current or 0):
+        raise StalePlan()
+    plan = build_balance_plan(printer_ids, objective=objective, match_plates=match_plates, now=now)
+    return plan, apply_balance_plan(plan)
+
+
+@transaction.atomic
+def apply_balance_plan(plan):
+    """
+    Scrive il piano: una UPDATE per stampante, più una per piatto per i file spostati che usano un
+    piatto (diventa quello omonimo della nuova stampante). Restituisce il numero di file aggiornati.
+    """
+    by_printer = {}
+    for assignment in plan.assignments:
+        by_printer.setdefault(assignment.printer_id, {})[assignment.file_id] = assignment.position
+    # Gli aggregati statistici si ricalcolano una volta sola per tutti i giorni toccati
+    moved_days = list(
+        PrintFile.objects.filter(id__in=[a.file_id for a in plan.moved]).dates('created_at', 'day')
+    ) if plan.moved else []
+    updated = sum(
+        apply_positions(positions, printer_id, refresh_rollup=False)
+        for printer_id, positions in by_printer.items()
+    )
+    PrintStatsRollup.refresh_days(moved_days)
+
+    moved_with_plate = [a for a in plan.moved if a.file_id in plan.plate_names]
+    if moved_with_plate:
+        plates = {
+            (printer_id, name.strip().lower()): plate_id
+            for plate_id, printer_id, name in Plate.objects.filter(
+                printer_id__in={a.printer_id for a in moved_with_plate}
+            ).values_list('id', 'printer_id', 'name')
+        }
+        by_plate = {}
+        for assignment in moved_with_plate:
+            plate_id = plates.get((assignment.printer_id, plan.plate_names[assignment.file_id].strip().lower()))
+            by_plate.setdefault(plate_id, []).append(assignment.file_id)
+        for plate_id, file_ids in by_plate.items():
+            PrintFile.objects.filter(id__in=file_ids).update(plate_id=plate_id)
+
+    if updated:
+        changefeed.bump_domain_versions(changefeed.PRINT_QUEUE)
+    return updated
@@ -0,0 +1,342 @@
+"""
+Generatore deterministico di dati sintetici per benchmark e test di carico.
+
+Crea con bulk_create stampanti e piatti (con manutenzioni), filamenti e bobine, progetti master
+completi, ordini di lavoro in tutti gli stati con file di stampa e consumi, oggetti di magazzino e
+vendite, spese e acquisti di materie prime, mantenendo l'integrità referenziale: ogni vista
+dell'applicazione si apre sui dati generati. Gli ordini vengono scritti a blocchi di
+WORK_ORDER_CHUNK, così la memoria usata non dipende dal volume richiesto.
+
+Come nell'applicazione, gli acquisti di bobine e materie prime generano la spesa corrispondente e
+vendite e spese entrano nel registro dei saldi (BalanceMovement). Alla fine vengono ricostruite le
+tabelle derivate (registro bobine, aggregati statistici, riepiloghi contabili, indice di ricerca) e
+incrementate le versioni dei domini, perché bulk_create non passa dai segnali.
+
+A parità di seed, data di riferimento e volumi il risultato è sempre lo stesso. I dati si possono
+aggiungere a un database già popolato: categorie e metodi di pagamento esistenti vengono riusati e
+gli ID personalizzati proseguono dall'ultimo già presente per anno.
+"""
+import datetime
+import random
+import string
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import F, OuterRef, Subquery
+from django.utils import timezone
+
+from . import changefeed, search
+from .models import (
+    Category, Printer, Plate, MaintenanceLog, Filament, Spool, SpoolLedger, Project, ProjectPart, ProjectOutput,
+    MasterPrintFile, MasterFilamentUsage, WorkOrder, PrintFile, FilamentUsage, PrintStatsRollup,
+    StockItem, PaymentMethod, BalanceMovement, BalanceSnapshot, Expense, ExpenseCategory, AccountingSummary, RawMaterial,
+    RawMaterialPurchase, ProjectRawMaterial, WorkOrderRawMaterial, IdSequence,
+)
+from .sequences import existing_max, format_custom_id
+
+SCALES = {
+    'small': dict(printers=3, filaments=8, spools_per_filament=2, projects=5, work_orders=20, files_per_order=3, expenses=20, raw_materials=5, years=1),
+    'medium': dict(printers=6, filaments=30, spools_per_filament=3, projects=25, work_orders=150, files_per_order=4, expenses=200, raw_materials=15, years=2),
+    'large': dict(printers=12, filaments=120, spools_per_filament=4, projects=100, work_orders=1500, files_per_order=5, expenses=2000, raw_materials=40, years=3),
+    # Oltre un milione di righe (file di stampa e consumi)
+    'huge': dict(printers=20, filaments=300, spools_per_filament=6, projects=500, work_orders=120000, files_per_order=4, expenses=20000, raw_materials=80, years=5),
+}
+
+BATCH_SIZE = 1000
+# Ordini di lavoro (con file, consumi e oggetti di magazzino) generati e scritti insieme
+WORK_ORDER_CHUNK = 2000
+
+# Distribuzione degli stati: la maggior parte degli ordini è storica
+WORK_ORDER_STATUSES = ['DONE'] * 6 + ['TODO', 'TODO', 'PRINTING', 'PRINTED', 'QUOTE']
+PRINT_FILE_STATUS = {
+    'QUOTE': ['TODO'],
+    'TODO': ['TODO'],
+    'PRINTING': ['DONE', 'PRINTING', 'TODO'],
+    'PRINTED': ['DONE'],
+    'DONE': ['DONE'] * 9 + ['FAILED'],
+}
+# Gli ordini attivi sono recenti, quelli storici coprono tutto il periodo
+RECENT_DAYS = 30
+
+CATEGORIES = ['Categoria 0', 'Categoria 1', 'Categoria 2', 'Categoria 3', 'Categoria 4']
+EXPENSE_CATEGORIES = ['Bobine', 'Materie Prime', 'Ricambi', 'Spedizioni', 'Varie']
+PAYMENT_METHODS = ['Cassa', 'Conto', 'PayPal', 'SumUp']
+
+
+def _spool_identifier(index):
+    letters = string.ascii_uppercase
+    return letters[index // len(letters) % len(letters)] + letters[index % len(letters)]
+
+
+class LoadDataGenerator:
+    def __init__(self, seed=0, now=None, **volumes):
+        self.rng = random.Random(seed)
+        self.now = now or timezone.now()
+        self.volumes = dict(SCALES['small'], **volumes)
+        self.counts = {}
+        # Movimenti di saldo di spese e vendite, scritti alla fine insieme al saldo in cache
+        self.movements = []
+
+    def _create(self, model, objects):
+        created = model.objects.bulk_create(objects, batch_size=BATCH_SIZE)
+        self.counts[model.__name__] = self.counts.get(model.__name__, 0) + len(created)
+        return created
+
+    def _named(self, model, names, **defaults):
+        """Righe con i nomi indicati: riusa quelle esistenti e crea le mancanti."""
+        existing = set(model.objects.filter(name__in=names).values_list('name', flat=True))
+        self._create(model, [model(name=name, **defaults) for name in names if name not in existing])
+        by_name = {obj.name: obj for obj in model.objects.filter(name__in=names)}
+        return [by_name[name] for name in names]
+
+    def _moment(self, days=None):
+        """Istante casuale negli ultimi `days` giorni (default: tutto il periodo di `years` anni)."""
+        seconds = self.rng.randint(0, (days or self.volumes['years'] * 365) * 86400)
+        return self.now - datetime.timedelta(seconds=seconds)
+
+    def _expense(self, description, amount, category, expense_date, payment_method):
+        return Expense(
+            description=description, amount=amount, category=category,
+            expense_date=expense_date, payment_method=payment_method
+        )
+
+    def _create_expenses(self, expenses):
+        expenses = self._create(Expense, expenses)
+        self.movements += [
+            BalanceMovement(
+                payment_method=expense.payment_method, kind=BalanceMovement.Kind.EXPENSE, amount=-expense.amount,
+                occurred_on=expense.expense_date, description=expense.description, expense=expense,
+            )
+            for expense in expenses
+        ]
+        return expenses
+
+    @transaction.atomic
+    def run(self):
+        self.create_catalogues()
+        self.create_printers()
+        self.create_filaments()
+        self.create_raw_materials()
+        self.create_projects()
+        self.create_work_orders()
+        self.create_expenses()
+        self.rebuild_derived_tables()
+        return self.counts
+
+    def create_catalogues(self):
+        self.categories = self._named(Category, CATEGORIES)
+        self.expense_categories = dict(zip(EXPENSE_CATEGORIES, self._named(ExpenseCategory, EXPENSE_CATEGORIES)))
+        self.payment_methods = self._named(PaymentMethod, PAYMENT_METHODS, balance=Decimal('0.00'))
+
+    def create_printers(self):
+        self.printers = self._create(Printer, [
+            Printer(name=f'Stampante {i}', model='P1S', power_consumption=self.rng.choice([120, 150, 300]), tag=f'P{i}')
+            for i in range(self.volumes['printers'])
+        ])
+        self.plates = self._create(Plate, [
+            Plate(name=name, printer=printer) for printer in self.printers for name in ('Liscio', 'Texture')
+        ])
+        self.plates_by_printer = {}
+        for plate in self.plates:
+            self.plates_by_printer.setdefault(plate.printer_id, []).append(plate)
+        self._create(MaintenanceLog, [
+            MaintenanceLog(
+                printer=printer, log_date=self._moment().date(), description='Manutenzione ordinaria',
+                cost=Decimal(self.rng.randint(0, 4000)) / 100,
+            )
+            for printer in self.printers for _ in range(self.volumes['years'] * 2)
+        ])
+
+    def create_filaments(self):
+        materials = [choice[0] for choice in Filament.MATERIAL_CHOICES]
+        self.filaments = self._create(Filament, [
+            Filament(
+                material=self.rng.choice(materials), color_code=f'{i % 1000:03d}', brand=f'Marca {i % 7}',
+                color_hex='#%06X' % self.rng.randint(0, 0xFFFFFF), color_name=f'Colore {i}'
+            )
+            for i in range(self.volumes['filaments'])
+        ])
+        self.spools = self._create(Spool, [
+            Spool(
+                filament=filament, identifier=_spool_identifier(i * self.volumes['spools_per_filament'] + j),
+                initial_weight_g=1000, cost=Decimal(self.rng.randint(15, 35)),
+                purchase_date=self._moment().date(), is_active=j > 0 or self.rng.random() > 0.5,
+            )
+            for i, filament in enumerate(self.filaments) for j in range(self.volumes['spools_per_filament'])
+        ])
+        self.spools_by_filament = {}
+        for spool in self.spools:
+            self.spools_by_filament.setdefault(spool.filament_id, []).append(spool)
+        # Ogni bobina acquistata è una spesa, come in add_spool
+        filaments = {filament.id: filament for filament in self.filaments}
+        self._create_expenses([
+            self._expense(
+                f'Bobina {filaments[spool.filament_id]} {spool.identifier}', spool.cost,
+                self.expense_categories['Bobine'], spool.purchase_date, self.rng.choice(self.payment_methods)
+            )
+            for spool in self.spools
+        ])
+
+    def create_raw_materials(self):
+        self.raw_materials = self._named(RawMaterial, [f'Materia Prima {i}' for i in range(self.volumes['raw_materials'])])
+        purchases = []
+        for material in self.raw_materials:
+            for _ in range(self.rng.randint(1, 3)):
+                quantity = self.rng.randint(10, 200)
+                purchases.append(RawMaterialPurchase(
+                    raw_material=material, quantity=quantity, cost=Decimal(self.rng.randint(5, 80)),
+                    purchase_date=self._moment().date(), payment_method=self.rng.choice(self.payment_methods),
+                ))
+        # Spesa collegata a ogni acquisto, come in add_raw_material_purchase
+        expenses = self._create_expenses([
+            self._expense(
+                f'Acquisto materia prima: {purchase.quantity}x {purchase.raw_material.name}', purchase.cost,
+                self.expense_categories['Materie Prime'], purchase.purchase_date, purchase.payment_method
+            )
+            for purchase in purchases
+        ])
+        for purchase, expense in zip(purchases, expenses):
+            purchase.expense = expense
+        self._create(RawMaterialPurchase, purchases)
+
+    def create_projects(self):
+        self.projects = self._create(Project, [
+            Project(
+                name=f'Progetto {i}', category=self.rng.choice(self.categories), base_quantity=self.rng.randint(1, 4),
+                suggested_selling_price=Decimal(self.rng.randint(5, 60)), created_at=self._moment(),
+            )
+            for i in range(self.volumes['projects'])
+        ])
+        self._create(ProjectPart, [
+            ProjectPart(project=project, name=f'Parte {j + 1}', order=j + 1) for project in self.projects for j in range(2)
+        ])
+        self._create(ProjectOutput, [
+            ProjectOutput(project=project, name=project.name, quantity=project.base_quantity) for project in self.projects
+        ])
+        self.master_files = self._create(MasterPrintFile, [
+            MasterPrintFile(
+                project=project, name=f'{project.name} piatto {j + 1}.gcode',
+                estimated_time_seconds=self.rng.randint(1800, 8 * 3600), printer=self.rng.choice(self.printers),
+                produced_quantity=self.rng.randint(1, 4),
+            )
+            for project in self.projects for j in range(3)
+        ])
+        self._create(MasterFilamentUsage, [
+            MasterFilamentUsage(master_print_file=master_file, filament=self.rng.choice(self.filaments), grams_used=Decimal(self.rng.randint(10, 300)))
+            for master_file in self.master_files
+        ])
+        if self.raw_materials:
+            self._create(ProjectRawMaterial, [
+                ProjectRawMaterial(project=project, raw_material=self.rng.choice(self.raw_materials), quantity=self.rng.randint(1, 4))
+                for project in self.projects
+            ])
+
+    def create_work_orders(self):
+        # Gli ID personalizzati proseguono dall'ultimo già presente per anno
+        self.sequences = existing_max(IdSequence.Entity.WORK_ORDER)
+        total = self.volumes['work_orders']
+        for start in range(0, total, WORK_ORDER_CHUNK):
+            self._create_work_order_chunk(start, min(start + WORK_ORDER_CHUNK, total))
+
+    def _create_work_order_chunk(self, start, end):
+        work_orders = []
+        for i in range(start, end):
+            status = self.rng.choice(WORK_ORDER_STATUSES)
+            created_at = self._moment() if status == 'DONE' else self._moment(RECENT_DAYS)
+            custom_id = None
+            if status == 'DONE':
+                self.sequences[created_at.year] = self.sequences.get(created_at.year, 0) + 1
+                custom_id = format_custom_id(created_at.year, self.sequences[created_at.year])
+            work_orders.append(WorkOrder(
+                name=f'Ordine {i}', custom_id=custom_id, project=self.rng.choice(self.projects), created_at=created_at,
+                status=status, priority=self.rng.choice(WorkOrder.Priority.values), category=self.rng.choice(self.categories),
+                quantity=self.rng.randint(1, 10),
+                completed_at=created_at + datetime.timedelta(days=self.rng.randint(1, 20)) if status == 'DONE' else None,
+                delivery_date=(created_at + datetime.timedelta(days=self.rng.randint(3, 40))).date() if self.rng.random() > 0.3 else None,
+            ))
+        work_orders = self._create(WorkOrder, work_orders)
+
+        print_files = []
+        for work_order in work_orders:
+            for j in range(self.volumes['files_per_order']):
+                printer = self.rng.choice(self.printers)
+                status = self.rng.choice(PRINT_FILE_STATUS[work_order.status])
+                print_files.append(PrintFile(
+                    work_order=work_order, name=f'{work_order.name} file {j + 1}.gcode', created_at=work_order.created_at,
+                    printer=printer, plate=self.rng.choice(self.plates_by_printer[printer.id]),
+                    print_time_seconds=self.rng.randint(1800, 10 * 3600), status=status, queue_position=(j + 1) * 1024,
+                    produced_quantity=1, actual_quantity=1 if status == 'DONE' else 0,
+                    started_at=work_order.created_at if status == 'PRINTING' else None,
+                ))
+        print_files = self._create(PrintFile, print_files)
+
+        usages = []
+        for print_file in print_files:
+            for filament in self.rng.sample(self.filaments, k=min(len(self.filaments), self.rng.randint(1, 2))):
+                usages.append(FilamentUsage(
+                    print_file=print_file, spool=self.rng.choice(self.spools_by_filament[filament.id]),
+                    grams_used=Decimal(self.rng.randint(500, 15000)) / 100,
+                ))
+        self._create(FilamentUsage, usages)
+
+        if self.raw_materials:
+            self._create(WorkOrderRawMaterial, [
+                WorkOrderRawMaterial(work_order=work_order, raw_material=self.rng.choice(self.raw_materials), quantity=self.rng.randint(1, 4))
+                for work_order in work_orders if self.rng.random() > 0.7
+            ])
+
+        stock_items = []
+        for work_order in work_orders:
+            if work_order.status != 'DONE':
+                continue
+            status = self.rng.choice(StockItem.Status.values)
+            sold = status == 'SOLD'
+            item = StockItem(
+                work_order=work_order, custom_id=work_order.custom_id, name=work_order.name, quantity=work_order.quantity,
+                status=status, material_cost=Decimal(self.rng.randint(100, 5000)) / 100,
+                labor_cost=Decimal(self.rng.randint(0, 2000)) / 100, suggested_price=Decimal(self.rng.randint(5, 80)),
+                sold_at=(work_order.completed_at + datetime.timedelta(days=self.rng.randint(0, 30))).date() if sold else None,
+                sale_price=Decimal(self.rng.randint(5, 80)) if sold else None,
+                payment_method=self.rng.choice(self.payment_methods + [None]) if sold else None,
+                sold_to=f'Cliente {self.rng.randint(1, 50)}' if sold else '',
+            )
+            stock_items.append(item)
+        stock_items = self._create(StockItem, stock_items)
+        self.movements += [
+            BalanceMovement(
+                payment_method=item.payment_method, kind=BalanceMovement.Kind.SALE, amount=item.get_net_revenue(),
+                occurred_on=item.sold_at, description=f'Vendita {item.name}', stock_item=item,
+            )
+            for item in stock_items if item.payment_method
+        ]
+        # created_at è auto_now_add: l'oggetto entra in magazzino quando l'ordine viene completato
+        StockItem.objects.filter(pk__in=[item.pk for item in stock_items]).update(
+            created_at=Subquery(WorkOrder.objects.filter(pk=OuterRef('work_order_id')).values('completed_at')[:1])
+        )
+
+    def create_expenses(self):
+        categories = [self.expense_categories[name] for name in ('Ricambi', 'Spedizioni', 'Varie')]
+        self._create_expenses([
+            self._expense(
+                f'Spesa {i}', Decimal(self.rng.randint(100, 20000)) / 100, self.rng.choice(categories),
+                self._moment().date(), self.rng.choice(self.payment_methods)
+            )
+            for i in range(self.volumes['expenses'])
+        ])
+
+    def rebuild_derived_tables(self):
+        # I consumi generati usano solo bobine nuove; gli aggregati giornalieri si ricalcolano per intero
+        spool_ids = [spool.id for spool in self.spools]
+        SpoolLedger.objects.bulk_create(SpoolLedger.compute(spool_ids=spool_ids).values(), batch_size=BATCH_SIZE)
+        PrintStatsRollup.objects.all().delete()
+        PrintStatsRollup.objects.bulk_create(PrintStatsRollup.compute(), batch_size=BATCH_SIZE)
+        AccountingSummary.rebuild()
+        search.rebuild()
+        deltas = {}
+        for movement in self._create(BalanceMovement, self.movements):
+            deltas[movement.payment_method_id] = deltas.get(movement.payment_method_id, Decimal('0.00')) + movement.amount
+        # Movimenti retrodatati: le istantanee di fine mese vanno ricalcolate
+        BalanceSnapshot.objects.filter(payment_method_id__in=deltas).delete()
+        for method_id, delta in deltas.items():
+            PaymentMethod.objects.filter(pk=method_id).update(balance=F('balance') + delta)
+        changefeed.bump_domain_versions(*changefeed.DOMAINS)
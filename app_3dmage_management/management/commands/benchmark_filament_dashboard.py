@@ -0,0 +1,133 @@
+import random
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Sum, Count, F, OuterRef, Subquery, IntegerField, DecimalField, ExpressionWrapper
+from django.db.models.functions import Coalesce
+from django.test.utils import CaptureQueriesContext
+
+from app_3dmage_management.models import Filament, Spool, SpoolLedger, WorkOrder, PrintFile, FilamentUsage
+
+COMPARED_FIELDS = (
+    'annotated_active_spool_count', 'annotated_total_initial_weight', 'annotated_total_used_weight',
+    'annotated_total_adjustment', 'annotated_total_pending_weight', 'annotated_remaining_weight',
+)
+
+
+def _cents(value):
+    return Decimal(str(value)).quantize(Decimal('0.01'))
+
+
+class _Rollback(Exception):
+    pass
+
+
+def legacy_active_filaments():
+    """Interrogazione precedente della dashboard (una subquery correlata per ogni totale), per confronto."""
+    def per_filament(queryset, group_by, field):
+        return Subquery(queryset.values(group_by).annotate(s=Sum(field)).values('s'), output_field=DecimalField())
+
+    active_spools = Spool.objects.filter(filament=OuterRef('pk'), is_active=True)
+    active_usages = FilamentUsage.objects.filter(spool__filament=OuterRef('pk'), spool__is_active=True)
+    return Filament.objects.annotate(
+        annotated_active_spool_count=Coalesce(Subquery(
+            active_spools.values('filament').annotate(c=Count('id')).values('c'), output_field=IntegerField()
+        ), 0),
+    ).filter(annotated_active_spool_count__gt=0).annotate(
+        annotated_total_initial_weight=Coalesce(per_filament(active_spools, 'filament', 'initial_weight_g'), Decimal('0.00')),
+        annotated_total_used_weight=Coalesce(per_filament(
+            active_usages.filter(print_file__status__in=['DONE', 'FAILED']), 'spool__filament', 'grams_used'
+        ), Decimal('0.00')),
+        annotated_total_adjustment=Coalesce(per_filament(active_spools, 'filament', 'weight_adjustment'), Decimal('0.00')),
+        annotated_total_pending_weight=Coalesce(per_filament(
+            active_usages.filter(print_file__status__in=['TODO', 'PRINTING']), 'spool__filament', 'grams_used'
+        ), Decimal('0.00')),
+    ).annotate(
+        annotated_remaining_weight=ExpressionWrapper(
+            F('annotated_total_initial_weight') + F('annotated_total_adjustment') - F('annotated_total_used_weight'),
+            output_field=DecimalField()
+        )
+    ).order_by('material', 'color_code', 'brand')
+
+
+class Command(BaseCommand):
+    help = "Confronta tempi e risultati dell'aggregazione della dashboard filamenti con l'interrogazione precedente (dati di prova annullati al termine)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--filaments', type=int, default=500)
+        parser.add_argument('--spools', type=int, default=5000)
+        parser.add_argument('--usages', type=int, default=200000)
+        parser.add_argument('--usages-per-file', type=int, default=10, help='Consumi per ogni file di stampa di prova.')
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                start = time.perf_counter()
+                self._build_fixture(options['filaments'], options['spools'], options['usages'], options['usages_per_file'])
+                self.stdout.write(f'Dati di prova creati in {time.perf_counter() - start:.1f} s')
+
+                legacy, legacy_ms, legacy_queries = self._measure(lambda: list(legacy_active_filaments()))
+                current, current_ms, current_queries = self._measure(
+                    lambda: list(Filament.objects.with_stock_totals().filter(annotated_spool_count__gt=0).order_by('material', 'color_code', 'brand'))
+                )
+                self.stdout.write(f'Subquery correlate: {legacy_ms:9.1f} ms ({legacy_queries} query)')
+                self.stdout.write(f'Passaggio unico:    {current_ms:9.1f} ms ({current_queries} query)')
+
+                current_active = [filament for filament in current if filament.annotated_active_spool_count]
+                # Su SQLite le somme decimali sono in virgola mobile: si confronta al centesimo
+                differences = [
+                    (old.pk, field, getattr(old, field), getattr(new, field))
+                    for old, new in zip(legacy, current_active) for field in COMPARED_FIELDS
+                    if _cents(getattr(old, field)) != _cents(getattr(new, field))
+                ]
+                if len(legacy) != len(current_active) or differences:
+                    raise CommandError(f'Risultati diversi dalla dashboard precedente: {differences[:10]}')
+                self.stdout.write(self.style.SUCCESS(f'{len(current_active)} filamenti attivi con totali identici.'))
+                raise _Rollback()
+        except _Rollback:
+            pass
+
+    def _measure(self, run):
+        start = time.perf_counter()
+        with CaptureQueriesContext(connection) as ctx:
+            result = run()
+        return result, (time.perf_counter() - start) * 1000, len(ctx.captured_queries)
+
+    def _build_fixture(self, filament_count, spool_count, usage_count, usages_per_file):
+        rng = random.Random(filament_count)
+        materials = [choice[0] for choice in Filament.MATERIAL_CHOICES]
+        filaments = Filament.objects.bulk_create([
+            Filament(material=rng.choice(materials), color_code=f'{i % 1000:03d}', brand=f'Benchmark {i}', color_hex='#808080')
+            for i in range(filament_count)
+        ], batch_size=500)
+        spools = Spool.objects.bulk_create([
+            Spool(
+                filament=rng.choice(filaments),
+                initial_weight_g=rng.choice([250, 500, 1000]),
+                weight_adjustment=rng.choice([0, 0, 0, -15.5]),
+                identifier=f'{i % 100:02d}',
+                cost=20,
+                is_active=rng.random() > 0.2,
+            )
+            for i in range(spool_count)
+        ], batch_size=500)
+
+        work_order = WorkOrder.objects.create(name='Benchmark dashboard filamenti', status='TODO')
+        statuses = ['DONE', 'DONE', 'FAILED', 'TODO', 'PRINTING']
+        print_files = PrintFile.objects.bulk_create([
+            PrintFile(work_order=work_order, name=f'benchmark_{i}.gcode', status=rng.choice(statuses))
+            for i in range(max(1, usage_count // usages_per_file))
+        ], batch_size=500)
+        FilamentUsage.objects.bulk_create([
+            FilamentUsage(
+                print_file=print_files[i // usages_per_file % len(print_files)],
+                spool=rng.choice(spools),
+                grams_used=Decimal(rng.randint(50, 2000)) / 100,
+            )
+            for i in range(usage_count)
+        ], batch_size=1000)
+        # bulk_create non passa dai segnali: il registro pesi si calcola in blocco, solo per le bobine
+        # di prova (quelle già presenti nel database hanno le loro righe)
+        SpoolLedger.refresh([spool.id for spool in spools])
@@ -0,0 +1,77 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from app_3dmage_management.load_balancing import build_balance_plan, apply_balance_plan
+from app_3dmage_management.models import Printer, Plate, WorkOrder, PrintFile
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = "Misura tempi e query del bilanciamento automatico della coda di stampa (dati di prova annullati al termine)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--files', nargs='+', type=int, default=[100, 1000], help='File da stampare per ogni misurazione (default: 100 1000).')
+        parser.add_argument('--printers', type=int, default=8, help='Stampanti di prova.')
+        parser.add_argument('--orders', type=int, default=50, help='Ordini di lavoro tra cui dividere i file.')
+        parser.add_argument('--objective', choices=['makespan', 'lateness'], default='makespan')
+
+    def handle(self, *args, **options):
+        for file_count in options['files']:
+            try:
+                with transaction.atomic():
+                    printer_ids = self._build_fixture(file_count, options['printers'], options['orders'])
+
+                    start = time.perf_counter()
+                    with CaptureQueriesContext(connection) as plan_ctx:
+                        plan = build_balance_plan(printer_ids, objective=options['objective'])
+                    plan_ms = (time.perf_counter() - start) * 1000
+
+                    start = time.perf_counter()
+                    with CaptureQueriesContext(connection) as apply_ctx:
+                        updated = apply_balance_plan(plan)
+                    apply_ms = (time.perf_counter() - start) * 1000
+
+                    self.stdout.write(
+                        f'{file_count:>6} file: piano {plan_ms:8.1f} ms ({len(plan_ctx.captured_queries)} query), '
+                        f'applicazione {apply_ms:8.1f} ms ({len(apply_ctx.captured_queries)} query), '
+                        f'{updated} file aggiornati, {len(plan.unassigned)} non assegnabili'
+                    )
+                    raise _Rollback()
+            except _Rollback:
+                pass
+
+    def _build_fixture(self, file_count, printer_count, order_count):
+        rng = random.Random(file_count)
+        printers = [Printer.objects.create(name=f'Benchmark {i}') for i in range(printer_count)]
+        # Metà delle stampanti ha il piatto "Texture", tutte hanno il "Liscio"
+        plates = {}
+        for i, printer in enumerate(printers):
+            plates.setdefault('Liscio', []).append(Plate.objects.create(name='Liscio', printer=printer))
+            if i % 2 == 0:
+                plates.setdefault('Texture', []).append(Plate.objects.create(name='Texture', printer=printer))
+
+        priorities = [choice[0] for choice in WorkOrder.Priority.choices]
+        orders = WorkOrder.objects.bulk_create([
+            WorkOrder(name=f'Benchmark {i}', status='TODO', priority=rng.choice(priorities))
+            for i in range(order_count)
+        ])
+
+        files = []
+        for i in range(file_count):
+            plate = rng.choice(plates[rng.choice(['Liscio', 'Texture'])])
+            files.append(PrintFile(
+                work_order=rng.choice(orders),
+                name=f'benchmark_{i}.gcode',
+                printer_id=plate.printer_id,
+                plate=plate,
+                print_time_seconds=rng.randint(600, 12 * 3600),
+            ))
+        PrintFile.objects.bulk_create(files, batch_size=500)
+        return [printer.id for printer in printers]
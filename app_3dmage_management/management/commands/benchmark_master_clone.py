@@ -0,0 +1,79 @@
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from app_3dmage_management.cloning import MasterCloner
+from app_3dmage_management.models import (
+    Project, ProjectPart, MasterPrintFile, MasterFilamentUsage, Filament, Spool, WorkOrder,
+    RawMaterial, ProjectRawMaterial
+)
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = "Misura query e tempi della clonazione di un Progetto Master in un Ordine di Lavoro (dati di prova annullati al termine)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sets',
+            nargs='+',
+            type=int,
+            default=[1, 10, 100],
+            help='Numero di set da clonare per ogni misurazione (default: 1 10 100).'
+        )
+        parser.add_argument('--files', type=int, default=5, help='File master nel progetto di prova.')
+        parser.add_argument('--filaments', type=int, default=3, help='Filamenti per ogni file master.')
+
+    def handle(self, *args, **options):
+        for sets in options['sets']:
+            try:
+                with transaction.atomic():
+                    project = self._build_fixture(options['files'], options['filaments'])
+                    work_order = WorkOrder.objects.create(name=project.name, project=project, quantity=sets)
+
+                    start = time.perf_counter()
+                    with CaptureQueriesContext(connection) as ctx:
+                        cloner = MasterCloner(project, work_order)
+                        cloner.plan_batches([{'quantity': sets, 'printers': {}}])
+                        cloner.plan_raw_materials(sets)
+                        created = cloner.save()
+                    elapsed = (time.perf_counter() - start) * 1000
+
+                    self.stdout.write(
+                        f'{sets:>5} set: {len(created):>6} file, {len(ctx.captured_queries):>3} query, {elapsed:8.1f} ms'
+                    )
+                    raise _Rollback()
+            except _Rollback:
+                pass
+
+    def _build_fixture(self, file_count, filament_count):
+        project = Project.objects.create(name='Benchmark Clonazione')
+        part = ProjectPart.objects.create(project=project, name='Parte Benchmark', order=1)
+
+        filaments = [
+            Filament.objects.create(material='PLA', brand='Benchmark', color_code=f'B{i:02d}')
+            for i in range(filament_count)
+        ]
+        for filament in filaments:
+            for _ in range(3):
+                Spool.objects.create(filament=filament, cost=Decimal('20.00'))
+
+        for i in range(file_count):
+            mpf = MasterPrintFile.objects.create(
+                project=project, name=f'benchmark_{i}.gcode', estimated_time_seconds=3600, produced_quantity=1
+            )
+            mpf.project_parts.add(part)
+            MasterFilamentUsage.objects.bulk_create([
+                MasterFilamentUsage(master_print_file=mpf, filament=filament, grams_used=Decimal('12.50'))
+                for filament in filaments
+            ])
+
+        raw_material = RawMaterial.objects.create(name='Magnete Benchmark')
+        ProjectRawMaterial.objects.create(project=project, raw_material=raw_material, quantity=2)
+        return project
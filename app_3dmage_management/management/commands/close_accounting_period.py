@@ -0,0 +1,63 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from app_3dmage_management.models import AccountingPeriod, AccountingSummary
+
+
+def _month(value):
+    try:
+        return datetime.datetime.strptime(value, '%Y-%m').date()
+    except ValueError:
+        raise CommandError(f"Mese non valido: {value} (formato AAAA-MM)")
+
+
+class Command(BaseCommand):
+    help = 'Chiude i mesi contabili fino al mese indicato: i loro riepiloghi vengono congelati'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--until',
+            help='Ultimo mese da chiudere, AAAA-MM (default: il mese precedente).'
+        )
+        parser.add_argument(
+            '--reopen',
+            metavar='AAAA-MM',
+            help='Riapre il mese indicato e ne ricalcola i riepiloghi.'
+        )
+        parser.add_argument(
+            '--rebuild',
+            action='store_true',
+            help='Ricalcola i riepiloghi di tutti i mesi aperti.'
+        )
+
+    def handle(self, *args, **options):
+        if options['reopen']:
+            month = _month(options['reopen'])
+            with transaction.atomic():
+                deleted, _ = AccountingPeriod.objects.filter(month=month).delete()
+                AccountingSummary.refresh_months([month])
+            if not deleted:
+                raise CommandError(f'{month:%m/%Y} non è chiuso.')
+            self.stdout.write(self.style.SUCCESS(f'{month:%m/%Y} riaperto.'))
+            return
+
+        if options['rebuild']:
+            with transaction.atomic():
+                rows = AccountingSummary.rebuild()
+            self.stdout.write(f'Riepiloghi dei mesi aperti ricalcolati: {len(rows)} righe.')
+
+        today = datetime.date.today()
+        until = _month(options['until']) if options['until'] else (today.replace(day=1) - datetime.timedelta(days=1)).replace(day=1)
+        if until >= today.replace(day=1):
+            raise CommandError('Il mese in corso non si può chiudere.')
+
+        # Mesi con vendite o spese ancora aperti, fino a quello indicato
+        open_months = AccountingSummary.objects.filter(month__lte=until).exclude(
+            month__in=AccountingPeriod.objects.values('month')
+        ).dates('month', 'month')
+        for month in open_months:
+            AccountingSummary.close_period(month)
+            self.stdout.write(f'{month:%m/%Y} chiuso.')
+        self.stdout.write(self.style.SUCCESS(f'{len(open_months)} mesi chiusi fino a {until:%m/%Y}.'))
@@ -0,0 +1,50 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from app_3dmage_management.load_data import SCALES
+from app_3dmage_management.query_budget import VIEW_BUDGETS, measure_scale
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = "Misura query e tempi delle viste principali su dati sintetici (annullati al termine) e scrive un report JSON"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', nargs='+', choices=list(SCALES), default=['small', 'medium'], help='Scale dei dati di prova (default: small medium).')
+        parser.add_argument('--seed', type=int, default=0, help='Seed del generatore di dati.')
+        parser.add_argument('--view', nargs='+', choices=[budget[0] for budget in VIEW_BUDGETS], help='Misura solo le viste indicate.')
+        parser.add_argument('--output', help='File in cui scrivere il report (default: standard output).')
+
+    def handle(self, *args, **options):
+        report = {'generated_at': timezone.now().isoformat(), 'seed': options['seed'], 'scales': {}}
+        over_budget = []
+
+        for scale in options['scale']:
+            try:
+                # Il client di test risponde come host "testserver"
+                with transaction.atomic(), override_settings(ALLOWED_HOSTS=['testserver']):
+                    counts, results = measure_scale(scale, seed=options['seed'], views=options['view'])
+                    raise _Rollback()
+            except _Rollback:
+                pass
+            report['scales'][scale] = {'rows': counts, 'views': results}
+            over_budget += [f"{scale}/{row['view']}: {row['queries']} > {row['budget']}" for row in results if row['over_budget']]
+            if options['output']:
+                self.stdout.write(f"{scale}: {len(results)} viste misurate, {sum(row['over_budget'] for row in results)} oltre il budget")
+
+        content = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as report_file:
+                report_file.write(content)
+        else:
+            self.stdout.write(content)
+
+        if over_budget:
+            raise CommandError('Budget di query superato: ' + ', '.join(over_budget))
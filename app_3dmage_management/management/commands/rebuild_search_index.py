@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from app_3dmage_management import search
+
+
+class Command(BaseCommand):
+    help = "Ricostruisce l'indice di ricerca full-text da ordini, progetti master, magazzino, vendite e spese"
+
+    def handle(self, *args, **options):
+        count = search.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Indice di ricerca ricostruito: {count} voci ({search.get_backend().__class__.__name__}).'))
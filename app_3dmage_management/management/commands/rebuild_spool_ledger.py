@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from app_3dmage_management.models import SpoolLedger
+
+
+class Command(BaseCommand):
+    help = 'Ricostruisce (o verifica con --verify) il registro pesi delle bobine a partire dai FilamentUsage'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify',
+            action='store_true',
+            help='Confronta il registro salvato con i dati reali senza modificarlo.'
+        )
+
+    def handle(self, *args, **options):
+        expected = SpoolLedger.compute()
+
+        if options['verify']:
+            stored = {ledger.spool_id: ledger for ledger in SpoolLedger.objects.all()}
+            mismatches = 0
+            for spool_id, ledger in expected.items():
+                current = stored.get(spool_id)
+                if current is None:
+                    mismatches += 1
+                    self.stdout.write(self.style.WARNING(f'Bobina {spool_id}: registro mancante'))
+                    continue
+                for field in ('consumed_grams', 'committed_grams', 'available_grams'):
+                    if getattr(current, field) != getattr(ledger, field):
+                        mismatches += 1
+                        self.stdout.write(self.style.WARNING(
+                            f'Bobina {spool_id}: {field} = {getattr(current, field)} (atteso {getattr(ledger, field)})'
+                        ))
+            orphans = set(stored) - set(expected)
+            mismatches += len(orphans)
+
+            if mismatches:
+                raise CommandError(f'Registro bobine non allineato: {mismatches} differenze trovate.')
+            self.stdout.write(self.style.SUCCESS(f'Registro bobine verificato: {len(expected)} bobine allineate.'))
+            return
+
+        with transaction.atomic():
+            SpoolLedger.objects.all().delete()
+            SpoolLedger.objects.bulk_create(expected.values(), batch_size=500)
+
+        self.stdout.write(self.style.SUCCESS(f'Registro bobine ricostruito per {len(expected)} bobine.'))
@@ -0,0 +1,52 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from app_3dmage_management.models import PrintStatsRollup
+
+ROLLUP_FIELDS = ('file_count', 'print_seconds', 'watt_seconds', 'grams', 'material_cost')
+
+
+def _rollup_key(row):
+    return (row.day, row.printer_id, row.status, row.material)
+
+
+class Command(BaseCommand):
+    help = 'Ricostruisce (o verifica con --verify) gli aggregati giornalieri delle statistiche a partire dai file di stampa'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify',
+            action='store_true',
+            help='Confronta gli aggregati salvati con i dati reali senza modificarli.'
+        )
+
+    def handle(self, *args, **options):
+        expected = {_rollup_key(row): row for row in PrintStatsRollup.compute()}
+
+        if options['verify']:
+            stored = {_rollup_key(row): row for row in PrintStatsRollup.objects.all()}
+            mismatches = 0
+            for key, row in expected.items():
+                current = stored.get(key)
+                if current is None:
+                    mismatches += 1
+                    self.stdout.write(self.style.WARNING(f'Aggregato {row}: riga mancante'))
+                    continue
+                for field in ROLLUP_FIELDS:
+                    if getattr(current, field) != getattr(row, field):
+                        mismatches += 1
+                        self.stdout.write(self.style.WARNING(
+                            f'Aggregato {row}: {field} = {getattr(current, field)} (atteso {getattr(row, field)})'
+                        ))
+            orphans = set(stored) - set(expected)
+            mismatches += len(orphans)
+
+            if mismatches:
+                raise CommandError(f'Aggregati statistiche non allineati: {mismatches} differenze trovate.')
+            self.stdout.write(self.style.SUCCESS(f'Aggregati statistiche verificati: {len(expected)} righe allineate.'))
+            return
+
+        with transaction.atomic():
+            PrintStatsRollup.objects.all().delete()
+            PrintStatsRollup.objects.bulk_create(expected.values(), batch_size=500)
+
+        self.stdout.write(self.style.SUCCESS(f'Aggregati statistiche ricostruiti: {len(expected)} righe.'))
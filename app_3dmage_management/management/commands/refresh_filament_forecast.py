@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from app_3dmage_management.forecasting import build_forecast, notify_shortages
+from app_3dmage_management.models import Filament
+
+
+class Command(BaseCommand):
+    help = 'Ricalcola le previsioni di esaurimento dei filamenti, notifica le mancanze e stampa i riordini suggeriti (da pianificare, es. ogni notte)'
+
+    def handle(self, *args, **options):
+        forecast = build_forecast()
+        created = notify_shortages(forecast)
+
+        reorders = {item.filament_id: item for item in forecast.reorders}
+        for filament in Filament.objects.filter(id__in=reorders).order_by('material', 'color_code', 'brand'):
+            item = reorders[filament.id]
+            self.stdout.write(
+                f'{filament}: {item.reorder_spools} bobine ({item.reorder_grams}g), '
+                f'consumo {item.daily_grams}g/giorno, mancanza per la coda {item.shortage_grams}g'
+            )
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Previsioni calcolate per {len(forecast.filaments)} filamenti: '
+            f'{len(reorders)} da riordinare, {len(created)} nuove notifiche.'
+        ))
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from app_3dmage_management.models import IdSequence
+from app_3dmage_management.sequences import ENTITY_MODELS, existing_max
+
+
+class Command(BaseCommand):
+    help = 'Allinea le sequenze degli ID personalizzati (ordini di lavoro, oggetti di magazzino) agli ID già presenti nei dati'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--reset',
+            action='store_true',
+            help="Imposta ogni contatore esattamente sull'ultimo ID presente, anche se è più basso del valore attuale."
+        )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            for entity in ENTITY_MODELS:
+                stored = dict(IdSequence.objects.filter(entity=entity).values_list('year', 'last_value'))
+                for year, found in sorted(existing_max(entity).items()):
+                    current = stored.get(year)
+                    value = found if options['reset'] else max(found, current or 0)
+                    if current == value:
+                        continue
+                    IdSequence.objects.update_or_create(entity=entity, year=year, defaults={'last_value': value})
+                    self.stdout.write(f'{IdSequence.Entity(entity).label} {year}: {current or 0} -> {value}')
+
+        self.stdout.write(self.style.SUCCESS('Sequenze ID allineate.'))
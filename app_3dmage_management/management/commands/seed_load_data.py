@@ -0,0 +1,46 @@
+import time
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+
+from app_3dmage_management.load_data import LoadDataGenerator, SCALES
+
+VOLUMES = (
+    ('printers', 'Stampanti (ognuna con due piatti).'),
+    ('filaments', 'Filamenti.'),
+    ('spools_per_filament', 'Bobine per filamento.'),
+    ('projects', 'Progetti master (con parti, output e file master).'),
+    ('work_orders', 'Ordini di lavoro, in tutti gli stati.'),
+    ('files_per_order', 'File di stampa per ordine.'),
+    ('expenses', 'Spese generiche (oltre a quelle di bobine e materie prime).'),
+    ('raw_materials', 'Materie prime.'),
+    ('years', 'Anni di storico.'),
+)
+
+
+class Command(BaseCommand):
+    help = 'Genera dati sintetici deterministici per benchmark e test di carico (scala predefinita più volumi personalizzati)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--scale', choices=list(SCALES), default='small',
+            help=f"Volumi di partenza (default: small). 'huge' supera il milione di righe."
+        )
+        parser.add_argument('--seed', type=int, default=0, help='Seed del generatore: stesso seed, stessi dati.')
+        for name, help_text in VOLUMES:
+            parser.add_argument(f"--{name.replace('_', '-')}", dest=name, type=int, help=help_text)
+
+    def handle(self, *args, **options):
+        volumes = dict(SCALES[options['scale']])
+        volumes.update({name: options[name] for name, _ in VOLUMES if options[name] is not None})
+        self.stdout.write('Volumi: ' + ', '.join(f'{name}={value}' for name, value in volumes.items()))
+
+        start = time.perf_counter()
+        counts = LoadDataGenerator(seed=options['seed'], **volumes).run()
+        elapsed = time.perf_counter() - start
+
+        for model_name, count in counts.items():
+            self.stdout.write(f'{model_name:<22} {count:>10}')
+        # Le sequenze degli ID personalizzati ripartono dagli ultimi ID generati
+        call_command('seed_id_sequences', stdout=self.stdout)
+        self.stdout.write(self.style.SUCCESS(f'{sum(counts.values())} righe create in {elapsed:.1f} s.'))
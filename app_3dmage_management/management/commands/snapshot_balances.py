@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from app_3dmage_management import ledger
+from app_3dmage_management.models import BalanceSnapshot
+
+
+class Command(BaseCommand):
+    help = 'Crea le istantanee di fine mese dei saldi dal registro movimenti e verifica i saldi in cache'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rebuild',
+            action='store_true',
+            help='Cancella e ricalcola tutte le istantanee invece di aggiungere solo quelle mancanti.'
+        )
+        parser.add_argument(
+            '--fix-cache',
+            action='store_true',
+            help='Riallinea PaymentMethod.balance al saldo del registro quando non coincidono.'
+        )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            if options['rebuild']:
+                BalanceSnapshot.objects.all().delete()
+            created = ledger.ensure_snapshots()
+        self.stdout.write(f'{created} istantanee create (fino al {ledger.last_closed_month_end():%d/%m/%Y}).')
+
+        mismatches = ledger.cache_mismatches()
+        for method, cached, booked in mismatches:
+            self.stdout.write(f'{method}: saldo in cache {cached}€, registro {booked}€')
+            if options['fix_cache']:
+                type(method).objects.filter(pk=method.pk).update(balance=booked)
+        if mismatches and not options['fix_cache']:
+            raise CommandError(f'{len(mismatches)} saldi in cache non coincidono con il registro (usa --fix-cache).')
+        self.stdout.write(self.style.SUCCESS('Saldi coerenti con il registro.'))
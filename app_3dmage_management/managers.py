@@ -1,6 +1,6 @@
 from django.db import models
-from django.db.models import Sum, Case, When, Value, DecimalField, F, IntegerField, ExpressionWrapper
-from django.db.models.functions import Coalesce
+from django.db.models import Sum, Case, When, Value, DecimalField, F, IntegerField, ExpressionWrapper, Window, Count, Q
+from django.db.models.functions import Cast, Coalesce
 from decimal import Decimal
 
 class WorkOrderQuerySet(models.QuerySet):
@@ -100,9 +100,226 @@ class WorkOrderQuerySet(models.QuerySet):
             )
         )
 
+    def with_costs(self):
+        """
+        Annota i costi completi di ogni ordine calcolandoli in SQL (una sola query per N ordini):
+        - cost_material: grammi * costo/grammo della bobina (bobine con peso iniziale > 0)
+        - cost_electricity: watt della stampante * ore * costo kWh
+        - cost_wear_tear: ore di stampa * coefficiente di usura
+        - cost_raw_materials: quantità * costo medio unitario della materia prima
+        - cost_total: somma dei precedenti
+        Stesse regole delle property PrintFile.total_cost e WorkOrder.full_total_cost,
+        che usano questi valori quando presenti.
+        """
+        from django.db.models import OuterRef, Subquery, FloatField
+        from django.db.models.functions import Cast, Round
+        from .models import PrintFile, FilamentUsage, WorkOrderRawMaterial, RawMaterialPurchase
+        from .cost_settings import get_cost_settings
+
+        cost_settings = get_cost_settings()
+        cost_field = DecimalField(max_digits=14, decimal_places=4)
+
+        def real(expression):
+            # SQLite salva i decimali interi come INTEGER: senza cast le divisioni sarebbero intere
+            return Cast(expression, output_field=FloatField())
+
+        def cost(expression):
+            return Cast(expression, output_field=cost_field)
+
+        material_sub = FilamentUsage.objects.filter(
+            print_file__work_order=OuterRef('pk'),
+            spool__initial_weight_g__gt=0
+        ).annotate(
+            usage_cost=real(F('grams_used')) * real(F('spool__cost')) / F('spool__initial_weight_g')
+        ).values('print_file__work_order').annotate(total=Sum('usage_cost')).values('total')
+
+        # Watt-secondi totali delle stampe con stampante a consumo noto
+        watt_seconds_sub = PrintFile.objects.filter(
+            work_order=OuterRef('pk'),
+            printer__power_consumption__gt=0
+        ).annotate(
+            watt_seconds=F('print_time_seconds') * F('printer__power_consumption')
+        ).values('work_order').annotate(total=Sum('watt_seconds')).values('total')
+
+        seconds_sub = PrintFile.objects.filter(
+            work_order=OuterRef('pk')
+        ).values('work_order').annotate(total=Sum('print_time_seconds')).values('total')
+
+        # Costo medio unitario arrotondato al centesimo, come RawMaterial.average_unit_cost
+        unit_cost_sub = RawMaterialPurchase.objects.filter(
+            raw_material=OuterRef('raw_material')
+        ).values('raw_material').annotate(
+            unit_cost=Round(cost(real(Sum('cost')) / Sum('quantity')), 2, output_field=cost_field)
+        ).values('unit_cost')
+
+        raw_materials_sub = WorkOrderRawMaterial.objects.filter(
+            work_order=OuterRef('pk')
+        ).annotate(
+            line_cost=F('quantity') * Coalesce(Subquery(unit_cost_sub), Value(Decimal('0.00')))
+        ).values('work_order').annotate(total=Sum('line_cost')).values('total')
+
+        return self.annotate(
+            cost_material=Coalesce(cost(Subquery(material_sub)), Value(Decimal('0.00')), output_field=cost_field),
+            cost_electricity=cost(
+                real(Coalesce(Subquery(watt_seconds_sub), Value(0)))
+                * Value(float(cost_settings.electricity_cost_kwh)) / Value(3600000)
+            ),
+            cost_wear_tear=cost(
+                real(Coalesce(Subquery(seconds_sub), Value(0)))
+                * Value(float(cost_settings.wear_tear_coefficient)) / Value(3600)
+            ),
+            cost_raw_materials=Coalesce(cost(Subquery(raw_materials_sub)), Value(Decimal('0.00')), output_field=cost_field),
+        ).annotate(
+            cost_total=ExpressionWrapper(
+                F('cost_material') + F('cost_electricity') + F('cost_wear_tear') + F('cost_raw_materials'),
+                output_field=cost_field
+            )
+        )
+
 class WorkOrderManager(models.Manager):
     def get_queryset(self):
         return WorkOrderQuerySet(self.model, using=self._db)
 
     def with_annotations(self):
         return self.get_queryset().with_annotations()
+
+    def with_costs(self):
+        return self.get_queryset().with_costs()
+
+
+class SpoolQuerySet(models.QuerySet):
+    def with_weights(self):
+        """
+        Annota i pesi della bobina letti dal registro SpoolLedger (join 1:1, nessuna aggregazione):
+        - gross_grams: peso iniziale + aggiustamento manuale
+        - remaining_grams: peso fisico residuo (stampe DONE/FAILED)
+        - pending_grams: grammi impegnati da stampe TODO/PRINTING
+        - available_grams: peso realmente disponibile
+        """
+        weight_field = DecimalField(max_digits=12, decimal_places=2)
+        return self.annotate(
+            gross_grams=ExpressionWrapper(
+                Cast('initial_weight_g', weight_field) + F('weight_adjustment'),
+                output_field=weight_field
+            ),
+        ).annotate(
+            remaining_grams=ExpressionWrapper(
+                F('gross_grams') - Coalesce(F('ledger__consumed_grams'), Value(Decimal('0.00'))),
+                output_field=weight_field
+            ),
+            pending_grams=Coalesce(F('ledger__committed_grams'), Value(Decimal('0.00')), output_field=weight_field),
+            # Senza registro (bobina appena creata) tutto il peso è disponibile
+            available_grams=Coalesce(F('ledger__available_grams'), F('gross_grams'), output_field=weight_field),
+        )
+
+    def with_filament_totals(self):
+        """
+        Aggiunge a ogni bobina i totali del suo filamento sulle sole bobine attive
+        (filament_remaining_grams, filament_pending_grams), calcolati nella stessa query.
+        """
+        weight_field = DecimalField(max_digits=14, decimal_places=2)
+
+        def active_total(field):
+            return Window(
+                expression=Sum(Case(When(is_active=True, then=F(field)), default=Value(Decimal('0.00')), output_field=weight_field)),
+                partition_by=[F('filament_id')],
+            )
+
+        return self.with_weights().annotate(
+            filament_remaining_grams=active_total('remaining_grams'),
+            filament_pending_grams=active_total('pending_grams'),
+        )
+
+    def available(self):
+        """Bobine attive con peso disponibile, dalla più vuota alla più piena."""
+        return self.with_weights().filter(is_active=True, available_grams__gt=0).order_by('available_grams', 'id')
+
+class FilamentQuerySet(models.QuerySet):
+    def with_stock_totals(self):
+        """
+        Annota i totali di magazzino di ogni filamento con un solo passaggio raggruppato sulle bobine
+        e sul loro registro (SpoolLedger, 1:1 con la bobina: il join non duplica righe):
+        - annotated_spool_count / annotated_active_spool_count
+        - annotated_total_initial_weight, annotated_total_adjustment, annotated_total_used_weight,
+          annotated_total_pending_weight (sulle sole bobine attive)
+        - annotated_remaining_weight, annotated_available_weight
+        - total_grams_ever_used (su tutte le bobine, per i filamenti esauriti)
+        """
+        weight_field = DecimalField(max_digits=14, decimal_places=2)
+        active = Q(spools__is_active=True)
+
+        def total(field, condition=None):
+            return Coalesce(Sum(field, filter=condition), Value(Decimal('0.00')), output_field=weight_field)
+
+        return self.annotate(
+            annotated_spool_count=Count('spools'),
+            annotated_active_spool_count=Count('spools', filter=active),
+            annotated_total_initial_weight=total(Cast('spools__initial_weight_g', weight_field), active),
+            annotated_total_adjustment=total('spools__weight_adjustment', active),
+            annotated_total_used_weight=total('spools__ledger__consumed_grams', active),
+            annotated_total_pending_weight=total('spools__ledger__committed_grams', active),
+            total_grams_ever_used=total('spools__ledger__consumed_grams'),
+        ).annotate(
+            annotated_remaining_weight=ExpressionWrapper(
+                F('annotated_total_initial_weight') + F('annotated_total_adjustment') - F('annotated_total_used_weight'),
+                output_field=weight_field
+            ),
+        ).annotate(
+            annotated_available_weight=Case(
+                When(
+                    annotated_remaining_weight__gt=F('annotated_total_pending_weight'),
+                    then=F('annotated_remaining_weight') - F('annotated_total_pending_weight')
+                ),
+                default=Value(Decimal('0.00')),
+                output_field=weight_field
+            )
+        )
+
+class RawMaterialQuerySet(models.QuerySet):
+    def with_stock_totals(self):
+        """
+        Annota le giacenze di ogni materia prima con subquery separate (acquisti e utilizzi sono due
+        relazioni inverse: un join unico moltiplicherebbe le righe):
+        - annotated_total_purchased / annotated_total_cost: quantità e spesa degli acquisti
+        - annotated_total_used: quantità usata da ordini completati
+        - annotated_total_pending: quantità impegnata da ordini attivi
+        Le property di RawMaterial usano questi valori quando presenti.
+        """
+        from django.db.models import OuterRef, Subquery
+        from .models import RawMaterialPurchase, WorkOrderRawMaterial
+
+        cost_field = DecimalField(max_digits=14, decimal_places=2)
+
+        def purchases_total(field):
+            return Subquery(
+                RawMaterialPurchase.objects.filter(raw_material=OuterRef('pk'))
+                .values('raw_material').annotate(total=Sum(field)).values('total')
+            )
+
+        def usages_total(**filters):
+            return Subquery(
+                WorkOrderRawMaterial.objects.filter(raw_material=OuterRef('pk'), **filters)
+                .values('raw_material').annotate(total=Sum('quantity')).values('total')
+            )
+
+        return self.annotate(
+            annotated_total_purchased=Coalesce(purchases_total('quantity'), Value(0), output_field=IntegerField()),
+            annotated_total_cost=Coalesce(purchases_total('cost'), Value(Decimal('0.00')), output_field=cost_field),
+            annotated_total_used=Coalesce(usages_total(work_order__status='DONE'), Value(0), output_field=IntegerField()),
+            annotated_total_pending=Coalesce(
+                usages_total(work_order__status__in=['TODO', 'PRINTING', 'PRINTED']), Value(0), output_field=IntegerField()
+            ),
+        )
+
+class SpoolManager(models.Manager):
+    def get_queryset(self):
+        return SpoolQuerySet(self.model, using=self._db)
+
+    def with_weights(self):
+        return self.get_queryset().with_weights()
+
+    def with_filament_totals(self):
+        return self.get_queryset().with_filament_totals()
+
+    def available(self):
+        return self.get_queryset().available()
@@ -0,0 +1,57 @@
+# Generated by Django 4.2.30 on 2026-10-18 11:57
+
+from django.db import migrations, models
+import django.db.models.deletion
+from decimal import Decimal
+
+
+def populate_spool_ledger(apps, schema_editor):
+    """Calcola il registro pesi iniziale per tutte le bobine esistenti."""
+    Spool = apps.get_model('app_3dmage_management', 'Spool')
+    FilamentUsage = apps.get_model('app_3dmage_management', 'FilamentUsage')
+    SpoolLedger = apps.get_model('app_3dmage_management', 'SpoolLedger')
+
+    totals = {
+        row['spool_id']: row for row in FilamentUsage.objects.values('spool_id').annotate(
+            consumed=models.Sum('grams_used', filter=models.Q(print_file__status__in=['DONE', 'FAILED'])),
+            committed=models.Sum('grams_used', filter=models.Q(print_file__status__in=['TODO', 'PRINTING'])),
+        )
+    }
+
+    ledgers = []
+    for spool in Spool.objects.all():
+        row = totals.get(spool.id, {})
+        consumed = row.get('consumed') or Decimal('0.00')
+        committed = row.get('committed') or Decimal('0.00')
+        gross = Decimal(spool.initial_weight_g) + Decimal(str(spool.weight_adjustment))
+        ledgers.append(SpoolLedger(
+            spool_id=spool.id,
+            consumed_grams=consumed,
+            committed_grams=committed,
+            available_grams=max(Decimal('0.00'), gross - consumed - committed),
+        ))
+    SpoolLedger.objects.bulk_create(ledgers, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_3dmage_management', '0044_rawmaterial_rawmaterialpurchase_workorderrawmaterial_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SpoolLedger',
+            fields=[
+                ('spool', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='ledger', serialize=False, to='app_3dmage_management.spool', verbose_name='Bobina')),
+                ('consumed_grams', models.DecimalField(decimal_places=2, default=0.0, max_digits=12, verbose_name='Grammi Consumati')),
+                ('committed_grams', models.DecimalField(decimal_places=2, default=0.0, max_digits=12, verbose_name='Grammi Impegnati')),
+                ('available_grams', models.DecimalField(decimal_places=2, default=0.0, max_digits=12, verbose_name='Grammi Disponibili')),
+            ],
+            options={
+                'verbose_name': 'Registro Bobina',
+                'verbose_name_plural': 'Registri Bobine',
+            },
+        ),
+        migrations.RunPython(populate_spool_ledger, reverse_code=migrations.RunPython.noop),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 4.2.30 on 2026-10-18 12:05
+
+from django.db import migrations, models
+
+
+DOMAINS = ['work_orders', 'print_queue', 'stock', 'filaments', 'accounting']
+
+
+def seed_domain_versions(apps, schema_editor):
+    """Crea i contatori per dominio e rimuove le vecchie chiavi di versione da GlobalSetting."""
+    DomainVersion = apps.get_model('app_3dmage_management', 'DomainVersion')
+    GlobalSetting = apps.get_model('app_3dmage_management', 'GlobalSetting')
+
+    DomainVersion.objects.bulk_create(
+        [DomainVersion(domain=domain, version=1) for domain in DOMAINS],
+        ignore_conflicts=True
+    )
+    GlobalSetting.objects.filter(key='app_last_updated').delete()
+    GlobalSetting.objects.filter(key__in=[f'version_{domain}' for domain in DOMAINS]).delete()
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_3dmage_management', '0045_spoolledger'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DomainVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('domain', models.CharField(choices=[('work_orders', 'Ordini di Lavoro'), ('print_queue', 'Coda di Stampa'), ('stock', 'Magazzino'), ('filaments', 'Filamenti'), ('accounting', 'Contabilità')], max_length=20, unique=True, verbose_name='Dominio')),
+                ('version', models.PositiveBigIntegerField(default=0, verbose_name='Versione')),
+            ],
+            options={
+                'verbose_name': 'Versione Dominio',
+                'verbose_name_plural': 'Versioni Domini',
+            },
+        ),
+        migrations.RunPython(seed_domain_versions, reverse_code=migrations.RunPython.noop),
+    ]
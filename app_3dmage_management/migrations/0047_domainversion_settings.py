@@ -0,0 +1,24 @@
+# Generated by Django 4.2.30 on 2026-10-18 12:06
+
+from django.db import migrations, models
+
+
+def seed_settings_version(apps, schema_editor):
+    DomainVersion = apps.get_model('app_3dmage_management', 'DomainVersion')
+    DomainVersion.objects.get_or_create(domain='settings', defaults={'version': 1})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_3dmage_management', '0046_domainversion'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='domainversion',
+            name='domain',
+            field=models.CharField(choices=[('work_orders', 'Ordini di Lavoro'), ('print_queue', 'Coda di Stampa'), ('stock', 'Magazzino'), ('filaments', 'Filamenti'), ('accounting', 'Contabilità'), ('settings', 'Impostazioni')], max_length=20, unique=True, verbose_name='Dominio'),
+        ),
+        migrations.RunPython(seed_settings_version, reverse_code=migrations.RunPython.noop),
+    ]
@@ -0,0 +1,77 @@
+# Generated by Django 4.2.30 on 2026-10-18 12:12
+
+from django.db import migrations, models
+from django.db.models.functions import Cast, TruncDate
+import django.db.models.deletion
+from decimal import Decimal
+
+
+def populate_stats_rollup(apps, schema_editor):
+    """Calcola gli aggregati giornalieri per tutto lo storico dei file di stampa."""
+    PrintFile = apps.get_model('app_3dmage_management', 'PrintFile')
+    FilamentUsage = apps.get_model('app_3dmage_management', 'FilamentUsage')
+    PrintStatsRollup = apps.get_model('app_3dmage_management', 'PrintStatsRollup')
+
+    rows = []
+    file_totals = PrintFile.objects.annotate(day=TruncDate('created_at')).values('day', 'printer_id', 'status').annotate(
+        files=models.Count('id'),
+        seconds=models.Sum('print_time_seconds'),
+        watts=models.Sum(
+            models.F('print_time_seconds') * models.F('printer__power_consumption'),
+            filter=models.Q(printer__power_consumption__gt=0)
+        ),
+    ).order_by()
+    for row in file_totals:
+        rows.append(PrintStatsRollup(
+            day=row['day'], printer_id=row['printer_id'], status=row['status'],
+            file_count=row['files'], print_seconds=row['seconds'] or 0, watt_seconds=row['watts'] or 0,
+        ))
+
+    unit_cost = Cast('spool__cost', models.FloatField()) / Cast('spool__initial_weight_g', models.FloatField())
+    usage_totals = FilamentUsage.objects.annotate(day=TruncDate('print_file__created_at')).values(
+        'day', 'print_file__printer_id', 'print_file__status', 'spool__filament__material'
+    ).annotate(
+        total_grams=models.Sum('grams_used'),
+        cost=models.Sum(
+            Cast('grams_used', models.FloatField()) * unit_cost,
+            filter=models.Q(spool__initial_weight_g__gt=0), output_field=models.FloatField()
+        ),
+    ).order_by()
+    for row in usage_totals:
+        rows.append(PrintStatsRollup(
+            day=row['day'], printer_id=row['print_file__printer_id'], status=row['print_file__status'],
+            material=row['spool__filament__material'],
+            grams=Decimal(str(row['total_grams'] or 0)).quantize(Decimal('0.01')),
+            material_cost=Decimal(str(row['cost'] or 0)).quantize(Decimal('0.0001')),
+        ))
+    PrintStatsRollup.objects.bulk_create(rows, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_3dmage_management', '0047_domainversion_settings'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PrintStatsRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(db_index=True, verbose_name='Giorno')),
+                ('status', models.CharField(choices=[('TODO', 'Da Stampare'), ('PRINTING', 'In Stampa'), ('DONE', 'Stampato'), ('FAILED', 'Fallito')], max_length=10, verbose_name='Status Stampa')),
+                ('material', models.CharField(blank=True, max_length=10, verbose_name='Materiale')),
+                ('file_count', models.PositiveIntegerField(default=0, verbose_name='File di Stampa')),
+                ('print_seconds', models.PositiveBigIntegerField(default=0, verbose_name='Secondi di Stampa')),
+                ('watt_seconds', models.PositiveBigIntegerField(default=0, verbose_name='Watt·Secondi')),
+                ('grams', models.DecimalField(decimal_places=2, default=0.0, max_digits=14, verbose_name='Grammi')),
+                ('material_cost', models.DecimalField(decimal_places=4, default=0.0, max_digits=14, verbose_name='Costo Materiale')),
+                ('printer', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='stats_rollups', to='app_3dmage_management.printer', verbose_name='Stampante')),
+            ],
+            options={
+                'verbose_name': 'Aggregato Statistiche',
+                'verbose_name_plural': 'Aggregati Statistiche',
+            },
+        ),
+        migrations.RunPython(populate_stats_rollup, reverse_code=migrations.RunPython.noop),
+    ]
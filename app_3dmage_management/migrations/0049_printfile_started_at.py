@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 12:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_3dmage_management', '0048_printstatsrollup'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='printfile',
+            name='started_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Inizio Stampa'),
+        ),
+    ]
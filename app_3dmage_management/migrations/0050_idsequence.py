@@ -0,0 +1,27 @@
+# Generated by Django 4.2.30 on 2026-10-18 12:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_3dmage_management', '0049_printfile_started_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IdSequence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('entity', models.CharField(choices=[('work_order', 'Ordine di Lavoro'), ('stock_item', 'Oggetto Magazzino')], max_length=20, verbose_name='Entità')),
+                ('year', models.PositiveSmallIntegerField(verbose_name='Anno')),
+                ('last_value', models.PositiveIntegerField(default=0, verbose_name='Ultimo Valore')),
+            ],
+            options={
+                'verbose_name': 'Sequenza ID',
+                'verbose_name_plural': 'Sequenze ID',
+                'unique_together': {('entity', 'year')},
+            },
+        ),
+    ]
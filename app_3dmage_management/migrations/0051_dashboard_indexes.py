@@ -0,0 +1,37 @@
+# Generated by Django 4.2.30 on 2026-10-18 12:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_3dmage_management', '0050_idsequence'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='expense',
+            index=models.Index(fields=['expense_date'], name='expense_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='printfile',
+            index=models.Index(fields=['status'], name='printfile_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='printfile',
+            index=models.Index(fields=['printer', 'status', 'queue_position'], name='printfile_printer_queue_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stockitem',
+            index=models.Index(fields=['status', 'sold_at'], name='stockitem_status_sold_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stockitem',
+            index=models.Index(fields=['work_order', 'name', 'status'], name='stockitem_wo_name_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='workorder',
+            index=models.Index(fields=['status', 'completed_at'], name='workorder_status_completed_idx'),
+        ),
+    ]
@@ -0,0 +1,106 @@
+# Generated by Django 4.2.30 on 2026-10-18 12:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+import datetime
+from decimal import Decimal
+
+
+def _net_revenue(item):
+    # Stessa logica di StockItem.get_net_revenue (i modelli storici non hanno i metodi)
+    total = (item.sale_price or Decimal('0.00')) * item.quantity
+    name = item.payment_method.name.lower()
+    if 'satispay business' in name:
+        return (total * Decimal('0.99')).quantize(Decimal('0.01'))
+    if 'sumup' in name or 'sum up' in name:
+        return (total * Decimal('0.9805')).quantize(Decimal('0.01'))
+    return total
+
+
+def populate_balance_movements(apps, schema_editor):
+    """
+    Ricostruisce il registro dallo storico: una spesa e una vendita per riga, più un saldo iniziale per
+    metodo pari alla differenza tra il saldo attuale e i movimenti ricostruiti (trasferimenti e
+    correzioni passate non hanno lasciato traccia), datato prima del primo movimento.
+    """
+    PaymentMethod = apps.get_model('app_3dmage_management', 'PaymentMethod')
+    Expense = apps.get_model('app_3dmage_management', 'Expense')
+    StockItem = apps.get_model('app_3dmage_management', 'StockItem')
+    BalanceMovement = apps.get_model('app_3dmage_management', 'BalanceMovement')
+
+    movements = []
+    for expense in Expense.objects.filter(payment_method__isnull=False).exclude(amount=0).iterator():
+        movements.append(BalanceMovement(
+            payment_method_id=expense.payment_method_id, kind='EXPENSE', amount=-expense.amount,
+            occurred_on=expense.expense_date, description=expense.description[:255], expense=expense,
+        ))
+    sales = StockItem.objects.filter(status='SOLD', payment_method__isnull=False).select_related('payment_method')
+    for item in sales.iterator():
+        amount = _net_revenue(item)
+        if amount:
+            movements.append(BalanceMovement(
+                payment_method_id=item.payment_method_id, kind='SALE', amount=amount,
+                occurred_on=item.sold_at or item.created_at.date(), description=f"Vendita {item.name}"[:255], stock_item=item,
+            ))
+
+    totals, first_day = {}, {}
+    for movement in movements:
+        method_id = movement.payment_method_id
+        totals[method_id] = totals.get(method_id, Decimal('0.00')) + movement.amount
+        first_day[method_id] = min(first_day.get(method_id, movement.occurred_on), movement.occurred_on)
+    today = django.utils.timezone.localdate()
+    for method in PaymentMethod.objects.all():
+        opening = method.balance - totals.get(method.pk, Decimal('0.00'))
+        if opening:
+            movements.append(BalanceMovement(
+                payment_method=method, kind='OPENING', amount=opening, description='Saldo iniziale',
+                occurred_on=first_day.get(method.pk, today) - datetime.timedelta(days=1),
+            ))
+    BalanceMovement.objects.bulk_create(movements, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_3dmage_management', '0051_dashboard_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BalanceSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period_end', models.DateField(verbose_name='Fine Periodo')),
+                ('balance', models.DecimalField(decimal_places=2, max_digits=12, verbose_name='Saldo')),
+                ('payment_method', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='snapshots', to='app_3dmage_management.paymentmethod', verbose_name='Metodo di Pagamento')),
+            ],
+            options={
+                'verbose_name': 'Istantanea Saldo',
+                'verbose_name_plural': 'Istantanee Saldi',
+                'unique_together': {('payment_method', 'period_end')},
+            },
+        ),
+        migrations.CreateModel(
+            name='BalanceMovement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('OPENING', 'Saldo iniziale'), ('SALE', 'Vendita'), ('EXPENSE', 'Spesa'), ('REVERSAL', 'Storno'), ('TRANSFER', 'Trasferimento'), ('CORRECTION', 'Correzione saldo')], max_length=10, verbose_name='Tipo')),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=12, verbose_name='Importo (€)')),
+                ('occurred_on', models.DateField(default=django.utils.timezone.localdate, verbose_name='Data')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Registrato il')),
+                ('description', models.CharField(blank=True, max_length=255, verbose_name='Descrizione')),
+                ('transfer_id', models.UUIDField(blank=True, null=True, verbose_name='Trasferimento')),
+                ('expense', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='movements', to='app_3dmage_management.expense', verbose_name='Spesa')),
+                ('payment_method', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='movements', to='app_3dmage_management.paymentmethod', verbose_name='Metodo di Pagamento')),
+                ('stock_item', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='movements', to='app_3dmage_management.stockitem', verbose_name='Vendita')),
+            ],
+            options={
+                'verbose_name': 'Movimento di Saldo',
+                'verbose_name_plural': 'Movimenti di Saldo',
+                'ordering': ['occurred_on', 'id'],
+                'indexes': [models.Index(fields=['payment_method', 'occurred_on'], name='movement_method_date_idx')],
+            },
+        ),
+        migrations.RunPython(populate_balance_movements, reverse_code=migrations.RunPython.noop),
+    ]
@@ -0,0 +1,81 @@
+# Generated by Django 4.2.30 on 2026-10-18 12:46
+
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models.functions import Coalesce, TruncMonth
+from decimal import Decimal
+
+
+def populate_accounting_summary(apps, schema_editor):
+    """Riepiloghi mensili per tutto lo storico di vendite e spese (nessun periodo chiuso)."""
+    StockItem = apps.get_model('app_3dmage_management', 'StockItem')
+    Expense = apps.get_model('app_3dmage_management', 'Expense')
+    AccountingSummary = apps.get_model('app_3dmage_management', 'AccountingSummary')
+
+    # Stessa logica di StockItemQuerySet.with_net_values (i manager storici non hanno i metodi)
+    gross = Coalesce('sale_price', models.Value(0), output_field=models.DecimalField()) * models.F('quantity')
+    net_revenue = models.Case(
+        models.When(payment_method__name__icontains='satispay business', then=gross * models.Value(0.99)),
+        models.When(payment_method__name__icontains='sumup', then=gross * models.Value(0.9805)),
+        models.When(payment_method__name__icontains='sum up', then=gross * models.Value(0.9805)),
+        default=gross,
+        output_field=models.DecimalField(max_digits=10, decimal_places=2),
+    )
+    rows = []
+    sales = StockItem.objects.filter(status='SOLD', payment_method__isnull=False)
+    for row in sales.annotate(month=TruncMonth('sold_at')).values('month', 'payment_method_id').annotate(
+        count=models.Count('id'), total=models.Sum(net_revenue),
+    ).order_by():
+        rows.append(AccountingSummary(
+            month=row['month'], kind='INCOME', payment_method_id=row['payment_method_id'],
+            entries=row['count'], amount=Decimal(str(row['total'] or 0)).quantize(Decimal('0.01')),
+        ))
+    for row in Expense.objects.annotate(month=TruncMonth('expense_date')).values('month', 'payment_method_id', 'category_id').annotate(
+        count=models.Count('id'), total=models.Sum('amount'),
+    ).order_by():
+        rows.append(AccountingSummary(
+            month=row['month'], kind='EXPENSE', payment_method_id=row['payment_method_id'],
+            category_id=row['category_id'], entries=row['count'], amount=row['total'] or 0,
+        ))
+    AccountingSummary.objects.bulk_create(rows, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_3dmage_management', '0052_balance_ledger'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AccountingPeriod',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField(unique=True, verbose_name='Mese')),
+                ('closed_at', models.DateTimeField(auto_now_add=True, verbose_name='Chiuso il')),
+            ],
+            options={
+                'verbose_name': 'Periodo Contabile Chiuso',
+                'verbose_name_plural': 'Periodi Contabili Chiusi',
+                'ordering': ['-month'],
+            },
+        ),
+        migrations.CreateModel(
+            name='AccountingSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField(blank=True, null=True, verbose_name='Mese')),
+                ('kind', models.CharField(choices=[('INCOME', 'Entrata'), ('EXPENSE', 'Uscita')], max_length=7, verbose_name='Tipo')),
+                ('entries', models.PositiveIntegerField(default=0, verbose_name='Movimenti')),
+                ('amount', models.DecimalField(decimal_places=2, default=0.0, max_digits=14, verbose_name='Importo (€)')),
+                ('category', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='accounting_summaries', to='app_3dmage_management.expensecategory', verbose_name='Categoria')),
+                ('payment_method', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='accounting_summaries', to='app_3dmage_management.paymentmethod', verbose_name='Metodo di Pagamento')),
+            ],
+            options={
+                'verbose_name': 'Riepilogo Contabile',
+                'verbose_name_plural': 'Riepiloghi Contabili',
+                'indexes': [models.Index(fields=['month', 'kind'], name='accounting_summary_month_idx')],
+            },
+        ),
+        migrations.RunPython(populate_accounting_summary, reverse_code=migrations.RunPython.noop),
+    ]
@@ -0,0 +1,141 @@
+# Generated by Django 4.2.30 on 2026-10-18 12:57
+
+import re
+import unicodedata
+
+from django.db import migrations, models
+
+ENTRY_TABLE = 'app_3dmage_management_searchentry'
+FTS_TABLE = f'{ENTRY_TABLE}_fts'
+
+SQLITE_INDEX = [
+    # Tabella FTS5 a contenuto esterno: il testo resta in SearchEntry, i trigger tengono allineato l'indice.
+    # Su SQLite un AlterField futuro di SearchEntry ricrea la tabella: i trigger andranno ricreati
+    f"""CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(
+        keywords, body, content='{ENTRY_TABLE}', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+    )""",
+    f"""CREATE TRIGGER {FTS_TABLE}_ai AFTER INSERT ON {ENTRY_TABLE} BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, keywords, body) VALUES (new.id, new.keywords, new.body);
+    END""",
+    f"""CREATE TRIGGER {FTS_TABLE}_ad AFTER DELETE ON {ENTRY_TABLE} BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, keywords, body) VALUES ('delete', old.id, old.keywords, old.body);
+    END""",
+    f"""CREATE TRIGGER {FTS_TABLE}_au AFTER UPDATE ON {ENTRY_TABLE} BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, keywords, body) VALUES ('delete', old.id, old.keywords, old.body);
+        INSERT INTO {FTS_TABLE}(rowid, keywords, body) VALUES (new.id, new.keywords, new.body);
+    END""",
+]
+SQLITE_DROP = [f"DROP TABLE IF EXISTS {FTS_TABLE}"] + [
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_{suffix}" for suffix in ('ai', 'ad', 'au')
+]
+
+POSTGRES_INDEX = [
+    f"""ALTER TABLE {ENTRY_TABLE} ADD COLUMN search_vector tsvector GENERATED ALWAYS AS (
+        setweight(to_tsvector('simple', keywords), 'A') || setweight(to_tsvector('simple', body), 'B')
+    ) STORED""",
+    f"CREATE INDEX searchentry_vector_idx ON {ENTRY_TABLE} USING GIN (search_vector)",
+]
+POSTGRES_DROP = [
+    "DROP INDEX IF EXISTS searchentry_vector_idx",
+    f"ALTER TABLE {ENTRY_TABLE} DROP COLUMN IF EXISTS search_vector",
+]
+
+
+def create_search_index(apps, schema_editor):
+    statements = {'sqlite': SQLITE_INDEX, 'postgresql': POSTGRES_INDEX}.get(schema_editor.connection.vendor, [])
+    for statement in statements:
+        schema_editor.execute(statement)
+
+
+def drop_search_index(apps, schema_editor):
+    statements = {'sqlite': SQLITE_DROP, 'postgresql': POSTGRES_DROP}.get(schema_editor.connection.vendor, [])
+    for statement in statements:
+        schema_editor.execute(statement)
+
+
+# Stessa normalizzazione di search.py (le migrazioni non importano il codice dell'app)
+WORD_RE = re.compile(r'[^\W_]+')
+
+
+def _stem(word):
+    if len(word) < 4 or not word.isalpha() or word[-1] not in 'aeiou':
+        return word
+    word = word[:-1]
+    return word[:-1] if word.endswith(('ch', 'gh')) else word
+
+
+def _index_text(*parts):
+    tokens = []
+    for part in parts:
+        text = unicodedata.normalize('NFKD', str(part or '')).casefold()
+        tokens += WORD_RE.findall(''.join(char for char in text if not unicodedata.combining(char)))
+    return ' '.join(tokens + [_stem(word) for word in tokens if _stem(word) != word])
+
+
+def populate_search_index(apps, schema_editor):
+    """Voci di ricerca per gli oggetti già presenti."""
+    WorkOrder = apps.get_model('app_3dmage_management', 'WorkOrder')
+    Project = apps.get_model('app_3dmage_management', 'Project')
+    StockItem = apps.get_model('app_3dmage_management', 'StockItem')
+    Expense = apps.get_model('app_3dmage_management', 'Expense')
+    SearchEntry = apps.get_model('app_3dmage_management', 'SearchEntry')
+
+    entries = []
+    for order in WorkOrder.objects.iterator(chunk_size=1000):
+        entries.append(SearchEntry(
+            kind='work_order', object_id=order.pk, title=order.name,
+            subtitle=f"#{order.custom_id or order.pk} · {order.get_status_display()}",
+            keywords=_index_text(order.custom_id, order.name), body=_index_text(order.notes),
+        ))
+    for project in Project.objects.select_related('category').iterator(chunk_size=1000):
+        entries.append(SearchEntry(
+            kind='project', object_id=project.pk, title=project.name,
+            subtitle=project.category.name if project.category_id else '',
+            keywords=_index_text(project.name), body=_index_text(project.notes, project.dimensions),
+        ))
+    for item in StockItem.objects.iterator(chunk_size=1000):
+        if item.status == 'SOLD':
+            sold_at = item.sold_at.strftime('%d/%m/%Y') if item.sold_at else 'senza data'
+            kind, subtitle = 'sale', ' · '.join(filter(None, [sold_at, item.sold_to]))
+        else:
+            kind, subtitle = 'stock_item', f"#{item.custom_id or item.pk} · {item.get_status_display()}"
+        entries.append(SearchEntry(
+            kind=kind, object_id=item.pk, title=item.name, subtitle=subtitle,
+            keywords=_index_text(item.custom_id, item.name), body=_index_text(item.notes, item.sold_to),
+        ))
+    for expense in Expense.objects.iterator(chunk_size=1000):
+        entries.append(SearchEntry(
+            kind='expense', object_id=expense.pk, title=expense.description[:255],
+            subtitle=f"{expense.expense_date:%d/%m/%Y} · {expense.amount:.2f}€",
+            keywords=_index_text(expense.description), body=_index_text(expense.notes),
+        ))
+    SearchEntry.objects.bulk_create(entries, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_3dmage_management', '0053_accounting_summary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('work_order', 'Ordine di Lavoro'), ('project', 'Progetto Master'), ('stock_item', 'Magazzino'), ('sale', 'Vendita'), ('expense', 'Spesa')], max_length=20, verbose_name='Tipo')),
+                ('object_id', models.PositiveBigIntegerField(verbose_name='ID Oggetto')),
+                ('title', models.CharField(max_length=255, verbose_name='Titolo')),
+                ('subtitle', models.CharField(blank=True, max_length=255, verbose_name='Dettaglio')),
+                ('keywords', models.TextField(blank=True, verbose_name='Parole Chiave')),
+                ('body', models.TextField(blank=True, verbose_name='Testo')),
+            ],
+            options={
+                'verbose_name': 'Voce Indice Ricerca',
+                'verbose_name_plural': 'Voci Indice Ricerca',
+                'unique_together': {('kind', 'object_id')},
+            },
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+        migrations.RunPython(populate_search_index, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 4.2.30 on 2026-10-18 13:04
+
+from django.db import migrations, models
+
+
+def seed_notifications_version(apps, schema_editor):
+    DomainVersion = apps.get_model('app_3dmage_management', 'DomainVersion')
+    DomainVersion.objects.get_or_create(domain='notifications', defaults={'version': 1})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_3dmage_management', '0054_search_index'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='domainversion',
+            name='domain',
+            field=models.CharField(choices=[('work_orders', 'Ordini di Lavoro'), ('print_queue', 'Coda di Stampa'), ('stock', 'Magazzino'), ('filaments', 'Filamenti'), ('accounting', 'Contabilità'), ('settings', 'Impostazioni'), ('notifications', 'Notifiche')], max_length=20, unique=True, verbose_name='Dominio'),
+        ),
+        migrations.RunPython(seed_notifications_version, reverse_code=migrations.RunPython.noop),
+    ]
@@ -1,39 +1,14 @@
 import datetime
 import math
-from django.db import models
-from django.db.models import Sum, F, Case, When, IntegerField, Value
+from django.db import models, transaction, IntegrityError
+from django.db.models import Sum, F, Case, When, IntegerField, Value, Count, Q, FloatField
+from django.db.models.functions import Cast, TruncDate, TruncMonth
 from django.utils import timezone
 from django.conf import settings
 from decimal import Decimal
-from .managers import WorkOrderManager
-
-def bump_global_version():
-    """Update a global version timestamp to signal HTMX clients to refresh."""
-    from decimal import Decimal
-    try:
-        # Use a safe string conversion for Decimal
-        # Use a safe string conversion for Decimal, modulo 100000 to fit in max_digits=10
-        ts = str(timezone.now().timestamp() % 100000)
-        new_val = Decimal(ts)
-        
-        # Robust update: Try to update directly first (efficient)
-        updated = GlobalSetting.objects.filter(key='app_last_updated').update(value=new_val)
-        
-        if updated == 0:
-            # If not found, create it
-            GlobalSetting.objects.create(key='app_last_updated', value=new_val)
-            
-    except Exception:
-        # If update/create failed (e.g. corruption causing issues even on update), 
-        # delete and recreate.
-        try:
-            GlobalSetting.objects.filter(key='app_last_updated').delete()
-            ts = str(timezone.now().timestamp() % 100000)
-            new_val = Decimal(ts)
-            GlobalSetting.objects.create(key='app_last_updated', value=new_val)
-        except Exception:
-            pass # Last resort, prevent crash
-
+from .managers import WorkOrderManager, SpoolManager, FilamentQuerySet, RawMaterialQuerySet
+from . import changefeed
+from .cost_settings import get_cost_settings
 
 # Modello per le Categorie dei progetti
 class Category(models.Model):
@@ -91,6 +66,13 @@ class FilamentUsage(models.Model):
         verbose_name="Grammi Usati"
     )
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Memorizziamo la bobina originale per aggiornare il registro se viene cambiata
+        instance._loaded_spool_id = instance.__dict__.get('spool_id')
+        return instance
+
     def __str__(self):
         return f"{self.grams_used}g di {self.spool.filament} per {self.print_file.name}"
 
@@ -110,6 +92,8 @@ class Filament(models.Model):
     volumetric_speed = models.PositiveIntegerField(default=15, verbose_name="Velocità Volumetrica (mm³/s)")
     notes = models.TextField(blank=True, verbose_name="Note")
 
+    objects = FilamentQuerySet.as_manager()
+
     @property
     def total_initial_weight(self):
         return self.spools.aggregate(total=models.Sum('initial_weight_g'))['total'] or 0
@@ -156,21 +140,39 @@ class Spool(models.Model):
     purchase_link = models.URLField(max_length=512, blank=True, null=True, verbose_name="Link Acquisto")
     is_active = models.BooleanField(default=True, verbose_name="Attiva")
 
+    objects = SpoolManager()
+
+    @property
+    def gross_weight(self):
+        """Peso (g) iniziale comprensivo dell'aggiustamento manuale."""
+        return Decimal(self.initial_weight_g) + Decimal(str(self.weight_adjustment))
+
+    def get_ledger(self):
+        """
+        Restituisce il registro pesi della bobina (usa la cache di select_related('ledger')).
+        Se il registro non esiste ancora viene calcolato al volo.
+        """
+        try:
+            return self.ledger
+        except SpoolLedger.DoesNotExist:
+            ledger = SpoolLedger.refresh([self.pk])[self.pk]
+            self.ledger = ledger
+            return ledger
+
     @property
     def remaining_weight(self):
         """Peso (g) basato sulle stampe completate (DONE/FAILED)."""
-        used = self.usages.filter(print_file__status__in=['DONE', 'FAILED']).aggregate(total=Sum('grams_used'))['total'] or Decimal('0.00')
-        return (Decimal(self.initial_weight_g) + Decimal(str(self.weight_adjustment))) - used
+        return self.gross_weight - self.get_ledger().consumed_grams
 
     @property
     def pending_weight(self):
         """Peso (g) impegnato per stampe in coda (TODO/PRINTING)."""
-        return self.usages.filter(print_file__status__in=['TODO', 'PRINTING']).aggregate(total=Sum('grams_used'))['total'] or Decimal('0.00')
+        return self.get_ledger().committed_grams
 
     @property
     def available_weight(self):
         """Peso (g) realmente disponibile (rimanente - impegnato)."""
-        return max(Decimal('0.00'), self.remaining_weight - self.pending_weight)
+        return self.get_ledger().available_grams
 
     # MODIFICA: Logica di assegnazione automatica lettera (A, B, C...)
     def save(self, *args, **kwargs):
@@ -198,6 +200,76 @@ class Spool(models.Model):
         verbose_name_plural = "Bobine"
         ordering = ['purchase_date', 'identifier']
 
+
+# Registro materializzato dei pesi per bobina.
+# Viene mantenuto dai segnali in signals.py ogni volta che cambiano i FilamentUsage,
+# lo stato di un PrintFile o il peso della bobina stessa.
+class SpoolLedger(models.Model):
+    CONSUMED_STATUSES = ['DONE', 'FAILED']
+    COMMITTED_STATUSES = ['TODO', 'PRINTING']
+
+    spool = models.OneToOneField(Spool, on_delete=models.CASCADE, primary_key=True, related_name='ledger', verbose_name="Bobina")
+    consumed_grams = models.DecimalField(max_digits=12, decimal_places=2, default=0.00, verbose_name="Grammi Consumati")
+    committed_grams = models.DecimalField(max_digits=12, decimal_places=2, default=0.00, verbose_name="Grammi Impegnati")
+    available_grams = models.DecimalField(max_digits=12, decimal_places=2, default=0.00, verbose_name="Grammi Disponibili")
+
+    @classmethod
+    def compute(cls, spool_ids=None):
+        """
+        Calcola dai dati reali (FilamentUsage) i valori del registro.
+        Restituisce un dizionario {spool_id: SpoolLedger} non salvato.
+        """
+        spools = Spool.objects.all()
+        usages = FilamentUsage.objects.all()
+        if spool_ids is not None:
+            spools = spools.filter(id__in=spool_ids)
+            usages = usages.filter(spool_id__in=spool_ids)
+
+        totals = {
+            row['spool_id']: row for row in usages.values('spool_id').annotate(
+                consumed=Sum('grams_used', filter=models.Q(print_file__status__in=cls.CONSUMED_STATUSES)),
+                committed=Sum('grams_used', filter=models.Q(print_file__status__in=cls.COMMITTED_STATUSES)),
+            )
+        }
+
+        ledgers = {}
+        for spool_id, initial, adjustment in spools.values_list('id', 'initial_weight_g', 'weight_adjustment'):
+            row = totals.get(spool_id, {})
+            consumed = (row.get('consumed') or Decimal('0.00')).quantize(Decimal('0.01'))
+            committed = (row.get('committed') or Decimal('0.00')).quantize(Decimal('0.01'))
+            gross = Decimal(initial) + Decimal(str(adjustment))
+            ledgers[spool_id] = cls(
+                spool_id=spool_id,
+                consumed_grams=consumed,
+                committed_grams=committed,
+                available_grams=max(Decimal('0.00'), gross - consumed - committed),
+            )
+        return ledgers
+
+    @classmethod
+    def refresh(cls, spool_ids):
+        """Ricalcola e salva il registro per le bobine indicate (una query di aggregazione + un upsert)."""
+        spool_ids = {spool_id for spool_id in spool_ids if spool_id}
+        if not spool_ids:
+            return {}
+        ledgers = cls.compute(spool_ids)
+        cls.objects.bulk_create(
+            ledgers.values(),
+            update_conflicts=True,
+            unique_fields=['spool'],
+            update_fields=['consumed_grams', 'committed_grams', 'available_grams'],
+        )
+        # Pesi residui cambiati: le viste dei filamenti vanno aggiornate
+        changefeed.bump_domain_versions(changefeed.FILAMENTS)
+        return ledgers
+
+    def __str__(self):
+        return f"Registro {self.spool_id}: {self.available_grams}g disponibili"
+
+    class Meta:
+        verbose_name = "Registro Bobina"
+        verbose_name_plural = "Registri Bobine"
+
 # Modello per i Progetti Master (Ricettario)
 class Project(models.Model):
     name = models.CharField(max_length=200, verbose_name="Nome Progetto")
@@ -215,10 +287,6 @@ class Project(models.Model):
         Clona questo progetto Master in un nuovo Ordine di Lavoro (WorkOrder),
         creando ricorsivamente tutti i PrintFile e i FilamentUsage associati.
         """
-        import math
-        # I modelli sono definiti nello stesso file e saranno disponibili a runtime.
-        # Definiamo i riferimenti locali se necessario o usiamoli direttamente.
-        
         # 1. Crea il WorkOrder
         new_wo = WorkOrder.objects.create(
             name=self.name,
@@ -230,66 +298,13 @@ class Project(models.Model):
             notes=notes or self.notes
         )
         
-        # 2. Crea i PrintFile basandosi sui file Master
-        for mpf in self.master_print_files.all():
-            # Otteniamo le parti a cui appartiene il file (o una lista con None se non ne ha)
-            file_parts = list(mpf.project_parts.all())
-            if not file_parts:
-                file_parts = [None]
-                
-            for part in file_parts:
-                # Calcolo Moltiplicatore per il file (quanti set di pezzi servono)
-                # Per semplicità nel re-print rapido assumiamo 1 set se non diversamente specificato
-                file_multiplier = 1 # In create_from_template era math.ceil(batch_qty / mpf.produced_quantity)
-                
-                for i in range(file_multiplier):
-                    multiplier_suffix = f" ({i+1})" if file_multiplier > 1 else ""
-                    pf_name = f"{mpf.name}{multiplier_suffix}"
-                    
-                    pf = PrintFile.objects.create(
-                        work_order=new_wo,
-                        master_print_file=mpf,
-                        project_part=part,
-                        name=pf_name,
-                        print_time_seconds=mpf.estimated_time_seconds,
-                        printer_id=mpf.printer_id,
-                        plate=mpf.plate,
-                        produced_quantity=mpf.produced_quantity,
-                        status=PrintFile.Status.TODO
-                    )
-                    
-                    # 3. Crea FilamentUsage
-                    for master_usage in mpf.filament_usages.all():
-                        target_filament = master_usage.filament
-                        
-                        # Selezione automatica bobina
-                        spools = Spool.objects.filter(filament=target_filament, is_active=True)
-                        suitable_spools = sorted(
-                            [s for s in spools if s.available_weight >= master_usage.grams_used],
-                            key=lambda x: x.available_weight
-                        )
-                        
-                        spool = None
-                        if suitable_spools:
-                            spool = suitable_spools[0]
-                        else:
-                            spool = sorted(list(spools), key=lambda x: x.available_weight, reverse=True)[0] if spools.exists() else None
-                        
-                        if spool:
-                            FilamentUsage.objects.create(
-                                print_file=pf,
-                                spool=spool,
-                                grams_used=master_usage.grams_used
-                            )
-        
-        # Copia le materie prime del Progetto Master all'Ordine di Lavoro
-        for pm_rm in self.raw_materials.all():
-            WorkOrderRawMaterial.objects.create(
-                work_order=new_wo,
-                raw_material=pm_rm.raw_material,
-                quantity=pm_rm.quantity * quantity
-            )
-            
+        # 2. Crea i PrintFile, i FilamentUsage e le materie prime con inserimenti massivi
+        from .cloning import MasterCloner
+        cloner = MasterCloner(self, new_wo)
+        cloner.plan_single_set()
+        cloner.plan_raw_materials(quantity)
+        cloner.save()
+
         return new_wo
 
     def __str__(self):
@@ -352,7 +367,7 @@ class MasterPrintFile(models.Model):
 
     @property
     def total_grams(self):
-        return self.filament_usages.aggregate(total=Sum('grams_used'))['total'] or 0.0
+        return sum(usage.grams_used for usage in self.filament_usages.all()) or 0.0
 
     def __str__(self):
         return f"{self.project.name} - {self.name}"
@@ -418,28 +433,39 @@ class WorkOrder(models.Model):
 
     @property
     def total_print_time(self):
-        total_seconds = self.print_files.aggregate(total=Sum('print_time_seconds'))['total'] or 0
+        # Valori già calcolati in SQL da WorkOrderQuerySet.with_annotations()
+        if hasattr(self, 'total_print_time_seconds'):
+            total_seconds = self.total_print_time_seconds
+        else:
+            total_seconds = self.print_files.aggregate(total=Sum('print_time_seconds'))['total'] or 0
         return str(datetime.timedelta(seconds=total_seconds))
 
     @property
     def remaining_print_time(self):
-        total_seconds = self.print_files.filter(status='TODO').aggregate(total=Sum('print_time_seconds'))['total'] or 0
+        if hasattr(self, 'remaining_print_time_seconds'):
+            total_seconds = self.remaining_print_time_seconds
+        else:
+            total_seconds = self.print_files.filter(status='TODO').aggregate(total=Sum('print_time_seconds'))['total'] or 0
         return str(datetime.timedelta(seconds=total_seconds))
 
+    def _file_counts(self):
+        """(file completati, file validi), dalle annotazioni di with_annotations() se presenti."""
+        if hasattr(self, 'total_files_count'):
+            return self.done_files_count, self.total_files_count
+        return self.print_files.filter(status='DONE').count(), self.print_files.exclude(status='FAILED').count()
+
     @property
     def progress(self):
-        total_valid_files = self.print_files.exclude(status='FAILED').count()
+        done_files, total_valid_files = self._file_counts()
         if total_valid_files == 0:
             return "0/0"
-        done_files = self.print_files.filter(status='DONE').count()
         return f"{done_files}/{total_valid_files}"
 
     @property
     def progress_percentage(self):
-        total_valid_files = self.print_files.exclude(status='FAILED').count()
+        done_files, total_valid_files = self._file_counts()
         if total_valid_files == 0:
             return 0
-        done_files = self.print_files.filter(status='DONE').count()
         return (done_files * 100) / total_valid_files
 
     @property
@@ -455,6 +481,9 @@ class WorkOrder(models.Model):
 
     @property
     def total_material_cost(self):
+        # Valore già calcolato in SQL da WorkOrderQuerySet.with_costs()
+        if hasattr(self, 'cost_material'):
+            return self.cost_material.quantize(Decimal('0.01'))
         total_cost = Decimal('0.00')
         for print_file in self.print_files.all():
             for usage in print_file.filament_usages.all():
@@ -466,6 +495,8 @@ class WorkOrder(models.Model):
     # NUOVA PROPRIETA' per il costo totale comprensivo
     @property
     def full_total_cost(self):
+        if hasattr(self, 'cost_total'):
+            return self.cost_total
         total_cost = Decimal('0.00')
         for print_file in self.print_files.all():
             # La property total_cost del PrintFile include già materiale, elettricità e usura
@@ -496,8 +527,14 @@ class WorkOrder(models.Model):
         """Calcola il numero totale di pezzi attesi per tutti gli output definiti nel progetto."""
         if not self.project:
             return self.quantity
-        total_pieces_per_set = self.project.outputs.aggregate(Sum('quantity'))['quantity__sum'] or 1
-        return self.quantity * total_pieces_per_set
+        return self.quantity * self._pieces_per_set()
+
+    # Gli helper leggono le relazioni con .all(): la vista di dettaglio le precarica una volta sola
+    def _pieces_per_set(self):
+        return sum(output.quantity for output in self.project.outputs.all()) or 1
+
+    def _stocked_quantity(self, name):
+        return sum(item.quantity for item in self.stockitem_set.all() if item.name == name)
 
     @property
     def remaining_objects(self):
@@ -526,13 +563,11 @@ class WorkOrder(models.Model):
         """Calcola quanti pezzi di un determinato output devono ancora essere versati a magazzino."""
         if not self.project:
             return 0
-        from django.db.models import Sum
         # In un ordine, 'quantity' è il numero di SET.
         num_sets = self.quantity
         total_expected = int(num_sets * output.quantity)
         
-        from .models import StockItem
-        produced = StockItem.objects.filter(work_order=self, name=output.name).aggregate(Sum('quantity'))['quantity__sum'] or 0
+        produced = self._stocked_quantity(output.name)
         return max(0, total_expected - produced)
 
     def get_printed_ready_to_stock_for_output(self, output):
@@ -543,12 +578,11 @@ class WorkOrder(models.Model):
         if not self.project:
             return 0
             
-        from django.db.models import Sum
         # 1. Quanti pezzi totali sono stati stampati (DONE)
-        total_printed = self.print_files.filter(status='DONE').aggregate(Sum('actual_quantity'))['actual_quantity__sum'] or 0
+        total_printed = sum(f.actual_quantity for f in self.print_files.all() if f.status == 'DONE')
         
         # 2. Distribuzione proporzionale per questo output
-        total_pieces_per_set = self.project.outputs.all().aggregate(Sum('quantity'))['quantity__sum'] or 1
+        total_pieces_per_set = self._pieces_per_set()
         # Se l'output contribuisce per N pezzi su un totale di M nel set:
         proportion = Decimal(output.quantity) / Decimal(total_pieces_per_set)
         
@@ -556,8 +590,7 @@ class WorkOrder(models.Model):
         printed_for_output = int(Decimal(total_printed) * proportion)
         
         # 3. Sottraiamo quelli già versati a magazzino
-        from .models import StockItem
-        already_stocked = StockItem.objects.filter(work_order=self, name=output.name).aggregate(Sum('quantity'))['quantity__sum'] or 0
+        already_stocked = self._stocked_quantity(output.name)
         
         return max(0, printed_for_output - already_stocked)
 
@@ -591,7 +624,7 @@ class WorkOrder(models.Model):
 
     def save(self, *args, **kwargs):
         super().save(*args, **kwargs)
-        bump_global_version()
+        changefeed.bump_domain_versions(changefeed.WORK_ORDERS, changefeed.PRINT_QUEUE)
 
     def __str__(self):
         return self.name
@@ -600,6 +633,10 @@ class WorkOrder(models.Model):
         verbose_name = "Ordine di Lavoro"
         verbose_name_plural = "Ordini di Lavoro"
         ordering = ['-created_at']
+        indexes = [
+            # Ordini completati filtrati e ordinati per data di completamento
+            models.Index(fields=['status', 'completed_at'], name='workorder_status_completed_idx'),
+        ]
 
 # Modello per i singoli File di Stampa (.gcode)
 class PrintFile(models.Model):
@@ -622,6 +659,30 @@ class PrintFile(models.Model):
     queue_position = models.PositiveIntegerField(default=0, verbose_name="Posizione in Coda")
     produced_quantity = models.PositiveIntegerField(default=1, verbose_name="Oggetti per Stampa")
     actual_quantity = models.PositiveIntegerField(default=0, verbose_name="Oggetti Stampati Effettivi")
+    started_at = models.DateTimeField(null=True, blank=True, verbose_name="Inizio Stampa")
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Stato letto dal DB: serve ai segnali per capire se il registro bobine va aggiornato
+        instance._loaded_status = instance.__dict__.get('status')
+        instance._loaded_created_at = instance.__dict__.get('created_at')
+        instance._loaded_rollup = instance.rollup_values()
+        return instance
+
+    # Campi copiati negli aggregati statistici (PrintStatsRollup)
+    ROLLUP_FIELDS = ('status', 'printer_id', 'print_time_seconds', 'created_at')
+
+    def rollup_values(self):
+        return tuple(self.__dict__.get(name) for name in self.ROLLUP_FIELDS)
+
+    def save(self, *args, **kwargs):
+        # L'inizio stampa serve allo scheduler per stimare la fine del file in corso
+        if self.status == self.Status.PRINTING:
+            restarted = getattr(self, '_loaded_status', self.status) != self.Status.PRINTING
+            if self.started_at is None or restarted:
+                self.started_at = timezone.now()
+        super().save(*args, **kwargs)
 
     @property
     def print_time_formatted(self):
@@ -641,11 +702,7 @@ class PrintFile(models.Model):
         if not self.print_time_seconds or not self.printer or self.printer.power_consumption <= 0:
             return Decimal('0.00')
 
-        cost_setting, _ = GlobalSetting.objects.get_or_create(
-            key='electricity_cost_kwh',
-            defaults={'value': Decimal('0.25')}
-        )
-        cost_kwh = cost_setting.value
+        cost_kwh = get_cost_settings().electricity_cost_kwh
 
         hours = Decimal(self.print_time_seconds) / Decimal(3600)
         kwh_used = (Decimal(self.printer.power_consumption) * hours) / Decimal(1000)
@@ -656,11 +713,7 @@ class PrintFile(models.Model):
         if not self.print_time_seconds:
             return Decimal('0.00')
 
-        wear_setting, _ = GlobalSetting.objects.get_or_create(
-            key='wear_tear_coefficient',
-            defaults={'value': Decimal('0.10')}
-        )
-        wear_cost_per_hour = wear_setting.value
+        wear_cost_per_hour = get_cost_settings().wear_tear_coefficient
 
         hours = Decimal(self.print_time_seconds) / Decimal(3600)
         return (hours * wear_cost_per_hour)
@@ -671,7 +724,8 @@ class PrintFile(models.Model):
 
     @property
     def total_grams_used(self):
-        return self.filament_usages.aggregate(total=Sum('grams_used'))['total'] or 0
+        # Come material_cost legge filament_usages.all(): usa i consumi già precaricati dalla vista
+        return sum(usage.grams_used for usage in self.filament_usages.all()) or 0
 
     @property
     def filament_types_summary(self):
@@ -687,12 +741,120 @@ class PrintFile(models.Model):
         verbose_name = "File di Stampa"
         verbose_name_plural = "File di Stampa"
         ordering = ['queue_position']
+        indexes = [
+            models.Index(fields=['status'], name='printfile_status_idx'),
+            # Coda di una stampante già nell'ordine della bacheca
+            models.Index(fields=['printer', 'status', 'queue_position'], name='printfile_printer_queue_idx'),
+        ]
+
+# Aggregati giornalieri per le statistiche (stampante × materiale × stato)
+class PrintStatsRollup(models.Model):
+    """
+    Una riga con material vuoto riassume i file di stampa del giorno (numero, secondi, watt·secondi);
+    le righe con il materiale valorizzato riportano grammi e costo del filamento consumato.
+    Le righe vengono ricalcolate per giorno intero ogni volta che un file o un consumo cambia.
+    """
+    day = models.DateField(db_index=True, verbose_name="Giorno")
+    printer = models.ForeignKey(Printer, on_delete=models.SET_NULL, null=True, blank=True, related_name='stats_rollups', verbose_name="Stampante")
+    status = models.CharField(max_length=10, choices=PrintFile.Status.choices, verbose_name="Status Stampa")
+    material = models.CharField(max_length=10, blank=True, verbose_name="Materiale")
+    file_count = models.PositiveIntegerField(default=0, verbose_name="File di Stampa")
+    print_seconds = models.PositiveBigIntegerField(default=0, verbose_name="Secondi di Stampa")
+    watt_seconds = models.PositiveBigIntegerField(default=0, verbose_name="Watt·Secondi")
+    grams = models.DecimalField(max_digits=14, decimal_places=2, default=0.00, verbose_name="Grammi")
+    material_cost = models.DecimalField(max_digits=14, decimal_places=4, default=0.00, verbose_name="Costo Materiale")
+
+    @classmethod
+    def compute(cls, days=None):
+        """
+        Calcola le righe aggregate dai file di stampa e dai consumi reali.
+        Con days=None considera tutto lo storico; restituisce una lista di righe non salvate.
+        """
+        print_files = PrintFile.objects.all()
+        usages = FilamentUsage.objects.all()
+        if days is not None:
+            print_files = print_files.filter(created_at__date__in=days)
+            usages = usages.filter(print_file__created_at__date__in=days)
+
+        rows = []
+        file_totals = print_files.annotate(day=TruncDate('created_at')).values('day', 'printer_id', 'status').annotate(
+            files=Count('id'),
+            seconds=Sum('print_time_seconds'),
+            watts=Sum(F('print_time_seconds') * F('printer__power_consumption'), filter=Q(printer__power_consumption__gt=0)),
+        ).order_by()
+        for row in file_totals:
+            rows.append(cls(
+                day=row['day'], printer_id=row['printer_id'], status=row['status'],
+                file_count=row['files'], print_seconds=row['seconds'] or 0, watt_seconds=row['watts'] or 0,
+            ))
+
+        # Costo al grammo calcolato in virgola mobile: su SQLite i decimali interi verrebbero divisi come interi
+        unit_cost = Cast('spool__cost', FloatField()) / Cast('spool__initial_weight_g', FloatField())
+        usage_totals = usages.annotate(day=TruncDate('print_file__created_at')).values(
+            'day', 'print_file__printer_id', 'print_file__status', 'spool__filament__material'
+        ).annotate(
+            total_grams=Sum('grams_used'),
+            cost=Sum(Cast('grams_used', FloatField()) * unit_cost, filter=Q(spool__initial_weight_g__gt=0), output_field=FloatField()),
+        ).order_by()
+        for row in usage_totals:
+            rows.append(cls(
+                day=row['day'], printer_id=row['print_file__printer_id'], status=row['print_file__status'],
+                material=row['spool__filament__material'],
+                grams=Decimal(str(row['total_grams'] or 0)).quantize(Decimal('0.01')),
+                material_cost=Decimal(str(row['cost'] or 0)).quantize(Decimal('0.0001')),
+            ))
+        return rows
+
+    @classmethod
+    def refresh_days(cls, days):
+        """Ricalcola e sostituisce le righe dei giorni indicati (due aggregazioni, un delete e un insert)."""
+        days = {day for day in days if day}
+        if not days:
+            return []
+        rows = cls.compute(days)
+        cls.objects.filter(day__in=days).delete()
+        cls.objects.bulk_create(rows)
+        return rows
+
+    @classmethod
+    def refresh_for_print_files(cls, print_files):
+        """Ricalcola i giorni toccati da un queryset di PrintFile (da chiamare dopo update())."""
+        return cls.refresh_days(print_files.dates('created_at', 'day'))
+
+    @staticmethod
+    def day_of(moment):
+        """Giorno locale in cui ricade una data/ora, come per TruncDate."""
+        return timezone.localtime(moment).date() if timezone.is_aware(moment) else moment.date()
+
+    def __str__(self):
+        return f"{self.day} {self.printer_id or '-'} {self.status} {self.material or 'file'}"
+
+    class Meta:
+        verbose_name = "Aggregato Statistiche"
+        verbose_name_plural = "Aggregati Statistiche"
 
 # Modello per i Metodi di Pagamento
 class PaymentMethod(models.Model):
     name = models.CharField(max_length=100, unique=True, verbose_name="Nome Metodo")
+    # Valore in cache: la fonte è il registro BalanceMovement (vedi ledger.py)
     balance = models.DecimalField(max_digits=10, decimal_places=2, default=0.00, verbose_name="Saldo Attuale")
 
+    def save(self, *args, **kwargs):
+        """
+        Un saldo impostato a mano (creazione, correzione, admin) diventa un movimento di apertura o di
+        correzione, così il registro resta completo. I movimenti di ledger.py aggiornano il saldo con
+        update() e non passano da qui.
+        """
+        previous = None
+        if self.pk:
+            previous = PaymentMethod.objects.filter(pk=self.pk).values_list('balance', flat=True).first()
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            delta = Decimal(str(self.balance)) - (previous if previous is not None else Decimal('0.00'))
+            if delta:
+                kind = BalanceMovement.Kind.CORRECTION if previous is not None else BalanceMovement.Kind.OPENING
+                BalanceMovement.append(self, delta, kind, description=kind.label)
+
     def __str__(self):
         return self.name
 
@@ -700,6 +862,78 @@ class PaymentMethod(models.Model):
         verbose_name = "Metodo di Pagamento"
         verbose_name_plural = "Metodi di Pagamento"
 
+
+class BalanceMovement(models.Model):
+    """
+    Registro append-only dei movimenti di saldo: le righe non si modificano né si cancellano, un errore
+    si corregge con un movimento di storno. Il saldo a una data è la somma dei movimenti con
+    occurred_on fino a quella data (a partire dall'ultimo BalanceSnapshot).
+    """
+    class Kind(models.TextChoices):
+        OPENING = 'OPENING', 'Saldo iniziale'
+        SALE = 'SALE', 'Vendita'
+        EXPENSE = 'EXPENSE', 'Spesa'
+        REVERSAL = 'REVERSAL', 'Storno'
+        TRANSFER = 'TRANSFER', 'Trasferimento'
+        CORRECTION = 'CORRECTION', 'Correzione saldo'
+
+    payment_method = models.ForeignKey(PaymentMethod, on_delete=models.CASCADE, related_name='movements', verbose_name="Metodo di Pagamento")
+    kind = models.CharField(max_length=10, choices=Kind.choices, verbose_name="Tipo")
+    amount = models.DecimalField(max_digits=12, decimal_places=2, verbose_name="Importo (€)")
+    # Data contabile (vendita, spesa...); created_at è il momento della registrazione
+    occurred_on = models.DateField(default=timezone.localdate, verbose_name="Data")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Registrato il")
+    description = models.CharField(max_length=255, blank=True, verbose_name="Descrizione")
+    expense = models.ForeignKey('Expense', on_delete=models.SET_NULL, null=True, blank=True, related_name='movements', verbose_name="Spesa")
+    stock_item = models.ForeignKey('StockItem', on_delete=models.SET_NULL, null=True, blank=True, related_name='movements', verbose_name="Vendita")
+    # Le due righe di un trasferimento condividono lo stesso identificativo
+    transfer_id = models.UUIDField(null=True, blank=True, verbose_name="Trasferimento")
+
+    @classmethod
+    def append(cls, payment_method, amount, kind, occurred_on=None, **fields):
+        """
+        Aggiunge un movimento senza toccare il saldo in cache e invalida le istantanee dei periodi che
+        lo comprendono (un movimento retrodatato cambia i saldi di fine periodo successivi).
+        """
+        movement = cls.objects.create(
+            payment_method=payment_method, amount=amount, kind=kind,
+            occurred_on=occurred_on or timezone.localdate(), **fields
+        )
+        BalanceSnapshot.objects.filter(payment_method=payment_method, period_end__gte=movement.occurred_on).delete()
+        return movement
+
+    def save(self, *args, **kwargs):
+        if self.pk:
+            raise ValueError("I movimenti di saldo non si modificano: registrare uno storno.")
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return f"{self.payment_method} {self.occurred_on}: {self.amount:+}€ ({self.get_kind_display()})"
+
+    class Meta:
+        verbose_name = "Movimento di Saldo"
+        verbose_name_plural = "Movimenti di Saldo"
+        ordering = ['occurred_on', 'id']
+        indexes = [
+            # Saldo a una data: somma per metodo su un intervallo di date
+            models.Index(fields=['payment_method', 'occurred_on'], name='movement_method_date_idx'),
+        ]
+
+
+class BalanceSnapshot(models.Model):
+    """Saldo di un metodo di pagamento a fine periodo (mese), calcolato dal registro e riusato."""
+    payment_method = models.ForeignKey(PaymentMethod, on_delete=models.CASCADE, related_name='snapshots', verbose_name="Metodo di Pagamento")
+    period_end = models.DateField(verbose_name="Fine Periodo")
+    balance = models.DecimalField(max_digits=12, decimal_places=2, verbose_name="Saldo")
+
+    def __str__(self):
+        return f"{self.payment_method} al {self.period_end}: {self.balance}€"
+
+    class Meta:
+        verbose_name = "Istantanea Saldo"
+        verbose_name_plural = "Istantanee Saldi"
+        unique_together = ('payment_method', 'period_end')
+
 class StockItemQuerySet(models.QuerySet):
     def with_net_values(self):
         """
@@ -763,6 +997,14 @@ class StockItem(models.Model):
     locked_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True, related_name='locked_stock')
     locked_at = models.DateTimeField(null=True, blank=True)
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Stato e data di vendita letti dal DB: servono ai segnali per aggiornare i riepiloghi contabili
+        instance._loaded_status = instance.__dict__.get('status')
+        instance._loaded_sold_at = instance.__dict__.get('sold_at')
+        return instance
+
     def is_locked(self, user=None):
         if not self.locked_by or not self.locked_at:
             return False
@@ -774,7 +1016,11 @@ class StockItem(models.Model):
 
     def save(self, *args, **kwargs):
         super().save(*args, **kwargs)
-        bump_global_version()
+        if self.status == self.Status.SOLD:
+            # Le vendite incidono anche su saldi e riepiloghi contabili
+            changefeed.bump_domain_versions(changefeed.STOCK, changefeed.ACCOUNTING)
+        else:
+            changefeed.bump_domain_versions(changefeed.STOCK)
 
     objects = StockItemQuerySet.as_manager()
 
@@ -818,6 +1064,11 @@ class StockItem(models.Model):
         verbose_name = "Oggetto a Magazzino"
         verbose_name_plural = "Oggetti a Magazzino"
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'sold_at'], name='stockitem_status_sold_idx'),
+            # Ricerca dell'oggetto POST_PROD da incrementare alla chiusura di un ordine
+            models.Index(fields=['work_order', 'name', 'status'], name='stockitem_wo_name_status_idx'),
+        ]
 
 
 class ExpenseCategory(models.Model):
@@ -841,10 +1092,146 @@ class Expense(models.Model):
     def __str__(self):
         return f"{self.description} - {self.amount}€"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_expense_date = instance.__dict__.get('expense_date')
+        return instance
+
     class Meta:
         verbose_name = "Spesa"
         verbose_name_plural = "Spese"
         ordering = ['-expense_date']
+        indexes = [
+            models.Index(fields=['expense_date'], name='expense_date_idx'),
+        ]
+
+
+class AccountingPeriod(models.Model):
+    """Mese contabile chiuso: i suoi riepiloghi (AccountingSummary) non vengono più ricalcolati."""
+    month = models.DateField(unique=True, verbose_name="Mese")
+    closed_at = models.DateTimeField(auto_now_add=True, verbose_name="Chiuso il")
+
+    @staticmethod
+    def month_of(day):
+        return day.replace(day=1) if day else None
+
+    @classmethod
+    def closed_months(cls, months=None):
+        periods = cls.objects.all()
+        if months is not None:
+            periods = periods.filter(month__in=[month for month in months if month])
+        return set(periods.values_list('month', flat=True))
+
+    def __str__(self):
+        return f"{self.month:%m/%Y} (chiuso)"
+
+    class Meta:
+        verbose_name = "Periodo Contabile Chiuso"
+        verbose_name_plural = "Periodi Contabili Chiusi"
+        ordering = ['-month']
+
+
+class AccountingSummary(models.Model):
+    """
+    Totali contabili per mese × metodo di pagamento × categoria: entrate nette (vendite con metodo di
+    pagamento, per data di vendita) e uscite (spese, per data spesa). Le righe dei mesi aperti vengono
+    ricalcolate per mese intero quando una vendita o una spesa cambia; quelle dei mesi chiusi restano
+    congelate. Un mese nullo raccoglie le vendite senza data.
+    """
+    class Kind(models.TextChoices):
+        INCOME = 'INCOME', 'Entrata'
+        EXPENSE = 'EXPENSE', 'Uscita'
+
+    month = models.DateField(null=True, blank=True, verbose_name="Mese")
+    kind = models.CharField(max_length=7, choices=Kind.choices, verbose_name="Tipo")
+    payment_method = models.ForeignKey(PaymentMethod, on_delete=models.SET_NULL, null=True, blank=True, related_name='accounting_summaries', verbose_name="Metodo di Pagamento")
+    category = models.ForeignKey(ExpenseCategory, on_delete=models.SET_NULL, null=True, blank=True, related_name='accounting_summaries', verbose_name="Categoria")
+    entries = models.PositiveIntegerField(default=0, verbose_name="Movimenti")
+    amount = models.DecimalField(max_digits=14, decimal_places=2, default=0.00, verbose_name="Importo (€)")
+
+    @staticmethod
+    def _months_filter(field, months):
+        months = set(months)
+        query = Q(**{f'{field}__isnull': True}) if None in months else Q()
+        for month in months - {None}:
+            # Intervallo di date invece di __year/__month, così l'indice sulla data resta utilizzabile
+            next_month = (month + datetime.timedelta(days=32)).replace(day=1)
+            query |= Q(**{f'{field}__gte': month, f'{field}__lt': next_month})
+        return query
+
+    @classmethod
+    def compute(cls, months=None):
+        """
+        Calcola le righe dai dati reali (vendite e spese). Con months=None considera tutto lo storico;
+        restituisce una lista di righe non salvate.
+        """
+        sales = StockItem.objects.filter(status=StockItem.Status.SOLD, payment_method__isnull=False)
+        expenses = Expense.objects.all()
+        if months is not None:
+            if not months:
+                return []
+            sales = sales.filter(cls._months_filter('sold_at', months))
+            expenses = expenses.filter(cls._months_filter('expense_date', months))
+
+        rows = []
+        income_totals = sales.with_net_values().annotate(month=TruncMonth('sold_at')).values('month', 'payment_method_id').annotate(
+            count=Count('id'), total=Sum('annotated_net_revenue'),
+        ).order_by()
+        for row in income_totals:
+            rows.append(cls(
+                month=row['month'], kind=cls.Kind.INCOME, payment_method_id=row['payment_method_id'],
+                entries=row['count'], amount=Decimal(str(row['total'] or 0)).quantize(Decimal('0.01')),
+            ))
+        expense_totals = expenses.annotate(month=TruncMonth('expense_date')).values('month', 'payment_method_id', 'category_id').annotate(
+            count=Count('id'), total=Sum('amount'),
+        ).order_by()
+        for row in expense_totals:
+            rows.append(cls(
+                month=row['month'], kind=cls.Kind.EXPENSE, payment_method_id=row['payment_method_id'],
+                category_id=row['category_id'], entries=row['count'], amount=row['total'] or Decimal('0.00'),
+            ))
+        return rows
+
+    @classmethod
+    def refresh_months(cls, months):
+        """Ricalcola e sostituisce le righe dei mesi indicati, esclusi quelli chiusi."""
+        months = {AccountingPeriod.month_of(month) for month in months}
+        months -= AccountingPeriod.closed_months(months)
+        if not months:
+            return []
+        rows = cls.compute(months)
+        cls.objects.filter(cls._months_filter('month', months)).delete()
+        cls.objects.bulk_create(rows)
+        return rows
+
+    @classmethod
+    def rebuild(cls):
+        """Ricalcola tutti i mesi aperti (dopo import o bulk_create, che non inviano segnali)."""
+        closed = AccountingPeriod.closed_months()
+        rows = [row for row in cls.compute() if row.month not in closed]
+        cls.objects.exclude(month__in=closed).delete()
+        cls.objects.bulk_create(rows, batch_size=1000)
+        return rows
+
+    @classmethod
+    def close_period(cls, month):
+        """Ricalcola un'ultima volta il mese e lo congela."""
+        month = AccountingPeriod.month_of(month)
+        with transaction.atomic():
+            cls.refresh_months([month])
+            period, _ = AccountingPeriod.objects.get_or_create(month=month)
+        return period
+
+    def __str__(self):
+        return f"{self.month or '-'} {self.get_kind_display()} {self.payment_method_id or '-'}/{self.category_id or '-'}: {self.amount}€"
+
+    class Meta:
+        verbose_name = "Riepilogo Contabile"
+        verbose_name_plural = "Riepiloghi Contabili"
+        indexes = [
+            models.Index(fields=['month', 'kind'], name='accounting_summary_month_idx'),
+        ]
 
 class MaintenanceLog(models.Model):
     printer = models.ForeignKey(Printer, on_delete=models.CASCADE, related_name='maintenance_logs', verbose_name="Stampante")
@@ -868,6 +1255,100 @@ class GlobalSetting(models.Model):
     def __str__(self):
         return self.key
 
+# Contatori di versione per dominio, usati dal feed delle modifiche e dalle risposte 204 di HTMX
+class DomainVersion(models.Model):
+    class Domain(models.TextChoices):
+        WORK_ORDERS = 'work_orders', 'Ordini di Lavoro'
+        PRINT_QUEUE = 'print_queue', 'Coda di Stampa'
+        STOCK = 'stock', 'Magazzino'
+        FILAMENTS = 'filaments', 'Filamenti'
+        ACCOUNTING = 'accounting', 'Contabilità'
+        SETTINGS = 'settings', 'Impostazioni'
+        NOTIFICATIONS = 'notifications', 'Notifiche'
+
+    domain = models.CharField(max_length=20, unique=True, choices=Domain.choices, verbose_name="Dominio")
+    version = models.PositiveBigIntegerField(default=0, verbose_name="Versione")
+
+    def __str__(self):
+        return f"{self.get_domain_display()} v{self.version}"
+
+    class Meta:
+        verbose_name = "Versione Dominio"
+        verbose_name_plural = "Versioni Domini"
+
+class IdSequence(models.Model):
+    """
+    Contatore per (entità, anno) da cui si ricavano gli ID personalizzati (es. 25001).
+    L'incremento è un'unica UPDATE con F()+1 nella transazione del chiamante: due utenti non possono
+    ottenere lo stesso numero e, se la transazione viene annullata, il numero torna disponibile.
+    """
+    class Entity(models.TextChoices):
+        WORK_ORDER = 'work_order', 'Ordine di Lavoro'
+        STOCK_ITEM = 'stock_item', 'Oggetto Magazzino'
+
+    entity = models.CharField(max_length=20, choices=Entity.choices, verbose_name="Entità")
+    year = models.PositiveSmallIntegerField(verbose_name="Anno")
+    last_value = models.PositiveIntegerField(default=0, verbose_name="Ultimo Valore")
+
+    @classmethod
+    def next_value(cls, entity, year, seed=None):
+        """
+        Incrementa e restituisce il contatore. Se non esiste ancora viene creato partendo da seed()
+        (l'ultimo valore già usato); in caso di creazione concorrente si ripete l'incremento.
+        """
+        with transaction.atomic():
+            sequence = cls.objects.filter(entity=entity, year=year)
+            if not sequence.update(last_value=F('last_value') + 1):
+                try:
+                    with transaction.atomic():
+                        created = cls.objects.create(entity=entity, year=year, last_value=(seed() if seed else 0) + 1)
+                    return created.last_value
+                except IntegrityError:
+                    sequence.update(last_value=F('last_value') + 1)
+            return sequence.values_list('last_value', flat=True).get()
+
+    @classmethod
+    def fast_forward(cls, entity, year, value):
+        """Porta il contatore almeno a value (mai indietro)."""
+        cls.objects.filter(entity=entity, year=year, last_value__lt=value).update(last_value=value)
+
+    def __str__(self):
+        return f"{self.get_entity_display()} {self.year}: {self.last_value}"
+
+    class Meta:
+        unique_together = ('entity', 'year')
+        verbose_name = "Sequenza ID"
+        verbose_name_plural = "Sequenze ID"
+
+class SearchEntry(models.Model):
+    """
+    Documento dell'indice di ricerca full-text: una riga per ordine, progetto master, oggetto di
+    magazzino, vendita o spesa. keywords e body contengono il testo già normalizzato (vedi search.py);
+    l'indice vero e proprio (tabella FTS5 su SQLite, colonna tsvector su PostgreSQL) viene creato
+    dalla migrazione e segue questa tabella.
+    """
+    class Kind(models.TextChoices):
+        WORK_ORDER = 'work_order', 'Ordine di Lavoro'
+        PROJECT = 'project', 'Progetto Master'
+        STOCK_ITEM = 'stock_item', 'Magazzino'
+        SALE = 'sale', 'Vendita'
+        EXPENSE = 'expense', 'Spesa'
+
+    kind = models.CharField(max_length=20, choices=Kind.choices, verbose_name="Tipo")
+    object_id = models.PositiveBigIntegerField(verbose_name="ID Oggetto")
+    title = models.CharField(max_length=255, verbose_name="Titolo")
+    subtitle = models.CharField(max_length=255, blank=True, verbose_name="Dettaglio")
+    keywords = models.TextField(blank=True, verbose_name="Parole Chiave")
+    body = models.TextField(blank=True, verbose_name="Testo")
+
+    def __str__(self):
+        return f"{self.get_kind_display()}: {self.title}"
+
+    class Meta:
+        unique_together = ('kind', 'object_id')
+        verbose_name = "Voce Indice Ricerca"
+        verbose_name_plural = "Voci Indice Ricerca"
+
 class Quote(models.Model):
     name = models.CharField(max_length=255, verbose_name="Nome Preventivo")
     total_cost = models.DecimalField(max_digits=10, decimal_places=2, verbose_name="Costo Totale")
@@ -906,19 +1387,28 @@ class RawMaterial(models.Model):
     name = models.CharField(max_length=200, unique=True, verbose_name="Nome Materia Prima")
     notes = models.TextField(blank=True, verbose_name="Note")
 
+    objects = RawMaterialQuerySet.as_manager()
+
     def __str__(self):
         return self.name
 
+    # Le property usano i valori di RawMaterialQuerySet.with_stock_totals() se presenti
     @property
     def total_purchased(self):
+        if hasattr(self, 'annotated_total_purchased'):
+            return self.annotated_total_purchased
         return self.purchases.aggregate(total=Sum('quantity'))['total'] or 0
 
     @property
     def total_used(self):
+        if hasattr(self, 'annotated_total_used'):
+            return self.annotated_total_used
         return self.work_order_usages.filter(work_order__status='DONE').aggregate(total=Sum('quantity'))['total'] or 0
 
     @property
     def total_pending(self):
+        if hasattr(self, 'annotated_total_pending'):
+            return self.annotated_total_pending
         return self.work_order_usages.filter(work_order__status__in=['TODO', 'PRINTING', 'PRINTED']).aggregate(total=Sum('quantity'))['total'] or 0
 
     @property
@@ -933,10 +1423,13 @@ class RawMaterial(models.Model):
 
     @property
     def average_unit_cost(self):
-        total_qty = self.purchases.aggregate(total=Sum('quantity'))['total'] or 0
+        total_qty = self.total_purchased
         if total_qty == 0:
             return Decimal('0.00')
-        total_cost = self.purchases.aggregate(total=Sum('cost'))['total'] or Decimal('0.00')
+        if hasattr(self, 'annotated_total_cost'):
+            total_cost = self.annotated_total_cost
+        else:
+            total_cost = self.purchases.aggregate(total=Sum('cost'))['total'] or Decimal('0.00')
         return (total_cost / Decimal(total_qty)).quantize(Decimal('0.01'))
 
     class Meta:
@@ -0,0 +1,168 @@
+"""
+Paginazione keyset (seek) per gli elenchi lunghi: vendite, magazzino, contabilità e ordini attivi.
+
+Invece di OFFSET, che obbliga il database a scorrere tutte le righe delle pagine precedenti, la
+pagina successiva parte dai valori delle colonne di ordinamento dell'ultima riga mostrata, più l'id
+come spareggio: ogni pagina costa lo stesso anche in fondo a uno storico lungo. I valori viaggiano in
+un cursore opaco nella query string; il client lo richiede con HTMX quando l'ultima riga diventa
+visibile (scroll infinito, come per gli ordini completati).
+
+I NULL stanno sempre in fondo, in entrambe le direzioni, così l'ordine è lo stesso su ogni database.
+I totali degli elenchi vanno calcolati a parte sul queryset filtrato, non sulla pagina.
+"""
+import base64
+import json
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import DecimalField, F, Q
+from django.db.models.functions import Round
+
+PAGE_SIZE = 50
+CURSOR_PARAM = 'after'
+# Cifre decimali delle annotazioni monetarie senza decimal_places esplicito
+MONEY_PLACES = 2
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def _keys(ordering):
+    """[(campo, discendente)] con l'id in coda come spareggio, nella direzione dell'ultimo campo."""
+    keys = [(name.lstrip('-'), name.startswith('-')) for name in ordering]
+    if not any(name in ('id', 'pk') for name, _ in keys):
+        keys.append(('id', keys[-1][1] if keys else False))
+    return keys
+
+
+def _value(obj, name):
+    # Campi correlati (category__name) seguiti attributo per attributo; annotazioni lette direttamente
+    for part in name.split('__'):
+        if obj is None:
+            return None
+        obj = getattr(obj, part if part != 'pk' else 'pk')
+    return obj
+
+
+def encode_cursor(values):
+    raw = json.dumps(values, cls=DjangoJSONEncoder, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(queryset, keys, cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        values = json.loads(raw)
+    except (ValueError, TypeError):
+        raise InvalidCursor(cursor)
+    if not isinstance(values, list) or len(values) != len(keys):
+        raise InvalidCursor(cursor)
+    query = queryset.query.clone()
+    decoded = []
+    for (name, _), value in zip(keys, values):
+        if value is None:
+            decoded.append(None)
+            continue
+        # Stesso tipo della colonna (date, decimali...): il confronto avviene sul valore, non sul testo
+        field = query.resolve_ref(name, allow_joins=True).output_field
+        try:
+            decoded.append(field.to_python(value))
+        except ValidationError:
+            raise InvalidCursor(cursor)
+    return decoded
+
+
+def seek_filter(keys, values):
+    """Righe successive alla posizione (values) nell'ordinamento keys, con i NULL in fondo."""
+    condition = Q(pk__in=[])
+    equal = Q()
+    for (name, descending), value in zip(keys, values):
+        if value is not None:
+            after = Q(**{f'{name}__lt' if descending else f'{name}__gt': value}) | Q(**{f'{name}__isnull': True})
+            condition |= equal & after
+            equal &= Q(**{name: value})
+        else:
+            # Dopo un NULL vengono solo altri NULL: si prosegue sulle colonne successive
+            equal &= Q(**{f'{name}__isnull': True})
+    return condition
+
+
+class KeysetPage:
+    """Una pagina di righe più il cursore della successiva (None se è l'ultima)."""
+
+    def __init__(self, items, next_cursor, param=CURSOR_PARAM, is_first=True):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.param = param
+        self.is_first = is_first
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __bool__(self):
+        return bool(self.items)
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def next_query(self, params):
+        """Query string della pagina successiva: stessi filtri e ordinamento, senza versione HTMX."""
+        params = params.copy()
+        params.pop('v', None)
+        params[self.param] = self.next_cursor
+        return params.urlencode()
+
+
+def keyset_page(queryset, ordering, cursor=None, page_size=PAGE_SIZE, param=CURSOR_PARAM):
+    """
+    Applica l'ordinamento (nomi di campo o annotazione, '-' per discendente) e restituisce la pagina
+    che segue il cursore. Un cursore non valido riparte dalla prima pagina.
+    """
+    keys = _keys(ordering)
+    rounded = {}
+    for index, (name, descending) in enumerate(keys):
+        annotation = queryset.query.annotations.get(name)
+        if annotation is not None and isinstance(annotation.output_field, DecimalField):
+            # Annotazioni decimali calcolate in virgola mobile (es. commissioni su SQLite): ordinamento,
+            # confronto e cursore usano il valore arrotondato, uguale sul database e in Python
+            places = annotation.output_field.decimal_places
+            places = MONEY_PLACES if places is None else places
+            alias = f'keyset_{name}'
+            queryset = queryset.alias(**{alias: Round(name, places)})
+            keys[index] = (alias, descending)
+            rounded[alias] = (name, Decimal(1).scaleb(-places))
+    queryset = queryset.order_by(*[
+        F(name).desc(nulls_last=True) if descending else F(name).asc(nulls_last=True) for name, descending in keys
+    ])
+    is_first = True
+    if cursor:
+        try:
+            queryset = queryset.filter(seek_filter(keys, decode_cursor(queryset, keys, cursor)))
+            is_first = False
+        except InvalidCursor:
+            pass
+    items = list(queryset[:page_size + 1])
+    next_cursor = None
+    if len(items) > page_size:
+        items = items[:page_size]
+        values = []
+        for name, _ in keys:
+            if name in rounded:
+                source, exponent = rounded[name]
+                value = _value(items[-1], source)
+                values.append(None if value is None else Decimal(value).quantize(exponent, rounding=ROUND_HALF_UP))
+            else:
+                values.append(_value(items[-1], name))
+        next_cursor = encode_cursor(values)
+    return KeysetPage(items, next_cursor, param=param, is_first=is_first)
+
+
+def rows_request(request, page):
+    """True se la richiesta HTMX chiede solo le righe successive di un elenco (scroll infinito)."""
+    return bool(request.headers.get('HX-Request')) and not page.is_first
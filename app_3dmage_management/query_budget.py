@@ -0,0 +1,103 @@
+"""
+Budget di query delle viste principali.
+
+Ogni vista ha un numero massimo di query che non deve dipendere dalla quantità di dati: lo stesso
+budget vale per le scale small, medium e large di load_data, così un N+1 introdotto in una vista
+(o in un filtro di template) lo supera appena i dati crescono. measure_views() misura query e tempo
+di ogni vista con il client di test e restituisce righe pronte per il report JSON; measure_scale()
+genera prima i dati della scala richiesta.
+
+I budget valgono a cache fredde (scheduler, previsioni, costi): è il caso peggiore di ogni richiesta.
+"""
+import time
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from .cost_settings import invalidate_cost_settings
+from .forecasting import invalidate_forecast
+from .load_data import LoadDataGenerator, SCALES
+from .scheduling import invalidate_schedule
+
+
+def _first_id(model, **filters):
+    return model.objects.filter(**filters).order_by('id').values_list('id', flat=True).first()
+
+
+def _project_detail_args():
+    from .models import WorkOrder
+    return [_first_id(WorkOrder, status='DONE') or _first_id(WorkOrder)]
+
+
+def _master_detail_args():
+    from .models import Project
+    return [_first_id(Project)]
+
+
+def _filament_args():
+    from .models import Filament
+    return [_first_id(Filament)]
+
+
+# (nome, url, argomenti, parametri GET, budget di query)
+VIEW_BUDGETS = [
+    ('dashboard_active', 'project_dashboard', None, {'view': 'active'}, 16),
+    ('dashboard_completed', 'project_dashboard', None, {'view': 'completed'}, 18),
+    # Una query (più i prefetch) per ognuna delle quattro colonne
+    ('kanban', 'project_kanban_board', None, {}, 34),
+    ('gantt', 'project_gantt_board', None, {}, 6),
+    ('print_queue', 'print_queue_board', None, {}, 12),
+    ('project_detail', 'project_detail', _project_detail_args, {}, 27),
+    ('inventory', 'inventory_dashboard', None, {}, 8),
+    ('sales', 'sales_dashboard', None, {}, 10),
+    ('accounting', 'accounting_dashboard', None, {}, 22),
+    ('statistics', 'statistics_dashboard', None, {}, 15),
+    ('settings', 'settings_dashboard', None, {}, 17),
+    ('filaments', 'filament_dashboard', None, {}, 16),
+    ('raw_materials', 'raw_materials_dashboard', None, {}, 10),
+    ('library', 'projects_library', None, {}, 13),
+    ('master_detail', 'project_master_detail', _master_detail_args, {}, 20),
+    ('filament_spools_api', 'api_get_filament_spools', _filament_args, {}, 6),
+]
+
+
+def measure_views(client, views=None):
+    """Apre ogni vista con il client indicato e ne misura query e tempo."""
+    results = []
+    for name, url_name, args, params, budget in VIEW_BUDGETS:
+        if views and name not in views:
+            continue
+        url = reverse(url_name, args=args() if args else None)
+        invalidate_schedule()
+        invalidate_forecast()
+        invalidate_cost_settings()
+        start = time.perf_counter()
+        # Lo storage con manifest richiede collectstatic: per la misura bastano i file statici semplici
+        with override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage'):
+            with CaptureQueriesContext(connection) as ctx:
+                response = client.get(url, params)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        results.append({
+            'view': name,
+            'url': url,
+            'status': response.status_code,
+            'queries': len(ctx.captured_queries),
+            'budget': budget,
+            'over_budget': len(ctx.captured_queries) > budget,
+            'ms': round(elapsed_ms, 1),
+        })
+    return results
+
+
+def measure_scale(scale, seed=0, views=None):
+    """
+    Genera i dati della scala indicata e misura le viste con un utente di prova.
+    I dati restano nel database: il chiamante esegue tutto in una transazione da annullare.
+    """
+    counts = LoadDataGenerator(seed=seed, **SCALES[scale]).run()
+    client = Client()
+    client.force_login(get_user_model().objects.create_user('query-budget'))
+    return counts, measure_views(client, views)
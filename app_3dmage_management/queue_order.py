@@ -0,0 +1,118 @@
+"""
+Ordinamento della coda di stampa.
+
+Le posizioni in coda sono sparse (multipli di POSITION_GAP): spostare un file significa di norma
+scrivere soltanto la sua riga, con una posizione a metà tra i due vicini. La coda della stampante
+viene rinumerata solo quando tra i vicini non resta spazio. Ogni scrittura è un'unica UPDATE con
+CASE eseguita in transazione, così riordini concorrenti non si mescolano.
+"""
+from django.db import transaction
+from django.db.models import Case, When, Value, IntegerField
+
+from .models import PrintFile, PrintStatsRollup
+
+POSITION_GAP = 1024
+ACTIVE_STATUSES = ['TODO', 'PRINTING']
+
+# Segnaposto: la stampante dei file non va modificata
+UNCHANGED = object()
+
+
+def queue_file_ids(printer_id):
+    """Id dei file attivi nella coda della stampante, nell'ordine mostrato dalla bacheca."""
+    return list(
+        PrintFile.objects.filter(
+            printer_id=printer_id,
+            status__in=ACTIVE_STATUSES,
+            work_order__status__in=ACTIVE_STATUSES
+        ).order_by('queue_position', 'id').values_list('id', flat=True)
+    )
+
+
+def apply_positions(positions, printer_id=UNCHANGED, refresh_rollup=True):
+    """
+    Scrive le posizioni {file_id: posizione} con una sola UPDATE, spostando i file sulla
+    stampante indicata. Restituisce il numero di righe aggiornate.
+    Con refresh_rollup=False gli aggregati statistici restano a carico del chiamante.
+    """
+    if not positions:
+        return 0
+    files = PrintFile.objects.filter(id__in=positions)
+    values = {
+        'queue_position': Case(
+            *[When(id=file_id, then=Value(position)) for file_id, position in positions.items()],
+            output_field=IntegerField()
+        )
+    }
+    moved_days = []
+    if printer_id is not UNCHANGED:
+        values['printer_id'] = printer_id
+        if refresh_rollup:
+            # Cambiare stampante sposta i file tra le righe degli aggregati statistici
+            moved_days = list(files.exclude(printer_id=printer_id).dates('created_at', 'day'))
+
+    updated = files.update(**values)
+    PrintStatsRollup.refresh_days(moved_days)
+    return updated
+
+
+@transaction.atomic
+def reorder_queue(printer_id, file_ids):
+    """
+    Applica l'ordine completo di una coda. Se le posizioni attuali rispettano già l'ordine
+    vengono scritti solo i file da spostare di stampante, altrimenti la coda viene rinumerata.
+    """
+    current = {
+        file_id: (position, current_printer_id)
+        for file_id, position, current_printer_id in PrintFile.objects.select_for_update()
+        .filter(id__in=file_ids).values_list('id', 'queue_position', 'printer_id')
+    }
+    file_ids = [file_id for file_id in file_ids if file_id in current]
+
+    ordered = [current[file_id][0] for file_id in file_ids]
+    if all(low < high for low, high in zip(ordered, ordered[1:])):
+        positions = {file_id: current[file_id][0] for file_id in file_ids if current[file_id][1] != printer_id}
+    else:
+        positions = {
+            file_id: (index + 1) * POSITION_GAP
+            for index, file_id in enumerate(file_ids)
+            if current[file_id] != ((index + 1) * POSITION_GAP, printer_id)
+        }
+    return apply_positions(positions, printer_id)
+
+
+def _position_between(low, high):
+    """Posizione libera strettamente compresa tra due vicini (None se non c'è spazio)."""
+    if low is None and high is None:
+        return POSITION_GAP
+    if low is None:
+        return high // 2 if high > 0 else None
+    if high is None:
+        return low + POSITION_GAP
+    return (low + high) // 2 if high - low > 1 else None
+
+
+@transaction.atomic
+def move_in_queue(file_id, printer_id, after_id=None, before_id=None):
+    """
+    Sposta un file nella coda della stampante, dopo after_id e/o prima di before_id.
+    Di norma aggiorna una sola riga; se i vicini sono contigui rinumera la coda.
+    """
+    neighbours = dict(
+        PrintFile.objects.select_for_update()
+        .filter(id__in=[neighbour for neighbour in (after_id, before_id) if neighbour])
+        .values_list('id', 'queue_position')
+    )
+    position = _position_between(neighbours.get(after_id), neighbours.get(before_id))
+    if position is not None:
+        return apply_positions({file_id: position}, printer_id)
+
+    file_ids = [queued_id for queued_id in queue_file_ids(printer_id) if queued_id != file_id]
+    if after_id in file_ids:
+        index = file_ids.index(after_id) + 1
+    elif before_id in file_ids:
+        index = file_ids.index(before_id)
+    else:
+        index = len(file_ids)
+    file_ids.insert(index, file_id)
+    return reorder_queue(printer_id, file_ids)
@@ -0,0 +1,135 @@
+"""
+Scheduler predittivo della coda di stampa.
+
+Simula la coda di ogni stampante (prima il file in stampa, poi i file da stampare in ordine di
+queue_position) e stima inizio e fine di ogni PrintFile e il completamento di ogni WorkOrder
+attivo, segnalando gli ordini che non rispetteranno la data di consegna.
+
+Il calcolo è un unico passaggio su tutti i file attivi. Il risultato viene riutilizzato finché le
+versioni di coda e ordini non cambiano, e comunque al massimo per SCHEDULE_TTL secondi, perché le
+stime dipendono dall'ora corrente.
+"""
+import datetime
+import threading
+import time
+from collections import namedtuple
+
+from django.utils import timezone
+
+from . import changefeed
+
+ACTIVE_STATUSES = ['TODO', 'PRINTING']
+SCHEDULE_DOMAINS = (changefeed.PRINT_QUEUE, changefeed.WORK_ORDERS)
+SCHEDULE_TTL = 60
+
+FileEta = namedtuple('FileEta', ['printer_id', 'start', 'finish'])
+OrderEta = namedtuple('OrderEta', ['finish', 'delivery_date', 'is_late', 'unscheduled_files'])
+
+_lock = threading.Lock()
+_cache = {'schedule': None, 'version': None, 'built_at': 0.0}
+
+
+class Schedule:
+    """Stime calcolate in un certo istante: file, ordini e fine coda di ogni stampante."""
+
+    def __init__(self, now):
+        self.now = now
+        self.files = {}
+        self.orders = {}
+        self.printers = {}
+
+    def file(self, file_id):
+        return self.files.get(file_id)
+
+    def order(self, work_order_id):
+        return self.orders.get(work_order_id)
+
+    def printer_finish(self, printer_id):
+        """Istante in cui la stampante avrà svuotato la coda (adesso, se è libera)."""
+        return self.printers.get(printer_id, self.now)
+
+    @property
+    def late_orders(self):
+        return [work_order_id for work_order_id, eta in self.orders.items() if eta.is_late]
+
+
+def build_schedule(now=None):
+    """Simula le code di tutte le stampanti con una sola query sui file attivi."""
+    from .models import PrintFile
+    now = now or timezone.now()
+    schedule = Schedule(now)
+
+    rows = PrintFile.objects.filter(
+        status__in=ACTIVE_STATUSES,
+        work_order__status__in=ACTIVE_STATUSES
+    ).values_list(
+        'id', 'work_order_id', 'printer_id', 'status', 'queue_position', 'print_time_seconds',
+        'started_at', 'work_order__delivery_date'
+    )
+
+    queues = {}
+    orders = {}
+    for row in rows:
+        file_id, work_order_id, printer_id = row[:3]
+        order = orders.setdefault(work_order_id, {'delivery_date': row[7], 'finish': None, 'unscheduled': 0})
+        if printer_id is None:
+            # Senza stampante il file non è in nessuna coda: il completamento dell'ordine resta indefinito
+            order['unscheduled'] += 1
+            continue
+        queues.setdefault(printer_id, []).append(row)
+
+    for printer_id, queue in queues.items():
+        # Il file in stampa precede tutti quelli in coda
+        queue.sort(key=lambda row: (row[3] != 'PRINTING', row[4], row[0]))
+        cursor = now
+        for file_id, work_order_id, _, status, _, seconds, started_at, _ in queue:
+            duration = datetime.timedelta(seconds=seconds)
+            if status == 'PRINTING':
+                start = started_at or now
+                # Una stampa oltre il tempo stimato si considera in chiusura adesso
+                finish = max(start + duration, cursor)
+            else:
+                start = cursor
+                finish = start + duration
+            cursor = finish
+            schedule.files[file_id] = FileEta(printer_id, start, finish)
+
+            order = orders[work_order_id]
+            if order['finish'] is None or finish > order['finish']:
+                order['finish'] = finish
+        schedule.printers[printer_id] = cursor
+
+    today = timezone.localdate(now)
+    for work_order_id, order in orders.items():
+        finish = order['finish'] if not order['unscheduled'] else None
+        delivery_date = order['delivery_date']
+        finish_date = timezone.localdate(finish) if finish else today
+        schedule.orders[work_order_id] = OrderEta(
+            finish=finish,
+            delivery_date=delivery_date,
+            is_late=delivery_date is not None and finish_date > delivery_date,
+            unscheduled_files=order['unscheduled'],
+        )
+    return schedule
+
+
+def get_schedule():
+    """Restituisce le stime correnti, ricalcolandole solo se coda o ordini sono cambiati."""
+    versions = changefeed.get_domain_versions(SCHEDULE_DOMAINS)
+    version = tuple(versions[domain] for domain in SCHEDULE_DOMAINS)
+    now = time.monotonic()
+    with _lock:
+        schedule = _cache['schedule']
+        if schedule is not None and _cache['version'] == version and now - _cache['built_at'] < SCHEDULE_TTL:
+            return schedule
+
+    schedule = build_schedule()
+    with _lock:
+        _cache.update(schedule=schedule, version=version, built_at=now)
+    return schedule
+
+
+def invalidate_schedule():
+    """Svuota la cache: la prossima lettura ricalcola le stime."""
+    with _lock:
+        _cache.update(schedule=None, version=None, built_at=0.0)
@@ -0,0 +1,250 @@
+"""
+Ricerca full-text su ordini di lavoro, progetti master, oggetti di magazzino, vendite e spese.
+
+Ogni oggetto ha una riga SearchEntry con il testo già normalizzato: minuscolo, senza accenti e con
+in più la radice delle parole italiane (vaso/vasi -> vas), così "citta" trova "Città" e "vasi" trova
+"Vaso". Le parole della ricerca valgono anche come prefisso ("lamp" trova "Lampada"), tutte devono
+comparire. L'indice vero e proprio dipende dal database:
+
+- SQLite: tabella virtuale FTS5 collegata a SearchEntry da trigger, ranking bm25;
+- PostgreSQL: colonna tsvector generata con indice GIN, ranking ts_rank;
+- altri database: LIKE sul testo normalizzato, senza ranking.
+
+Le righe seguono gli oggetti tramite i segnali di salvataggio ed eliminazione; dopo import o
+bulk_create (che non inviano segnali) si ricostruiscono con rebuild() o il comando rebuild_search_index.
+"""
+import re
+import unicodedata
+from decimal import Decimal
+from urllib.parse import urlencode
+
+from django.db import connection, transaction
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+from django.urls import reverse
+
+from .models import Expense, Project, SearchEntry, StockItem, WorkOrder
+
+Kind = SearchEntry.Kind
+ENTRY_TABLE = SearchEntry._meta.db_table
+FTS_TABLE = f'{ENTRY_TABLE}_fts'
+TS_CONFIG = 'simple'
+# Peso di nome e ID rispetto al testo libero (note) nel ranking
+KEYWORDS_WEIGHT = 10.0
+RESULTS_LIMIT = 50
+
+WORD_RE = re.compile(r'[^\W_]+')
+VOWELS = 'aeiou'
+
+# Tipi di voce che ogni modello può produrre e campi che ne cambiano il contenuto
+SOURCES = {
+    WorkOrder: ([Kind.WORK_ORDER], {'custom_id', 'name', 'notes', 'status'}),
+    Project: ([Kind.PROJECT], {'name', 'notes', 'dimensions', 'category'}),
+    StockItem: ([Kind.STOCK_ITEM, Kind.SALE], {'custom_id', 'name', 'notes', 'sold_to', 'status', 'sold_at'}),
+    Expense: ([Kind.EXPENSE], {'description', 'notes', 'expense_date', 'amount'}),
+}
+
+
+def normalize(text):
+    """Minuscolo e senza accenti: 'Però Città' -> 'pero citta'."""
+    text = unicodedata.normalize('NFKD', str(text or '')).casefold()
+    return ''.join(char for char in text if not unicodedata.combining(char))
+
+
+def stem(word):
+    """
+    Radice minima di una parola italiana: senza vocale finale (e senza la h di -chi/-ghe), così
+    singolare e plurale coincidono. vaso/vasi -> vas, bianco/bianchi -> bianc, lampada/lampade -> lampad.
+    """
+    if len(word) < 4 or not word.isalpha() or word[-1] not in VOWELS:
+        return word
+    word = word[:-1]
+    if word.endswith(('ch', 'gh')):
+        word = word[:-1]
+    return word
+
+
+def words(text):
+    return WORD_RE.findall(normalize(text))
+
+
+def index_text(*parts):
+    """Testo da indicizzare: le parole normalizzate seguite dalle radici diverse dalla parola."""
+    tokens = [word for part in parts for word in words(part)]
+    return ' '.join(tokens + [stem(word) for word in tokens if stem(word) != word])
+
+
+def terms(query):
+    """[(parola, radice)] della ricerca; una parola corrisponde come prefisso o tramite la radice."""
+    return [(word, stem(word)) for word in words(query)]
+
+
+# --- Documenti ---
+
+def build_entry(instance):
+    """Riga SearchEntry (non salvata) che descrive l'oggetto."""
+    if isinstance(instance, WorkOrder):
+        return SearchEntry(
+            kind=Kind.WORK_ORDER, object_id=instance.pk, title=instance.name,
+            subtitle=f"#{instance.custom_id or instance.pk} · {instance.get_status_display()}",
+            keywords=index_text(instance.custom_id, instance.name), body=index_text(instance.notes),
+        )
+    if isinstance(instance, Project):
+        return SearchEntry(
+            kind=Kind.PROJECT, object_id=instance.pk, title=instance.name,
+            subtitle=instance.category.name if instance.category_id else '',
+            keywords=index_text(instance.name), body=index_text(instance.notes, instance.dimensions),
+        )
+    if isinstance(instance, StockItem):
+        if instance.status == StockItem.Status.SOLD:
+            sold_at = instance.sold_at.strftime('%d/%m/%Y') if instance.sold_at else 'senza data'
+            kind, subtitle = Kind.SALE, ' · '.join(filter(None, [sold_at, instance.sold_to]))
+        else:
+            kind, subtitle = Kind.STOCK_ITEM, f"#{instance.custom_id or instance.pk} · {instance.get_status_display()}"
+        return SearchEntry(
+            kind=kind, object_id=instance.pk, title=instance.name, subtitle=subtitle,
+            keywords=index_text(instance.custom_id, instance.name), body=index_text(instance.notes, instance.sold_to),
+        )
+    if isinstance(instance, Expense):
+        return SearchEntry(
+            kind=Kind.EXPENSE, object_id=instance.pk, title=instance.description[:255],
+            subtitle=f"{instance.expense_date:%d/%m/%Y} · {Decimal(instance.amount):.2f}€",
+            keywords=index_text(instance.description), body=index_text(instance.notes),
+        )
+    raise TypeError(f"{type(instance).__name__} non è indicizzato")
+
+
+def index_object(instance, update_fields=None):
+    """Crea o aggiorna la voce dell'oggetto; salvataggi che non toccano campi indicizzati non costano nulla."""
+    kinds, fields = SOURCES[type(instance)]
+    if update_fields is not None and not fields & set(update_fields):
+        return None
+    entry = build_entry(instance)
+    with transaction.atomic():
+        # Un oggetto venduto passa da Magazzino a Vendita (e viceversa se la vendita viene annullata)
+        SearchEntry.objects.filter(kind__in=kinds, object_id=instance.pk).exclude(kind=entry.kind).delete()
+        entry, _ = SearchEntry.objects.update_or_create(
+            kind=entry.kind, object_id=instance.pk,
+            defaults={field: getattr(entry, field) for field in ('title', 'subtitle', 'keywords', 'body')},
+        )
+    return entry
+
+
+def remove_object(instance):
+    kinds, _ = SOURCES[type(instance)]
+    SearchEntry.objects.filter(kind__in=kinds, object_id=instance.pk).delete()
+
+
+def rebuild():
+    """Ricostruisce l'intero indice dagli oggetti; restituisce il numero di voci."""
+    querysets = [
+        WorkOrder.objects.all(),
+        Project.objects.select_related('category'),
+        StockItem.objects.all(),
+        Expense.objects.all(),
+    ]
+    entries = [build_entry(instance) for queryset in querysets for instance in queryset.iterator(chunk_size=1000)]
+    with transaction.atomic():
+        SearchEntry.objects.all().delete()
+        SearchEntry.objects.bulk_create(entries, batch_size=1000)
+    return len(entries)
+
+
+# --- Backend ---
+
+class SqliteBackend:
+    """FTS5: ogni parola diventa "parola"* OR "radice", unite in AND."""
+
+    @staticmethod
+    def expression(terms):
+        return ' AND '.join(
+            f'("{word}"* OR "{root}")' if root != word else f'"{word}"*' for word, root in terms
+        )
+
+    def entries(self, terms):
+        return SearchEntry.objects.filter(
+            id__in=RawSQL(f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', [self.expression(terms)])
+        )
+
+    def ranked(self, terms, limit):
+        # bm25 è negativo: più è basso, più la voce è pertinente
+        return SearchEntry.objects.raw(
+            f'SELECT e.* FROM {ENTRY_TABLE} e JOIN {FTS_TABLE} ON {FTS_TABLE}.rowid = e.id '
+            f'WHERE {FTS_TABLE} MATCH %s ORDER BY bm25({FTS_TABLE}, %s, 1.0), e.id DESC LIMIT %s',
+            [self.expression(terms), KEYWORDS_WEIGHT, limit]
+        )
+
+
+class PostgresBackend:
+    """tsvector con pesi A (parole chiave) e B (testo); ogni parola diventa parola:* | radice."""
+
+    @staticmethod
+    def expression(terms):
+        return ' & '.join(f'({word}:* | {root})' if root != word else f'{word}:*' for word, root in terms)
+
+    def entries(self, terms):
+        return SearchEntry.objects.filter(id__in=RawSQL(
+            f"SELECT id FROM {ENTRY_TABLE} WHERE search_vector @@ to_tsquery('{TS_CONFIG}', %s)", [self.expression(terms)]
+        ))
+
+    def ranked(self, terms, limit):
+        query = f"to_tsquery('{TS_CONFIG}', %s)"
+        return SearchEntry.objects.raw(
+            f'SELECT e.* FROM {ENTRY_TABLE} e WHERE e.search_vector @@ {query} '
+            f'ORDER BY ts_rank(e.search_vector, {query}) DESC, e.id DESC LIMIT %s',
+            [self.expression(terms), self.expression(terms), limit]
+        )
+
+
+class LikeBackend:
+    """Ripiego per gli altri database: LIKE sul testo normalizzato, i risultati più recenti prima."""
+
+    def entries(self, terms):
+        condition = Q()
+        for word, root in terms:
+            condition &= Q(keywords__contains=word) | Q(body__contains=word) | Q(keywords__contains=root) | Q(body__contains=root)
+        return SearchEntry.objects.filter(condition)
+
+    def ranked(self, terms, limit):
+        return self.entries(terms).order_by('-id')[:limit]
+
+
+BACKENDS = {'sqlite': SqliteBackend(), 'postgresql': PostgresBackend()}
+
+
+def get_backend():
+    return BACKENDS.get(connection.vendor) or LikeBackend()
+
+
+# --- Interrogazione ---
+
+def matching_ids(query, *kinds):
+    """
+    Sottoquery degli id degli oggetti dei tipi indicati che corrispondono alla ricerca, da usare come
+    queryset.filter(pk__in=...): resta un'unica query SQL insieme all'elenco.
+    """
+    query_terms = terms(query)
+    if not query_terms:
+        return SearchEntry.objects.none().values('object_id')
+    return get_backend().entries(query_terms).filter(kind__in=kinds).values('object_id')
+
+
+def search(query, limit=RESULTS_LIMIT):
+    """Voci più pertinenti di tutti i tipi, ciascuna con l'url della pagina dell'oggetto."""
+    query_terms = terms(query)
+    if not query_terms:
+        return []
+    entries = list(get_backend().ranked(query_terms, limit))
+    for entry in entries:
+        entry.url = entry_url(entry)
+    return entries
+
+
+def entry_url(entry):
+    if entry.kind == Kind.WORK_ORDER:
+        return reverse('project_detail', args=[entry.object_id])
+    if entry.kind == Kind.PROJECT:
+        return reverse('project_master_detail', args=[entry.object_id])
+    # Magazzino, vendite e spese non hanno una pagina propria: elenco filtrato sul nome
+    dashboard = {Kind.STOCK_ITEM: 'inventory_dashboard', Kind.SALE: 'sales_dashboard', Kind.EXPENSE: 'accounting_dashboard'}
+    return f"{reverse(dashboard[entry.kind])}?{urlencode({'q': entry.title})}"
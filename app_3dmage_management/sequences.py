@@ -0,0 +1,77 @@
+"""
+Assegnazione degli ID personalizzati (anno a due cifre + progressivo, es. 25001).
+
+Il progressivo viene da IdSequence, una riga per (entità, anno) incrementata atomicamente: niente
+più ricerca dell'ultimo ID a ogni assegnazione e niente collisioni tra utenti concorrenti. Alla prima
+assegnazione dell'anno il contatore parte dall'ultimo ID già presente nei dati (vedi existing_max);
+il comando seed_id_sequences lo allinea in blocco per tutti gli anni.
+"""
+import re
+
+from django.utils import timezone
+
+from .models import IdSequence, WorkOrder, StockItem
+
+ENTITY_MODELS = {
+    IdSequence.Entity.WORK_ORDER: WorkOrder,
+    IdSequence.Entity.STOCK_ITEM: StockItem,
+}
+
+CUSTOM_ID_RE = re.compile(r'^(\d{2})(\d{3,})$')
+# Tentativi se l'ID calcolato è già occupato (es. inserito a mano dall'admin)
+MAX_ATTEMPTS = 3
+
+
+def format_custom_id(year, value):
+    return f"{year % 100:02d}{value:03d}"
+
+
+def parse_custom_id(custom_id):
+    """(anno, progressivo) di un ID personalizzato, o None se non è nel formato standard."""
+    match = CUSTOM_ID_RE.match(custom_id or '')
+    if not match:
+        return None
+    return 2000 + int(match.group(1)), int(match.group(2))
+
+
+def existing_max(entity, year=None):
+    """
+    Ultimo progressivo già usato nei dati, per anno ({anno: progressivo}), oppure per il solo anno
+    indicato. Confronta i numeri e non le stringhe, così 25999 precede 251000.
+    """
+    custom_ids = ENTITY_MODELS[entity].objects.filter(custom_id__regex=r'^\d{5,}$')
+    if year is not None:
+        custom_ids = custom_ids.filter(custom_id__startswith=f"{year % 100:02d}")
+    maxima = {}
+    for custom_id in custom_ids.values_list('custom_id', flat=True):
+        parsed = parse_custom_id(custom_id)
+        if parsed:
+            maxima[parsed[0]] = max(maxima.get(parsed[0], 0), parsed[1])
+    if year is not None:
+        return maxima.get(year, 0)
+    return maxima
+
+
+def next_custom_id(entity, year=None):
+    """
+    Assegna il prossimo ID personalizzato dell'entità. Va chiamata dentro la transazione che salva
+    l'oggetto, così un salvataggio annullato non lascia buchi nella numerazione.
+    """
+    year = year or timezone.localdate().year
+    model = ENTITY_MODELS[entity]
+    for _ in range(MAX_ATTEMPTS):
+        value = IdSequence.next_value(entity, year, seed=lambda: existing_max(entity, year))
+        custom_id = format_custom_id(year, value)
+        if not model.objects.filter(custom_id=custom_id).exists():
+            return custom_id
+        # ID già occupato: il contatore riparte dall'ultimo ID presente nei dati
+        IdSequence.fast_forward(entity, year, existing_max(entity, year))
+    raise RuntimeError(f"Impossibile assegnare un ID libero per {entity} ({year})")
+
+
+def next_work_order_id(year=None):
+    return next_custom_id(IdSequence.Entity.WORK_ORDER, year)
+
+
+def next_stock_item_id(year=None):
+    return next_custom_id(IdSequence.Entity.STOCK_ITEM, year)
@@ -0,0 +1,225 @@
+from django.db.models.signals import post_save, post_delete, pre_delete
+from django.db import transaction
+from django.dispatch import receiver
+
+from . import changefeed, search
+from .cost_settings import DEFAULTS as COST_SETTING_KEYS, invalidate_cost_settings
+from .models import (
+    Filament, Spool, SpoolLedger, FilamentUsage, PrintFile, PaymentMethod, BalanceMovement, Expense, ExpenseCategory, GlobalSetting,
+    Printer, PrintStatsRollup, WorkOrder, StockItem, AccountingSummary, Project, Plate, Notification
+)
+
+
+# --- Registro pesi bobine (SpoolLedger) ---
+
+@receiver(post_save, sender=FilamentUsage)
+def refresh_ledger_on_usage_save(sender, instance, created, **kwargs):
+    spool_ids = {instance.spool_id}
+    loaded_spool_id = getattr(instance, '_loaded_spool_id', None)
+    if loaded_spool_id:
+        # La bobina è stata cambiata: va ricalcolata anche quella precedente
+        spool_ids.add(loaded_spool_id)
+    SpoolLedger.refresh(spool_ids)
+    instance._loaded_spool_id = instance.spool_id
+
+
+@receiver(post_delete, sender=FilamentUsage)
+def refresh_ledger_on_usage_delete(sender, instance, origin=None, **kwargs):
+    # Se si sta eliminando la bobina (o il filamento) il registro sparisce a cascata
+    if isinstance(origin, (Spool, Filament)):
+        return
+    SpoolLedger.refresh([instance.spool_id])
+
+
+@receiver(post_save, sender=PrintFile)
+def refresh_ledger_on_print_file_status(sender, instance, created, **kwargs):
+    if created:
+        return
+    if getattr(instance, '_loaded_status', None) != instance.status:
+        SpoolLedger.refresh(instance.filament_usages.values_list('spool_id', flat=True))
+    instance._loaded_status = instance.status
+
+
+@receiver(post_save, sender=Spool)
+def refresh_ledger_on_spool_save(sender, instance, **kwargs):
+    # Peso iniziale e aggiustamento manuale incidono sui grammi disponibili
+    SpoolLedger.refresh([instance.pk])
+
+
+# --- Aggregati delle statistiche (PrintStatsRollup) ---
+
+ROLLUP_UPDATE_FIELDS = {'status', 'printer', 'printer_id', 'print_time_seconds', 'created_at'}
+
+
+@receiver(post_save, sender=PrintFile)
+def refresh_rollup_on_print_file_save(sender, instance, created, update_fields=None, **kwargs):
+    # Riordino della coda, blocchi, piatto, note...: gli aggregati non cambiano
+    if update_fields is not None and not ROLLUP_UPDATE_FIELDS & set(update_fields):
+        return
+    if not created and getattr(instance, '_loaded_rollup', None) == instance.rollup_values():
+        return
+    days = {PrintStatsRollup.day_of(instance.created_at)}
+    loaded_created_at = getattr(instance, '_loaded_created_at', None)
+    if loaded_created_at:
+        # Data di creazione modificata: il file va tolto anche dal giorno precedente
+        days.add(PrintStatsRollup.day_of(loaded_created_at))
+    PrintStatsRollup.refresh_days(days)
+    instance._loaded_created_at = instance.created_at
+    instance._loaded_rollup = instance.rollup_values()
+
+
+@receiver(post_delete, sender=PrintFile)
+def refresh_rollup_on_print_file_delete(sender, instance, **kwargs):
+    PrintStatsRollup.refresh_days([PrintStatsRollup.day_of(instance.created_at)])
+
+
+@receiver(post_save, sender=FilamentUsage)
+@receiver(post_delete, sender=FilamentUsage)
+def refresh_rollup_on_usage_change(sender, instance, origin=None, **kwargs):
+    # Eliminando file, ordine, bobina o filamento ci pensano già i rispettivi segnali
+    if isinstance(origin, (PrintFile, WorkOrder, Spool, Filament)):
+        return
+    PrintStatsRollup.refresh_for_print_files(PrintFile.objects.filter(id=instance.print_file_id))
+
+
+def _print_files_using(instance):
+    """File di stampa i cui aggregati dipendono dalla bobina, dal filamento o dalla stampante indicati."""
+    if isinstance(instance, Spool):
+        return PrintFile.objects.filter(filament_usages__spool=instance)
+    if isinstance(instance, Filament):
+        return PrintFile.objects.filter(filament_usages__spool__filament=instance)
+    return PrintFile.objects.filter(printer=instance)
+
+
+@receiver(post_save, sender=Spool)
+@receiver(post_save, sender=Filament)
+@receiver(post_save, sender=Printer)
+def refresh_rollup_on_cost_source_save(sender, instance, created, **kwargs):
+    # Costo/peso della bobina, materiale del filamento e consumo della stampante sono copiati negli aggregati
+    if created:
+        return
+    PrintStatsRollup.refresh_for_print_files(_print_files_using(instance))
+
+
+@receiver(pre_delete, sender=Spool)
+@receiver(pre_delete, sender=Filament)
+@receiver(pre_delete, sender=Printer)
+def collect_rollup_days_before_delete(sender, instance, **kwargs):
+    # Dopo l'eliminazione i legami con i file non esistono più: i giorni vanno raccolti prima
+    instance._rollup_days = list(_print_files_using(instance).dates('created_at', 'day'))
+
+
+@receiver(post_delete, sender=Spool)
+@receiver(post_delete, sender=Filament)
+@receiver(post_delete, sender=Printer)
+def refresh_rollup_after_delete(sender, instance, **kwargs):
+    PrintStatsRollup.refresh_days(getattr(instance, '_rollup_days', []))
+
+
+# --- Riepiloghi contabili (AccountingSummary) ---
+
+@receiver(post_save, sender=StockItem)
+@receiver(post_delete, sender=StockItem)
+def refresh_accounting_summary_on_sale(sender, instance, **kwargs):
+    # Mesi della vendita attuale e di quella letta dal DB (vendita stornata o data modificata)
+    months = set()
+    if instance.status == StockItem.Status.SOLD:
+        months.add(instance.sold_at)
+    if getattr(instance, '_loaded_status', None) == StockItem.Status.SOLD:
+        months.add(instance._loaded_sold_at)
+    if months:
+        AccountingSummary.refresh_months(months)
+    instance._loaded_status = instance.status
+    instance._loaded_sold_at = instance.sold_at
+
+
+@receiver(post_save, sender=Expense)
+@receiver(post_delete, sender=Expense)
+def refresh_accounting_summary_on_expense(sender, instance, **kwargs):
+    # Data modificata: la spesa va tolta anche dal mese precedente
+    AccountingSummary.refresh_months({instance.expense_date, getattr(instance, '_loaded_expense_date', None)} - {None})
+    instance._loaded_expense_date = instance.expense_date
+
+
+@receiver(post_save, sender=PaymentMethod)
+def refresh_accounting_summary_on_method_rename(sender, instance, created, **kwargs):
+    # Le commissioni dipendono dal nome del metodo: le entrate vanno ricalcolate
+    if not created:
+        AccountingSummary.refresh_months(
+            instance.accounting_summaries.filter(kind=AccountingSummary.Kind.INCOME).values_list('month', flat=True)
+        )
+
+
+# --- Indice di ricerca (SearchEntry) ---
+
+@receiver(post_save, sender=WorkOrder)
+@receiver(post_save, sender=Project)
+@receiver(post_save, sender=StockItem)
+@receiver(post_save, sender=Expense)
+def update_search_index(sender, instance, update_fields=None, **kwargs):
+    search.index_object(instance, update_fields=update_fields)
+
+
+@receiver(post_delete, sender=WorkOrder)
+@receiver(post_delete, sender=Project)
+@receiver(post_delete, sender=StockItem)
+@receiver(post_delete, sender=Expense)
+def remove_from_search_index(sender, instance, **kwargs):
+    search.remove_object(instance)
+
+
+# --- Feed delle modifiche ---
+
+@receiver(post_save, sender=PrintFile)
+@receiver(post_delete, sender=PrintFile)
+def bump_queue_version_on_print_file_change(sender, instance, **kwargs):
+    # Coda di stampa e avanzamento degli ordini dipendono dai file di stampa
+    changefeed.bump_domain_versions(changefeed.PRINT_QUEUE, changefeed.WORK_ORDERS)
+
+
+@receiver(post_save, sender=Filament)
+@receiver(post_delete, sender=Filament)
+@receiver(post_delete, sender=Spool)
+def bump_filaments_version(sender, instance, **kwargs):
+    # Il salvataggio di una bobina passa già dal registro (SpoolLedger.refresh)
+    changefeed.bump_domain_versions(changefeed.FILAMENTS)
+
+
+@receiver(post_save, sender=PaymentMethod)
+@receiver(post_delete, sender=PaymentMethod)
+@receiver(post_save, sender=BalanceMovement)
+@receiver(post_save, sender=Expense)
+@receiver(post_delete, sender=Expense)
+@receiver(post_save, sender=ExpenseCategory)
+@receiver(post_delete, sender=ExpenseCategory)
+def bump_accounting_version(sender, instance, **kwargs):
+    changefeed.bump_domain_versions(changefeed.ACCOUNTING)
+
+
+@receiver(post_save, sender=Printer)
+@receiver(post_delete, sender=Printer)
+@receiver(post_save, sender=Plate)
+@receiver(post_delete, sender=Plate)
+def bump_printers_version(sender, instance, **kwargs):
+    # Stampanti e piatti: elenchi delle impostazioni e colonne della coda di stampa
+    changefeed.bump_domain_versions(changefeed.SETTINGS, changefeed.PRINT_QUEUE)
+
+
+@receiver(post_save, sender=Notification)
+@receiver(post_delete, sender=Notification)
+def bump_notifications_version(sender, instance, **kwargs):
+    changefeed.bump_domain_versions(changefeed.NOTIFICATIONS)
+
+
+# --- Impostazioni di costo ---
+
+@receiver(post_save, sender=GlobalSetting)
+@receiver(post_delete, sender=GlobalSetting)
+def invalidate_cost_settings_on_change(sender, instance, **kwargs):
+    if instance.key not in COST_SETTING_KEYS:
+        return
+    # Il contatore avvisa gli altri processi; in questo processo la cache si svuota subito
+    # e di nuovo al commit, per non conservare valori letti prima della conferma
+    changefeed.bump_domain_versions(changefeed.SETTINGS)
+    invalidate_cost_settings()
+    transaction.on_commit(invalidate_cost_settings)
@@ -38,6 +38,36 @@ function hideLoader() {
     document.getElementById('loading-overlay')?.classList.add('d-none');
 }
 
+// --- Risposte JSON con ETag ---
+// Le API di sola lettura (filamenti, bobine, costi, piatti...) rispondono con un ETag ricavato dalle
+// versioni dei domini. La risposta resta in sessionStorage e viene richiesta di nuovo con
+// If-None-Match: se i dati non sono cambiati il server risponde 304 e si riusa la copia salvata.
+function fetchJsonCached(url) {
+    const key = `etag-cache:${url}`;
+    let cached = null;
+    try {
+        cached = JSON.parse(sessionStorage.getItem(key));
+    } catch (e) {
+        cached = null;
+    }
+    const headers = cached ? { 'If-None-Match': cached.etag } : {};
+    return fetch(url, { headers }).then(response => {
+        if (response.status === 304 && cached) return JSON.parse(cached.body);
+        if (!response.ok) throw new Error(`Richiesta ${url} fallita: ${response.status}`);
+        return response.text().then(body => {
+            const etag = response.headers.get('ETag');
+            if (etag) {
+                try {
+                    sessionStorage.setItem(key, JSON.stringify({ etag, body }));
+                } catch (e) {
+                    // Spazio esaurito: la risposta si usa comunque, senza conservarla
+                }
+            }
+            return JSON.parse(body);
+        });
+    });
+}
+
 // --- Gestione Blocchi Concorrenza ---
 let lockHeartbeatInterval = null;
 
@@ -95,3 +125,60 @@ function startLockHeartbeat(model, id) {
     // Rilascio automatico alla chiusura
     window.addEventListener('beforeunload', () => releaseLock(model, id));
 }
+
+// --- Feed delle Modifiche (SSE con fallback long-poll) ---
+// Le sezioni con data-change-feed si aggiornano solo quando il loro dominio cambia sul server.
+const CHANGE_FEED_EVENTS = {
+    work_orders: 'workOrdersChanged',
+    stock: 'stockChanged',
+    print_queue: 'printQueueChanged'
+};
+const changeFeedVersions = {};
+
+function applyDomainChanges(changes) {
+    for (const [domain, version] of Object.entries(changes)) {
+        const known = changeFeedVersions[domain];
+        changeFeedVersions[domain] = version;
+        // La prima versione ricevuta è solo il punto di partenza
+        if (known !== undefined && known !== version && CHANGE_FEED_EVENTS[domain]) {
+            htmx.trigger('body', CHANGE_FEED_EVENTS[domain]);
+        }
+    }
+}
+
+async function longPollChanges() {
+    while (true) {
+        try {
+            const params = new URLSearchParams(changeFeedVersions);
+            const response = await fetch(`/ajax/changes/?${params}`);
+            if (response.status === 200) {
+                const data = await response.json();
+                applyDomainChanges(data.changes);
+                continue;
+            }
+            if (response.status === 204) continue; // Timeout senza modifiche: si riapre subito
+        } catch (e) {
+            console.error('Errore feed modifiche:', e);
+        }
+        // Errore o sessione scaduta: attendiamo prima di riprovare
+        await new Promise(resolve => setTimeout(resolve, 10000));
+    }
+}
+
+function startChangeFeed() {
+    if (!document.querySelector('[data-change-feed]')) return;
+    if (!window.EventSource) {
+        longPollChanges();
+        return;
+    }
+    const source = new EventSource('/ajax/changes/stream/');
+    Object.keys(CHANGE_FEED_EVENTS).forEach(domain => {
+        source.addEventListener(domain, (event) => applyDomainChanges({ [domain]: event.data }));
+    });
+    source.onerror = () => {
+        // Sotto WSGI lo stream risponde 204: EventSource si chiude e passiamo al long-poll
+        if (source.readyState === EventSource.CLOSED) longPollChanges();
+    };
+}
+
+document.addEventListener('DOMContentLoaded', startChangeFeed);
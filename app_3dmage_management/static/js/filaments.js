@@ -16,12 +16,7 @@ document.addEventListener('DOMContentLoaded', async function() {
     let allFilamentsData = [];
     async function loadFilamentsData() {
         try {
-            const response = await fetch(URLS.api_filaments);
-            if (response.ok) {
-                allFilamentsData = await response.json();
-            } else {
-                console.error("Failed to load filament data for TomSelect.");
-            }
+            allFilamentsData = await fetchJsonCached(URLS.api_filaments);
         } catch (e) {
             console.error("Error fetching filament data:", e);
         }
@@ -156,8 +151,7 @@ document.addEventListener('DOMContentLoaded', async function() {
     const fetchAndRenderSpools = (filamentId) => {
         activeSpoolListContainer.innerHTML = '<p class="text-white-50 small fst-italic p-3">Caricamento bobine...</p>';
         inactiveSpoolListContainer.innerHTML = '';
-        fetch(`${URLS.api_base_spool}${filamentId}/spools/`)
-            .then(res => res.json())
+        fetchJsonCached(`${URLS.api_base_spool}${filamentId}/spools/`)
             .then(data => {
                 activeSpoolListContainer.innerHTML = data.active_spools.length > 0 ? `<ul class="list-group list-group-flush spool-list-group">${data.active_spools.map(renderSpool).join('')}</ul>` : '<p class="text-white-50 small">Nessuna bobina attiva.</p>';
                 inactiveSpoolListContainer.innerHTML = data.inactive_spools.length > 0 ? `<ul class="list-group list-group-flush spool-list-group">${data.inactive_spools.map(renderSpool).join('')}</ul>` : '<p class="text-white-50 small">Nessuna bobina finita.</p>';
@@ -301,8 +301,10 @@ function updateNetPreview() {
 // --- INIZIALIZZAZIONE DINAMICA (TABELLA HTMX) ---
 function initInventoryBoard() {
     // Gestione click sulle righe della tabella (delegation o ri-aggancio)
-    // Dato che HTMX ricarica il body, ri-agganciamo i listener alle nuove righe.
-    document.querySelectorAll('#inventory-table-body tr[data-item-id]').forEach(row => {
+    // Dato che HTMX ricarica il body, ri-agganciamo i listener alle nuove righe
+    // (anche a quelle aggiunte dallo scroll infinito, una volta sola).
+    document.querySelectorAll('#inventory-table-body tr[data-item-id]:not([data-bound])').forEach(row => {
+        row.dataset.bound = '1';
         row.removeAttribute('data-bs-toggle');
         row.removeAttribute('data-bs-target');
         
@@ -365,7 +367,7 @@ document.addEventListener('DOMContentLoaded', () => {
 });
 
 document.addEventListener('htmx:afterSettle', function(evt) {
-    if (evt.detail.target.id === 'inventory-table-container') {
+    if (evt.detail.target.id === 'inventory-table-container' || evt.detail.target.closest('#inventory-table-body')) {
         initInventoryBoard();
     }
 });
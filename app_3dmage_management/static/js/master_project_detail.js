@@ -125,8 +125,7 @@ document.addEventListener('DOMContentLoaded', function () {
                 plateSelect.innerHTML = '<option value="">Seleziona Piatto</option>';
                 return;
             }
-            fetch(`/ajax/load-plates/?printer_id=${printerId}`)
-                .then(r => r.json())
+            fetchJsonCached(`/ajax/load-plates/?printer_id=${printerId}`)
                 .then(data => {
                     let html = '<option value="">Seleziona Piatto</option>';
                     data.forEach(p => {
@@ -153,13 +153,21 @@ function initPrintQueue() {
                         const col = evt.to.closest('.kanban-column');
                         if (col && col.id.includes('-')) pId = col.id.split('-')[1];
 
-                        const fileIds = Array.from(evt.to.querySelectorAll('.kanban-card'))
-                            .map(card => card.dataset.printFileId);
+                        // Si inviano solo il file spostato e i suoi vicini: il server aggiorna una riga
+                        const cards = Array.from(evt.to.querySelectorAll('.kanban-card'));
+                        const index = cards.indexOf(evt.item);
+                        const afterCard = cards[index - 1];
+                        const beforeCard = cards[index + 1];
 
                         fetch(updateQueueUrl, {
                             method: 'POST',
                             headers: {'Content-Type': 'application/json', 'X-CSRFToken': csrftoken},
-                            body: JSON.stringify({ printer_id: pId, file_ids: fileIds })
+                            body: JSON.stringify({
+                                printer_id: pId,
+                                file_id: evt.item.dataset.printFileId,
+                                after_id: afterCard ? afterCard.dataset.printFileId : null,
+                                before_id: beforeCard ? beforeCard.dataset.printFileId : null
+                            })
                         });
                     }
                 }
@@ -228,3 +236,50 @@ function sortQueue(printerId) {
         body: JSON.stringify({ printer_id: printerId, file_ids: fileIds })
     });
 }
+
+// --- BILANCIAMENTO AUTOMATICO (GLOBALE) ---
+function balanceQueue() {
+    const queueScriptTag = document.getElementById('print-queue-data');
+    if (!queueScriptTag) return;
+    const balanceQueueUrl = queueScriptTag.dataset.balanceQueueUrl;
+
+    // Per applicare si rimandano versione della coda e istante dell'anteprima: il server applica
+    // lo stesso piano, o risponde 409 se nel frattempo la coda è cambiata
+    function requestPlan(dryRun, preview = null) {
+        const payload = { objective: 'makespan', match_plates: true, dry_run: dryRun };
+        if (preview) {
+            payload.version = preview.version;
+            payload.now = preview.now;
+        }
+        return fetch(balanceQueueUrl, {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+                'X-CSRFToken': getCookie('csrftoken')
+            },
+            body: JSON.stringify(payload)
+        }).then(response => response.json());
+    }
+
+    // Prima l'anteprima, poi l'applicazione dopo conferma
+    requestPlan(true).then(data => {
+        if (data.status !== 'ok') {
+            showToast('Errore: ' + data.message, 'error');
+            return;
+        }
+        const plan = data.plan;
+        const formatDate = iso => iso ? new Date(iso).toLocaleString('it-IT', { dateStyle: 'short', timeStyle: 'short' }) : 'N/D';
+        let summary = `File spostati di stampante: ${plan.moved}\n`
+            + `Fine coda attuale: ${formatDate(plan.current_makespan)}\n`
+            + `Fine coda prevista: ${formatDate(plan.makespan)}`;
+        if (plan.unassigned.length) {
+            summary += `\nFile senza stampante compatibile: ${plan.unassigned.length}`;
+        }
+        if (!confirm(summary + '\n\nApplicare il bilanciamento?')) return;
+
+        requestPlan(false, plan).then(result => {
+            showToast(result.message, result.status === 'ok' ? 'success' : 'error');
+            htmx.trigger('body', 'printQueueChanged');
+        });
+    }).catch(() => showToast('Errore di connessione', 'error'));
+}
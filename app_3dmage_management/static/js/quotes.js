@@ -354,7 +354,7 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     }
 
-    fetch("/api/costs/").then(res => res.json()).then(data => {
+    fetchJsonCached("/api/costs/").then(data => {
         costs = data;
         initializeApp();
     }).catch(err => {
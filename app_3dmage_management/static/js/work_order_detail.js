@@ -82,16 +82,11 @@ document.addEventListener('DOMContentLoaded', async function () {
     let tomSelectInstances = new Map();
 
     try {
-        const filamentsResponse = await fetch(URLS.apiFilaments);
-        if (!filamentsResponse.ok) {
-            console.error("Impossibile caricare i dati dei filamenti.");
-        } else {
-            const allFilaments = await filamentsResponse.json();
-            window.allFilaments = allFilaments; // Global fallback if needed
+        const allFilaments = await fetchJsonCached(URLS.apiFilaments);
+        window.allFilaments = allFilaments; // Global fallback if needed
 
-            // Re-initialize TomSelect functions if they were waiting for data
-            // (In this script they are initialized inside functions called later)
-        }
+        // Re-initialize TomSelect functions if they were waiting for data
+        // (In this script they are initialized inside functions called later)
     } catch (e) {
         console.error("Errore fetch filamenti:", e);
     }
@@ -356,8 +351,7 @@ document.addEventListener('DOMContentLoaded', async function () {
         plateSelect.disabled = true;
         if (!printerId) { plateSelect.innerHTML = '<option value="">Scegli una stampante</option>'; return; }
         try {
-            const response = await fetch(`${URLS.ajaxPlates}?printer_id=${printerId}`);
-            const data = await response.json();
+            const data = await fetchJsonCached(`${URLS.ajaxPlates}?printer_id=${printerId}`);
             plateSelect.innerHTML = '<option value="">Seleziona Piatto</option>';
             data.forEach(plate => { plateSelect.innerHTML += `<option value="${plate.id}">${plate.name}</option>`; });
             plateSelect.disabled = false;
@@ -428,8 +422,7 @@ document.addEventListener('DOMContentLoaded', async function () {
             }
 
             const spoolUrl = URLS.apiSpoolsUrlBase.replace('0', usage.spool__filament_id);
-            const spoolsResponse = await fetch(spoolUrl);
-            const spoolsData = await spoolsResponse.json();
+            const spoolsData = await fetchJsonCached(spoolUrl);
             const spools = spoolsData.active_spools || [];
             spoolSelect.innerHTML = '<option value="">Seleziona Bobina...</option>';
             if (spools.length > 0) {
@@ -744,7 +737,7 @@ document.addEventListener('DOMContentLoaded', async function () {
                 spoolSelect.disabled = true;
                 if (fId) {
                     const spoolUrl = URLS.apiSpoolsUrlBase.replace('0', fId);
-                    fetch(spoolUrl).then(res => res.json()).then(data => {
+                    fetchJsonCached(spoolUrl).then(data => {
                         spoolSelect.innerHTML = '<option value="">Seleziona Bobina...</option>';
                         const spools = data.active_spools || [];
                         if (spools.length > 0) {
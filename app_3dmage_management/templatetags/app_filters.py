@@ -27,13 +27,13 @@ def duration_format(value):
 def get_project_printers(project):
     """
     Returns a list of distinct printer names for a project.
+    Reads master_print_files.all(), so views listing many projects should prefetch 'master_print_files__printer'.
     """
-    printers = project.master_print_files.exclude(printer=None).values('printer__id', 'printer__name', 'printer__tag').distinct()
     unique = {}
-    for p in printers:
-        key = p['printer__id']
-        if key not in unique:
-            unique[key] = {'id': p['printer__id'], 'name': p['printer__name'], 'tag': p['printer__tag']}
+    for master_file in project.master_print_files.all():
+        printer = master_file.printer
+        if printer and printer.id not in unique:
+            unique[printer.id] = {'id': printer.id, 'name': printer.name, 'tag': printer.tag}
     return list(unique.values())
 @register.filter
 def sum_quantities(outputs):
@@ -1,6 +1,6 @@
 # in app_3dmage_management/tests.py
 
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from .models import WorkOrder, PrintFile, Project, ProjectPart
 
 class WorkOrderModelTests(TestCase):
@@ -95,6 +95,198 @@ class ExpenseAccountingTests(TestCase):
         self.assertEqual(float(self.payment_method.balance), 70.00)
 
 
+class BalanceLedgerTests(TestCase):
+    def setUp(self):
+        from django.contrib.auth.models import User
+        self.user = User.objects.create_user(username='testuser', password='password')
+        self.client.force_login(self.user)
+        self.category = ExpenseCategory.objects.create(name="Materiali")
+        self.cash = PaymentMethod.objects.create(name="Cassa", balance=100)
+        self.bank = PaymentMethod.objects.create(name="Conto", balance=0)
+
+    def assertLedgerMatchesCache(self):
+        from . import ledger
+        self.assertEqual(ledger.cache_mismatches(), [])
+
+    def test_opening_balance_and_corrections_are_movements(self):
+        from decimal import Decimal
+        from .models import BalanceMovement
+        self.cash.balance = 150
+        self.cash.save()
+        kinds = list(self.cash.movements.values_list('kind', 'amount'))
+        self.assertEqual(kinds, [
+            (BalanceMovement.Kind.OPENING, Decimal('100.00')), (BalanceMovement.Kind.CORRECTION, Decimal('50.00'))
+        ])
+        self.assertFalse(self.bank.movements.exists())
+        self.assertLedgerMatchesCache()
+
+    def test_transfer_is_double_entry(self):
+        self.client.post(reverse('transfer_funds'), {'source': self.cash.id, 'destination': self.bank.id, 'amount': '30.00'})
+        self.cash.refresh_from_db()
+        self.bank.refresh_from_db()
+        self.assertEqual(float(self.cash.balance), 70.00)
+        self.assertEqual(float(self.bank.balance), 30.00)
+        legs = list(self.cash.movements.filter(kind='TRANSFER')) + list(self.bank.movements.filter(kind='TRANSFER'))
+        self.assertEqual(len(legs), 2)
+        self.assertEqual(legs[0].transfer_id, legs[1].transfer_id)
+        self.assertEqual(sum(leg.amount for leg in legs), 0)
+        self.assertLedgerMatchesCache()
+
+    def test_deleted_expense_is_reversed_not_erased(self):
+        self.client.post(reverse('add_expense'), {
+            'description': 'Spesa 1', 'amount': '20.00', 'category': self.category.id,
+            'payment_method': self.cash.id, 'expense_date': timezone.now().date().strftime('%Y-%m-%d'),
+        })
+        expense = Expense.objects.get()
+        self.client.post(reverse('delete_expense', args=[expense.id]))
+        self.cash.refresh_from_db()
+        self.assertEqual(float(self.cash.balance), 100.00)
+        self.assertEqual(
+            sorted(self.cash.movements.values_list('kind', flat=True)), ['EXPENSE', 'OPENING', 'REVERSAL']
+        )
+        self.assertLedgerMatchesCache()
+
+    def test_balance_as_of_date_and_snapshots(self):
+        import datetime
+        from decimal import Decimal
+        from . import ledger
+        from .models import BalanceMovement, BalanceSnapshot
+        today = timezone.localdate()
+        opening = self.cash.movements.get()
+        old_day = ledger.last_closed_month_end(today) - datetime.timedelta(days=40)
+        # Movimento di apertura spostato indietro per avere mesi chiusi da fotografare
+        BalanceMovement.objects.filter(pk=opening.pk).update(occurred_on=old_day - datetime.timedelta(days=1))
+        ledger.record(self.cash, Decimal('-10.00'), BalanceMovement.Kind.EXPENSE, old_day)
+
+        self.assertTrue(ledger.ensure_snapshots() >= 2)
+        self.assertEqual(ledger.ensure_snapshots(), 0)
+        balances = {m.pk: m.ledger_balance for m in ledger.balances_as_of(old_day - datetime.timedelta(days=1))}
+        self.assertEqual(balances[self.cash.pk], Decimal('100.00'))
+        self.assertEqual(balances[self.bank.pk], Decimal('0.00'))
+        self.assertEqual(ledger.balances_as_of().get(pk=self.cash.pk).ledger_balance, Decimal('90.00'))
+
+        # Un movimento retrodatato invalida le istantanee successive e il saldo alla data cambia
+        ledger.record(self.cash, Decimal('5.00'), BalanceMovement.Kind.CORRECTION, old_day)
+        self.assertFalse(BalanceSnapshot.objects.filter(period_end__gte=old_day).exists())
+        self.assertEqual(ledger.balances_as_of(old_day).get(pk=self.cash.pk).ledger_balance, Decimal('95.00'))
+        ledger.ensure_snapshots()
+        self.assertEqual(
+            BalanceSnapshot.objects.get(payment_method=self.cash, period_end=ledger.last_closed_month_end(today)).balance,
+            Decimal('95.00')
+        )
+        self.assertLedgerMatchesCache()
+
+    @override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+    def test_accounting_dashboard_shows_period_balances(self):
+        response = self.client.get(reverse('accounting_dashboard'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(float(response.context['total_cash']), 100.00)
+        rows = response.context['period_balances']
+        self.assertEqual(len(rows), timezone.localdate().month)
+        self.assertEqual(float(rows[-1]['total']), 100.00)
+
+    def test_snapshot_balances_command_reports_cache_drift(self):
+        from io import StringIO
+        from django.core.management import call_command
+        from django.core.management.base import CommandError
+        call_command('snapshot_balances', stdout=StringIO())
+        PaymentMethod.objects.filter(pk=self.cash.pk).update(balance=99)
+        with self.assertRaises(CommandError):
+            call_command('snapshot_balances', stdout=StringIO())
+        call_command('snapshot_balances', '--fix-cache', stdout=StringIO())
+        self.assertLedgerMatchesCache()
+
+
+class AccountingSummaryTests(TestCase):
+    def setUp(self):
+        from django.contrib.auth.models import User
+        self.user = User.objects.create_user(username='testuser', password='password')
+        self.client.force_login(self.user)
+        self.category = ExpenseCategory.objects.create(name="Materiali")
+        self.cash = PaymentMethod.objects.create(name="Cassa")
+        self.sumup = PaymentMethod.objects.create(name="SumUp")
+
+    def summary_totals(self, **filters):
+        from .views.accounting import _summary_totals
+        return _summary_totals(filters.get('year', ''), filters.get('payment_method', ''), filters.get('category', ''))
+
+    def live_totals(self, **filters):
+        from decimal import Decimal
+        from django.db.models import Sum
+        from .models import StockItem
+        sales = StockItem.objects.filter(status='SOLD', payment_method__isnull=False).with_net_values()
+        expenses = Expense.objects.all()
+        if 'year' in filters:
+            sales = sales.filter(sold_at__year=filters['year'])
+            expenses = expenses.filter(expense_date__year=filters['year'])
+        if 'payment_method' in filters:
+            sales = sales.filter(payment_method_id=filters['payment_method'])
+            expenses = expenses.filter(payment_method_id=filters['payment_method'])
+        if 'category' in filters:
+            expenses = expenses.filter(category_id=filters['category'])
+        return (
+            sales.aggregate(total=Sum('annotated_net_revenue'))['total'] or Decimal('0.00'),
+            expenses.aggregate(total=Sum('amount'))['total'] or Decimal('0.00'),
+        )
+
+    def test_summaries_follow_sales_and_expenses(self):
+        import datetime
+        from .models import StockItem
+        last_year = datetime.date(timezone.localdate().year - 1, 6, 15)
+        sale = StockItem.objects.create(
+            name='Vaso', status='SOLD', sale_price=40, quantity=2, sold_at=last_year, payment_method=self.sumup
+        )
+        StockItem.objects.create(name='Vaso', status='IN_STOCK', quantity=3)
+        expense = Expense.objects.create(
+            description='Resina', amount=12, category=self.category, payment_method=self.cash, expense_date=last_year
+        )
+        for filters in ({}, {'year': last_year.year}, {'payment_method': self.sumup.id}, {'category': self.category.id}):
+            self.assertEqual(self.summary_totals(**filters), self.live_totals(**filters), filters)
+
+        # Vendita spostata all'anno in corso, spesa modificata e poi eliminata
+        sale = StockItem.objects.get(pk=sale.pk)
+        sale.sold_at = timezone.localdate()
+        sale.save()
+        expense = Expense.objects.get(pk=expense.pk)
+        expense.amount = 20
+        expense.save()
+        self.assertEqual(self.summary_totals(year=last_year.year), self.live_totals(year=last_year.year))
+        self.assertEqual(self.summary_totals(), self.live_totals())
+        expense.delete()
+        sale.status = 'IN_STOCK'
+        sale.save()
+        self.assertEqual(self.summary_totals(), (0, 0))
+
+    def test_closed_period_is_frozen(self):
+        import datetime
+        from io import StringIO
+        from django.core.management import call_command
+        from .models import AccountingPeriod
+        old_day = (timezone.localdate().replace(day=1) - datetime.timedelta(days=40))
+        Expense.objects.create(description='Affitto', amount=100, payment_method=self.cash, expense_date=old_day)
+        call_command('close_accounting_period', stdout=StringIO())
+        self.assertTrue(AccountingPeriod.objects.filter(month=old_day.replace(day=1)).exists())
+
+        Expense.objects.create(description='Tardiva', amount=5, payment_method=self.cash, expense_date=old_day)
+        self.assertEqual(self.summary_totals()[1], 100)
+        self.assertEqual(self.live_totals()[1], 105)
+
+        call_command('close_accounting_period', '--reopen', old_day.strftime('%Y-%m'), stdout=StringIO())
+        self.assertEqual(self.summary_totals()[1], 105)
+
+    @override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+    def test_dashboard_totals_and_years_from_summaries(self):
+        import datetime
+        day = datetime.date(2024, 3, 2)
+        Expense.objects.create(description='Filo', amount=7, category=self.category, payment_method=self.cash, expense_date=day)
+        response = self.client.get(reverse('accounting_dashboard'))
+        self.assertEqual(response.context['available_years'], [2024])
+        self.assertEqual(float(response.context['total_expenses']), 7.00)
+        # Con la ricerca testuale i totali vengono dalle righe filtrate
+        response = self.client.get(reverse('accounting_dashboard'), {'q': 'nessuna'})
+        self.assertEqual(float(response.context['total_expenses']), 0.00)
+
+
 class PrintFileCloningTests(TestCase):
     def setUp(self):
         from django.contrib.auth.models import User
@@ -126,3 +318,1152 @@ class PrintFileCloningTests(TestCase):
         self.assertEqual(cloned_file.produced_quantity, 3)
 
 
+
+class MasterClonerTests(TestCase):
+    def setUp(self):
+        from decimal import Decimal
+        from .models import Filament, Spool, MasterPrintFile, MasterFilamentUsage
+        from django.contrib.auth.models import User
+        self.user = User.objects.create_user(username='testuser', password='password')
+        self.client.force_login(self.user)
+        self.project = Project.objects.create(name="Progetto Clonazione")
+        self.part = ProjectPart.objects.create(project=self.project, name="Parte Unica", order=1)
+        self.filament = Filament.objects.create(material='PLA', brand='Test', color_code='001')
+        self.small_spool = Spool.objects.create(filament=self.filament, cost=Decimal('20.00'), initial_weight_g=100)
+        self.big_spool = Spool.objects.create(filament=self.filament, cost=Decimal('20.00'), initial_weight_g=1000)
+        for i in range(2):
+            mpf = MasterPrintFile.objects.create(project=self.project, name=f"pezzo_{i}.gcode", produced_quantity=1)
+            mpf.project_parts.add(self.part)
+            MasterFilamentUsage.objects.create(master_print_file=mpf, filament=self.filament, grams_used=Decimal('40.00'))
+
+    def _clone(self, sets):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from .cloning import MasterCloner
+        work_order = WorkOrder.objects.create(name="Ordine Clonato", project=self.project, quantity=sets)
+        with CaptureQueriesContext(connection) as ctx:
+            cloner = MasterCloner(self.project, work_order)
+            cloner.plan_batches([{'quantity': sets, 'printers': {}}])
+            cloner.plan_raw_materials(sets)
+            cloner.save()
+        return work_order, len(ctx.captured_queries)
+
+    def test_query_count_does_not_grow_with_sets(self):
+        _, queries_one = self._clone(1)
+        work_order, queries_ten = self._clone(10)
+        self.assertEqual(queries_one, queries_ten)
+        self.assertEqual(work_order.print_files.count(), 20)
+
+    def test_spools_are_picked_against_running_availability(self):
+        from .models import FilamentUsage
+        work_order, _ = self._clone(3)
+        spool_ids = list(
+            FilamentUsage.objects.filter(print_file__work_order=work_order)
+            .order_by('print_file__id').values_list('spool_id', flat=True)
+        )
+        # Le prime due stampe esauriscono la bobina piccola (100g), le successive passano a quella grande
+        self.assertEqual(spool_ids[:2], [self.small_spool.id, self.small_spool.id])
+        self.assertTrue(all(spool_id == self.big_spool.id for spool_id in spool_ids[2:]))
+        self.small_spool.refresh_from_db()
+        self.assertEqual(self.small_spool.available_weight, 20)
+
+    def test_add_parts_continues_numbering(self):
+        work_order = self.project.create_work_order(quantity=1)
+        response = self.client.post(
+            reverse('add_parts_to_order', args=[self.project.id]),
+            {'work_order_id': work_order.id, 'quantity': 2, 'ignore_warnings': 'true', 'is_ajax': 'true'}
+        )
+        self.assertEqual(response.status_code, 200)
+        names = sorted(work_order.print_files.filter(master_print_file__name="pezzo_0.gcode").values_list('name', flat=True))
+        self.assertEqual(names, ["pezzo_0.gcode", "pezzo_0.gcode  (1)", "pezzo_0.gcode  (2)"])
+
+
+class ChangeFeedTests(TestCase):
+    def setUp(self):
+        from django.contrib.auth.models import User
+        from . import fragments
+        # Le versioni ripartono a ogni test: niente parziali rimasti da un test precedente
+        fragments.clear()
+        self.user = User.objects.create_user(username='testuser', password='password')
+        self.client.force_login(self.user)
+
+    def test_saves_bump_only_their_domains(self):
+        from . import changefeed
+        from .models import StockItem
+        before = changefeed.get_domain_versions()
+        StockItem.objects.create(name="Oggetto Test")
+        after = changefeed.get_domain_versions()
+        self.assertEqual(changefeed.changed_domains(before, after), {'stock': after['stock']})
+
+        WorkOrder.objects.create(name="Ordine Feed")
+        changes = changefeed.changed_domains(after, changefeed.get_domain_versions())
+        self.assertEqual(set(changes), {'work_orders', 'print_queue'})
+
+    def test_long_poll_returns_current_state_then_changes(self):
+        from unittest import mock
+        from . import changefeed
+        response = self.client.get(reverse('change_feed'))
+        self.assertEqual(response.status_code, 200)
+        versions = response.json()['changes']
+        self.assertEqual(set(versions), set(changefeed.DOMAINS))
+
+        with mock.patch.object(changefeed, 'LONG_POLL_TIMEOUT', 0):
+            response = self.client.get(reverse('change_feed'), versions)
+            self.assertEqual(response.status_code, 204)
+
+            WorkOrder.objects.create(name="Ordine Feed")
+            response = self.client.get(reverse('change_feed'), {**versions, 'domains': 'stock,work_orders'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(response.json()['changes']), ['work_orders'])
+
+    def test_htmx_shortcut_compares_own_domain_only(self):
+        from . import changefeed
+        from .models import StockItem
+        queue_version = changefeed.get_domain_versions()['print_queue']
+        StockItem.objects.create(name="Oggetto Test")
+        response = self.client.get(reverse('print_queue_board'), {'v': queue_version}, HTTP_HX_REQUEST='true')
+        self.assertEqual(response.status_code, 204)
+
+        stale_stock_version = str(int(changefeed.get_domain_versions()['stock']) - 1)
+        response = self.client.get(reverse('inventory_dashboard'), {'v': stale_stock_version}, HTTP_HX_REQUEST='true')
+        self.assertEqual(response.status_code, 200)
+
+    def test_check_updates_reports_changed_domains(self):
+        from . import changefeed
+        from .models import Expense, ExpenseCategory, PaymentMethod
+        versions = changefeed.get_domain_versions()
+        self.assertEqual(self.client.get(reverse('check_updates'), versions).status_code, 204)
+
+        payment_method = PaymentMethod.objects.create(name="Cassa", balance=100)
+        category = ExpenseCategory.objects.create(name="Varie")
+        Expense.objects.create(description="Spesa", amount=10, category=category, payment_method=payment_method)
+        response = self.client.get(reverse('check_updates'), versions)
+        self.assertEqual(list(response.json()['changes']), ['accounting'])
+
+    def test_stream_falls_back_under_wsgi(self):
+        response = self.client.get(reverse('change_stream'))
+        self.assertEqual(response.status_code, 204)
+
+    def _fake_change(self, versions, domain):
+        from . import changefeed
+        # La fotografia inventata non deve restare per i test successivi
+        self.addCleanup(setattr, changefeed, '_snapshot_at', None)
+        return {**versions, domain: str(int(versions[domain]) + 1)}
+
+    def test_idle_long_poll_reads_versions_once(self):
+        from . import changefeed
+        versions = changefeed.get_domain_versions()
+        with self.assertNumQueries(1):
+            self.assertEqual(changefeed.wait_for_changes(versions, timeout=0.3), {})
+
+    def test_long_poll_and_stream_wake_on_publish_without_queries(self):
+        import asyncio
+        import threading
+        import time
+        from . import changefeed
+        versions = changefeed.get_domain_versions()
+        changed = self._fake_change(versions, 'stock')
+
+        threading.Timer(0.1, changefeed._publish, [changed]).start()
+        with self.assertNumQueries(1):  # solo la lettura all'arrivo della richiesta
+            changes = changefeed.wait_for_changes(versions, timeout=5)
+        self.assertEqual(changes, {'stock': changed['stock']})
+
+        async def wait_stream():
+            seen = changefeed._generation
+            threading.Timer(0.1, changefeed._publish, [versions]).start()
+            await changefeed._wait_for_publish(seen, 5)
+
+        started = time.monotonic()
+        asyncio.run(wait_stream())
+        self.assertLess(time.monotonic() - started, 2)
+
+
+class CostSettingsProviderTests(TestCase):
+    def setUp(self):
+        from django.contrib.auth.models import User
+        from .cost_settings import invalidate_cost_settings
+        invalidate_cost_settings()
+        self.user = User.objects.create_user(username='testuser', password='password')
+        self.client.force_login(self.user)
+
+    def tearDown(self):
+        from .cost_settings import invalidate_cost_settings
+        # Le impostazioni modificate nel test non devono restare nella cache del processo
+        invalidate_cost_settings()
+
+    def test_cost_properties_do_not_query_settings(self):
+        from decimal import Decimal
+        from .models import Printer
+        from .cost_settings import get_cost_settings
+        printer = Printer.objects.create(name="Stampante", power_consumption=200)
+        work_order = WorkOrder.objects.create(name="Ordine Costi")
+        files = [
+            PrintFile.objects.create(work_order=work_order, name=f"file_{i}", printer=printer, print_time_seconds=3600)
+            for i in range(5)
+        ]
+        get_cost_settings()
+        with self.assertNumQueries(0):
+            costs = [(pf.electricity_cost, pf.wear_tear_cost) for pf in files]
+        self.assertEqual(costs[0], (Decimal('0.05'), Decimal('0.10')))
+
+    def test_update_general_settings_invalidates_cache(self):
+        from decimal import Decimal
+        from .cost_settings import get_cost_settings
+        self.assertEqual(get_cost_settings().electricity_cost_kwh, Decimal('0.25'))
+        self.client.post(reverse('update_general_settings'), {
+            'electricity_cost': '0.40',
+            'wear_tear_coefficient': '0.20',
+        })
+        settings = get_cost_settings()
+        self.assertEqual(settings.electricity_cost_kwh, Decimal('0.40'))
+        self.assertEqual(settings.wear_tear_coefficient, Decimal('0.20'))
+
+
+class WorkOrderCostAnnotationTests(TestCase):
+    def setUp(self):
+        from decimal import Decimal
+        from .models import (
+            Filament, Spool, FilamentUsage, Printer, RawMaterial, RawMaterialPurchase, WorkOrderRawMaterial
+        )
+        from .cost_settings import invalidate_cost_settings
+        invalidate_cost_settings()
+        printer = Printer.objects.create(name="Stampante", power_consumption=230)
+        idle_printer = Printer.objects.create(name="Spenta", power_consumption=0)
+        filament = Filament.objects.create(material='PLA', brand='Test', color_code='001')
+        spool = Spool.objects.create(filament=filament, cost=Decimal('19.99'), initial_weight_g=1000)
+        empty_spool = Spool.objects.create(filament=filament, cost=Decimal('5.00'), initial_weight_g=0)
+        magnet = RawMaterial.objects.create(name="Magnete")
+        RawMaterialPurchase.objects.create(raw_material=magnet, quantity=7, cost=Decimal('10.00'))
+
+        self.project = Project.objects.create(name="Progetto Costi")
+        self.work_orders = []
+        for i in range(3):
+            work_order = WorkOrder.objects.create(name=f"Ordine {i}", project=self.project, quantity=i + 1)
+            for j in range(i + 1):
+                pf = PrintFile.objects.create(
+                    work_order=work_order, name=f"file_{j}", print_time_seconds=1234 * (j + 1),
+                    printer=[printer, idle_printer, None][j % 3]
+                )
+                FilamentUsage.objects.create(print_file=pf, spool=spool, grams_used=Decimal('37.45'))
+                FilamentUsage.objects.create(print_file=pf, spool=empty_spool, grams_used=Decimal('3.00'))
+            WorkOrderRawMaterial.objects.create(work_order=work_order, raw_material=magnet, quantity=i + 2)
+            self.work_orders.append(work_order)
+        # Un ordine senza file né materie prime
+        self.work_orders.append(WorkOrder.objects.create(name="Vuoto"))
+
+    def tearDown(self):
+        from .cost_settings import invalidate_cost_settings
+        invalidate_cost_settings()
+
+    def test_with_costs_matches_python_properties(self):
+        from decimal import Decimal
+        cent = Decimal('0.01')
+        annotated = {wo.pk: wo for wo in WorkOrder.objects.with_costs()}
+        for work_order in self.work_orders:
+            plain = WorkOrder.objects.get(pk=work_order.pk)
+            row = annotated[work_order.pk]
+            self.assertEqual(row.total_material_cost, plain.total_material_cost)
+            self.assertEqual(row.full_total_cost.quantize(cent), plain.full_total_cost.quantize(cent))
+            self.assertEqual(row.suggested_price, plain.suggested_price)
+            print_files = list(plain.print_files.all())
+            self.assertEqual(row.cost_electricity.quantize(cent), sum((pf.electricity_cost for pf in print_files), Decimal('0')).quantize(cent))
+            self.assertEqual(row.cost_wear_tear.quantize(cent), sum((pf.wear_tear_cost for pf in print_files), Decimal('0')).quantize(cent))
+
+    def test_with_costs_is_a_single_query(self):
+        from .cost_settings import get_cost_settings
+        get_cost_settings()
+        with self.assertNumQueries(1):
+            totals = [wo.full_total_cost for wo in WorkOrder.objects.with_costs()]
+        self.assertEqual(len(totals), 4)
+
+
+# La dashboard renderizza la pagina completa: niente manifest degli statici nei test
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class StatisticsRollupTests(TestCase):
+    def setUp(self):
+        import datetime
+        from decimal import Decimal
+        from django.contrib.auth.models import User
+        from .models import Filament, Spool, FilamentUsage, Printer
+        from .cost_settings import invalidate_cost_settings
+        invalidate_cost_settings()
+        self.user = User.objects.create_user(username='testuser', password='password')
+        self.client.force_login(self.user)
+
+        self.printer = Printer.objects.create(name="Stampante A", power_consumption=230)
+        self.idle_printer = Printer.objects.create(name="Stampante B", power_consumption=0)
+        pla = Filament.objects.create(material='PLA', brand='Test', color_code='001')
+        petg = Filament.objects.create(material='PETG', brand='Test', color_code='002')
+        self.pla_spool = Spool.objects.create(filament=pla, cost=Decimal('19.99'), initial_weight_g=1000)
+        petg_spool = Spool.objects.create(filament=petg, cost=Decimal('24.50'), initial_weight_g=750)
+
+        self.work_order = WorkOrder.objects.create(name="Ordine Statistiche")
+        last_year = timezone.now() - datetime.timedelta(days=400)
+        self.files = []
+        specs = [
+            ('DONE', self.printer, None, 3725),
+            ('DONE', self.idle_printer, None, 1800),
+            ('FAILED', self.printer, last_year, 600),
+            ('TODO', None, None, 4000),
+            ('PRINTING', self.printer, last_year, 900),
+        ]
+        for i, (status, printer, created_at, seconds) in enumerate(specs):
+            pf = PrintFile.objects.create(
+                work_order=self.work_order, name=f"file_{i}", status=status, printer=printer,
+                print_time_seconds=seconds, created_at=created_at or timezone.now()
+            )
+            FilamentUsage.objects.create(print_file=pf, spool=self.pla_spool, grams_used=Decimal('37.45'))
+            if i % 2 == 0:
+                FilamentUsage.objects.create(print_file=pf, spool=petg_spool, grams_used=Decimal('12.30'))
+            self.files.append(pf)
+
+    def tearDown(self):
+        from .cost_settings import invalidate_cost_settings
+        invalidate_cost_settings()
+
+    def _expected(self, print_files):
+        """Valori calcolati file per file, come faceva la dashboard prima degli aggregati."""
+        from decimal import Decimal
+        completed = [pf for pf in print_files if pf.status in ('DONE', 'FAILED')]
+        grams = {}
+        for pf in completed:
+            for usage in pf.filament_usages.all():
+                material = usage.spool.filament.material
+                grams[material] = grams.get(material, 0.0) + float(usage.grams_used)
+        return {
+            'total_prints': len(print_files),
+            'successful_prints': sum(1 for pf in print_files if pf.status == 'DONE'),
+            'failed_prints': sum(1 for pf in print_files if pf.status == 'FAILED'),
+            'active_prints': sum(1 for pf in print_files if pf.status in ('TODO', 'PRINTING')),
+            'total_material_cost': round(sum((pf.material_cost for pf in completed), Decimal('0.00')), 2),
+            'total_electricity_cost': round(sum((pf.electricity_cost for pf in completed), Decimal('0.00')), 2),
+            'total_wear_tear_cost': round(sum((pf.wear_tear_cost for pf in completed), Decimal('0.00')), 2),
+            'total_cost': round(sum((pf.total_cost for pf in completed), Decimal('0.00')), 2),
+            'total_kg': round(sum(grams.values()) / 1000.0, 2),
+            'materials': {material: round(value / 1000.0, 3) for material, value in grams.items()},
+        }
+
+    def _assert_dashboard_matches(self, params, print_files):
+        response = self.client.get(reverse('statistics_dashboard'), params)
+        self.assertEqual(response.status_code, 200)
+        context = response.context
+        expected = self._expected([PrintFile.objects.get(pk=pf.pk) for pf in print_files])
+        for key in ('total_prints', 'successful_prints', 'failed_prints', 'active_prints', 'total_kg',
+                    'total_material_cost', 'total_electricity_cost', 'total_wear_tear_cost', 'total_cost'):
+            self.assertEqual(context[key], expected[key], key)
+        materials = dict(zip(context['chart_material_labels'], context['chart_material_values']))
+        for material, kg in expected['materials'].items():
+            self.assertEqual(materials[material], kg)
+        self.assertEqual(sum(context['chart_printer_values']), expected['total_prints'])
+        self.assertEqual(sum(context['chart_monthly_print_counts']), expected['successful_prints'] + expected['failed_prints'])
+
+    def test_dashboard_matches_per_file_costs(self):
+        self._assert_dashboard_matches({}, self.files)
+
+    def test_dashboard_filters_by_year_and_printer(self):
+        this_year = timezone.localdate().year
+        self._assert_dashboard_matches(
+            {'year': this_year}, [pf for pf in self.files if timezone.localtime(pf.created_at).year == this_year]
+        )
+        self._assert_dashboard_matches(
+            {'printer': self.printer.pk}, [pf for pf in self.files if pf.printer_id == self.printer.pk]
+        )
+
+    def test_rollup_follows_status_cost_and_deletions(self):
+        from decimal import Decimal
+        from io import StringIO
+        from django.core.management import call_command
+        todo = self.files[3]
+        todo.status = 'DONE'
+        todo.printer = self.printer
+        todo.save()
+        self.pla_spool.cost = Decimal('30.00')
+        self.pla_spool.save()
+        self.files[0].delete()
+        self.printer.power_consumption = 120
+        self.printer.save()
+
+        self._assert_dashboard_matches({}, self.files[1:])
+        call_command('rebuild_statistics_rollup', '--verify', stdout=StringIO())
+
+    def test_saves_that_do_not_touch_rolled_up_fields_skip_refresh(self):
+        from .models import PrintStatsRollup
+        print_file = PrintFile.objects.get(pk=self.files[0].pk)
+        day = PrintStatsRollup.day_of(print_file.created_at)
+        PrintStatsRollup.objects.filter(day=day).delete()
+        print_file.queue_position = 4096
+        print_file.save()
+        print_file.name = 'rinominato.gcode'
+        print_file.save(update_fields=['name'])
+        self.assertFalse(PrintStatsRollup.objects.filter(day=day).exists())
+
+        print_file.print_time_seconds = 4000
+        print_file.save()
+        self.assertTrue(PrintStatsRollup.objects.filter(day=day).exists())
+
+    def test_rebuild_command_restores_rollup(self):
+        from io import StringIO
+        from django.core.management import call_command
+        from django.core.management.base import CommandError
+        from .models import PrintStatsRollup
+        PrintStatsRollup.objects.filter(status='DONE').delete()
+        with self.assertRaises(CommandError):
+            call_command('rebuild_statistics_rollup', '--verify', stdout=StringIO())
+        call_command('rebuild_statistics_rollup', stdout=StringIO())
+        call_command('rebuild_statistics_rollup', '--verify', stdout=StringIO())
+        self._assert_dashboard_matches({}, self.files)
+
+    def test_dashboard_queries_do_not_grow_with_history(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        url = reverse('statistics_dashboard')
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as before:
+            self.client.get(url)
+        for i in range(20):
+            PrintFile.objects.create(work_order=self.work_order, name=f"extra_{i}", status='DONE', printer=self.printer)
+        with CaptureQueriesContext(connection) as after:
+            self.client.get(url)
+        self.assertEqual(len(after.captured_queries), len(before.captured_queries))
+
+
+class QueueOrderTests(TestCase):
+    def setUp(self):
+        from django.contrib.auth.models import User
+        from .models import Printer
+        self.user = User.objects.create_user(username='testuser', password='password')
+        self.client.force_login(self.user)
+        self.printer = Printer.objects.create(name="Stampante A")
+        self.other_printer = Printer.objects.create(name="Stampante B")
+        self.work_order = WorkOrder.objects.create(name="Ordine Coda", status='TODO')
+        self.files = [
+            PrintFile.objects.create(work_order=self.work_order, name=f"file_{i}", printer=self.printer)
+            for i in range(6)
+        ]
+
+    def _queue(self, printer):
+        from .queue_order import queue_file_ids
+        return queue_file_ids(printer.pk)
+
+    def _post(self, payload):
+        import json
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post(reverse('update_print_queue'), json.dumps(payload), content_type='application/json')
+        self.assertEqual(response.json()['status'], 'ok')
+        return [q['sql'] for q in ctx.captured_queries if q['sql'].startswith('UPDATE "app_3dmage_management_printfile"')]
+
+    def test_full_reorder_is_a_single_update(self):
+        ids = [pf.pk for pf in reversed(self.files)]
+        updates = self._post({'printer_id': self.printer.pk, 'file_ids': ids})
+        self.assertEqual(len(updates), 1)
+        self.assertEqual(self._queue(self.printer), ids)
+
+    def test_move_touches_only_the_moved_file(self):
+        from .queue_order import reorder_queue, move_in_queue
+        ids = [pf.pk for pf in self.files]
+        reorder_queue(self.printer.pk, ids)
+        before = dict(PrintFile.objects.values_list('id', 'queue_position'))
+
+        moved = ids[5]
+        self.assertEqual(move_in_queue(moved, self.printer.pk, after_id=ids[0], before_id=ids[1]), 1)
+        after = dict(PrintFile.objects.values_list('id', 'queue_position'))
+        self.assertEqual([file_id for file_id in ids if before[file_id] != after[file_id]], [moved])
+        self.assertEqual(self._queue(self.printer), [ids[0], moved] + ids[1:5])
+
+        # Spostamenti ripetuti nello stesso punto esauriscono lo spazio: la coda viene rinumerata
+        for _ in range(12):
+            first, second = self._queue(self.printer)[:2]
+            move_in_queue(self._queue(self.printer)[-1], self.printer.pk, after_id=first, before_id=second)
+        queue = self._queue(self.printer)
+        self.assertEqual(len(queue), 6)
+        positions = dict(PrintFile.objects.values_list('id', 'queue_position'))
+        self.assertEqual(len({positions[file_id] for file_id in queue}), 6)
+
+    def test_move_to_another_printer(self):
+        from .models import PrintStatsRollup
+        moved = self.files[2]
+        updates = self._post({'printer_id': self.other_printer.pk, 'file_id': moved.pk, 'after_id': None, 'before_id': None})
+        self.assertEqual(len(updates), 1)
+        self.assertEqual(self._queue(self.other_printer), [moved.pk])
+        self.assertNotIn(moved.pk, self._queue(self.printer))
+        self.assertEqual(
+            PrintStatsRollup.objects.get(printer=self.other_printer, material='').file_count, 1
+        )
+
+
+class PrintSchedulerTests(TestCase):
+    def setUp(self):
+        import datetime
+        from .models import Printer
+        from . import fragments
+        from .scheduling import invalidate_schedule
+        invalidate_schedule()
+        fragments.clear()
+        self.now = timezone.now()
+        self.printer = Printer.objects.create(name="Stampante A")
+        self.other_printer = Printer.objects.create(name="Stampante B")
+        self.on_time = WorkOrder.objects.create(
+            name="In tempo", status='PRINTING', delivery_date=(self.now + datetime.timedelta(days=10)).date()
+        )
+        self.late = WorkOrder.objects.create(name="In ritardo", status='TODO', delivery_date=timezone.localdate(self.now))
+        self.unassigned = WorkOrder.objects.create(name="Senza stampante", status='TODO')
+
+        self.printing = PrintFile.objects.create(
+            work_order=self.on_time, name="in_stampa", printer=self.printer, status='PRINTING', print_time_seconds=3600
+        )
+        PrintFile.objects.filter(pk=self.printing.pk).update(started_at=self.now - datetime.timedelta(minutes=30))
+        self.second = PrintFile.objects.create(
+            work_order=self.on_time, name="secondo", printer=self.printer, queue_position=2048, print_time_seconds=7200
+        )
+        self.first = PrintFile.objects.create(
+            work_order=self.late, name="primo", printer=self.printer, queue_position=1024, print_time_seconds=86400 * 2
+        )
+        self.other = PrintFile.objects.create(
+            work_order=self.late, name="altra", printer=self.other_printer, print_time_seconds=600
+        )
+        PrintFile.objects.create(work_order=self.unassigned, name="orfano", print_time_seconds=600)
+
+    def tearDown(self):
+        from .scheduling import invalidate_schedule
+        invalidate_schedule()
+
+    def test_simulates_each_printer_queue(self):
+        import datetime
+        from .scheduling import build_schedule
+        schedule = build_schedule(self.now)
+        minutes = lambda m: self.now + datetime.timedelta(minutes=m)
+
+        self.assertEqual(schedule.file(self.printing.pk).finish, minutes(30))
+        self.assertEqual(schedule.file(self.first.pk).start, minutes(30))
+        self.assertEqual(schedule.file(self.second.pk).start, minutes(30 + 2 * 24 * 60))
+        self.assertEqual(schedule.printer_finish(self.printer.pk), minutes(30 + 2 * 24 * 60 + 120))
+        self.assertEqual(schedule.file(self.other.pk).finish, minutes(10))
+
+        self.assertEqual(schedule.order(self.on_time.pk).finish, minutes(30 + 2 * 24 * 60 + 120))
+        self.assertFalse(schedule.order(self.on_time.pk).is_late)
+        self.assertEqual(schedule.order(self.late.pk).finish, minutes(30 + 2 * 24 * 60))
+        self.assertTrue(schedule.order(self.late.pk).is_late)
+        self.assertIsNone(schedule.order(self.unassigned.pk).finish)
+        self.assertEqual(schedule.order(self.unassigned.pk).unscheduled_files, 1)
+        self.assertEqual(schedule.late_orders, [self.late.pk])
+
+    def test_overdue_print_finishes_now(self):
+        import datetime
+        from .scheduling import build_schedule
+        PrintFile.objects.filter(pk=self.printing.pk).update(started_at=self.now - datetime.timedelta(hours=5))
+        schedule = build_schedule(self.now)
+        self.assertEqual(schedule.file(self.printing.pk).finish, self.now)
+        self.assertEqual(schedule.file(self.first.pk).start, self.now)
+
+    def test_schedule_is_cached_until_the_queue_changes(self):
+        from .scheduling import get_schedule
+        schedule = get_schedule()
+        with self.assertNumQueries(1):
+            self.assertIs(get_schedule(), schedule)
+        self.first.print_time_seconds = 60
+        self.first.save()
+        self.assertIsNot(get_schedule(), schedule)
+
+    def test_started_at_is_set_when_printing_starts(self):
+        self.first.status = 'PRINTING'
+        self.first.save()
+        self.first.refresh_from_db()
+        self.assertIsNotNone(self.first.started_at)
+        self.assertGreaterEqual(self.first.started_at, self.now)
+
+    @override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+    def test_views_show_projected_times(self):
+        import json
+        from django.contrib.auth.models import User
+        self.client.force_login(User.objects.create_user(username='testuser', password='password'))
+
+        response = self.client.get(reverse('print_queue_board'), HTTP_HX_REQUEST='true')
+        self.assertContains(response, 'Fine coda prevista')
+        self.assertIsNotNone(response.context['printers'][0].queue_finish)
+
+        response = self.client.get(reverse('project_gantt_board'))
+        tasks = {task['id']: task for task in json.loads(response.context['gantt_tasks_json'])}
+        self.assertTrue(tasks[str(self.late.pk)]['late'])
+        self.assertIn('bar-late', tasks[str(self.late.pk)]['custom_class'])
+        self.assertFalse(tasks[str(self.on_time.pk)]['late'])
+
+        response = self.client.get(reverse('project_dashboard'), HTTP_HX_REQUEST='true')
+        etas = {project.pk: project.eta for project in response.context['active_projects']}
+        self.assertTrue(etas[self.late.pk].is_late)
+
+
+class LoadBalancingTests(TestCase):
+    def setUp(self):
+        from django.contrib.auth.models import User
+        from .models import Printer, Plate
+        self.user = User.objects.create_user(username='testuser', password='password')
+        self.client.force_login(self.user)
+        self.printer_a = Printer.objects.create(name="Stampante A")
+        self.printer_b = Printer.objects.create(name="Stampante B")
+        self.texture_a = Plate.objects.create(name="Texture", printer=self.printer_a)
+        Plate.objects.create(name="Liscio", printer=self.printer_a)
+        self.liscio_b = Plate.objects.create(name="liscio ", printer=self.printer_b)
+
+        self.urgent = WorkOrder.objects.create(name="Urgente", status='TODO', priority='URGENT')
+        self.normal = WorkOrder.objects.create(name="Normale", status='TODO', priority='LOW')
+        hours = [4, 3, 3, 2, 2]
+        self.files = [
+            PrintFile.objects.create(
+                work_order=self.normal, name=f"file_{i}", printer=self.printer_a, print_time_seconds=h * 3600
+            )
+            for i, h in enumerate(hours)
+        ]
+        self.urgent_file = PrintFile.objects.create(
+            work_order=self.urgent, name="urgente", printer=self.printer_a, print_time_seconds=3600
+        )
+        self.texture_file = PrintFile.objects.create(
+            work_order=self.normal, name="texture", printer=self.printer_a, plate=self.texture_a, print_time_seconds=3600
+        )
+
+    def _printers(self):
+        return [self.printer_a.pk, self.printer_b.pk]
+
+    def test_makespan_plan_balances_printers(self):
+        from .load_balancing import build_balance_plan
+        plan = build_balance_plan(self._printers(), now=timezone.now())
+        loads = {printer_id: (finish - plan.now).total_seconds() / 3600 for printer_id, finish in plan.printer_finish.items()}
+        self.assertEqual(sum(loads.values()), 16)
+        self.assertLessEqual(max(loads.values()), 9)
+        self.assertEqual(plan.unassigned, [])
+
+        assignments = {a.file_id: a for a in plan.assignments}
+        # Il file con piatto Texture può restare solo sulla stampante A
+        self.assertEqual(assignments[self.texture_file.pk].printer_id, self.printer_a.pk)
+        # L'ordine urgente è il primo della sua coda
+        urgent = assignments[self.urgent_file.pk]
+        self.assertEqual(urgent.position, min(a.position for a in plan.assignments if a.printer_id == urgent.printer_id))
+
+    def test_plate_without_owner_is_left_unassigned(self):
+        from .load_balancing import build_balance_plan
+        # Con la sola stampante B si bilanciano i suoi file e quelli senza stampante
+        PrintFile.objects.filter(pk=self.texture_file.pk).update(printer=None)
+        plan = build_balance_plan([self.printer_b.pk])
+        self.assertEqual(plan.unassigned, [self.texture_file.pk])
+        self.assertTrue(all(a.printer_id == self.printer_b.pk for a in plan.assignments))
+
+    def test_lateness_objective_serves_priorities_first(self):
+        import datetime
+        from .load_balancing import build_balance_plan
+        now = timezone.now()
+        plan = build_balance_plan(self._printers(), objective='lateness', now=now)
+        urgent = next(a for a in plan.assignments if a.file_id == self.urgent_file.pk)
+        self.assertEqual(urgent.start, now)
+        self.assertEqual(urgent.finish, now + datetime.timedelta(hours=1))
+
+    def test_dry_run_then_apply(self):
+        import json
+        url = reverse('balance_print_queue')
+        response = self.client.post(url, json.dumps({'dry_run': True}), content_type='application/json')
+        preview = response.json()['plan']
+        self.assertGreater(preview['moved'], 0)
+        self.assertFalse(PrintFile.objects.filter(printer=self.printer_b).exists())
+
+        confirm = {'version': preview['version'], 'now': preview['now']}
+        response = self.client.post(url, json.dumps(confirm), content_type='application/json')
+        self.assertEqual(response.json()['status'], 'ok')
+        # Applicato esattamente il piano mostrato nell'anteprima
+        self.assertEqual(response.json()['plan']['assignments'], preview['assignments'])
+        moved = PrintFile.objects.filter(printer=self.printer_b)
+        self.assertEqual(moved.count(), preview['moved'])
+        for print_file in moved:
+            self.assertIn(print_file.plate_id, (None, self.liscio_b.pk))
+        self.texture_file.refresh_from_db()
+        self.assertEqual(self.texture_file.plate_id, self.texture_a.pk)
+
+    def test_apply_is_rejected_if_queue_changed_after_preview(self):
+        import json
+        url = reverse('balance_print_queue')
+        preview = self.client.post(url, json.dumps({'dry_run': True}), content_type='application/json').json()['plan']
+        PrintFile.objects.create(work_order=self.normal, name="nuovo", printer=self.printer_a, print_time_seconds=3600)
+
+        confirm = {'version': preview['version'], 'now': preview['now']}
+        response = self.client.post(url, json.dumps(confirm), content_type='application/json')
+        self.assertEqual(response.status_code, 409)
+        self.assertFalse(PrintFile.objects.filter(printer=self.printer_b).exists())
+        # Senza anteprima non si applica nulla
+        response = self.client.post(url, json.dumps({}), content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_files_on_excluded_printers_are_left_alone(self):
+        from .models import Printer
+        from .load_balancing import apply_balance_plan, build_balance_plan
+        printer_c = Printer.objects.create(name="Stampante C")
+        unassigned = PrintFile.objects.create(work_order=self.normal, name="senza stampante", print_time_seconds=3600)
+        # Si bilanciano solo B e C: i file della stampante A restano dove sono
+        plan = build_balance_plan([self.printer_b.pk, printer_c.pk])
+        self.assertEqual([a.file_id for a in plan.assignments], [unassigned.pk])
+        apply_balance_plan(plan)
+        self.assertEqual(PrintFile.objects.filter(printer=self.printer_a).count(), len(self.files) + 2)
+        unassigned.refresh_from_db()
+        self.assertIn(unassigned.printer_id, (self.printer_b.pk, printer_c.pk))
+
+    def test_invalid_objective_is_rejected(self):
+        import json
+        response = self.client.post(
+            reverse('balance_print_queue'), json.dumps({'objective': 'random'}), content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 400)
+
+
+class CsvExportTests(TestCase):
+    def setUp(self):
+        import datetime
+        from decimal import Decimal
+        from django.contrib.auth.models import User
+        from .models import StockItem, Expense, ExpenseCategory, PaymentMethod, Printer, Filament, Spool, FilamentUsage
+        self.client.force_login(User.objects.create_user(username='export'))
+        self.cash = PaymentMethod.objects.create(name="Cassa", balance=0)
+        StockItem.objects.create(name="Vaso", status='IN_STOCK', material_cost=Decimal('2.50'))
+        StockItem.objects.create(name="Lampada", status='SOLD', sale_price=Decimal('30.00'), sold_to="Mario", payment_method=self.cash)
+        category = ExpenseCategory.objects.create(name="Materiali")
+        Expense.objects.create(description="Bobine", amount=Decimal('40.00'), category=category, expense_date=datetime.date(2024, 3, 1))
+        Expense.objects.create(description="Ugelli", amount=Decimal('12.00'), expense_date=datetime.date(2025, 3, 1))
+
+        self.printer = Printer.objects.create(name="P1S")
+        spool = Spool.objects.create(
+            filament=Filament.objects.create(material='PLA', color_code='BLK', brand='Generic'),
+            initial_weight_g=1000, cost=Decimal('20.00'), identifier='A'
+        )
+        work_order = WorkOrder.objects.create(name="Ordine Export")
+        done = PrintFile.objects.create(work_order=work_order, name="done.gcode", status='DONE', printer=self.printer, print_time_seconds=5400)
+        PrintFile.objects.create(work_order=work_order, name="todo.gcode", status='TODO', printer=self.printer)
+        FilamentUsage.objects.create(print_file=done, spool=spool, grams_used=Decimal('150.00'))
+
+    def _rows(self, response):
+        from django.http import StreamingHttpResponse
+        self.assertIsInstance(response, StreamingHttpResponse)
+        content = b''.join(response.streaming_content).decode('utf-8')
+        self.assertTrue(content.startswith('\ufeff'))
+        return [line.split(';') for line in content.lstrip('\ufeff').splitlines()]
+
+    def test_stock_sales_export_keeps_format_and_accepts_filters(self):
+        rows = self._rows(self.client.get(reverse('export_stock_sales_csv')))
+        self.assertEqual(rows[0][0], 'ID Oggetto')
+        self.assertEqual(len(rows), 3)
+
+        rows = self._rows(self.client.get(reverse('export_csv', args=['magazzino-vendite']), {'status': 'SOLD', 'sold_to': 'mar'}))
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(rows[1][3], 'Lampada')
+        self.assertEqual(rows[1][13], '30,00')
+        self.assertEqual(rows[1][16], 'Cassa')
+
+    def test_exports_use_dashboard_search(self):
+        # Plurale e prefisso trovano gli stessi oggetti della ricerca full-text delle dashboard
+        rows = self._rows(self.client.get(reverse('export_csv', args=['magazzino-vendite']), {'q': 'lampade', 'status': 'SOLD'}))
+        self.assertEqual([row[3] for row in rows[1:]], ['Lampada'])
+        rows = self._rows(self.client.get(reverse('export_stock_sales_csv'), {'q': 'vas'}))
+        self.assertEqual([row[3] for row in rows[1:]], ['Vaso'])
+        rows = self._rows(self.client.get(reverse('export_csv', args=['spese']), {'q': 'ugell'}))
+        self.assertEqual([row[2] for row in rows[1:]], ['Ugelli'])
+
+    def test_inventory_export_link_keeps_dashboard_filters(self):
+        from django.test import override_settings
+        with override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage'):
+            response = self.client.get(reverse('inventory_dashboard'), {'q': 'Vaso', 'status': 'IN_STOCK'})
+        self.assertContains(response, f"{reverse('export_stock_sales_csv')}?q=Vaso&amp;status=IN_STOCK")
+
+    def test_expenses_export_uses_accounting_filters(self):
+        rows = self._rows(self.client.get(reverse('export_csv', args=['spese']), {'year': '2024'}))
+        self.assertEqual([row[2] for row in rows[1:]], ['Bobine'])
+        self.assertEqual(rows[1][1], '01/03/2024')
+        self.assertEqual(rows[1][3], 'Materiali')
+
+    def test_print_history_and_filament_usage_exports(self):
+        rows = self._rows(self.client.get(reverse('export_csv', args=['storico-stampe']), {'printer': str(self.printer.id)}))
+        self.assertEqual([row[3] for row in rows[1:]], ['done.gcode'])
+        self.assertEqual(rows[1][9], '1,50')
+        self.assertEqual(rows[1][11], '150,00')
+
+        rows = self._rows(self.client.get(reverse('export_csv', args=['consumi-filamento'])))
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(rows[1][7:], ['150,00', '3,00'])
+
+    def test_rows_are_streamed_in_chunks(self):
+        import math
+        from . import exports
+        from .models import Expense
+        Expense.objects.bulk_create([Expense(description=f"Spesa {i}", amount=1) for i in range(450)])
+        chunks = list(exports.EXPORTS['spese'].lines({}))
+        # intestazione + 452 righe in blocchi da ROWS_PER_WRITE
+        self.assertEqual(len(chunks), 1 + math.ceil(452 / exports.ROWS_PER_WRITE))
+
+    def test_unknown_export_returns_404(self):
+        self.assertEqual(self.client.get(reverse('export_csv', args=['inesistente'])).status_code, 404)
+
+
+class IdSequenceTests(TestCase):
+    def test_first_allocation_continues_existing_ids(self):
+        from .sequences import next_work_order_id
+        WorkOrder.objects.create(name="Vecchio", custom_id="25999")
+        WorkOrder.objects.create(name="Vecchissimo", custom_id="251000")
+        WorkOrder.objects.create(name="Anno prima", custom_id="24050")
+        self.assertEqual(next_work_order_id(2025), "251001")
+        self.assertEqual(next_work_order_id(2025), "251002")
+        self.assertEqual(next_work_order_id(2024), "24051")
+
+    def test_rolled_back_allocation_leaves_no_gap(self):
+        from django.db import transaction
+        from .sequences import next_work_order_id
+        self.assertEqual(next_work_order_id(2025), "25001")
+        try:
+            with transaction.atomic():
+                self.assertEqual(next_work_order_id(2025), "25002")
+                raise ValueError
+        except ValueError:
+            pass
+        self.assertEqual(next_work_order_id(2025), "25002")
+
+    def test_taken_id_fast_forwards_the_sequence(self):
+        from .sequences import next_work_order_id
+        self.assertEqual(next_work_order_id(2025), "25001")
+        # ID inseriti a mano (es. dall'admin) dopo l'avvio della sequenza
+        WorkOrder.objects.create(name="Manuale 1", custom_id="25002")
+        WorkOrder.objects.create(name="Manuale 2", custom_id="25003")
+        self.assertEqual(next_work_order_id(2025), "25004")
+
+    def test_manual_stock_items_use_the_sequence(self):
+        from django.contrib.auth.models import User
+        from .models import StockItem
+        from .sequences import format_custom_id
+        from django.utils import timezone
+        self.client.force_login(User.objects.create_user(username='sequence'))
+        for name in ("Primo", "Secondo"):
+            response = self.client.post(reverse('add_stock_item'), {
+                'name': name, 'quantity': 1, 'suggested_price': '10.00', 'material_cost': '1.00'
+            })
+            self.assertEqual(response.status_code, 200)
+        year = timezone.localdate().year
+        self.assertEqual(
+            list(StockItem.objects.order_by('id').values_list('custom_id', flat=True)),
+            [format_custom_id(year, 1), format_custom_id(year, 2)]
+        )
+        # Nessuna ricerca dell'ultimo ID: solo l'incremento del contatore e il controllo di unicità
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from .sequences import next_stock_item_id
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(next_stock_item_id(year), format_custom_id(year, 3))
+        self.assertFalse([q['sql'] for q in ctx.captured_queries if 'LIKE' in q['sql'] or 'REGEXP' in q['sql']])
+
+    def test_seed_command_aligns_sequences(self):
+        from io import StringIO
+        from django.core.management import call_command
+        from .models import IdSequence, StockItem
+        WorkOrder.objects.create(name="Ordine", custom_id="24012")
+        StockItem.objects.create(name="Oggetto", custom_id="24030")
+        call_command('seed_id_sequences', stdout=StringIO())
+        self.assertEqual(
+            set(IdSequence.objects.values_list('entity', 'year', 'last_value')),
+            {('work_order', 2024, 12), ('stock_item', 2024, 30)}
+        )
+
+
+class QueryPlanTests(TestCase):
+    """Le interrogazioni principali delle dashboard non devono leggere per intero le tabelle grandi."""
+    LARGE_TABLES = (
+        'app_3dmage_management_printfile', 'app_3dmage_management_workorder', 'app_3dmage_management_stockitem',
+        'app_3dmage_management_filamentusage', 'app_3dmage_management_expense',
+    )
+
+    def assertNoFullScan(self, queryset):
+        import re
+        from django.db import connection
+        if connection.vendor != 'sqlite':
+            self.skipTest("Piano di esecuzione verificato solo su SQLite")
+        plan = queryset.explain()
+        # "SCAN tabella" senza indice è una lettura completa; "SEARCH ... USING INDEX" no
+        full_scans = [
+            line for line in plan.splitlines()
+            if re.search(r'\bSCAN (%s)\b(?! USING)' % '|'.join(self.LARGE_TABLES), line)
+        ]
+        self.assertFalse(full_scans, f"Lettura completa di tabella:\n{plan}")
+
+    def test_print_queue_board(self):
+        self.assertNoFullScan(PrintFile.objects.filter(printer_id=1, status__in=['TODO', 'PRINTING']).order_by('queue_position'))
+        self.assertNoFullScan(PrintFile.objects.filter(status='PRINTING'))
+
+    def test_completed_work_orders(self):
+        self.assertNoFullScan(WorkOrder.objects.filter(status='DONE', completed_at__year=2024))
+        self.assertNoFullScan(WorkOrder.objects.filter(status='DONE', completed_at__isnull=False).dates('completed_at', 'year'))
+
+    def test_sales_and_stock(self):
+        from .models import StockItem
+        self.assertNoFullScan(StockItem.objects.filter(status='SOLD', sold_at__gte='2024-01-01'))
+        self.assertNoFullScan(StockItem.objects.filter(work_order_id=1, name='Vaso', status='POST_PROD'))
+
+    def test_spool_usage_by_print_status(self):
+        from .models import FilamentUsage
+        self.assertNoFullScan(FilamentUsage.objects.filter(spool_id=1, print_file__status__in=['DONE', 'FAILED']))
+        self.assertNoFullScan(
+            FilamentUsage.objects.filter(spool_id__in=[1, 2], print_file__status__in=['TODO', 'PRINTING']).values('spool_id')
+        )
+
+    def test_expenses_by_year(self):
+        from .models import Expense
+        self.assertNoFullScan(Expense.objects.filter(expense_date__year=2024))
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        import datetime
+        from django.contrib.auth.models import User
+        from .models import StockItem, PaymentMethod
+        self.user = User.objects.create_user(username='testuser', password='password')
+        self.client.force_login(self.user)
+        method = PaymentMethod.objects.create(name="SumUp")
+        # Prezzi ripetuti e date uguali: lo spareggio sull'id deve evitare righe perse o doppie
+        for index in range(23):
+            StockItem.objects.create(
+                name=f'Vaso {index}', status='SOLD', quantity=1 + index % 2, sale_price=10 + index % 4,
+                sold_at=datetime.date(2024, 1 + index % 3, 10), payment_method=method if index % 5 else None
+            )
+
+    def walk(self, queryset, ordering, page_size=5):
+        from .pagination import keyset_page
+        seen, cursor = [], None
+        while True:
+            page = keyset_page(queryset, ordering, cursor, page_size=page_size)
+            seen.extend(item.pk for item in page)
+            if not page.has_next:
+                return seen
+            cursor = page.next_cursor
+
+    def test_pages_cover_every_row_once_in_order(self):
+        from .models import StockItem
+        from .pagination import keyset_page
+        sold = StockItem.objects.filter(status='SOLD').with_net_values()
+        for ordering in (['-sold_at'], ['sale_price'], ['-annotated_net_revenue'], ['payment_method__name'], ['name']):
+            with self.subTest(ordering=ordering):
+                seen = self.walk(sold, ordering)
+                self.assertEqual(len(seen), len(set(seen)))
+                self.assertEqual(seen, [item.pk for item in keyset_page(sold, ordering, page_size=100)])
+
+    def test_invalid_cursor_restarts_from_the_first_page(self):
+        from .models import StockItem
+        from .pagination import keyset_page
+        sold = StockItem.objects.filter(status='SOLD')
+        first = keyset_page(sold, ['-sold_at'], page_size=5)
+        for cursor in ('not-a-cursor', 'WyJ4Il0'):
+            page = keyset_page(sold, ['-sold_at'], cursor, page_size=5)
+            self.assertTrue(page.is_first)
+            self.assertEqual([item.pk for item in page], [item.pk for item in first])
+
+    @override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+    def test_sales_rows_are_loaded_by_htmx_with_the_same_totals(self):
+        from django.db.models import Sum
+        from django.urls import reverse
+        from .pagination import PAGE_SIZE
+        from .models import StockItem
+        from datetime import date
+        for index in range(PAGE_SIZE):
+            StockItem.objects.create(name=f'Lampada {index}', status='SOLD', sale_price=5, sold_at=date(2024, 5, 1))
+        url = reverse('sales_dashboard')
+        response = self.client.get(url, {'sort': 'sold_at', 'order': 'desc'})
+        self.assertEqual(len(response.context['sold_items']), PAGE_SIZE)
+        self.assertEqual(response.context['total_sales'], StockItem.objects.filter(status='SOLD').with_net_values().aggregate(
+            total=Sum('annotated_net_revenue')
+        )['total'])
+        next_query = response.context['next_query']
+        self.assertNotIn('v=', next_query)
+
+        rows = self.client.get(f'{url}?{next_query}', HTTP_HX_REQUEST='true')
+        self.assertTemplateUsed(rows, 'app_3dmage_management/partials/sales_rows.html')
+        self.assertTemplateNotUsed(rows, 'app_3dmage_management/sales.html')
+        self.assertEqual(len(rows.context['sold_items']), StockItem.objects.filter(status='SOLD').count() - PAGE_SIZE)
+        self.assertFalse(rows.context['sold_items'].has_next)
+
+class SearchIndexTests(TestCase):
+    def setUp(self):
+        from django.contrib.auth.models import User
+        self.user = User.objects.create_user(username='testuser', password='password')
+        self.client.force_login(self.user)
+
+    def titles(self, query):
+        from .search import search
+        return [(entry.kind, entry.title) for entry in search(query)]
+
+    def test_index_follows_saves_and_deletes(self):
+        from .models import StockItem, SearchEntry
+        item = StockItem.objects.create(name='Vaso Città', quantity=1, notes='smalto lucido')
+        for query in ('vaso', 'VAS', 'citta', 'vasi', 'smalt'):
+            self.assertEqual(self.titles(query), [('stock_item', 'Vaso Città')], query)
+
+        item.status = StockItem.Status.SOLD
+        item.sold_to = 'Mario Rossi'
+        item.save()
+        self.assertEqual(self.titles('vaso rossi'), [('sale', 'Vaso Città')])
+        self.assertEqual(SearchEntry.objects.filter(object_id=item.pk).count(), 1)
+
+        item.delete()
+        self.assertEqual(self.titles('vaso'), [])
+        self.assertFalse(SearchEntry.objects.exists())
+
+    def test_keyword_matches_rank_above_notes(self):
+        WorkOrder.objects.create(name="Supporto cuffie", notes="Cliente abituale")
+        Project.objects.create(name="Lampada luna", notes="Variante con supporti in legno")
+        self.assertEqual(self.titles('supporti'), [('work_order', 'Supporto cuffie'), ('project', 'Lampada luna')])
+        self.assertEqual(self.titles('lampada supporto'), [('project', 'Lampada luna')])
+        self.assertEqual(self.titles('"*'), [])
+
+    def test_rebuild_matches_signal_entries(self):
+        import datetime
+        from io import StringIO
+        from django.core.management import call_command
+        from .models import Expense, SearchEntry, StockItem
+        WorkOrder.objects.create(name="Ordine Rebuild", custom_id='25001')
+        StockItem.objects.create(name='Gufo', status='SOLD', sold_at=datetime.date(2024, 3, 1))
+        Expense.objects.create(description='Corriere', amount=12, expense_date=datetime.date(2024, 3, 2))
+        fields = ('kind', 'object_id', 'title', 'subtitle', 'keywords', 'body')
+        before = sorted(SearchEntry.objects.values_list(*fields))
+        call_command('rebuild_search_index', stdout=StringIO())
+        self.assertEqual(sorted(SearchEntry.objects.values_list(*fields)), before)
+        self.assertEqual(self.titles('25001'), [('work_order', 'Ordine Rebuild')])
+
+    @override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+    def test_views_filter_through_the_index(self):
+        import datetime
+        from django.urls import reverse
+        from .models import Expense, StockItem
+        StockItem.objects.create(name='Portachiavi drago', quantity=2)
+        StockItem.objects.create(name='Portachiavi gatto', quantity=2)
+        StockItem.objects.create(name='Portachiavi drago', status='SOLD', sold_at=datetime.date(2024, 5, 1))
+        Expense.objects.create(description='Filamento drago verde', amount=20, expense_date=datetime.date(2024, 5, 2))
+        order = WorkOrder.objects.create(name='Draghi per fiera')
+
+        response = self.client.get(reverse('inventory_dashboard'), {'q': 'draghi'})
+        self.assertEqual([item.name for item in response.context['stock_items']], ['Portachiavi drago'])
+        response = self.client.get(reverse('sales_dashboard'), {'q': 'drag'})
+        self.assertEqual(len(response.context['sold_items']), 1)
+        response = self.client.get(reverse('accounting_dashboard'), {'q': 'drago'})
+        self.assertEqual(len(response.context['income_items']), 0)
+        self.assertEqual([expense.description for expense in response.context['expenses']], ['Filamento drago verde'])
+        response = self.client.get(reverse('project_dashboard'), {'q': 'drago'})
+        self.assertEqual([project.pk for project in response.context['active_projects']], [order.pk])
+
+        response = self.client.get(reverse('search_dashboard'), {'q': 'drago'})
+        self.assertEqual(len(response.context['results']), 4)
+        self.assertTemplateUsed(response, 'app_3dmage_management/search.html')
+        response = self.client.get(reverse('search_dashboard'), {'q': 'gatto'}, HTTP_HX_REQUEST='true')
+        self.assertTemplateNotUsed(response, 'app_3dmage_management/search.html')
+        self.assertContains(response, reverse('inventory_dashboard'))
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class FragmentCacheTests(TestCase):
+    def setUp(self):
+        from django.contrib.auth.models import User
+        from . import fragments
+        fragments.clear()
+        self.user = User.objects.create_user(username='testuser', password='password')
+        self.client.force_login(self.user)
+
+    def htmx_get(self, name, params=None):
+        return self.client.get(reverse(name), params or {}, HTTP_HX_REQUEST='true')
+
+    def test_clients_share_one_render_per_version(self):
+        from .models import StockItem
+        StockItem.objects.create(name='Drago', quantity=1)
+        first = self.htmx_get('inventory_dashboard', {'sort': 'name', 'v': '0'})
+        self.assertContains(first, 'Drago')
+        # Stessi filtri, versione nota diversa: HTML già pronto, solo sessione e versione del dominio
+        with self.assertNumQueries(3):
+            second = self.htmx_get('inventory_dashboard', {'v': '1', 'sort': 'name'})
+        self.assertEqual(second.content, first.content)
+
+        other = self.htmx_get('inventory_dashboard', {'sort': 'quantity'})
+        self.assertIsNotNone(other.context)
+
+        StockItem.objects.create(name='Grifone', quantity=1)
+        self.assertContains(self.htmx_get('inventory_dashboard', {'sort': 'name'}), 'Grifone')
+
+    def test_queue_and_active_orders_follow_both_domains(self):
+        from .models import Printer
+        printer = Printer.objects.create(name='Stampante Cache')
+        order = WorkOrder.objects.create(name='Ordine Cache', status='TODO')
+        self.htmx_get('print_queue_board')
+        self.htmx_get('project_dashboard', {'view': 'active'})
+        self.assertIsNone(self.htmx_get('print_queue_board').context)
+        self.assertIsNone(self.htmx_get('project_dashboard', {'view': 'active'}).context)
+
+        PrintFile.objects.create(work_order=order, name='cache.gcode', printer=printer, print_time_seconds=3600)
+        self.assertContains(self.htmx_get('print_queue_board'), 'cache.gcode')
+        # Il nuovo file cambia le stime dell'ordine: anche la tabella ordini va ricalcolata
+        self.assertIsNotNone(self.htmx_get('project_dashboard', {'view': 'active'}).context)
+
+    def test_queue_follows_filament_changes(self):
+        from .models import Printer, Filament
+        printer = Printer.objects.create(name='Stampante Filamenti')
+        order = WorkOrder.objects.create(name='Ordine Filamenti', status='TODO')
+        PrintFile.objects.create(work_order=order, name='colore.gcode', printer=printer, print_time_seconds=3600)
+        self.htmx_get('print_queue_board')
+        self.assertIsNone(self.htmx_get('print_queue_board').context)
+
+        # Materiali e bobine mostrati nella coda: una modifica ai filamenti ricalcola il parziale
+        Filament.objects.create(material='PLA', color_code='RED', brand='Test', color_hex='#FF0000')
+        self.assertIsNotNone(self.htmx_get('print_queue_board').context)
+
+    def test_full_pages_are_not_cached(self):
+        self.client.get(reverse('inventory_dashboard'))
+        self.assertIsNotNone(self.client.get(reverse('inventory_dashboard')).context)
+
+
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        from django.contrib.auth.models import User
+        self.user = User.objects.create_user(username='testuser', password='password')
+        self.client.force_login(self.user)
+
+    def test_unchanged_data_returns_304_without_queries(self):
+        from .models import Filament
+        Filament.objects.create(material='PLA', color_code='001', brand='Test', color_hex='#000000')
+        url = reverse('api_get_all_filaments')
+        first = self.client.get(url)
+        self.assertEqual(first.status_code, 200)
+        self.assertIn('no-cache', first['Cache-Control'])
+        etag = first['ETag']
+        # Solo sessione, utente e versioni: l'elenco dei filamenti non viene letto
+        with self.assertNumQueries(3):
+            cached = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(cached.status_code, 304)
+        self.assertEqual(cached.content, b'')
+
+        Filament.objects.create(material='PETG', color_code='002', brand='Test', color_hex='#FFFFFF')
+        changed = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed['ETag'], etag)
+        self.assertEqual(len(changed.json()), 2)
+
+    def test_plates_and_costs_follow_printer_changes(self):
+        from .models import Printer, Plate
+        printer = Printer.objects.create(name='Stampante ETag')
+        plates_url = f"{reverse('ajax_load_plates')}?printer_id={printer.id}"
+        plates_etag = self.client.get(plates_url)['ETag']
+        costs_etag = self.client.get(reverse('api_get_costs'))['ETag']
+
+        Plate.objects.create(name='Liscio', printer=printer)
+        response = self.client.get(plates_url, HTTP_IF_NONE_MATCH=plates_etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([plate['name'] for plate in response.json()], ['Liscio'])
+        self.assertEqual(self.client.get(reverse('api_get_costs'), HTTP_IF_NONE_MATCH=costs_etag).status_code, 200)
+
+    def test_notifications_etag_changes_when_marked_as_read(self):
+        from .models import Notification
+        from .changefeed import NOTIFICATIONS, get_domain_versions
+        Notification.objects.create(message='Prova')
+        url = reverse('api_get_notifications')
+        first = self.client.get(url)
+        self.assertEqual(first.json()['count'], 1)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag']).status_code, 304)
+
+        version = get_domain_versions((NOTIFICATIONS,))[NOTIFICATIONS]
+        self.client.post(reverse('api_mark_notifications_as_read'))
+        self.assertNotEqual(get_domain_versions((NOTIFICATIONS,))[NOTIFICATIONS], version)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['count'], 0)
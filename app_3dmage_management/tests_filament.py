@@ -56,3 +56,373 @@ class FilamentWeightTests(TestCase):
 
         self.assertEqual(data[0]['id'], self.spool1.id)
         self.assertEqual(data[1]['id'], self.spool2.id)
+
+
+class SpoolLedgerTests(TestCase):
+    def setUp(self):
+        self.filament = Filament.objects.create(
+            material='PLA', color_code='WHT', brand='Generic', color_hex='#FFFFFF'
+        )
+        self.spool = Spool.objects.create(
+            filament=self.filament, initial_weight_g=1000, identifier='A', cost=20
+        )
+        self.wo = WorkOrder.objects.create(name="Ledger WO")
+
+    def _ledger(self):
+        from .models import SpoolLedger
+        return SpoolLedger.objects.get(spool=self.spool)
+
+    def test_ledger_follows_print_file_status(self):
+        """Il registro sposta i grammi da impegnati a consumati quando la stampa viene completata."""
+        pf = PrintFile.objects.create(work_order=self.wo, name="Job", status='TODO')
+        FilamentUsage.objects.create(print_file=pf, spool=self.spool, grams_used=250)
+
+        ledger = self._ledger()
+        self.assertEqual(ledger.committed_grams, Decimal('250.00'))
+        self.assertEqual(ledger.consumed_grams, Decimal('0.00'))
+        self.assertEqual(ledger.available_grams, Decimal('750.00'))
+
+        pf = PrintFile.objects.get(id=pf.id)
+        pf.status = 'DONE'
+        pf.save()
+
+        ledger = self._ledger()
+        self.assertEqual(ledger.committed_grams, Decimal('0.00'))
+        self.assertEqual(ledger.consumed_grams, Decimal('250.00'))
+        self.assertEqual(ledger.available_grams, Decimal('750.00'))
+
+    def test_ledger_updates_on_cascade_delete_and_adjustment(self):
+        """Eliminando l'ordine (cascata) o correggendo il peso, il registro resta allineato."""
+        pf = PrintFile.objects.create(work_order=self.wo, name="Job", status='TODO')
+        FilamentUsage.objects.create(print_file=pf, spool=self.spool, grams_used=100)
+
+        self.wo.delete()
+        self.assertEqual(self._ledger().committed_grams, Decimal('0.00'))
+
+        self.spool.weight_adjustment = Decimal('-50.00')
+        self.spool.save()
+        self.assertEqual(self._ledger().available_grams, Decimal('950.00'))
+
+    def test_properties_read_ledger_without_aggregates(self):
+        """Con select_related('ledger') le proprietà di peso non eseguono query."""
+        pf = PrintFile.objects.create(work_order=self.wo, name="Job", status='DONE')
+        FilamentUsage.objects.create(print_file=pf, spool=self.spool, grams_used=100)
+
+        spool = Spool.objects.select_related('ledger').get(id=self.spool.id)
+        with self.assertNumQueries(0):
+            self.assertEqual(spool.remaining_weight, Decimal('900.00'))
+            self.assertEqual(spool.pending_weight, Decimal('0.00'))
+            self.assertEqual(spool.available_weight, Decimal('900.00'))
+
+    def test_rebuild_and_verify_command(self):
+        from django.core.management import call_command
+        from django.core.management.base import CommandError
+        from .models import SpoolLedger
+
+        pf = PrintFile.objects.create(work_order=self.wo, name="Job", status='TODO')
+        FilamentUsage.objects.create(print_file=pf, spool=self.spool, grams_used=100)
+        call_command('rebuild_spool_ledger', '--verify', stdout=open('/dev/null', 'w'))
+
+        # Un aggiornamento che salta i segnali disallinea il registro
+        PrintFile.objects.filter(id=pf.id).update(status='DONE')
+        with self.assertRaises(CommandError):
+            call_command('rebuild_spool_ledger', '--verify', stdout=open('/dev/null', 'w'))
+
+        call_command('rebuild_spool_ledger', stdout=open('/dev/null', 'w'))
+        self.assertEqual(SpoolLedger.objects.get(spool=self.spool).consumed_grams, Decimal('100.00'))
+
+
+class SpoolWeightsQuerySetTests(TestCase):
+    def setUp(self):
+        from django.contrib.auth.models import User
+        self.user = User.objects.create_user(username='testuser', password='password')
+        self.client.force_login(self.user)
+        self.filament = Filament.objects.create(
+            material='PETG', color_code='RED', brand='Generic', color_hex='#FF0000'
+        )
+        self.full = Spool.objects.create(filament=self.filament, initial_weight_g=1000, identifier='A', cost=20)
+        self.partial = Spool.objects.create(
+            filament=self.filament, initial_weight_g=1000, identifier='B', cost=20, weight_adjustment=Decimal('-50.00')
+        )
+        self.inactive = Spool.objects.create(filament=self.filament, initial_weight_g=750, identifier='C', cost=15, is_active=False)
+        self.empty = Spool.objects.create(filament=self.filament, initial_weight_g=250, identifier='D', cost=5)
+
+        wo = WorkOrder.objects.create(name="Pesi WO")
+        done = PrintFile.objects.create(work_order=wo, name="Done", status='DONE')
+        todo = PrintFile.objects.create(work_order=wo, name="Todo", status='TODO')
+        FilamentUsage.objects.create(print_file=done, spool=self.partial, grams_used=Decimal('400.00'))
+        FilamentUsage.objects.create(print_file=todo, spool=self.partial, grams_used=Decimal('120.50'))
+        FilamentUsage.objects.create(print_file=done, spool=self.empty, grams_used=Decimal('250.00'))
+
+    def test_annotations_match_properties(self):
+        for spool in Spool.objects.with_weights():
+            plain = Spool.objects.get(pk=spool.pk)
+            self.assertEqual(spool.remaining_grams, plain.remaining_weight)
+            self.assertEqual(spool.pending_grams, plain.pending_weight)
+            self.assertEqual(spool.available_grams, plain.available_weight)
+
+    def test_available_filters_and_orders_in_sql(self):
+        with self.assertNumQueries(1):
+            spools = list(Spool.objects.available().filter(filament=self.filament))
+        self.assertEqual([spool.pk for spool in spools], [self.partial.pk, self.full.pk])
+
+    def test_spool_picker_endpoints_use_a_single_query(self):
+        from django.urls import reverse
+        with self.assertNumQueries(4):  # sessione, utente, versioni (ETag), bobine
+            data = self.client.get(reverse('get_spools_for_filament'), {'filament_id': self.filament.pk}).json()
+        self.assertEqual([spool['id'] for spool in data], [self.partial.pk, self.full.pk])
+        self.assertEqual(Decimal(data[0]['remaining']), Decimal('429.50'))
+
+        with self.assertNumQueries(5):  # sessione, utente, versioni (ETag), filamento, bobine con totali
+            data = self.client.get(reverse('api_get_filament_spools', args=[self.filament.pk])).json()
+        self.assertEqual(len(data['active_spools']), 3)
+        self.assertEqual(len(data['inactive_spools']), 1)
+        # Fisico: 1000 + 550 + 0; impegnato: 120.50
+        self.assertEqual(data['filament_available'], 1429.5)
+
+
+class SpoolAllocatorTests(TestCase):
+    def setUp(self):
+        self.filament = Filament.objects.create(
+            material='PLA', color_code='GRN', brand='Generic', color_hex='#00FF00'
+        )
+        self.new_spool = Spool.objects.create(filament=self.filament, initial_weight_g=1000, identifier='A', cost=20)
+        self.started_spool = Spool.objects.create(filament=self.filament, initial_weight_g=1000, identifier='B', cost=20)
+        self.small_spool = Spool.objects.create(filament=self.filament, initial_weight_g=250, identifier='C', cost=8)
+        wo = WorkOrder.objects.create(name="Allocazione WO")
+        done = PrintFile.objects.create(work_order=wo, name="Done", status='DONE')
+        FilamentUsage.objects.create(print_file=done, spool=self.started_spool, grams_used=Decimal('600.00'))
+
+    def _allocator(self):
+        from .allocation import SpoolAllocator
+        return SpoolAllocator.for_filaments([self.filament.id])
+
+    def _demands(self, *grams):
+        from .allocation import Demand
+        return [Demand(i, self.filament.id, Decimal(g)) for i, g in enumerate(grams)]
+
+    def test_prefers_started_spools(self):
+        plan = self._allocator().allocate(self._demands('200.00'))
+        self.assertEqual([(spool.id, grams) for spool, grams in plan.parts(0)], [(self.started_spool.id, Decimal('200.00'))])
+
+    def test_whole_order_never_overdraws_a_spool(self):
+        allocator = self._allocator()
+        plan = allocator.allocate(self._demands(*['45.50'] * 30))
+        used = {}
+        for parts in plan.allocations.values():
+            for spool, grams in parts:
+                used[spool.id] = used.get(spool.id, Decimal('0')) + grams
+        self.assertEqual(sum(used.values()), Decimal('1365.00'))
+        self.assertLessEqual(used.get(self.started_spool.id, 0), Decimal('400.00'))
+        self.assertLessEqual(used.get(self.small_spool.id, 0), Decimal('250.00'))
+        self.assertEqual(plan.shortfalls, {})
+
+    def test_splits_when_no_spool_is_large_enough(self):
+        plan = self._allocator().allocate(self._demands('1200.00'))
+        parts = plan.parts(0)
+        self.assertGreater(len(parts), 1)
+        self.assertEqual(sum(grams for _, grams in parts), Decimal('1200.00'))
+        self.assertEqual(parts[0], (self.new_spool, Decimal('1000.00')))
+        self.assertEqual(plan.shortfalls, {})
+
+    def test_reports_shortfall_but_keeps_usage_complete(self):
+        plan = self._allocator().allocate(self._demands('1500.00', '300.00'))
+        self.assertEqual(plan.shortfalls, {self.filament.id: Decimal('150.00')})
+        # Tutta la domanda resta assegnata; i 150g oltre il disponibile (1000 + 400 + 250) sono segnalati
+        self.assertEqual(sum(grams for _, grams in plan.parts(0)) + sum(grams for _, grams in plan.parts(1)), Decimal('1800.00'))
+        self.assertEqual(sum(plan.overcommitted.values()), Decimal('150.00'))
+        self.assertEqual(plan.unassigned(), {})
+
+    def test_filament_without_active_spools_uses_latest_finished_spool(self):
+        from .allocation import Demand, SpoolAllocator
+        other = Filament.objects.create(material='PETG', color_code='RED', brand='Generic', color_hex='#FF0000')
+        Spool.objects.create(filament=other, initial_weight_g=1000, identifier='V', cost=20, is_active=False)
+        finished = Spool.objects.create(filament=other, initial_weight_g=1000, identifier='F', cost=20, is_active=False)
+        plan = SpoolAllocator.for_filaments([other.id]).allocate([Demand(0, other.id, Decimal('80.00'))])
+        self.assertEqual(plan.parts(0), [(finished, Decimal('80.00'))])
+        self.assertEqual(plan.shortfalls, {other.id: Decimal('80.00')})
+
+    def test_filament_without_spools_is_reported_unassigned(self):
+        from .allocation import Demand, SpoolAllocator
+        other = Filament.objects.create(material='PETG', color_code='RED', brand='Generic', color_hex='#FF0000')
+        plan = SpoolAllocator.for_filaments([other.id]).allocate([Demand(0, other.id, Decimal('80.00'))])
+        self.assertEqual(plan.parts(0), [])
+        self.assertEqual(plan.unassigned(), {other.id: Decimal('80.00')})
+
+    def test_master_cloner_keeps_full_bom_and_notifies_shortage(self):
+        from django.urls import reverse
+        from .cloning import MasterCloner
+        from .models import Notification, Project, MasterPrintFile, MasterFilamentUsage
+        project = Project.objects.create(name="Progetto Enorme")
+        mpf = MasterPrintFile.objects.create(project=project, name="enorme.gcode", produced_quantity=1)
+        MasterFilamentUsage.objects.create(master_print_file=mpf, filament=self.filament, grams_used=Decimal('2000.00'))
+        work_order = WorkOrder.objects.create(name="Ordine Enorme", project=project)
+
+        cloner = MasterCloner(project, work_order)
+        cloner.plan_single_set()
+        cloner.save()
+        usages = FilamentUsage.objects.filter(print_file__work_order=work_order)
+        self.assertEqual(sum(u.grams_used for u in usages), Decimal('2000.00'))
+        self.assertIn('350.0g', cloner.shortfall_summary())
+        notification = Notification.objects.get(is_read=False)
+        self.assertEqual(notification.level, Notification.NotificationLevel.WARNING)
+        self.assertEqual(notification.related_url, reverse('project_detail', args=[work_order.id]))
+
+    def test_master_cloner_splits_large_usages(self):
+        from .cloning import MasterCloner
+        from .models import Project, MasterPrintFile, MasterFilamentUsage
+        project = Project.objects.create(name="Progetto Grande")
+        mpf = MasterPrintFile.objects.create(project=project, name="grande.gcode", produced_quantity=1)
+        MasterFilamentUsage.objects.create(master_print_file=mpf, filament=self.filament, grams_used=Decimal('1100.00'))
+        work_order = WorkOrder.objects.create(name="Ordine Grande", project=project)
+
+        cloner = MasterCloner(project, work_order)
+        cloner.plan_single_set()
+        cloner.save()
+        usages = FilamentUsage.objects.filter(print_file__work_order=work_order)
+        self.assertEqual(usages.count(), 2)
+        self.assertEqual(sum(u.grams_used for u in usages), Decimal('1100.00'))
+        self.assertEqual(cloner.shortfall_summary(), '')
+
+
+class FilamentForecastTests(TestCase):
+    def setUp(self):
+        from .forecasting import invalidate_forecast
+        from .scheduling import invalidate_schedule
+        invalidate_forecast()
+        invalidate_schedule()
+        self.addCleanup(invalidate_forecast)
+        self.addCleanup(invalidate_schedule)
+        self.filament = Filament.objects.create(
+            material='PETG', color_code='BLU', brand='Generic', color_hex='#0000FF'
+        )
+        self.spool = Spool.objects.create(filament=self.filament, initial_weight_g=1000, identifier='A', cost=20)
+        self.wo = WorkOrder.objects.create(name="Previsione WO", status='TODO')
+
+    def _usage(self, status, grams, days_ago=0):
+        from django.utils import timezone
+        import datetime
+        pf = PrintFile.objects.create(work_order=self.wo, name=f"{status} {grams}", status=status)
+        PrintFile.objects.filter(pk=pf.pk).update(created_at=timezone.now() - datetime.timedelta(days=days_ago))
+        FilamentUsage.objects.create(print_file=pf, spool=self.spool, grams_used=Decimal(grams))
+        return pf
+
+    def test_consumption_rate_and_days_to_empty(self):
+        from .forecasting import build_forecast
+        self._usage('DONE', '300.00', days_ago=10)
+        forecast = build_forecast().get(self.filament.id)
+        self.assertEqual(forecast.remaining_grams, Decimal('700.00'))
+        self.assertAlmostEqual(float(forecast.daily_grams), 30.0, delta=0.1)
+        self.assertAlmostEqual(forecast.days_to_empty, 23.3, delta=0.1)
+        self.assertFalse(forecast.needs_reorder)
+
+    def test_low_autonomy_suggests_reorder_in_spools(self):
+        from .forecasting import build_forecast
+        self._usage('DONE', '900.00', days_ago=10)
+        forecast = build_forecast().get(self.filament.id)
+        # 100g residui a 90g/giorno: serve coprire 30 giorni (2700g) -> 3 bobine da 1kg
+        self.assertTrue(forecast.needs_reorder)
+        self.assertEqual(forecast.reorder_spools, 3)
+
+    def test_shortage_before_queue_end_raises_single_notification(self):
+        from .forecasting import build_forecast, notify_shortages
+        from .models import Notification
+        self._usage('DONE', '300.00', days_ago=5)
+        self._usage('TODO', '800.00')
+        forecast = build_forecast()
+        item = forecast.get(self.filament.id)
+        self.assertEqual(item.shortage_grams, Decimal('100.00'))
+        self.assertTrue(item.runs_out_before_queue)
+
+        self.assertEqual(len(notify_shortages(forecast)), 1)
+        self.assertEqual(notify_shortages(build_forecast()), [])
+        notification = Notification.objects.get()
+        self.assertEqual(notification.level, Notification.NotificationLevel.WARNING)
+        self.assertIn('mancano 100g', notification.message)
+
+    def test_dashboard_does_not_create_notifications(self):
+        from io import StringIO
+        from django.contrib.auth.models import User
+        from django.core.management import call_command
+        from django.test import override_settings
+        from django.urls import reverse
+        from .models import Notification
+        self._usage('DONE', '300.00', days_ago=5)
+        self._usage('TODO', '800.00')
+        self.client.force_login(User.objects.create_user(username='forecast'))
+        with override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage'):
+            self.client.get(reverse('filament_dashboard'))
+        self.assertFalse(Notification.objects.exists())
+
+        call_command('refresh_filament_forecast', stdout=StringIO())
+        self.assertEqual(Notification.objects.count(), 1)
+
+    def test_forecast_is_cached_until_data_changes(self):
+        from .forecasting import get_forecast
+        self._usage('DONE', '300.00', days_ago=10)
+        first = get_forecast()
+        with self.assertNumQueries(1):
+            self.assertIs(get_forecast(), first)
+
+        self._usage('TODO', '100.00')
+        self.assertEqual(get_forecast().get(self.filament.id).committed_grams, Decimal('100.00'))
+
+    def test_dashboard_shows_reorder_suggestions(self):
+        from django.contrib.auth.models import User
+        from django.test import override_settings
+        from django.urls import reverse
+        self._usage('DONE', '300.00', days_ago=5)
+        self._usage('TODO', '800.00')
+        self.client.force_login(User.objects.create_user(username='forecast'))
+        with override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage'):
+            response = self.client.get(reverse('filament_dashboard'))
+        self.assertContains(response, 'Riordini Suggeriti')
+        self.assertContains(response, 'Mancano 100g')
+
+
+class FilamentStockTotalsTests(TestCase):
+    def setUp(self):
+        self.pla = Filament.objects.create(material='PLA', color_code='RED', brand='Generic', color_hex='#FF0000')
+        self.abs = Filament.objects.create(material='ABS', color_code='WHT', brand='Generic', color_hex='#FFFFFF')
+        Filament.objects.create(material='TPU', color_code='BLK', brand='Generic', color_hex='#000000')
+        active = Spool.objects.create(filament=self.pla, initial_weight_g=1000, weight_adjustment=-20, identifier='A', cost=20)
+        Spool.objects.create(filament=self.pla, initial_weight_g=500, identifier='B', cost=10)
+        retired = Spool.objects.create(filament=self.pla, initial_weight_g=1000, identifier='C', cost=20)
+        empty = Spool.objects.create(filament=self.abs, initial_weight_g=250, identifier='D', cost=5)
+
+        wo = WorkOrder.objects.create(name="Totali WO")
+        done = PrintFile.objects.create(work_order=wo, name="Done", status='DONE')
+        todo = PrintFile.objects.create(work_order=wo, name="Todo", status='TODO')
+        FilamentUsage.objects.create(print_file=done, spool=active, grams_used=Decimal('300.00'))
+        FilamentUsage.objects.create(print_file=todo, spool=active, grams_used=Decimal('1250.00'))
+        FilamentUsage.objects.create(print_file=done, spool=retired, grams_used=Decimal('900.00'))
+        FilamentUsage.objects.create(print_file=done, spool=empty, grams_used=Decimal('240.00'))
+        Spool.objects.filter(pk__in=[retired.pk, empty.pk]).update(is_active=False)
+
+    def test_totals_match_per_spool_weights(self):
+        with self.assertNumQueries(1):
+            totals = {f.pk: f for f in Filament.objects.with_stock_totals().filter(annotated_spool_count__gt=0)}
+        self.assertEqual(set(totals), {self.pla.pk, self.abs.pk})
+
+        pla = totals[self.pla.pk]
+        self.assertEqual(pla.annotated_active_spool_count, 2)
+        self.assertEqual(pla.annotated_total_initial_weight, Decimal('1500.00'))
+        self.assertEqual(pla.annotated_total_adjustment, Decimal('-20.00'))
+        self.assertEqual(pla.annotated_total_used_weight, Decimal('300.00'))
+        self.assertEqual(pla.annotated_total_pending_weight, Decimal('1250.00'))
+        self.assertEqual(pla.annotated_remaining_weight, Decimal('1180.00'))
+        self.assertEqual(pla.annotated_available_weight, Decimal('0.00'))
+        self.assertEqual(pla.total_grams_ever_used, Decimal('1200.00'))
+
+        self.assertEqual(totals[self.abs.pk].annotated_active_spool_count, 0)
+        self.assertEqual(totals[self.abs.pk].total_grams_ever_used, Decimal('240.00'))
+
+    def test_dashboard_splits_active_and_exhausted(self):
+        from django.contrib.auth.models import User
+        from django.test import override_settings
+        from django.urls import reverse
+        self.client.force_login(User.objects.create_user(username='totals'))
+        with override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage'):
+            response = self.client.get(reverse('filament_dashboard'), {'sort': 'annotated_remaining_weight', 'order': 'desc'})
+        self.assertEqual([f.pk for f in response.context['active_filaments']], [self.pla.pk])
+        self.assertEqual([f.pk for f in response.context['exhausted_filaments']], [self.abs.pk])
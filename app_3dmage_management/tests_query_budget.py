@@ -0,0 +1,103 @@
+from django.test import TestCase
+
+
+class QueryBudgetTests(TestCase):
+    """Il numero di query di ogni vista non deve crescere con i dati (niente N+1)."""
+
+    def assertWithinBudget(self, scale):
+        from .query_budget import measure_scale
+        counts, results = measure_scale(scale, seed=1)
+        self.assertTrue(counts['WorkOrder'] > 0)
+        for row in results:
+            with self.subTest(scale=scale, view=row['view']):
+                self.assertEqual(row['status'], 200)
+                self.assertLessEqual(row['queries'], row['budget'], f"{row['view']} ({row['url']}) oltre il budget")
+
+    def test_small_scale(self):
+        self.assertWithinBudget('small')
+
+    def test_medium_scale(self):
+        self.assertWithinBudget('medium')
+
+    def test_every_dashboard_has_a_budget(self):
+        from .query_budget import VIEW_BUDGETS
+        names = {budget[1] for budget in VIEW_BUDGETS}
+        for url_name in (
+            'project_dashboard', 'project_kanban_board', 'project_gantt_board', 'print_queue_board',
+            'inventory_dashboard', 'sales_dashboard', 'accounting_dashboard', 'statistics_dashboard',
+            'settings_dashboard', 'filament_dashboard', 'raw_materials_dashboard', 'projects_library',
+            'project_master_detail',
+        ):
+            self.assertIn(url_name, names)
+
+    def test_load_data_is_deterministic(self):
+        from django.db import transaction
+        from django.db.models import Sum
+        from django.utils import timezone
+        from .load_data import LoadDataGenerator
+        from .models import WorkOrder, FilamentUsage
+        now = timezone.now()
+
+        def generate():
+            with transaction.atomic():
+                counts = LoadDataGenerator(seed=3, now=now, work_orders=10).run()
+                snapshot = (
+                    counts,
+                    list(WorkOrder.objects.order_by('id').values_list('name', 'status', 'quantity', 'created_at')),
+                    FilamentUsage.objects.aggregate(total=Sum('grams_used'))['total'],
+                )
+                transaction.set_rollback(True)
+            return snapshot
+
+        first = generate()
+        self.assertEqual(first[0]['WorkOrder'], 10)
+        self.assertEqual(first, generate())
+
+
+class QueryBudgetReportTests(TestCase):
+    def test_report_is_json(self):
+        import json
+        from io import StringIO
+        from django.core.management import call_command
+        from .models import WorkOrder
+        out = StringIO()
+        call_command('query_budget_report', '--scale', 'small', '--view', 'gantt', 'inventory', stdout=out)
+        report = json.loads(out.getvalue())
+        views = report['scales']['small']['views']
+        self.assertEqual([row['view'] for row in views], ['gantt', 'inventory'])
+        self.assertFalse(any(row['over_budget'] for row in views))
+        self.assertIn('ms', views[0])
+        # I dati di prova vengono annullati
+        self.assertFalse(WorkOrder.objects.exists())
+
+
+class SeedLoadDataTests(TestCase):
+    def test_seed_twice_appends_consistent_data(self):
+        from io import StringIO
+        from decimal import Decimal
+        from django.core.management import call_command
+        from django.db.models import Sum
+        from .models import WorkOrder, Spool, SpoolLedger, PaymentMethod, Expense, StockItem, IdSequence
+        for seed in (1, 2):
+            call_command('seed_load_data', '--seed', str(seed), '--work-orders', '15', stdout=StringIO())
+
+        self.assertEqual(WorkOrder.objects.count(), 30)
+        # Categorie e metodi di pagamento riusati, registro completo per ogni bobina
+        self.assertEqual(PaymentMethod.objects.count(), 4)
+        self.assertEqual(SpoolLedger.objects.count(), Spool.objects.count())
+        # Saldi coerenti con spese e vendite generate
+        expenses = Expense.objects.aggregate(total=Sum('amount'))['total']
+        revenue = sum(
+            (item.get_net_revenue() for item in StockItem.objects.filter(status='SOLD', payment_method__isnull=False)),
+            Decimal('0.00')
+        )
+        self.assertEqual(PaymentMethod.objects.aggregate(total=Sum('balance'))['total'], revenue - expenses)
+        # ...e con il registro dei movimenti
+        from .ledger import cache_mismatches
+        self.assertEqual(cache_mismatches(), [])
+        # Riepiloghi contabili ricostruiti dopo il bulk_create
+        from .models import AccountingSummary
+        self.assertEqual(AccountingSummary.objects.filter(kind='EXPENSE').aggregate(total=Sum('amount'))['total'], expenses)
+        # Le sequenze partono dall'ultimo ID generato
+        for sequence in IdSequence.objects.filter(entity=IdSequence.Entity.WORK_ORDER):
+            self.assertTrue(WorkOrder.objects.filter(custom_id=f'{sequence.year % 100:02d}{sequence.last_value:03d}').exists())
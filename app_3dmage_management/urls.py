@@ -74,6 +74,9 @@ urlpatterns = [
     path('spool/<int:spool_id>/delete/', views.delete_spool, name='delete_spool'),
     path('spool/<int:spool_id>/toggle_status/', views.toggle_spool_status, name='toggle_spool_status'),
 
+    # Ricerca globale
+    path('search/', views.search_dashboard, name='search_dashboard'),
+
     # Magazzino
     path('inventory/', views.inventory_dashboard, name='inventory_dashboard'),
     path('stock_item/add/', views.add_stock_item, name='add_stock_item'),
@@ -98,6 +101,7 @@ urlpatterns = [
 
     # EXPORT CSV
     path('export/stock-sales-csv/', views.export_stock_sales_csv, name='export_stock_sales_csv'),
+    path('export/<slug:export_name>.csv', views.export_csv, name='export_csv'),
 
     # Vendite
     path('sales/', views.sales_dashboard, name='sales_dashboard'),
@@ -157,12 +161,15 @@ urlpatterns = [
     path('ajax/load-plates/', views.load_plates, name='ajax_load_plates'),
     path('ajax/update_project_status/', views.update_project_status, name='update_project_status'),
     path('ajax/update_print_queue/', views.update_print_queue, name='update_print_queue'),
+    path('ajax/balance_print_queue/', views.balance_print_queue, name='balance_print_queue'),
     path('ajax/stock_item/<int:item_id>/details/', views.get_stock_item_details, name='get_stock_item_details'),
     path('ajax/stock_item/<int:item_id>/update/', views.update_stock_item, name='update_stock_item'),
     path('ajax/get_spools/', views.get_spools_for_filament, name='get_spools_for_filament'),
 
     # Sync & Locking
     path('ajax/check-updates/', views.check_updates, name='check_updates'),
+    path('ajax/changes/', views.change_feed, name='change_feed'),
+    path('ajax/changes/stream/', views.change_stream, name='change_stream'),
     path('ajax/lock/<str:model_type>/<int:item_id>/', views.lock_item, name='lock_item'),
     path('ajax/unlock/<str:model_type>/<int:item_id>/', views.unlock_item, name='unlock_item'),
 
@@ -11,3 +11,5 @@ from .notifications import *
 from .sync import *
 from .statistics import *
 from .raw_materials import *
+from .exports import *
+from .global_search import *
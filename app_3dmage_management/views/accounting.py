@@ -6,9 +6,15 @@ from django.contrib.auth.decorators import login_required
 from django.db import transaction
 from django.db.models import Sum, F, Q
 from django.forms.models import model_to_dict
+from django.utils import timezone
 
-from ..models import StockItem, Expense, ExpenseCategory, PaymentMethod
+from .. import ledger, search
+from ..models import StockItem, Expense, ExpenseCategory, PaymentMethod, AccountingSummary, SearchEntry
 from ..forms import ExpenseForm, ManualIncomeForm, TransferForm, CorrectBalanceForm
+from ..pagination import keyset_page, rows_request
+
+INCOME_CURSOR = 'income_after'
+EXPENSES_CURSOR = 'expenses_after'
 
 @login_required
 def accounting_dashboard(request):
@@ -19,15 +25,11 @@ def accounting_dashboard(request):
 
     income_items_query = StockItem.objects.filter(status='SOLD', payment_method__isnull=False)
     if search_query:
-        income_items_query = income_items_query.filter(
-            Q(name__icontains=search_query) | Q(notes__icontains=search_query)
-        )
+        income_items_query = income_items_query.filter(pk__in=search.matching_ids(search_query, SearchEntry.Kind.SALE))
 
     expenses_query = Expense.objects.select_related('category', 'payment_method')
     if search_query:
-        expenses_query = expenses_query.filter(
-            Q(description__icontains=search_query) | Q(notes__icontains=search_query)
-        )
+        expenses_query = expenses_query.filter(pk__in=search.matching_ids(search_query, SearchEntry.Kind.EXPENSE))
 
     if year_filter:
         income_items_query = income_items_query.filter(sold_at__year=year_filter)
@@ -39,23 +41,43 @@ def accounting_dashboard(request):
     if category_filter:
         expenses_query = expenses_query.filter(category_id=category_filter)
 
-    income_items = income_items_query.with_net_values().select_related('payment_method').order_by('-sold_at', '-id')
-    expenses = expenses_query.order_by('-expense_date', '-id')
+    income_items_query = income_items_query.with_net_values().select_related('payment_method')
+
+    # Entrate e uscite scorrono in modo indipendente, ognuna con il proprio cursore
+    income_items = keyset_page(income_items_query, ['-sold_at'], request.GET.get(INCOME_CURSOR), param=INCOME_CURSOR)
+    if rows_request(request, income_items):
+        return render(request, 'app_3dmage_management/partials/income_rows.html', {
+            'income_items': income_items, 'next_income_query': income_items.next_query(request.GET),
+        })
+    expenses = keyset_page(expenses_query, ['-expense_date'], request.GET.get(EXPENSES_CURSOR), param=EXPENSES_CURSOR)
+    if rows_request(request, expenses):
+        return render(request, 'app_3dmage_management/partials/expense_rows.html', {
+            'expenses': expenses, 'next_expenses_query': expenses.next_query(request.GET),
+        })
 
-    total_income = income_items.aggregate(total=Sum('annotated_net_revenue'))['total'] or Decimal('0.00')
-    total_expenses = expenses.aggregate(total=Sum('amount'))['total'] or Decimal('0.00')
+    if search_query:
+        # La ricerca testuale lavora sulle righe: totali calcolati sui dati reali
+        total_income = income_items_query.aggregate(total=Sum('annotated_net_revenue'))['total'] or Decimal('0.00')
+        total_expenses = expenses_query.aggregate(total=Sum('amount'))['total'] or Decimal('0.00')
+    else:
+        total_income, total_expenses = _summary_totals(year_filter, payment_method_filter, category_filter)
 
     profit = total_income - total_expenses
-    total_cash = PaymentMethod.objects.aggregate(total=Sum('balance'))['total'] or Decimal('0.00')
+    # Saldi dal registro dei movimenti; la tabella mostra i saldi di fine mese dell'anno filtrato
+    payment_methods = list(ledger.balances_as_of())
+    total_cash = sum((method.ledger_balance for method in payment_methods), Decimal('0.00'))
+    balance_year = int(year_filter) if year_filter.isdigit() else timezone.localdate().year
+    _, period_balances = ledger.period_balances(balance_year, methods=payment_methods)
 
-    income_years = StockItem.objects.filter(sold_at__isnull=False, payment_method__isnull=False).dates('sold_at', 'year', order='DESC')
-    expense_years = Expense.objects.dates('expense_date', 'year', order='DESC')
-    available_years = sorted(list(set([d.year for d in income_years] + [d.year for d in expense_years])), reverse=True)
+    available_years = [d.year for d in _summary_rows().filter(month__isnull=False).dates('month', 'year', order='DESC')]
 
     context = {
         'income_items': income_items, 'total_income': total_income, 'expenses': expenses,
-        'total_expenses': total_expenses, 'payment_methods': PaymentMethod.objects.all(),
-        'all_payment_methods': PaymentMethod.objects.all(),
+        'next_income_query': income_items.next_query(request.GET),
+        'next_expenses_query': expenses.next_query(request.GET),
+        'total_expenses': total_expenses, 'payment_methods': payment_methods,
+        'all_payment_methods': payment_methods,
+        'balance_year': balance_year, 'period_balances': period_balances,
         'all_expense_categories': ExpenseCategory.objects.all(),
         'profit': profit,
         'total_cash': total_cash, 'expense_form': ExpenseForm(),
@@ -69,6 +91,30 @@ def accounting_dashboard(request):
     return render(request, 'app_3dmage_management/accounting.html', context)
 
 
+def _summary_rows():
+    # Le entrate senza metodo di pagamento (metodo eliminato) non compaiono in contabilità
+    return AccountingSummary.objects.filter(
+        Q(kind=AccountingSummary.Kind.EXPENSE) | Q(payment_method__isnull=False)
+    )
+
+
+def _summary_totals(year_filter, payment_method_filter, category_filter):
+    """Entrate e uscite dai riepiloghi mensili, con gli stessi filtri applicati alle righe."""
+    rows = _summary_rows()
+    if year_filter:
+        rows = rows.filter(month__year=year_filter)
+    if payment_method_filter:
+        rows = rows.filter(payment_method_id=payment_method_filter)
+    expense_filter = Q(kind=AccountingSummary.Kind.EXPENSE)
+    if category_filter:
+        expense_filter &= Q(category_id=category_filter)
+    totals = rows.aggregate(
+        income=Sum('amount', filter=Q(kind=AccountingSummary.Kind.INCOME)),
+        expenses=Sum('amount', filter=expense_filter),
+    )
+    return totals['income'] or Decimal('0.00'), totals['expenses'] or Decimal('0.00')
+
+
 @require_POST
 @transaction.atomic
 @login_required
@@ -79,13 +125,9 @@ def add_manual_income(request):
         income.status = 'SOLD'
         income.quantity = 1
         income.material_cost = 0
-        if income.payment_method and income.sale_price:
-            income.save() # Salviamo per avere l'ID e i campi impostati
-            income.payment_method.refresh_from_db()
-            income.payment_method.balance += income.get_net_revenue()
-            income.payment_method.save()
-        else:
-            income.save()
+        income.save()
+        if income.sale_price:
+            ledger.record_sale(income)
     return redirect('accounting_dashboard')
 
 @require_POST
@@ -94,27 +136,20 @@ def add_manual_income(request):
 def add_expense(request):
     form = ExpenseForm(request.POST)
     if form.is_valid():
-        expense = form.save(commit=False)
-        if expense.payment_method and expense.amount:
-            payment_method = PaymentMethod.objects.select_for_update().get(id=expense.payment_method.id)
-            payment_method.balance -= expense.amount
-            payment_method.save()
-        expense.save()
+        expense = form.save()
+        ledger.record_expense(expense)
     return redirect('accounting_dashboard')
 
 @require_POST
 @login_required
+@transaction.atomic
 def transfer_funds(request):
     form = TransferForm(request.POST)
     if form.is_valid():
         amount = form.cleaned_data['amount']
         source = form.cleaned_data['source']
         destination = form.cleaned_data['destination']
-
-        source.balance -= amount
-        destination.balance += amount
-        source.save()
-        destination.save()
+        ledger.transfer(source, destination, amount)
     return redirect('accounting_dashboard')
 
 @require_POST
@@ -129,8 +164,7 @@ def correct_balance(request, method_id):
 
     form = CorrectBalanceForm(data)
     if form.is_valid():
-        payment_method.balance = form.cleaned_data['new_balance']
-        payment_method.save()
+        ledger.correct_balance(payment_method, form.cleaned_data['new_balance'])
         return JsonResponse({'status': 'ok'})
 
     # Restituisce JSON con errori per la gestione AJAX
@@ -148,21 +182,14 @@ def edit_expense(request, expense_id):
     expense = get_object_or_404(Expense, id=expense_id)
     old_amount = expense.amount
     old_payment_method = expense.payment_method
+    old_date = expense.expense_date
 
     form = ExpenseForm(request.POST, instance=expense)
     if form.is_valid():
-        if old_payment_method and old_amount:
-            old_pm = PaymentMethod.objects.select_for_update().get(id=old_payment_method.id)
-            old_pm.balance += old_amount
-            old_pm.save()
-
+        # Storno della spesa originale e nuova registrazione: il registro non si riscrive
+        ledger.reverse_expense(old_payment_method, old_amount, old_date, expense=expense)
         updated_expense = form.save()
-
-        if updated_expense.payment_method and updated_expense.amount:
-            new_pm = PaymentMethod.objects.select_for_update().get(id=updated_expense.payment_method.id)
-            new_pm.balance -= updated_expense.amount
-            new_pm.save()
-
+        ledger.record_expense(updated_expense)
         return JsonResponse({'status': 'ok'})
     return JsonResponse({'status': 'error', 'errors': form.errors.as_json()}, status=400)
 
@@ -172,9 +199,6 @@ def edit_expense(request, expense_id):
 @transaction.atomic
 def delete_expense(request, expense_id):
     expense = get_object_or_404(Expense, id=expense_id)
-    if expense.payment_method and expense.amount:
-        pm = PaymentMethod.objects.select_for_update().get(id=expense.payment_method.id)
-        pm.balance += expense.amount
-        pm.save()
+    ledger.reverse_expense(expense.payment_method, expense.amount, expense.expense_date, expense=expense)
     expense.delete()
     return JsonResponse({'status': 'ok'})
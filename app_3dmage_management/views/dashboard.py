@@ -1,37 +1,41 @@
 from django.shortcuts import render
 from django.http import HttpResponse
-from django.db.models import Sum, Case, When, Value, DecimalField, F, Q, IntegerField, Prefetch
+from django.db.models import Sum, Q, Prefetch
 from django.db.models.functions import Coalesce
 from django.contrib.auth.decorators import login_required
 from django.core.paginator import Paginator
+from django.utils import timezone
 from decimal import Decimal
 
-from ..models import WorkOrder, Category, Filament, FilamentUsage, GlobalSetting
+from .. import search
+from ..models import WorkOrder, Category, Filament, FilamentUsage, SearchEntry
+from ..changefeed import htmx_version, PRINT_QUEUE, WORK_ORDERS
+from ..fragments import Fragment
+from ..scheduling import get_schedule
 from ..forms import WorkOrderForm, PrintFileForm, PrintFileEditForm
+from ..pagination import CURSOR_PARAM, keyset_page, rows_request
 
 @login_required
 def project_dashboard(request):
-    # Intelligent Polling Check
-    try:
-        setting = GlobalSetting.objects.get(key='app_last_updated')
-        if setting.value is None or str(setting.value) == '':
-            raise ValueError("Empty value")
-        current_server_version = str(setting.value)
-    except Exception:
-        from django.utils import timezone
-        ts = str(timezone.now().timestamp() % 100000)
-        new_val = Decimal(ts)
-        GlobalSetting.objects.filter(key='app_last_updated').delete()
-        GlobalSetting.objects.create(key='app_last_updated', value=new_val)
-        current_server_version = str(new_val)
-
-    if request.headers.get('HX-Request'):
-        client_version = request.GET.get('v')
-        if client_version == current_server_version:
-            return HttpResponse(status=204)
+    # Polling intelligente: 204 se il client ha già la versione corrente del dominio
+    current_server_version, unchanged = htmx_version(request, WORK_ORDERS)
+    if unchanged:
+        return HttpResponse(status=204)
 
     # Determina la vista corrente (active o completed)
     view_mode = request.GET.get('view', 'active')
+
+    # Tabella ordini attivi già calcolata per un altro client con gli stessi filtri (stime incluse)
+    active_fragment = None
+    if view_mode == 'active' and CURSOR_PARAM not in request.GET:
+        active_fragment = Fragment(
+            request, 'app_3dmage_management/partials/work_order_table_active.html',
+            (WORK_ORDERS, PRINT_QUEUE), {WORK_ORDERS: current_server_version}
+        )
+        cached = active_fragment.lookup()
+        if cached is not None:
+            return cached
+
     # CALCOLO CONTATORI (Totale In Corso e Da Stampare)
     active_count = WorkOrder.objects.exclude(status='DONE').count()
     todo_count = WorkOrder.objects.filter(status='TODO').count()
@@ -70,7 +74,7 @@ def project_dashboard(request):
         active_projects_query = all_work_orders.exclude(status='DONE').with_annotations()
 
         if search_query:
-            q_filter = Q(name__icontains=search_query) | Q(custom_id__icontains=search_query)
+            q_filter = Q(pk__in=search.matching_ids(search_query, SearchEntry.Kind.WORK_ORDER))
             if search_query.isdigit():
                 q_filter |= Q(id=search_query)
             active_projects_query = active_projects_query.filter(q_filter)
@@ -83,23 +87,31 @@ def project_dashboard(request):
         if sort_active not in valid_sort_fields_active:
             sort_active = 'name'
         
+        # La paginazione keyset mette sempre in fondo le date di consegna mancanti
         sort_field = f'{order_prefix_active}{sort_active}'
         if sort_active == 'priority':
             sort_field = f'{order_prefix_active}priority_order'
         elif sort_active == 'progress':
             # Sort by progress percentage (done files / total files)
             sort_field = f'{order_prefix_active}progress_percentage_value'
-        elif sort_active == 'delivery_date':
-            if order_active == 'asc':
-                sort_field = F('delivery_date').asc(nulls_last=True)
-            else:
-                sort_field = F('delivery_date').desc(nulls_last=True)
-            
-        active_projects = active_projects_query.order_by(sort_field).distinct()
+
+        active_projects = keyset_page(active_projects_query.distinct(), [sort_field], request.GET.get(CURSOR_PARAM))
+
+        # Fine prevista e ritardi dallo scheduler della coda
+        schedule = get_schedule()
+        for project in active_projects:
+            project.eta = schedule.order(project.id)
+
+        if rows_request(request, active_projects):
+            return render(request, 'app_3dmage_management/partials/work_order_table_active_rows.html', {
+                'active_projects': active_projects, 'next_active_query': active_projects.next_query(request.GET),
+            })
+        next_active_query = active_projects.next_query(request.GET)
 
     else:
         sort_active = 'name'
         order_active = 'asc'
+        next_active_query = ''
 
     # --- Gestione Ordini Completati (Solo se view_mode è completed) ---
     if view_mode == 'completed':
@@ -118,7 +130,7 @@ def project_dashboard(request):
         )
 
         if completed_search_query:
-            q_filter_completed = Q(name__icontains=completed_search_query) | Q(custom_id__icontains=completed_search_query)
+            q_filter_completed = Q(pk__in=search.matching_ids(completed_search_query, SearchEntry.Kind.WORK_ORDER))
             if completed_search_query.isdigit():
                 q_filter_completed |= Q(id=completed_search_query)
             completed_projects_query = completed_projects_query.filter(q_filter_completed)
@@ -160,6 +172,7 @@ def project_dashboard(request):
     context = {
         'view_mode': view_mode,
         'active_projects': active_projects,
+        'next_active_query': next_active_query,
         'completed_projects': completed_projects,
         'active_count': active_count,
         'todo_count': todo_count,
@@ -190,7 +203,7 @@ def project_dashboard(request):
 
     if request.headers.get('HX-Request'):
         if view_mode == 'active':
-            return render(request, 'app_3dmage_management/partials/work_order_table_active.html', context)
+            return active_fragment.render(context)
         elif view_mode == 'completed':
             return render(request, 'app_3dmage_management/partials/work_order_table_completed_rows.html', context)
 
@@ -201,7 +214,7 @@ def project_kanban_board(request):
     kanban_columns = []
     statuses_to_show = [status for status in WorkOrder.Status.choices if status[0] != 'DONE']
     for status_id, status_name in statuses_to_show:
-        projects_in_status = WorkOrder.objects.filter(status=status_id).prefetch_related(
+        projects_in_status = WorkOrder.objects.filter(status=status_id).with_annotations().prefetch_related(
             'print_files__printer',
             'print_files__plate',
             'print_files__filament_usages__spool__filament'
@@ -215,14 +228,22 @@ def project_gantt_board(request):
     import json
     import datetime
     
-    active_orders = WorkOrder.objects.filter(status__in=[WorkOrder.Status.TODO, WorkOrder.Status.PRINTING]).order_by('created_at')
+    active_orders = WorkOrder.objects.filter(
+        status__in=[WorkOrder.Status.TODO, WorkOrder.Status.PRINTING]
+    ).with_annotations().order_by('created_at')
+    schedule = get_schedule()
     
     gantt_tasks = []
     for order in active_orders:
         start_date = order.created_at.strftime('%Y-%m-%d')
+        eta = schedule.order(order.id)
+        eta_finish = timezone.localtime(eta.finish) if eta and eta.finish else None
         
         if order.delivery_date:
             end_date = order.delivery_date.strftime('%Y-%m-%d')
+        elif eta_finish:
+            # Senza data di consegna la barra arriva alla fine prevista dallo scheduler
+            end_date = max(eta_finish.date(), timezone.localtime(order.created_at).date()).strftime('%Y-%m-%d')
         else:
             end_date = (order.created_at + datetime.timedelta(days=3)).strftime('%Y-%m-%d')
             
@@ -234,6 +255,9 @@ def project_gantt_board(request):
              
         if order.priority == WorkOrder.Priority.URGENT:
              css_class += ' bar-urgent'
+
+        if eta and eta.is_late:
+             css_class += ' bar-late'
              
         gantt_tasks.append({
             'id': str(order.id),
@@ -241,7 +265,9 @@ def project_gantt_board(request):
             'start': start_date,
             'end': end_date,
             'progress': float(progress),
-            'custom_class': css_class
+            'custom_class': css_class,
+            'eta': eta_finish.strftime('%d/%m/%Y %H:%M') if eta_finish else '',
+            'late': bool(eta and eta.is_late)
         })
         
     context = {
@@ -0,0 +1,15 @@
+from django.http import Http404
+from django.contrib.auth.decorators import login_required
+
+from ..exports import EXPORTS
+
+@login_required
+def export_csv(request, export_name):
+    export = EXPORTS.get(export_name)
+    if export is None:
+        raise Http404("Esportazione non trovata")
+    return export.response(request.GET)
+
+@login_required
+def export_stock_sales_csv(request):
+    return EXPORTS['magazzino-vendite'].response(request.GET)
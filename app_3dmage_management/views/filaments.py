@@ -5,12 +5,13 @@ from django.http import JsonResponse
 from django.views.decorators.http import require_POST
 from django.contrib.auth.decorators import login_required
 from django.db import transaction
-from django.db.models import Sum, Count, F, OuterRef, Subquery, IntegerField, DecimalField, ExpressionWrapper, Case, When
-from django.db.models.functions import Coalesce
 from django.forms.models import model_to_dict
 
+from .. import ledger
+from ..changefeed import conditional_on, FILAMENTS
 from ..models import Filament, Spool, FilamentUsage, Expense, ExpenseCategory
 from ..forms import FilamentForm, SpoolForm, SpoolEditForm
+from ..forecasting import get_forecast
 
 @login_required
 def filament_dashboard(request):
@@ -18,54 +19,6 @@ def filament_dashboard(request):
     order = request.GET.get('order', 'asc')
     order_prefix = '-' if order == 'desc' else ''
 
-    active_spool_count_subquery = Spool.objects.filter(
-        filament=OuterRef('pk'),
-        is_active=True
-    ).values('filament').annotate(c=Count('id')).values('c')
-
-    all_filaments = Filament.objects.annotate(
-        annotated_active_spool_count=Coalesce(Subquery(active_spool_count_subquery, output_field=IntegerField()), 0)
-    )
-
-    active_filaments_query = all_filaments.filter(annotated_active_spool_count__gt=0)
-
-    active_initial_weight_subquery = Spool.objects.filter(
-        filament=OuterRef('pk'), is_active=True
-    ).values('filament').annotate(s=Sum('initial_weight_g')).values('s')
-
-    active_used_weight_subquery = FilamentUsage.objects.filter(
-        spool__filament=OuterRef('pk'), spool__is_active=True, print_file__status__in=['DONE', 'FAILED']
-    ).values('spool__filament').annotate(s=Sum('grams_used')).values('s')
-
-    active_adjustment_subquery = Spool.objects.filter(
-        filament=OuterRef('pk'), is_active=True
-    ).values('filament').annotate(s=Sum('weight_adjustment')).values('s')
-
-    active_pending_weight_subquery = FilamentUsage.objects.filter(
-        spool__filament=OuterRef('pk'), spool__is_active=True, print_file__status__in=['TODO', 'PRINTING']
-    ).values('spool__filament').annotate(s=Sum('grams_used')).values('s')
-
-    active_filaments_query = active_filaments_query.annotate(
-        annotated_total_initial_weight=Coalesce(Subquery(active_initial_weight_subquery, output_field=DecimalField()), Decimal('0.00')),
-        annotated_total_used_weight=Coalesce(Subquery(active_used_weight_subquery, output_field=DecimalField()), Decimal('0.00')),
-        annotated_total_adjustment=Coalesce(Subquery(active_adjustment_subquery, output_field=DecimalField()), Decimal('0.00')),
-        annotated_total_pending_weight=Coalesce(Subquery(active_pending_weight_subquery, output_field=DecimalField()), Decimal('0.00'))
-    ).annotate(
-        annotated_remaining_weight=ExpressionWrapper(
-            F('annotated_total_initial_weight') + F('annotated_total_adjustment') - F('annotated_total_used_weight'),
-            output_field=DecimalField()
-        )
-    ).annotate(
-        annotated_available_weight=Case(
-            When(
-                annotated_remaining_weight__gt=F('annotated_total_pending_weight'),
-                then=F('annotated_remaining_weight') - F('annotated_total_pending_weight')
-            ),
-            default=Decimal('0.00'),
-            output_field=DecimalField()
-        )
-    )
-
     valid_sort_fields = ['material', 'brand', 'color_name', 'annotated_remaining_weight', 'annotated_total_used_weight', 'annotated_active_spool_count']
     if sort_by not in valid_sort_fields:
         sort_by = 'material'
@@ -75,20 +28,26 @@ def filament_dashboard(request):
     else:
         order_fields = (f'{order_prefix}{sort_by}',)
 
-    active_filaments = active_filaments_query.order_by(*order_fields)
-
-    exhausted_filaments_query = all_filaments.filter(annotated_active_spool_count=0, spools__isnull=False).distinct()
-
-    total_used_weight_subquery = FilamentUsage.objects.filter(
-        spool__filament=OuterRef('pk'), print_file__status__in=['DONE', 'FAILED']
-    ).values('spool__filament').annotate(s=Sum('grams_used')).values('s')
+    # Un solo passaggio raggruppato su bobine e registro pesi per filamenti attivi ed esauriti
+    filaments = Filament.objects.with_stock_totals().filter(annotated_spool_count__gt=0).order_by(*order_fields)
+    active_filaments = []
+    exhausted_filaments = []
+    for filament in filaments:
+        if filament.annotated_active_spool_count:
+            active_filaments.append(filament)
+        else:
+            exhausted_filaments.append(filament)
+    exhausted_filaments.sort(key=lambda filament: (filament.material, filament.brand, filament.color_code))
 
-    exhausted_filaments = exhausted_filaments_query.annotate(
-        total_grams_ever_used=Coalesce(Subquery(total_used_weight_subquery, output_field=DecimalField()), Decimal('0.00'))
-    ).order_by('material', 'brand', 'color_code')
+    # Previsioni precalcolate: nessuna aggregazione dello storico per richiesta
+    forecast = get_forecast()
+    for filament in active_filaments:
+        filament.forecast = forecast.get(filament.id)
+    reorder_suggestions = [filament for filament in active_filaments if filament.forecast and filament.forecast.needs_reorder]
 
     context = {
         'active_filaments': active_filaments,
+        'reorder_suggestions': reorder_suggestions,
         'exhausted_filaments': exhausted_filaments,
         'filament_form': FilamentForm(),
         'spool_form': SpoolForm(),
@@ -129,19 +88,18 @@ def add_spool(request):
 
         expense_description = f"Bobina {spool.filament} {spool}"
 
-        Expense.objects.create(
+        expense = Expense.objects.create(
             description=expense_description,
             amount=cost, category=material_category,
             expense_date=spool.purchase_date, payment_method=payment_method
         )
-
-        payment_method.balance -= cost
-        payment_method.save()
+        ledger.record_expense(expense)
 
     return redirect('filament_dashboard')
 
 @require_POST
 @login_required
+@transaction.atomic
 def delete_spool(request, spool_id):
     spool = get_object_or_404(Spool, id=spool_id)
     if spool.usages.exists():
@@ -157,8 +115,9 @@ def delete_spool(request, spool_id):
     ).first()
 
     if related_expense and related_expense.payment_method:
-        related_expense.payment_method.balance += related_expense.amount
-        related_expense.payment_method.save()
+        ledger.reverse_expense(
+            related_expense.payment_method, related_expense.amount, related_expense.expense_date, expense=related_expense
+        )
         related_expense.delete()
 
     spool.delete()
@@ -198,25 +157,18 @@ def delete_filament(request, filament_id):
     return JsonResponse({'status': 'ok'})
 
 @login_required
+@conditional_on(FILAMENTS)
 def get_spools_for_filament(request):
     filament_id = request.GET.get('filament_id')
-    # Filtra bobine attive e con peso disponibile > 0
-    # Ordiniamo per available_weight per proporre prima quelle più vuote
-    spools = Spool.objects.filter(filament_id=filament_id, is_active=True)
-    
-    # Python sorting because available_weight is a property
-    # Note: For large datasets, this might need optimization (e.g. annotation)
-    active_spools = sorted(
-        [s for s in spools if s.available_weight > 0],
-        key=lambda x: x.available_weight
-    )
+    # Bobine attive con peso disponibile > 0, prima le più vuote: filtro e ordinamento in SQL
+    spools = Spool.objects.available().filter(filament_id=filament_id).values('id', 'purchase_date', 'available_grams')
 
     spools_data = []
-    for spool in active_spools:
+    for spool in spools:
         spools_data.append({
-            'id': spool.id,
-            'purchase_date': spool.purchase_date.strftime('%d/%m/%Y'),
-            'remaining': spool.available_weight
+            'id': spool['id'],
+            'purchase_date': spool['purchase_date'].strftime('%d/%m/%Y'),
+            'remaining': spool['available_grams']
         })
     return JsonResponse(spools_data, safe=False)
 
@@ -254,6 +206,7 @@ def _handle_filament_data(request, print_file, filament_data_json, wasted_grams_
                 FilamentUsage.objects.create(print_file=print_file, spool=spool, grams_used=grams)
 
 @login_required
+@conditional_on(FILAMENTS)
 def api_get_all_filaments(request):
     # Mostra tutti i filamenti (permetti l'aggiunta di bobine anche a chi non ne ha)
     # Ordina per materiale e poi per codice colore
@@ -262,35 +215,34 @@ def api_get_all_filaments(request):
     return JsonResponse(data, safe=False)
 
 @login_required
+@conditional_on(FILAMENTS)
 def api_get_filament_spools(request, filament_id):
-    spools = Spool.objects.filter(filament_id=filament_id).order_by('identifier')
+    filament = get_object_or_404(Filament, id=filament_id)
+    # Pesi delle bobine e totali del filamento arrivano dalla stessa query
+    spools = Spool.objects.with_filament_totals().filter(filament=filament).select_related('filament').order_by('identifier')
     active_spools_data = []
     inactive_spools_data = []
+    total_physical = Decimal('0.00')
+    total_pending = Decimal('0.00')
 
     for spool in spools:
-        # Usiamo le nuove proprietà del modello
-        remaining = spool.remaining_weight
-
         spool_data = {
             'id': spool.id,
             'text': str(spool),
-            'remaining': float(spool.remaining_weight),
-            'available': float(spool.available_weight),
+            'remaining': float(spool.remaining_grams),
+            'available': float(spool.available_grams),
             'cost': f"{spool.cost}€",
             'purchase_link': spool.purchase_link,
             'is_active': spool.is_active
         }
+        total_physical = spool.filament_remaining_grams
+        total_pending = spool.filament_pending_grams
 
         if spool.is_active:
              active_spools_data.append(spool_data)
         else:
              inactive_spools_data.append(spool_data)
 
-
-    filament = get_object_or_404(Filament, id=filament_id)
-    active_spools = Spool.objects.filter(filament=filament, is_active=True)
-    total_physical = sum(s.remaining_weight for s in active_spools)
-    total_pending = sum(s.pending_weight for s in active_spools)
     filament_available = max(Decimal('0.00'), total_physical - total_pending)
 
     return JsonResponse({
@@ -0,0 +1,20 @@
+from django.shortcuts import render
+from django.contrib.auth.decorators import login_required
+
+from .. import search
+
+
+@login_required
+def search_dashboard(request):
+    """Ricerca globale su ordini, progetti master, magazzino, vendite e spese, in ordine di pertinenza."""
+    search_query = request.GET.get('q', '').strip()
+    results = search.search(search_query) if search_query else []
+    context = {
+        'results': results,
+        'search_query': search_query,
+        'page_title': 'Ricerca',
+    }
+    # Digitazione nella casella: solo l'elenco dei risultati
+    if request.headers.get('HX-Request'):
+        return render(request, 'app_3dmage_management/partials/search_results.html', context)
+    return render(request, 'app_3dmage_management/search.html', context)
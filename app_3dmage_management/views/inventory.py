@@ -1,4 +1,3 @@
-import csv
 from decimal import Decimal
 from django.shortcuts import render, get_object_or_404
 from django.http import JsonResponse, HttpResponse
@@ -6,36 +5,27 @@ from django.views.decorators.http import require_POST
 from django.contrib.auth.decorators import login_required
 from django.utils import timezone
 from django.db import transaction
-from django.db.models import F, Case, When, Value, DecimalField, Q
+from django.db.models import F, Case, When, Value, DecimalField
 from django.forms.models import model_to_dict
 
-from ..models import StockItem, PaymentMethod
+from .. import search
+from ..models import StockItem, PaymentMethod, SearchEntry
+from ..changefeed import htmx_version, STOCK
+from ..fragments import Fragment
+from ..sequences import next_stock_item_id
 from ..forms import StockItemForm, ManualStockItemForm, SaleEditForm
+from ..pagination import CURSOR_PARAM, keyset_page, rows_request
 
 @login_required
 def inventory_dashboard(request):
-    from ..models import GlobalSetting
-    # Intelligent Polling Check
-    try:
-        setting = GlobalSetting.objects.get(key='app_last_updated')
-        if setting.value is None or str(setting.value) == '':
-            raise ValueError("Empty value")
-        current_server_version = str(setting.value)
-    except Exception:
-        # Corrupt data, reset it
-        from django.utils import timezone
-        from decimal import Decimal
-        ts = str(timezone.now().timestamp())
-        new_val = Decimal(ts)
-        # Avoid reading corrupt data
-        GlobalSetting.objects.filter(key='app_last_updated').delete()
-        GlobalSetting.objects.create(key='app_last_updated', value=new_val)
-        current_server_version = str(new_val)
-
-    if request.headers.get('HX-Request'):
-        client_version = request.GET.get('v')
-        if client_version == current_server_version:
-            return HttpResponse(status=204)
+    # Polling intelligente: 204 se il client ha già la versione corrente del dominio
+    current_server_version, unchanged = htmx_version(request, STOCK)
+    if unchanged:
+        return HttpResponse(status=204)
+    table = Fragment(request, 'app_3dmage_management/partials/inventory_table.html', (STOCK,), {STOCK: current_server_version})
+    cached = table.lookup() if CURSOR_PARAM not in request.GET else None
+    if cached is not None:
+        return cached
 
     search_query = request.GET.get('q', '')
     status_filter = request.GET.get('status', '')
@@ -55,21 +45,23 @@ def inventory_dashboard(request):
     )
 
     if search_query:
-        stock_items_query = stock_items_query.filter(
-            Q(name__icontains=search_query) |
-            Q(custom_id__icontains=search_query)
-        )
+        stock_items_query = stock_items_query.filter(pk__in=search.matching_ids(search_query, SearchEntry.Kind.STOCK_ITEM))
     if status_filter:
         stock_items_query = stock_items_query.filter(status=status_filter)
 
-    valid_sort_fields = ['custom_id', 'quantity', 'name', 'status', 'suggested_price', 'total_cost']
+    valid_sort_fields = ['custom_id', 'quantity', 'name', 'status', 'suggested_price', 'annotated_total_cost']
     if sort_by not in valid_sort_fields:
         sort_by = 'created_at'
 
-    stock_items = stock_items_query.order_by(f'{order_prefix}{sort_by}')
+    stock_items = keyset_page(stock_items_query, [f'{order_prefix}{sort_by}'], request.GET.get(CURSOR_PARAM))
+    if rows_request(request, stock_items):
+        return render(request, 'app_3dmage_management/partials/inventory_rows.html', {
+            'stock_items': stock_items, 'next_query': stock_items.next_query(request.GET),
+        })
 
     context = {
         'stock_items': stock_items,
+        'next_query': stock_items.next_query(request.GET),
         'form': StockItemForm(),
         'manual_form': ManualStockItemForm(),
         'page_title': 'Magazzino',
@@ -83,7 +75,7 @@ def inventory_dashboard(request):
     }
 
     if request.headers.get('HX-Request'):
-        return render(request, 'app_3dmage_management/partials/inventory_table.html', context)
+        return table.render(context)
 
     return render(request, 'app_3dmage_management/inventory.html', context)
 
@@ -92,24 +84,13 @@ def inventory_dashboard(request):
 def add_stock_item(request):
     form = ManualStockItemForm(request.POST)
     if form.is_valid():
-        current_year = timezone.now().year
-        last_item = StockItem.objects.filter(
-            custom_id__startswith=f"{current_year % 100:02d}"
-        ).order_by('custom_id').last()
-
-        if last_item and last_item.custom_id.isdigit():
-             last_sequential = int(last_item.custom_id[2:])
-             new_sequential = last_sequential + 1
-        else:
-            new_sequential = 1
-
-        new_custom_id = f"{current_year % 100:02d}{new_sequential:03d}"
-
         item = form.save(commit=False)
-        item.custom_id = new_custom_id
         item.work_order = None
         item.status = 'IN_STOCK'
-        item.save()
+        # ID e salvataggio nella stessa transazione: un errore non consuma il progressivo
+        with transaction.atomic():
+            item.custom_id = next_stock_item_id()
+            item.save()
         return JsonResponse({'status': 'ok'})
     return JsonResponse({'status': 'error', 'errors': form.errors.as_json()}, status=400)
 
@@ -182,11 +163,8 @@ def update_stock_item(request, item_id):
         # Save all changes (including name)
         item_to_process.save()
 
-        if item_to_process.payment_method and item_to_process.sale_price:
-            net_revenue = item_to_process.get_net_revenue()
-            item_to_process.payment_method.refresh_from_db()
-            item_to_process.payment_method.balance += net_revenue
-            item_to_process.payment_method.save()
+        if item_to_process.sale_price:
+            ledger.record_sale(item_to_process)
     else:
         newly_sold_item = StockItem.objects.create(
             work_order=item_to_process.work_order,
@@ -233,11 +211,8 @@ def update_stock_item(request, item_id):
         
         item_to_process.save()
         
-        if newly_sold_item.payment_method and newly_sold_item.sale_price:
-            net_revenue = newly_sold_item.get_net_revenue()
-            newly_sold_item.payment_method.refresh_from_db()
-            newly_sold_item.payment_method.balance += net_revenue
-            newly_sold_item.payment_method.save()
+        if newly_sold_item.sale_price:
+            ledger.record_sale(newly_sold_item)
 
     has_stock = StockItem.objects.filter(
         name=item_to_process.name, 
@@ -261,48 +236,3 @@ def delete_stock_item(request, item_id):
         return JsonResponse({'status': 'error', 'message': 'Non puoi eliminare un oggetto già venduto da qui.'}, status=400)
     item.delete()
     return JsonResponse({'status': 'ok', 'message': 'Oggetto eliminato con successo.'})
-
-@login_required
-def export_stock_sales_csv(request):
-    response = HttpResponse(content_type='text/csv')
-    response['Content-Disposition'] = f'attachment; filename="export_magazzino_vendite_{timezone.now().strftime("%Y-%m-%d")}.csv"'
-    response.write(u'\ufeff'.encode('utf8'))
-
-    writer = csv.writer(response, delimiter=';')
-
-    writer.writerow([
-        'ID Oggetto', 'ID Progetto Origine', 'Categoria Progetto', 'Nome Oggetto', 'Stato', 'Quantita',
-        'Costo Materiali (€)', 'Costo Manodopera (€)', 'Costo Totale Produzione (€)',
-        'Prezzo Vendita Suggerito (Unità) (€)', 'Data Creazione', 'Data Vendita',
-        'Prezzo Vendita Effettivo (Unità) (€)', 'Ricavo Totale (€)', 'Profitto (€)',
-        'Venduto a', 'Metodo Pagamento', 'Note'
-    ])
-
-    items = StockItem.objects.all().select_related('work_order__category', 'payment_method').order_by('status', '-created_at')
-
-    for item in items:
-        total_revenue = (item.sale_price or 0) * item.quantity
-        profit = total_revenue - (item.material_cost + item.labor_cost) if item.status == 'SOLD' else None
-
-        writer.writerow([
-            item.custom_id or item.id,
-            item.work_order.custom_id if item.work_order else 'N/A',
-            item.work_order.category.name if item.work_order and item.work_order.category else 'N/A',
-            item.name,
-            item.get_status_display(),
-            item.quantity,
-            f'{item.material_cost:.2f}'.replace('.', ','),
-            f'{item.labor_cost:.2f}'.replace('.', ','),
-            f'{item.total_cost:.2f}'.replace('.', ','),
-            f'{item.suggested_price:.2f}'.replace('.', ','),
-            item.created_at.strftime('%d/%m/%Y'),
-            item.sold_at.strftime('%d/%m/%Y') if item.sold_at else '',
-            f'{item.sale_price:.2f}'.replace('.', ',') if item.sale_price is not None else '',
-            f'{total_revenue:.2f}'.replace('.', ',') if item.status == 'SOLD' else '',
-            f'{profit:.2f}'.replace('.', ',') if profit is not None else '',
-            item.sold_to,
-            item.payment_method.name if item.payment_method else ('DA PAGARE' if item.status == 'SOLD' else ''),
-            item.notes
-        ])
-
-    return response
@@ -3,9 +3,11 @@ from django.http import JsonResponse
 from django.views.decorators.http import require_POST
 from django.contrib.auth.decorators import login_required
 
+from ..changefeed import bump_domain_versions, conditional_on, NOTIFICATIONS
 from ..models import Notification
 
 @login_required
+@conditional_on(NOTIFICATIONS)
 def api_get_notifications(request):
     notifications = Notification.objects.filter(is_read=False)
     data = {
@@ -17,7 +19,8 @@ def api_get_notifications(request):
 @require_POST
 @login_required
 def api_mark_notifications_as_read(request):
-    Notification.objects.filter(is_read=False).update(is_read=True)
+    if Notification.objects.filter(is_read=False).update(is_read=True):
+        bump_domain_versions(NOTIFICATIONS)
     return JsonResponse({'status': 'ok'})
 
 @require_POST
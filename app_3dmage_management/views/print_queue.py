@@ -6,34 +6,29 @@ from django.views.decorators.http import require_POST
 from django.contrib.auth.decorators import login_required
 from django.db import transaction
 from django.db.models import Sum, Q, Prefetch
+from django.utils.dateparse import parse_datetime
 
-from ..models import PrintFile, Printer, Plate, Spool, FilamentUsage
+from ..models import PrintFile, Printer, Plate, Spool, FilamentUsage, PrintStatsRollup
+from ..queue_order import move_in_queue, reorder_queue
+from ..scheduling import get_schedule
+from ..load_balancing import build_balance_plan, apply_confirmed_plan, StalePlan
+from ..changefeed import bump_domain_versions, conditional_on, htmx_version, FILAMENTS, PRINT_QUEUE, SETTINGS, WORK_ORDERS
+from ..fragments import Fragment
 
 @login_required
 def print_queue_board(request):
-    from ..models import GlobalSetting
-    from ..models import GlobalSetting
-    # Intelligent Polling Check
-    try:
-        setting = GlobalSetting.objects.get(key='app_last_updated')
-        if setting.value is None or str(setting.value) == '':
-            raise ValueError("Empty value")
-        current_server_version = str(setting.value)
-    except Exception:
-         # Corrupt data, reset it
-         from django.utils import timezone
-         from decimal import Decimal
-         ts = str(timezone.now().timestamp())
-         new_val = Decimal(ts)
-         # Avoid reading corrupt data
-         GlobalSetting.objects.filter(key='app_last_updated').delete()
-         GlobalSetting.objects.create(key='app_last_updated', value=new_val)
-         current_server_version = str(new_val)
-
-    if request.headers.get('HX-Request'):
-        client_version = request.GET.get('v')
-        if client_version == current_server_version:
-            return HttpResponse(status=204)
+    # Polling intelligente: 204 se il client ha già la versione corrente del dominio
+    current_server_version, unchanged = htmx_version(request, PRINT_QUEUE)
+    if unchanged:
+        return HttpResponse(status=204)
+    # Stesso parziale per tutti i client finché coda, ordini e filamenti (materiali e bobine mostrati) non cambiano
+    content = Fragment(
+        request, 'app_3dmage_management/partials/print_queue_content.html',
+        (PRINT_QUEUE, WORK_ORDERS, FILAMENTS), {PRINT_QUEUE: current_server_version}
+    )
+    cached = content.lookup()
+    if cached is not None:
+        return cached
 
     active_print_files_qs = PrintFile.objects.filter(
         status__in=['TODO', 'PRINTING'],
@@ -42,7 +37,7 @@ def print_queue_board(request):
         'work_order', 'printer', 'plate'
     ).prefetch_related(
         'filament_usages__spool__filament'
-    ).order_by('queue_position')
+    ).order_by('queue_position', 'id')
 
     printers_qs = Printer.objects.prefetch_related(
         Prefetch('print_files', queryset=active_print_files_qs, to_attr='queued_files')
@@ -56,12 +51,18 @@ def print_queue_board(request):
         )
     ).order_by('name')
 
+    # Stime di inizio/fine calcolate dallo scheduler (in cache per versione della coda)
+    schedule = get_schedule()
+
     printers_list = []
     for printer in printers_qs:
+        for print_file in printer.queued_files:
+            print_file.eta = schedule.file(print_file.id)
         printing_file = next((f for f in printer.queued_files if f.status == 'PRINTING'), None)
         todo_files = [f for f in printer.queued_files if f.status == 'TODO']
         total_seconds = printer.total_queued_seconds or 0
         printer.total_queued_time_formatted = str(datetime.timedelta(seconds=total_seconds))
+        printer.queue_finish = schedule.printer_finish(printer.id)
         printer.printing_file = printing_file
         printer.todo_files = todo_files
         printers_list.append(printer)
@@ -73,7 +74,7 @@ def print_queue_board(request):
     }
 
     if request.headers.get('HX-Request'):
-        return render(request, 'app_3dmage_management/partials/print_queue_content.html', context)
+        return content.render(context)
 
     return render(request, 'app_3dmage_management/print_queue.html', context)
 
@@ -82,16 +83,71 @@ def print_queue_board(request):
 def update_print_queue(request):
     try:
         data = json.loads(request.body)
-        printer_id, ordered_file_ids = data.get('printer_id'), data.get('file_ids', [])
-        PrintFile.objects.filter(id__in=ordered_file_ids).update(printer_id=printer_id)
-        for index, file_id in enumerate(ordered_file_ids):
-            PrintFile.objects.filter(id=file_id).update(queue_position=index)
+        printer_id = data.get('printer_id')
+        printer_id = int(printer_id) if printer_id is not None else None
+
+        if data.get('file_id'):
+            # Spostamento singolo: di norma si scrive solo la riga del file spostato
+            neighbour_ids = [data.get('after_id'), data.get('before_id')]
+            after_id, before_id = [int(neighbour) if neighbour else None for neighbour in neighbour_ids]
+            updated = move_in_queue(int(data['file_id']), printer_id, after_id=after_id, before_id=before_id)
+        else:
+            ordered_file_ids = [int(file_id) for file_id in data.get('file_ids', [])]
+            updated = reorder_queue(printer_id, ordered_file_ids)
+
+        # update() non invia segnali: notifichiamo esplicitamente la coda modificata
+        if updated:
+            bump_domain_versions(PRINT_QUEUE)
         return JsonResponse({'status': 'ok', 'message': 'Coda di stampa aggiornata.'})
     except Exception as e:
         return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
 
 
+@require_POST
+@login_required
+def balance_print_queue(request):
+    """
+    Distribuisce i file da stampare sulle stampanti (tutte, o quelle in printer_ids).
+    Con dry_run restituisce solo l'anteprima del piano; altrimenti applica il piano dell'anteprima
+    confermata (version e now dell'anteprima), 409 se la coda è cambiata nel frattempo.
+    """
+    try:
+        data = json.loads(request.body or '{}')
+        printer_ids = [int(printer_id) for printer_id in data.get('printer_ids') or []]
+        if not printer_ids:
+            printer_ids = list(Printer.objects.values_list('id', flat=True))
+        options = {'objective': data.get('objective', 'makespan'), 'match_plates': data.get('match_plates', True)}
+
+        if data.get('dry_run'):
+            plan = build_balance_plan(printer_ids, **options)
+            schedule = get_schedule()
+            preview = plan.as_dict()
+            preview['current_makespan'] = max(schedule.printer_finish(printer_id) for printer_id in printer_ids).isoformat() if printer_ids else None
+            return JsonResponse({'status': 'ok', 'dry_run': True, 'plan': preview})
+
+        planned_at = parse_datetime(data.get('now') or '')
+        if data.get('version') is None or planned_at is None:
+            return JsonResponse({'status': 'error', 'message': "Manca l'anteprima del piano da applicare."}, status=400)
+        try:
+            plan, updated = apply_confirmed_plan(printer_ids, data['version'], planned_at, **options)
+        except StalePlan:
+            return JsonResponse({
+                'status': 'error',
+                'message': "La coda di stampa è cambiata dopo l'anteprima: ripeti il bilanciamento."
+            }, status=409)
+        preview = plan.as_dict()
+        return JsonResponse({
+            'status': 'ok',
+            'dry_run': False,
+            'plan': preview,
+            'message': f'Coda bilanciata: {updated} file riassegnati.'
+        })
+    except (ValueError, TypeError) as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+
+
 @login_required
+@conditional_on(SETTINGS)
 def load_plates(request):
     printer_id = request.GET.get('printer_id')
     try:
@@ -115,10 +171,13 @@ def set_print_file_status(request, file_id):
 
         if new_status == 'PRINTING':
             if file_to_update.printer:
-                PrintFile.objects.filter(
+                interrupted = PrintFile.objects.filter(
                     printer=file_to_update.printer,
                     status='PRINTING'
-                ).exclude(id=file_id).update(status='TODO')
+                ).exclude(id=file_id)
+                interrupted_days = list(interrupted.dates('created_at', 'day'))
+                interrupted.update(status='TODO')
+                PrintStatsRollup.refresh_days(interrupted_days)
         
         # Automatizzazione quantità
         if new_status == 'DONE':
@@ -16,21 +16,27 @@ from django.contrib import messages
 from ..models import (
     Project, MasterPrintFile, WorkOrder, PrintFile, StockItem, FilamentUsage, Spool, 
     Filament, MasterFilamentUsage, Printer, Category, ProjectPart,
-    RawMaterial, RawMaterialPurchase, ProjectRawMaterial, WorkOrderRawMaterial
+    RawMaterial, RawMaterialPurchase, ProjectRawMaterial, WorkOrderRawMaterial, SearchEntry
 )
+from .. import search
+from ..changefeed import conditional_on, WORK_ORDERS
 from ..forms import (
     WorkOrderForm, PrintFileForm, PrintFileEditForm, CompleteWorkOrderForm, 
     MasterProjectForm, MasterPrintFileForm, ProjectRawMaterialForm, WorkOrderRawMaterialForm
 )
 from .filaments import _handle_filament_data # Importing helper function
+from ..cloning import MasterCloner
+from ..sequences import next_work_order_id
 
 
 @login_required
 def project_detail(request, project_id):
-    queryset = WorkOrder.objects.prefetch_related(
+    queryset = WorkOrder.objects.with_costs().select_related('project').prefetch_related(
         Prefetch('print_files', queryset=PrintFile.objects.select_related('printer', 'plate')
                  .prefetch_related('filament_usages__spool__filament').order_by('project_part__name', 'created_at')),
-        'raw_materials__raw_material'
+        Prefetch('raw_materials__raw_material', queryset=RawMaterial.objects.with_stock_totals()),
+        'project__outputs',
+        'stockitem_set'
     )
     work_order = get_object_or_404(queryset, id=project_id)
 
@@ -194,7 +200,7 @@ def sync_work_order_to_master(request, project_id):
 @login_required
 @transaction.atomic
 def complete_project(request, project_id):
-    work_order = get_object_or_404(WorkOrder.objects.select_for_update().prefetch_related('print_files'), id=project_id)
+    work_order = get_object_or_404(WorkOrder.objects.with_costs().select_for_update().prefetch_related('print_files'), id=project_id)
     
     # Leggiamo i dati degli output inviati (JSON)
     outputs_data_str = request.POST.get('outputs_data', '[]')
@@ -221,16 +227,7 @@ def complete_project(request, project_id):
 
     # NUOVO: Generiamo il custom_id se non esiste
     if not work_order.custom_id:
-        current_year_str = timezone.now().strftime('%y')
-        last_wo_this_year = WorkOrder.objects.filter(custom_id__startswith=current_year_str, custom_id__regex=r'^\d{5}$').order_by('-custom_id').first()
-        new_sequential = 1
-        if last_wo_this_year:
-            try:
-                last_sequential = int(last_wo_this_year.custom_id[2:])
-                new_sequential = last_sequential + 1
-            except (ValueError, IndexError):
-                pass
-        work_order.custom_id = f"{current_year_str}{new_sequential:03d}"
+        work_order.custom_id = next_work_order_id()
 
     total_added_quantity = sum(item['quantity'] for item in outputs_data)
     
@@ -560,6 +557,7 @@ def get_print_file_details(request, file_id):
     return JsonResponse(data)
 
 @login_required
+@conditional_on(WORK_ORDERS)
 def api_get_all_projects(request):
     work_orders = WorkOrder.objects.filter(status__in=['QUOTE', 'TODO', 'PRINTING', 'PRINTED']).order_by('name')
     data = [{'id': wo.id, 'name': wo.name} for wo in work_orders]
@@ -763,11 +761,11 @@ def projects_library(request):
     sort_by = request.GET.get('sort', 'newest')  # Default: più recente (per data aggiunta)
     
     # Base QuerySet
-    projects = Project.objects.all().prefetch_related('master_print_files', 'parts')
+    projects = Project.objects.select_related('category').prefetch_related('master_print_files__printer', 'parts', 'outputs')
     
     # 1. Filtri
     if search_query:
-        projects = projects.filter(name__icontains=search_query)
+        projects = projects.filter(pk__in=search.matching_ids(search_query, SearchEntry.Kind.PROJECT))
     if category_filter:
         projects = projects.filter(category_id=category_filter)
     if printer_filter:
@@ -829,21 +827,26 @@ def add_master_project(request):
 
 @login_required
 def project_master_detail(request, pk):
-    project = get_object_or_404(Project.objects.prefetch_related(
-        'master_print_files__filament_usages',
+    project = get_object_or_404(Project.objects.select_related('category').prefetch_related(
+        'master_print_files__printer',
+        'master_print_files__project_parts',
+        'master_print_files__filament_usages__filament',
         'parts',
-        'raw_materials__raw_material'
+        'outputs',
+        Prefetch('raw_materials__raw_material', queryset=RawMaterial.objects.with_stock_totals())
     ), pk=pk)
     
     # Costruiamo una lista di dizionari per gestire la visualizzazione per parti
     # dato che un file può stare in più parti (M2M)
     parts_with_files = []
+    master_files = sorted(project.master_print_files.all(), key=lambda f: f.name)
+    for f in master_files:
+        f.dtag = f.printer.tag if f.printer and f.printer.tag else "-"
+        f.part_ids = {part.id for part in f.project_parts.all()}
     
     # 1. Parti definite
     for part in project.parts.all():
-        files = list(project.master_print_files.filter(project_parts=part).order_by('name'))
-        for f in files:
-            f.dtag = f.printer.tag if f.printer and f.printer.tag else "-"
+        files = [f for f in master_files if part.id in f.part_ids]
         parts_with_files.append({
             'part': part,
             'files': files,
@@ -851,9 +854,7 @@ def project_master_detail(request, pk):
         })
     
     # 2. File senza parte
-    unassigned_files = list(project.master_print_files.filter(project_parts__isnull=True).order_by('name'))
-    for f in unassigned_files:
-        f.dtag = f.printer.tag if f.printer and f.printer.tag else "-"
+    unassigned_files = [f for f in master_files if not f.part_ids]
     if unassigned_files:
         parts_with_files.append({
             'part': None,
@@ -1164,111 +1165,26 @@ def create_from_template(request, pk):
         except (json.JSONDecodeError, TypeError):
             replacements = {}
 
-    # 3. Creiamo i PrintFile per ogni lotto
-    for batch_idx, batch in enumerate(batches):
-        batch_qty = batch.get('quantity', 0)
-        if batch_qty <= 0:
-            continue
-            
-        part_printer_map = batch.get('printers', {})
-        
-        for mpf in master_project.master_print_files.all():
-            # Otteniamo le parti a cui appartiene il file (o una lista con None se non ne ha)
-            file_parts = list(mpf.project_parts.all())
-            if not file_parts:
-                file_parts = [None]
-                
-            for part in file_parts:
-                part_id_str = str(part.id) if part else 'None'
-                selected_printer_id = part_printer_map.get(part_id_str)
-                
-                # Filtri Selezione Parte/Stampante nel lotto
-                if selected_printer_id == 'skip':
-                    continue
-                
-                if selected_printer_id:
-                    # Se è stata scelta una stampante specifica per la parte in questo lotto,
-                    # il file deve corrispondere a quella stampante
-                    if mpf.printer and str(mpf.printer_id) != str(selected_printer_id):
-                        continue
-                elif mpf.printer:
-                    # Se il file richiede una stampante ma non è configurata nel lotto, lo saltiamo
-                    continue
-
-                # Calcolo Moltiplicatore per il file in questo lotto
-                file_multiplier = math.ceil(batch_qty / mpf.produced_quantity) if mpf.produced_quantity > 0 else 1
-
-                for i in range(file_multiplier):
-                    batch_suffix = f" (Set {batch_idx + 1})" if len(batches) > 1 else ""
-                    multiplier_suffix = f" ({i+1})" if file_multiplier > 1 else ""
-                    part_suffix = "" # Eliminiamo nome parte tra parentesi quadre
-                    
-                    pf_name = f"{mpf.name}{part_suffix}{batch_suffix}{multiplier_suffix}"
-                    
-                    actual_printer_id = selected_printer_id if selected_printer_id and selected_printer_id != 'skip' else mpf.printer_id
-                    
-                    pf = PrintFile.objects.create(
-                        work_order=new_wo,
-                        master_print_file=mpf,
-                        project_part=part,
-                        name=pf_name,
-                        print_time_seconds=mpf.estimated_time_seconds,
-                        printer_id=actual_printer_id,
-                        plate=mpf.plate,
-                        produced_quantity=mpf.produced_quantity,
-                        status=PrintFile.Status.TODO
-                    )
-                    
-                    for master_usage in mpf.filament_usages.all():
-                        # Controlla se l'utente ha confermato una sostituzione per questo filamento
-                        target_filament = master_usage.filament
-                        if str(target_filament.id) in replacements:
-                            try:
-                                target_filament = Filament.objects.get(id=replacements[str(target_filament.id)])
-                            except Filament.DoesNotExist:
-                                pass
-
-                        # Selezione automatica bobina: la più vuota che sia sufficiente
-                        spools = Spool.objects.filter(
-                            filament=target_filament,
-                            is_active=True
-                        )
-                        # Ordiniamo per available_weight per proporre prima quelle più vuote
-                        # Nota: available_weight tiene conto anche delle FilamentUsage create in questo stesso loop
-                        suitable_spools = sorted(
-                            [s for s in spools if s.available_weight >= master_usage.grams_used],
-                            key=lambda x: x.available_weight
-                        )
-                        
-                        spool = None
-                        if suitable_spools:
-                            spool = suitable_spools[0]
-                        else:
-                            # Se nessuna bobina è sufficiente, prendiamo quella con più spazio residuo (o la prima)
-                            spool = sorted(list(spools), key=lambda x: x.available_weight, reverse=True)[0] if spools.exists() else None
-                        
-                        if spool:
-                            FilamentUsage.objects.create(
-                                print_file=pf,
-                                spool=spool,
-                                grams_used=master_usage.grams_used
-                            )
-
-    # Copia le materie prime dal Progetto Master all'Ordine di Lavoro
-    for pm_rm in master_project.raw_materials.all():
-        WorkOrderRawMaterial.objects.create(
-            work_order=new_wo,
-            raw_material=pm_rm.raw_material,
-            quantity=pm_rm.quantity * total_requested_quantity
-        )
+    # 3. Creiamo i PrintFile per ogni lotto e copiamo le materie prime dal Progetto Master
+    cloner = MasterCloner(master_project, new_wo, replacements)
+    cloner.plan_batches(batches)
+    cloner.plan_raw_materials(total_requested_quantity)
+    cloner.save()
+
+    message = 'Ordine creato correttamente!'
+    shortfall = cloner.shortfall_summary()
+    if shortfall:
+        message += f" Attenzione, filamento insufficiente: {shortfall}."
 
     if is_ajax:
         return JsonResponse({
             'status': 'ok',
-            'message': 'Ordine creato correttamente!',
+            'message': message,
             'redirect_url': reverse('project_detail', args=[new_wo.id])
         })
 
+    if shortfall:
+        messages.warning(request, message)
     return redirect('project_detail', project_id=new_wo.id)
 
 @require_POST
@@ -1482,108 +1398,24 @@ def add_parts_to_order(request, pk):
         except (json.JSONDecodeError, TypeError):
             replacements = {}
 
-    # 2. Crea i PrintFile per ogni lotto
-    import math
-    import re
-    for batch_idx, batch in enumerate(batches):
-        batch_qty = batch.get('quantity', 0)
-        if batch_qty <= 0:
-            continue
-            
-        part_printer_map = batch.get('printers', {})
-        
-        for mpf in master_project.master_print_files.all():
-            file_parts = list(mpf.project_parts.all())
-            if not file_parts:
-                file_parts = [None]
-                
-            for part in file_parts:
-                part_id_str = str(part.id) if part else 'None'
-                selected_printer_id = part_printer_map.get(part_id_str)
-                
-                if selected_printer_id == 'skip':
-                    continue
-                
-                if selected_printer_id:
-                    if mpf.printer and str(mpf.printer_id) != str(selected_printer_id):
-                        continue
-                elif mpf.printer:
-                    continue
-
-                file_multiplier = math.ceil(batch_qty / mpf.produced_quantity) if mpf.produced_quantity > 0 else 1
-
-                # Trova max_num per non sovrascrivere o collidere coi nomi
-                base_name = mpf.name
-                existing_files = PrintFile.objects.filter(
-                    work_order=work_order,
-                    name__startswith=base_name
-                )
-                max_num = 0
-                for f in existing_files:
-                    match = re.search(r'\((\d+)\)$', f.name)
-                    if match:
-                        num = int(match.group(1))
-                        if num > max_num:
-                            max_num = num
-                
-                start_num = max_num + 1
-
-                for i in range(file_multiplier):
-                    batch_suffix = f" (Set {batch_idx + 1})" if len(batches) > 1 else ""
-                    multiplier_suffix = f" ({start_num + i})"
-                    pf_name = f"{mpf.name}{batch_suffix} {multiplier_suffix}"
-                    
-                    actual_printer_id = selected_printer_id if selected_printer_id and selected_printer_id != 'skip' else mpf.printer_id
-                    
-                    pf = PrintFile.objects.create(
-                        work_order=work_order,
-                        master_print_file=mpf,
-                        project_part=part,
-                        name=pf_name,
-                        print_time_seconds=mpf.estimated_time_seconds,
-                        printer_id=actual_printer_id,
-                        plate=mpf.plate,
-                        produced_quantity=mpf.produced_quantity,
-                        status=PrintFile.Status.TODO
-                    )
-                    
-                    for master_usage in mpf.filament_usages.all():
-                        target_filament = master_usage.filament
-                        if str(target_filament.id) in replacements:
-                            try:
-                                target_filament = Filament.objects.get(id=replacements[str(target_filament.id)])
-                            except Filament.DoesNotExist:
-                                pass
-
-                        spools = Spool.objects.filter(filament=target_filament, is_active=True)
-                        suitable_spools = sorted(
-                            [s for s in spools if s.available_weight >= master_usage.grams_used],
-                            key=lambda x: x.available_weight
-                        )
-                        
-                        spool = None
-                        if suitable_spools:
-                            spool = suitable_spools[0]
-                        else:
-                            spool = sorted(list(spools), key=lambda x: x.available_weight, reverse=True)[0] if spools.exists() else None
-                        
-                        if spool:
-                            FilamentUsage.objects.create(
-                                print_file=pf,
-                                spool=spool,
-                                grams_used=master_usage.grams_used
-                            )
+    # 2. Crea i PrintFile per ogni lotto, proseguendo la numerazione dei file già presenti
+    cloner = MasterCloner(master_project, work_order, replacements)
+    cloner.plan_batches(batches, append=True)
+    cloner.save()
 
     work_order.sync_status()
+
+    shortfall = cloner.shortfall_summary()
+    shortfall_note = f" Attenzione, filamento insufficiente: {shortfall}." if shortfall else ""
     
     if is_ajax:
         return JsonResponse({
             'status': 'ok',
-            'message': f"Parti aggiunte con successo all'ordine '{work_order.name}'.",
+            'message': f"Parti aggiunte con successo all'ordine '{work_order.name}'.{shortfall_note}",
             'redirect_url': reverse('project_detail', args=[work_order.id])
         })
 
-    messages.success(request, f"Parti di '{master_project.name}' aggiunte con successo all'ordine '{work_order.name}'.")
+    messages.success(request, f"Parti di '{master_project.name}' aggiunte con successo all'ordine '{work_order.name}'.{shortfall_note}")
     return redirect('project_detail', project_id=work_order.id)
 
 
@@ -8,13 +8,14 @@ from django.db import transaction
 from django.forms.models import model_to_dict
 from django.db.models import Q
 
+from .. import ledger
 from ..models import RawMaterial, RawMaterialPurchase, Expense, ExpenseCategory, PaymentMethod
 from ..forms import RawMaterialForm, RawMaterialPurchaseForm
 
 @login_required
 def raw_materials_dashboard(request):
     search_query = request.GET.get('q', '')
-    raw_materials_query = RawMaterial.objects.all()
+    raw_materials_query = RawMaterial.objects.with_stock_totals()
 
     if search_query:
         raw_materials_query = raw_materials_query.filter(name__icontains=search_query)
@@ -84,8 +85,7 @@ def add_raw_material_purchase(request):
                 payment_method=payment_method
             )
             purchase.expense = expense
-            payment_method.balance -= cost
-            payment_method.save()
+            ledger.record_expense(expense)
         else:
             purchase.payment_method = None
             purchase.expense = None
@@ -103,13 +103,15 @@ def delete_raw_material_purchase(request, purchase_id):
     
     # Ripristina i fondi se c'è una spesa collegata e un metodo di pagamento
     if purchase.expense and purchase.expense.payment_method:
-        purchase.expense.payment_method.balance += purchase.expense.amount
-        purchase.expense.payment_method.save()
-        purchase.expense.delete()
+        expense = purchase.expense
+        ledger.reverse_expense(expense.payment_method, expense.amount, expense.expense_date, expense=expense)
+        expense.delete()
     elif purchase.payment_method:
         # Fallback se la spesa è stata eliminata manualmente ma il metodo di pagamento era ancora segnato
-        purchase.payment_method.balance += purchase.cost
-        purchase.payment_method.save()
+        ledger.reverse_expense(
+            purchase.payment_method, purchase.cost, purchase.purchase_date,
+            description=f"Storno acquisto materia prima: {purchase.raw_material.name}"
+        )
 
     purchase.delete()
     return JsonResponse({'status': 'ok', 'message': 'Acquisto eliminato e contabilità stornata con successo.'})
@@ -7,8 +7,10 @@ from django.db import transaction
 from django.db.models import F, Sum
 from django.db.models.functions import Coalesce
 
-from ..models import StockItem, PaymentMethod
+from .. import ledger, search
+from ..models import StockItem, PaymentMethod, SearchEntry
 from ..forms import SaleEditForm
+from ..pagination import CURSOR_PARAM, keyset_page, rows_request
 
 @login_required
 def sales_dashboard(request):
@@ -27,8 +29,8 @@ def sales_dashboard(request):
 
     filter_summary_parts = []
     if search_query:
-        sold_items_query = sold_items_query.filter(name__icontains=search_query)
-        filter_summary_parts.append(f'Nome: "{search_query}"')
+        sold_items_query = sold_items_query.filter(pk__in=search.matching_ids(search_query, SearchEntry.Kind.SALE))
+        filter_summary_parts.append(f'Ricerca: "{search_query}"')
     if sold_to_filter:
         sold_items_query = sold_items_query.filter(sold_to__icontains=sold_to_filter)
         filter_summary_parts.append(f'Venduto a: "{sold_to_filter}"')
@@ -60,14 +62,23 @@ def sales_dashboard(request):
     if sort_by not in valid_sort_fields:
         sort_by = 'sold_at'
     
-    # We apply order_by here
-    sold_items = sold_items_query.order_by(f'{order_prefix}{sort_by}')
-
-    total_sales = sold_items_query.aggregate(total=Coalesce(Sum('annotated_net_revenue'), Decimal('0.00')))['total']
-    total_profit = sold_items_query.aggregate(total=Coalesce(Sum('annotated_net_profit'), Decimal('0.00')))['total']
+    # Una pagina alla volta (scroll infinito); i totali restano calcolati su tutte le vendite filtrate
+    sold_items = keyset_page(sold_items_query, [f'{order_prefix}{sort_by}'], request.GET.get(CURSOR_PARAM))
+    if rows_request(request, sold_items):
+        return render(request, 'app_3dmage_management/partials/sales_rows.html', {
+            'sold_items': sold_items, 'next_query': sold_items.next_query(request.GET),
+        })
+
+    totals = sold_items_query.aggregate(
+        sales=Coalesce(Sum('annotated_net_revenue'), Decimal('0.00')),
+        profit=Coalesce(Sum('annotated_net_profit'), Decimal('0.00')),
+    )
+    total_sales = totals['sales']
+    total_profit = totals['profit']
 
     context = {
         'sold_items': sold_items,
+        'next_query': sold_items.next_query(request.GET),
         'page_title': 'Vendite',
         'all_payment_methods': PaymentMethod.objects.all(),
         'sale_edit_form': SaleEditForm(),
@@ -112,25 +123,18 @@ def edit_sale(request, item_id):
     # CAPTURE OLD VALUES before the form modifies the instance!
     old_payment_method = sale.payment_method
     old_net_revenue = sale.get_net_revenue()
+    old_sold_at = sale.sold_at
 
     form = SaleEditForm(request.POST, instance=sale)
     if form.is_valid():
         # 1. STORNA L'IMPORTO DAL VECCHIO METODO (Se esisteva)
-        if old_payment_method:
-            old_payment_method.refresh_from_db() # Cruciale per evitare dati vecchi
-            old_payment_method.balance -= old_net_revenue
-            old_payment_method.save()
+        ledger.reverse_sale(old_payment_method, old_net_revenue, old_sold_at, stock_item=sale)
 
         # 2. SALVA LE MODIFICHE ALLA VENDITA
         updated_sale = form.save()
 
         # 3. AGGIUNGI IL NUOVO IMPORTO AL NUOVO METODO (Se presente)
-        if updated_sale.payment_method:
-            new_method = updated_sale.payment_method
-            new_method.refresh_from_db()
-            net_amount = updated_sale.get_net_revenue()
-            new_method.balance += net_amount
-            new_method.save()
+        ledger.record_sale(updated_sale)
 
         return JsonResponse({'status': 'ok'})
     return JsonResponse({'status': 'error', 'errors': form.errors.as_json()}, status=400)
@@ -142,12 +146,10 @@ def edit_sale(request, item_id):
 def reverse_sale(request, stock_item_id):
     sale_to_reverse = get_object_or_404(StockItem, id=stock_item_id, status='SOLD')
 
-    if sale_to_reverse.payment_method:
-        sale_to_reverse.payment_method.refresh_from_db()
-        # Quando storniamo, dobbiamo togliere esattamente quanto abbiamo aggiunto (net revenue)
-        net_to_reverse = sale_to_reverse.get_net_revenue()
-        sale_to_reverse.payment_method.balance -= net_to_reverse
-        sale_to_reverse.payment_method.save()
+    # Quando storniamo, dobbiamo togliere esattamente quanto abbiamo aggiunto (net revenue)
+    ledger.reverse_sale(
+        sale_to_reverse.payment_method, sale_to_reverse.get_net_revenue(), sale_to_reverse.sold_at, stock_item=sale_to_reverse
+    )
 
     existing_stock = StockItem.objects.filter(
         work_order=sale_to_reverse.work_order,
@@ -12,6 +12,8 @@ from ..models import (
     Printer, Plate, Category, PaymentMethod, ExpenseCategory,
     MaintenanceLog, GlobalSetting, PrintFile, Filament, WorkOrder
 )
+from ..changefeed import conditional_on, FILAMENTS, SETTINGS
+from ..cost_settings import get_cost_settings
 from ..forms import (
     PrinterForm, PlateForm, CategoryForm, PaymentMethodForm,
     ExpenseCategoryForm, MaintenanceLogForm, GeneralSettingsForm
@@ -22,12 +24,9 @@ def settings_dashboard(request):
     # Get the year from the request, default to empty string if not present
     year_filter = request.GET.get('year', '')
 
-    # Retrieve global setting for electricity cost, with a default value
-    electricity_cost_obj, _ = GlobalSetting.objects.get_or_create(
-        key='electricity_cost_kwh',
-        defaults={'value': Decimal('0.25')}
-    )
-    electricity_cost_kwh = electricity_cost_obj.value
+    # Retrieve cost settings (electricity, wear and tear) from the cached provider
+    cost_settings = get_cost_settings()
+    electricity_cost_kwh = cost_settings.electricity_cost_kwh
 
     # Get available years for the filter dropdown from completed orders
     available_years_dates = WorkOrder.objects.filter(
@@ -87,13 +86,9 @@ def settings_dashboard(request):
     payment_methods = PaymentMethod.objects.annotate(expense_count=Count('expense'), sale_count=Count('stockitem')).order_by('name')
     expense_categories = ExpenseCategory.objects.annotate(expense_count=Count('expense')).order_by('name')
 
-    wear_tear_obj, _ = GlobalSetting.objects.get_or_create(
-        key='wear_tear_coefficient',
-        defaults={'value': Decimal('0.10')}
-    )
     initial_data = {
-        'electricity_cost': electricity_cost_obj.value,
-        'wear_tear_coefficient': wear_tear_obj.value
+        'electricity_cost': cost_settings.electricity_cost_kwh,
+        'wear_tear_coefficient': cost_settings.wear_tear_coefficient
     }
 
     context = {
@@ -300,12 +295,9 @@ def add_maintenance_log(request):
 
 
 @login_required
+@conditional_on(FILAMENTS, SETTINGS)
 def api_get_costs(request):
-    try:
-        cost_obj = GlobalSetting.objects.get(key='electricity_cost_kwh')
-        cost_kwh = cost_obj.value
-    except GlobalSetting.DoesNotExist:
-        cost_kwh = 0.25
+    cost_kwh = get_cost_settings().electricity_cost_kwh
 
     filaments_data = []
     # Filtra solo i filamenti con bobbine attive e ordina per materiale e codice colore
@@ -1,11 +1,24 @@
 from decimal import Decimal
 from django.shortcuts import render
 from django.contrib.auth.decorators import login_required
-from django.db.models import Sum, Count
+from django.db.models import Sum
+from django.db.models.functions import TruncMonth
 from django.utils import timezone
-from collections import defaultdict
 
-from ..models import Printer, PrintFile, FilamentUsage, GlobalSetting, Filament
+from ..models import Printer, Filament, PrintStatsRollup
+from ..cost_settings import get_cost_settings
+
+COMPLETED_STATUSES = ['DONE', 'FAILED']
+ACTIVE_STATUSES = ['TODO', 'PRINTING']
+
+
+def _rollup_costs(totals, cost_kwh, wear_cost_per_hour):
+    """Costi materiale, elettricità e usura a partire dalle somme degli aggregati."""
+    material = totals['material_cost'] or Decimal('0.00')
+    electricity = Decimal(totals['watt_seconds'] or 0) / Decimal('3600000.0') * cost_kwh
+    wear = Decimal(totals['print_seconds'] or 0) / Decimal('3600.0') * wear_cost_per_hour
+    return material, electricity, wear
+
 
 @login_required
 def statistics_dashboard(request):
@@ -13,8 +26,8 @@ def statistics_dashboard(request):
     year_filter = request.GET.get('year', '')
     printer_filter = request.GET.get('printer', '')
 
-    # Fetch available years from PrintFile creation dates
-    available_years_dates = PrintFile.objects.dates('created_at', 'year', order='DESC')
+    # Fetch available years from the daily rollups
+    available_years_dates = PrintStatsRollup.objects.dates('day', 'year', order='DESC')
     available_years = [d.year for d in available_years_dates]
     if not available_years:
         available_years = [timezone.now().year]
@@ -22,108 +35,72 @@ def statistics_dashboard(request):
     # Fetch available printers
     printers = Printer.objects.all().order_by('name')
 
-    # Base query for print files
-    print_files = PrintFile.objects.all()
+    # Base query on the daily rollups (printer x material x status)
+    rollups = PrintStatsRollup.objects.all()
 
     # Apply filters
     if year_filter and year_filter.isdigit():
-        print_files = print_files.filter(created_at__year=int(year_filter))
+        rollups = rollups.filter(day__year=int(year_filter))
     if printer_filter and printer_filter.isdigit():
-        print_files = print_files.filter(printer_id=int(printer_filter))
+        rollups = rollups.filter(printer_id=int(printer_filter))
 
-    # Basic metrics
-    total_prints = print_files.count()
-    successful_prints = print_files.filter(status='DONE').count()
-    failed_prints = print_files.filter(status='FAILED').count()
-    active_prints = print_files.filter(status__in=['TODO', 'PRINTING']).count()
+    # Basic metrics (file-level rows have an empty material)
+    file_rollups = rollups.filter(material='')
+    status_counts = dict(file_rollups.values_list('status').annotate(count=Sum('file_count')).order_by())
+    total_prints = sum(status_counts.values())
+    successful_prints = status_counts.get('DONE', 0)
+    failed_prints = status_counts.get('FAILED', 0)
+    active_prints = sum(status_counts.get(status, 0) for status in ACTIVE_STATUSES)
 
     total_valid = successful_prints + failed_prints
     success_rate = (successful_prints / total_valid * 100) if total_valid > 0 else 0
 
     # Total print time (only completed prints)
-    total_seconds = print_files.filter(status='DONE').aggregate(total=Sum('print_time_seconds'))['total'] or 0
+    total_seconds = file_rollups.filter(status='DONE').aggregate(total=Sum('print_seconds'))['total'] or 0
     h = total_seconds // 3600
     m = (total_seconds % 3600) // 60
     total_time_formatted = f"{h} ore {m} min"
 
-    # Pre-fetch global setting configs for electricity and wear tear
-    cost_setting, _ = GlobalSetting.objects.get_or_create(
-        key='electricity_cost_kwh',
-        defaults={'value': Decimal('0.25')}
-    )
-    cost_kwh = cost_setting.value
-
-    wear_setting, _ = GlobalSetting.objects.get_or_create(
-        key='wear_tear_coefficient',
-        defaults={'value': Decimal('0.10')}
-    )
-    wear_cost_per_hour = wear_setting.value
-
-    # Fetch completed prints with prefetched spools and printers for precise calculations
-    completed_prints = print_files.filter(status__in=['DONE', 'FAILED']).prefetch_related(
-        'filament_usages__spool__filament', 'printer'
-    )
-
-    # Cost calculations
-    total_material_cost = Decimal('0.00')
-    total_electricity_cost = Decimal('0.00')
-    total_wear_tear_cost = Decimal('0.00')
-    total_grams = 0.0
+    # Global setting configs for electricity and wear tear (cached provider)
+    cost_settings = get_cost_settings()
+    cost_kwh = cost_settings.electricity_cost_kwh
+    wear_cost_per_hour = cost_settings.wear_tear_coefficient
+
+    # Cost calculations on completed prints
+    completed_rollups = rollups.filter(status__in=COMPLETED_STATUSES)
+    sums = {
+        'file_count': Sum('file_count'),
+        'print_seconds': Sum('print_seconds'),
+        'watt_seconds': Sum('watt_seconds'),
+        'grams': Sum('grams'),
+        'material_cost': Sum('material_cost'),
+    }
+    totals = completed_rollups.aggregate(**sums)
+    total_material_cost, total_electricity_cost, total_wear_tear_cost = _rollup_costs(totals, cost_kwh, wear_cost_per_hour)
+    total_grams = float(totals['grams'] or 0)
 
     # Filament type distribution (PLA, PETG, ABS, TPU, ASA) in grams
     material_distribution = {choice[0]: 0.0 for choice in Filament.MATERIAL_CHOICES}
-    
-    # Monthly aggregations
-    monthly_data = defaultdict(lambda: {'count': 0, 'cost': Decimal('0.00'), 'grams': 0.0})
-
-    for pf in completed_prints:
-        # Calculate components for this specific print file
-        pf_material_cost = Decimal('0.00')
-        pf_grams = 0.0
-
-        for usage in pf.filament_usages.all():
-            grams = float(usage.grams_used)
-            pf_grams += grams
-            total_grams += grams
-            
-            # Add to material type distribution
-            mat = usage.spool.filament.material
-            if mat in material_distribution:
-                material_distribution[mat] += grams
-            else:
-                material_distribution[mat] = material_distribution.get(mat, 0.0) + grams
-
-            if usage.spool and usage.spool.initial_weight_g > 0:
-                pf_material_cost += Decimal(str(usage.grams_used)) * (usage.spool.cost / Decimal(usage.spool.initial_weight_g))
-
-        pf_elec_cost = Decimal('0.00')
-        if pf.print_time_seconds and pf.printer and pf.printer.power_consumption > 0:
-            hours = Decimal(pf.print_time_seconds) / Decimal('3600.0')
-            kwh_used = (Decimal(pf.printer.power_consumption) * hours) / Decimal('1000.0')
-            pf_elec_cost = (kwh_used * cost_kwh)
-
-        pf_wear_cost = Decimal('0.00')
-        if pf.print_time_seconds:
-            hours = Decimal(pf.print_time_seconds) / Decimal('3600.0')
-            pf_wear_cost = (hours * wear_cost_per_hour)
-
-        # Totals
-        total_material_cost += pf_material_cost
-        total_electricity_cost += pf_elec_cost
-        total_wear_tear_cost += pf_wear_cost
-
-        # Monthly aggregation
-        # Format key as YYYY-MM
-        month_key = pf.created_at.strftime('%Y-%m')
-        monthly_data[month_key]['count'] += 1
-        monthly_data[month_key]['cost'] += (pf_material_cost + pf_elec_cost + pf_wear_cost)
-        monthly_data[month_key]['grams'] += pf_grams
+    material_rows = completed_rollups.exclude(material='').values_list('material').annotate(total=Sum('grams')).order_by()
+    for mat, grams in material_rows:
+        material_distribution[mat] = material_distribution.get(mat, 0.0) + float(grams or 0)
+
+    # Monthly aggregations (file rows carry counts/times, material rows carry grams/costs)
+    monthly_rows = completed_rollups.annotate(month=TruncMonth('day')).values('month').annotate(**sums).order_by('month')
+    monthly_data = {}
+    for row in monthly_rows:
+        material, electricity, wear = _rollup_costs(row, cost_kwh, wear_cost_per_hour)
+        monthly_data[row['month'].strftime('%Y-%m')] = {
+            'count': row['file_count'] or 0,
+            'cost': material + electricity + wear,
+            'grams': float(row['grams'] or 0),
+        }
 
     total_cost = total_material_cost + total_electricity_cost + total_wear_tear_cost
     total_kg = total_grams / 1000.0
 
     # Print files per printer (including incomplete prints)
-    printer_counts = print_files.values('printer__name').annotate(count=Count('id')).order_by('-count')
+    printer_counts = file_rollups.values('printer__name').annotate(count=Sum('file_count')).order_by('-count')
     printer_labels = [p['printer__name'] or 'N/D' for p in printer_counts]
     printer_values = [p['count'] for p in printer_counts]
 
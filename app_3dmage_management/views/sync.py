@@ -1,41 +1,75 @@
-from django.http import JsonResponse, HttpResponse
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.http import JsonResponse, HttpResponse, HttpResponseNotAllowed, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from django.utils import timezone
 from django.contrib.auth.decorators import login_required
 from django.views.decorators.http import require_GET, require_POST
-from ..models import WorkOrder, StockItem, GlobalSetting
-from decimal import Decimal
+from ..models import WorkOrder, StockItem
+from .. import changefeed
+
+def _requested_domains(request):
+    """Domini richiesti dal client con ?domains=a,b (default: tutti)."""
+    requested = [d for d in request.GET.get('domains', '').split(',') if d in changefeed.DOMAINS]
+    return tuple(requested) or changefeed.DOMAINS
+
+def _known_versions(request, domains):
+    """Versioni già note al client, passate come ?<dominio>=<versione>."""
+    return {domain: request.GET[domain] for domain in domains if domain in request.GET}
 
 @login_required
 @require_GET
 def check_updates(request):
     """
-    Check if the global app state has changed.
-    Expects a 'v' GET parameter (timestamp).
-    Returns 204 (No Content) if no change, or 200 with new version if change.
+    Controllo istantaneo delle versioni per dominio.
+    Il client invia le versioni note (?work_orders=3&stock=7, eventualmente con ?domains=...).
+    Restituisce 204 (No Content) se nessun dominio è cambiato, altrimenti 200 con i soli domini cambiati.
     """
-    client_version = request.GET.get('v')
-    # Intelligent Polling Check
-    try:
-        setting = GlobalSetting.objects.get(key='app_last_updated')
-        # Check if value is valid decimal/string
-        if setting.value is None or str(setting.value) == '':
-           raise ValueError("Empty value")
-        server_version = str(setting.value)
-    except Exception:
-         # Corrupt data, reset it
-         from django.utils import timezone
-         ts = str(timezone.now().timestamp())
-         new_val = Decimal(ts)
-         # Avoid reading corrupt data
-         GlobalSetting.objects.filter(key='app_last_updated').delete()
-         GlobalSetting.objects.create(key='app_last_updated', value=new_val)
-         server_version = str(new_val)
+    domains = _requested_domains(request)
+    known = _known_versions(request, domains)
+    changes = changefeed.changed_domains(known, changefeed.get_domain_versions(domains))
+    if not changes:
+        return HttpResponse(status=204)
+    return JsonResponse({'changes': changes})
 
-    if client_version == server_version:
+@login_required
+@require_GET
+def change_feed(request):
+    """
+    Long-poll del feed delle modifiche (funziona sotto WSGI).
+    Il client invia le versioni che conosce (?work_orders=3&stock=7...): la richiesta resta aperta
+    finché uno dei domini cambia, poi restituisce solo quelli cambiati.
+    Senza versioni note risponde subito con lo stato corrente. Allo scadere del timeout restituisce 204.
+    """
+    domains = _requested_domains(request)
+    known = _known_versions(request, domains)
+    timeout = changefeed.LONG_POLL_TIMEOUT if known else 0
+    changes = changefeed.wait_for_changes(known, domains, timeout=timeout)
+    if not changes:
         return HttpResponse(status=204)
-    
-    return JsonResponse({'v': server_version})
+    return JsonResponse({'changes': changes})
+
+async def change_stream(request):
+    """
+    Feed delle modifiche come Server-Sent Events (richiede ASGI).
+    Sotto WSGI risponde 204: EventSource non si ricollega e il client passa al long-poll.
+    """
+    # login_required e require_GET non supportano le viste asincrone in Django 4.2
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET'])
+    is_authenticated = await sync_to_async(lambda: request.user.is_authenticated)()
+    if not is_authenticated:
+        return HttpResponse(status=401)
+    if not isinstance(request, ASGIRequest):
+        return HttpResponse(status=204)
+
+    response = StreamingHttpResponse(
+        changefeed.stream_changes(_requested_domains(request)),
+        content_type='text/event-stream'
+    )
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
 
 @login_required
 @require_POST
@@ -92,6 +92,27 @@ if DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3':
     DATABASES['default']['OPTIONS']['timeout'] = 20 # Aumentato per ridurre i lock su Google Drive
 
 
+# --- Cache ---
+# I parziali HTMX (app_3dmage_management/fragments.py) vanno nella cache 'fragments': in memoria per
+# processo, oppure su file se FRAGMENT_CACHE_DIR è impostata, così più worker condividono i rendering.
+FRAGMENT_CACHE_DIR = os.getenv('FRAGMENT_CACHE_DIR')
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'fragments': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': FRAGMENT_CACHE_DIR,
+        'OPTIONS': {'MAX_ENTRIES': 1000},
+    } if FRAGMENT_CACHE_DIR else {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'fragments',
+        'OPTIONS': {'MAX_ENTRIES': 500},
+    },
+}
+
+
 # --- Password Validation ---
 AUTH_PASSWORD_VALIDATORS = [
     {'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator'},